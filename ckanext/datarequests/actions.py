@@ -23,100 +23,465 @@ import constants
 import datetime
 import cgi
 import db
+import events
+import helpers
 import logging
+import resolver
+import stats
 import validator
 
+from collections import OrderedDict
+
 c = plugins.toolkit.c
 log = logging.getLogger(__name__)
 tk = plugins.toolkit
 
-# Avoid user_show lag
-USERS_CACHE = {}
-
 
 def _get_user(user_id):
     try:
-        if user_id in USERS_CACHE:
-            return USERS_CACHE[user_id]
-        else:
-            user = tk.get_action('user_show')({'ignore_auth': True}, {'id': user_id})
-            USERS_CACHE[user_id] = user
-            return user
+        # Only the summary of the user is retrieved (and cached) to avoid user_show lag
+        user = resolver.get_user(user_id)
+        return user.as_dict() if user is not None else None
     except Exception as e:
         log.warn(e)
 
 
-def _get_organization(organization_id):
-    try:
-        organization_show = tk.get_action('organization_show')
-        return organization_show({'ignore_auth': True}, {'id': organization_id})
-    except Exception as e:
-        log.warn(e)
+def _get_flag(data_dict, key, default):
+    value = data_dict.get(key, default)
+    if isinstance(value, basestring):
+        return value.lower() in ('true', 'yes', '1')
+    return bool(value)
 
 
-def _get_package(package_id):
-    try:
-        package_show = tk.get_action('package_show')
-        return package_show({'ignore_auth': True}, {'id': package_id})
-    except Exception as e:
-        log.warn(e)
+def _get_projection(data_dict):
+    '''
+    Returns the fields (None for all of them) and the related objects requested
+    using the fields, include_user, include_organization and
+    include_accepted_dataset parameters. Related objects are included by
+    default unless a list of fields that does not include them is given.
+    '''
+    fields = data_dict.get('fields', None)
+
+    if fields is not None:
+        if isinstance(fields, basestring):
+            fields = fields.split(',')
+
+        if not isinstance(fields, list):
+            raise tk.ValidationError({tk._('Fields'): [tk._('Fields must be a list')]})
+
+        fields = [field.strip() for field in fields if isinstance(field, basestring) and field.strip()]
+        valid_fields = constants.DATAREQUEST_FIELDS + constants.DATAREQUEST_RELATED
+        invalid = [field for field in fields if field not in valid_fields]
+        if invalid:
+            raise tk.ValidationError({tk._('Fields'): [tk._('Invalid fields: %s') % ', '.join(invalid)]})
+
+    related = tuple(name for name in constants.DATAREQUEST_RELATED
+                    if _get_flag(data_dict, 'include_%s' % name, fields is None or name in fields))
+
+    # The ID is always included
+    if fields is not None:
+        fields = ['id'] + [field for field in fields if field in constants.DATAREQUEST_FIELDS and field != 'id']
+
+    return fields, related
+
+
+def _get_columns(fields, related, *extra_columns):
+    '''
+    Returns the columns that must be loaded to return the given fields and
+    related objects (None when all the fields are returned)
+    '''
+    if fields is None:
+        return None
+
+    columns = list(fields) + ['%s_id' % name for name in related]
+
+    # The stored names of the related objects are used instead of retrieving them
+    for name in related:
+        if name in constants.DATAREQUEST_STORED_RELATED:
+            columns.extend(['%s_name' % name, '%s_title' % name])
 
+    columns.extend(extra_columns)
 
-def _dictize_datarequest(datarequest):
-    # Transform time
-    open_time = str(datarequest.open_time)
-    # Close time can be None and the transformation is only needed when the
-    # fields contains a valid date
-    close_time = datarequest.close_time
-    close_time = str(close_time) if close_time else close_time
-
-    # Convert the data request into a dict
-    data_dict = {
-        'id': datarequest.id,
-        'user_id': datarequest.user_id,
-        'title': datarequest.title,
-        'description': datarequest.description,
-        'organization_id': datarequest.organization_id,
-        'open_time': open_time,
-        'accepted_dataset_id': datarequest.accepted_dataset_id,
-        'close_time': close_time,
-        'closed': datarequest.closed,
-        'user': _get_user(datarequest.user_id),
-        'organization': None,
-        'accepted_dataset': None
+    # Duplicates are removed keeping the order
+    return list(OrderedDict.fromkeys(columns))
+
+
+def _format_time(time):
+    # Times can be None and the transformation is only needed when the
+    # field contains a valid date
+    return str(time) if time else time
+
+
+def _get_stored_related(datarequest, name):
+    '''
+    Returns the basic fields of the organization or the accepted dataset of a
+    data request built from the name and title stored with it, or None when
+    they were not stored (or not loaded)
+    '''
+    if name not in constants.DATAREQUEST_STORED_RELATED:
+        return None
+
+    object_id = getattr(datarequest, '%s_id' % name)
+    object_name = getattr(datarequest, '%s_name' % name, None)
+
+    if not object_id or object_name is None:
+        return None
+
+    return _get_related_projection(object_id, object_name, getattr(datarequest, '%s_title' % name, None))
+
+
+def _get_related_projection(object_id, object_name, title):
+    # Only the basic fields of organizations and datasets are returned with the data requests
+    title = title or object_name
+    return {'id': object_id, 'name': object_name, 'title': title, 'display_name': title}
+
+
+def _get_related_summary(name, object_id, **kwargs):
+    '''
+    Returns the basic fields (id, name and display_name) of an organization
+    or a dataset (name is organization or accepted_dataset) given its ID or
+    its name, or None when it does not exist.
+    '''
+    if object_id:
+        try:
+            get_summaries = resolver.get_organizations if name == 'organization' else resolver.get_packages
+            return get_summaries([object_id], **kwargs).get(object_id)
+        except Exception as e:
+            log.warn(e)
+
+
+def _get_related_names(name, object_id, summary=None):
+    '''
+    Returns the name and the title of an organization or a dataset (name is
+    organization or accepted_dataset) to be stored with a data request. They
+    are None when the object does not exist.
+    '''
+    if summary is None:
+        summary = _get_related_summary(name, object_id)
+
+    return {
+        '%s_name' % name: summary['name'] if summary else None,
+        '%s_title' % name: summary['display_name'] if summary else None
     }
 
-    if datarequest.organization_id:
-        data_dict['organization'] = _get_organization(datarequest.organization_id)
 
-    if datarequest.accepted_dataset_id:
-        data_dict['accepted_dataset'] = _get_package(datarequest.accepted_dataset_id)
+def _get_accepted_dataset_values(accepted_dataset_id):
+    '''
+    Returns the values stored when a data request is closed accepting a
+    dataset. Datasets can be given by name, but their ID is stored so data
+    requests can be found by the ID of the dataset they accepted. Private
+    datasets can be accepted too, but their names are not stored, since data
+    requests are shown to every user.
+    '''
+    summary = _get_related_summary('accepted_dataset', accepted_dataset_id, include_private=True)
+
+    public = summary if summary and resolver.is_public_package(summary) else {}
+    values = _get_related_names('accepted_dataset', accepted_dataset_id, public)
+    values['accepted_dataset_id'] = summary['id'] if summary else accepted_dataset_id or None
+    return values
+
+
+def _resolve_related(datarequests, related, organizations=None):
+    '''
+    Retrieves the related objects of several data requests at once. Each
+    kind of object (users, organizations and datasets) is retrieved in a
+    single query, whatever the number of data requests. Organizations that
+    have already been retrieved can be given (indexed by ID, None for the
+    ones that do not exist). Returns a dict with the objects indexed by
+    (name, id).
+    '''
+    resolved = {}
+
+    # The users are retrieved in a single query
+    if 'user' in related:
+        try:
+            users = resolver.get_users(set(datarequest.user_id for datarequest in datarequests if datarequest.user_id))
+            resolved.update((('user', user_id), user.as_dict()) for user_id, user in users.iteritems())
+        except Exception as e:
+            log.warn(e)
+
+    # Stored names are used without retrieving the object. The rest of the
+    # organizations and datasets are read from their tables instead of
+    # calling organization_show and package_show once per object
+    getters = {'organization': resolver.get_organizations, 'accepted_dataset': resolver.get_packages}
+    known = {'organization': organizations or {}}
+    for name in related:
+        if name not in getters:
+            continue
+
+        object_ids = set(getattr(datarequest, '%s_id' % name) for datarequest in datarequests
+                         if getattr(datarequest, '%s_id' % name) and _get_stored_related(datarequest, name) is None)
+        summaries = dict((object_id, known[name][object_id]) for object_id in object_ids
+                         if object_id in known.get(name, {}))
+        missing = object_ids - set(summaries)
+
+        if missing:
+            try:
+                summaries.update(getters[name](missing))
+            except Exception as e:
+                log.warn(e)
+
+        for object_id in object_ids:
+            summary = summaries.get(object_id)
+            resolved[(name, object_id)] = _get_related_projection(
+                summary['id'], summary['name'], summary['display_name']) if summary else None
+
+    return resolved
+
+
+def _dictize_datarequest(datarequest, fields=None, related=constants.DATAREQUEST_RELATED, resolved=None):
+    # Convert the data request into a dict. Only the given fields are
+    # included (all of them by default)
+    data_dict = {}
+    for field in fields or constants.DATAREQUEST_FIELDS:
+        value = getattr(datarequest, field)
+        if field in ('open_time', 'close_time', 'last_activity_time'):
+            value = _format_time(value)
+        data_dict[field] = value
+
+    # Related objects are only retrieved when they are required (the keys of
+    # all of them are included when all the fields are returned)
+    if fields is None:
+        data_dict.update((name, None) for name in constants.DATAREQUEST_RELATED)
+
+    # The stored names are used when available. Otherwise, objects already
+    # retrieved for several data requests are reused. In both cases, the
+    # same basic fields of the organization and the dataset are returned
+    if resolved is None:
+        resolved = _resolve_related([datarequest], related)
+
+    for name in related:
+        object_id = getattr(datarequest, '%s_id' % name)
+        stored = _get_stored_related(datarequest, name)
+        data_dict[name] = stored if stored is not None else resolved.get((name, object_id))
 
     return data_dict
 
 
+def _fill_excerpts(data_dicts):
+    '''
+    Renders the excerpts of the data requests stored before they were rendered
+    (until backfill is run). The descriptions that have not been loaded are
+    retrieved with a single query, only when there are such data requests.
+    '''
+    pending = dict((data_dict['id'], data_dict) for data_dict in data_dicts
+                   if 'excerpt' in data_dict and data_dict['excerpt'] is None)
+
+    descriptions = dict((datarequest_id, data_dict['description']) for datarequest_id, data_dict
+                        in pending.iteritems() if 'description' in data_dict)
+    missing = [datarequest_id for datarequest_id in pending if datarequest_id not in descriptions]
+    if missing:
+        descriptions.update((data_req.id, data_req.description) for data_req in
+                            db.DataRequest.get_by_ids(missing, columns=['id', 'description']))
+
+    for datarequest_id, data_dict in pending.iteritems():
+        data_dict['excerpt'] = helpers.render_excerpt(descriptions.get(datarequest_id))
+
+    return data_dicts
+
+
+def _datarequest_basic_values(data_dict):
+    description = data_dict['description']
+    organization = data_dict['organization_id'] or None
+
+    values = {
+        'title': data_dict['title'],
+        'description': description,
+        'description_html': helpers.render_markdown(description),
+        'excerpt': helpers.render_excerpt(description),
+        'organization_id': organization
+    }
+    values.update(_get_related_names('organization', organization))
+
+    return values
+
+
 def _undictize_datarequest_basic(data_request, data_dict):
-    data_request.title = data_dict['title']
-    data_request.description = data_dict['description']
-    organization = data_dict['organization_id']
-    data_request.organization_id = organization if organization else None
+    for key, value in _datarequest_basic_values(data_dict).iteritems():
+        setattr(data_request, key, value)
 
 
-def _dictize_comment(comment):
+def _dictize_comment(comment, include_related=True):
 
     return {
         'id': comment.id,
         'datarequest_id': comment.datarequest_id,
         'user_id': comment.user_id,
         'comment': comment.comment,
+        'comment_html': comment.comment_html,
         'time': str(comment.time),
-        'user': _get_user(comment.user_id)
+        'user': _get_user(comment.user_id) if include_related else None
+    }
+
+
+def _comment_basic_values(data_dict):
+    comment = cgi.escape(data_dict.get('comment', ''))
+
+    return {
+        'comment': comment,
+        'comment_html': helpers.render_markdown(comment),
+        'datarequest_id': data_dict.get('datarequest_id', '')
     }
 
 
 def _undictize_comment_basic(comment, data_dict):
-    comment.comment = cgi.escape(data_dict.get('comment', ''))
-    comment.datarequest_id = data_dict.get('datarequest_id', '')
+    for key, value in _comment_basic_values(data_dict).iteritems():
+        setattr(comment, key, value)
+
+
+def _get_user_id(context):
+    user_obj = context.get('auth_user_obj', None)
+    return user_obj.id if user_obj else u''
+
+
+def _log_change(session, change_type, datarequest_id, user_id, comment_id=None):
+    '''
+    Returns a new entry of the change log. The entry is not added to the
+    session yet: it has to be passed to _commit, so it is stored in the same
+    transaction than the change itself.
+    '''
+    change = db.Change()
+    change.object_type = constants.CHANGE_OBJECT_COMMENT if comment_id else constants.CHANGE_OBJECT_DATAREQUEST
+    change.object_id = comment_id or datarequest_id
+    change.datarequest_id = datarequest_id
+    change.change_type = change_type
+    change.user_id = user_id
+    change.time = datetime.datetime.now()
+
+    return change
+
+
+def _change_event(change):
+    return {
+        'object_type': change.object_type,
+        'object_id': change.object_id,
+        'datarequest_id': change.datarequest_id,
+        'change_type': change.change_type,
+        'user_id': change.user_id,
+        'time': str(change.time)
+    }
+
+
+def _commit(session, changes):
+    '''
+    Commits the session with the given entries of the change log and publishes
+    their events once commited. Items that were not written (e.g. closed
+    concurrently) have no entry (None).
+    '''
+    changes = [change for change in changes if change is not None]
+
+    # The lock of the change log is kept until the transaction is commited, so
+    # the IDs of the changes are not assigned until the previous changes have
+    # been commited. The rest of the transaction is flushed before taking it,
+    # so it is only held for the insert of the entries and the commit
+    if changes:
+        session.flush()
+        db.Change.lock()
+        for change in changes:
+            session.add(change)
+
+    session.commit()
+
+    for change in changes:
+        events.publish(_change_event(change))
+
+
+def _dictize_change(change):
+    return {
+        'id': change.id,
+        'object_type': change.object_type,
+        'object_id': change.object_id,
+        'datarequest_id': change.datarequest_id,
+        'change_type': change.change_type,
+        'user_id': change.user_id,
+        'time': str(change.time)
+    }
+
+
+def _get_bulk_items(data_dict):
+    items = data_dict.get('datarequests', None)
+
+    if not isinstance(items, list) or not items:
+        raise tk.ValidationError({tk._('Data Requests'): [tk._('A list of data requests has not been included')]})
+
+    if len(items) > constants.BULK_MAX_ITEMS:
+        raise tk.ValidationError({tk._('Data Requests'): [tk._('A maximum of %d data requests can be processed at once') % constants.BULK_MAX_ITEMS]})
+
+    try:
+        chunk_size = int(data_dict.get('chunk_size', 0))
+        if chunk_size < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        raise tk.ValidationError({tk._('Chunk Size'): [tk._('Chunk size must be a positive integer')]})
+
+    return items, chunk_size
+
+
+def _delete_comments(datarequest):
+    '''
+    Deletes the comments of a data request that is being deleted (in the same
+    transaction). Returns the deltas of the statistics of the data request
+    and its comments.
+    '''
+    comments = db.Comment.delete_by_datarequest_ids([datarequest.id])
+    comments_deltas = [stats.comment_deltas(datarequest.organization_id, comment.time, -1) for comment in comments]
+    return stats.merge_deltas(stats.datarequest_deltas(datarequest, -1), *comments_deltas)
+
+
+def _bulk_error(error_dict):
+    return {'success': False, 'error': error_dict}
+
+
+def _bulk_get_datarequests(items):
+    '''
+    Returns the initial results of the items (an error for the items that do
+    not reference an existing data request and None for the rest of them)
+    and the data requests referenced by the items. All the data requests are
+    retrieved using only one query.
+    '''
+    ids = [item.get('id') for item in items if isinstance(item, dict) and item.get('id')]
+    datarequests = dict((data_req.id, data_req) for data_req in db.DataRequest.get_by_ids(ids))
+    processed_ids = set()
+    results = []
+
+    for item in items:
+        datarequest_id = item.get('id', '') if isinstance(item, dict) else ''
+
+        if not datarequest_id:
+            results.append(_bulk_error({tk._('Data Request'): [tk._('Data Request ID has not been included')]}))
+        elif datarequest_id in processed_ids:
+            results.append(_bulk_error({tk._('Data Request'): [tk._('Data Request %s is included more than once') % datarequest_id]}))
+        elif datarequest_id not in datarequests:
+            results.append(_bulk_error({tk._('Data Request'): [tk._('Data Request %s not found in the data base') % datarequest_id]}))
+        else:
+            results.append(None)
+
+        processed_ids.add(datarequest_id)
+
+    return results, datarequests
+
+
+def _bulk_write(session, items, results, chunk_size, write):
+    '''
+    Writes the items that passed the validation. Changes are commited once
+    every chunk_size items (or only once if chunk_size is 0) and the events
+    of each chunk are published after commiting it (see _commit).
+    '''
+    pending = []
+
+    for i, item in enumerate(items):
+        if results[i] is None:
+            results[i], change = write(item)
+            pending.append(change)
+
+            if chunk_size and len(pending) == chunk_size:
+                _commit(session, pending)
+                pending = []
+
+    if pending:
+        _commit(session, pending)
+
+    return results
 
 
 def datarequest_create(context, data_dict):
@@ -158,12 +523,17 @@ def datarequest_create(context, data_dict):
 
     # Store the data
     data_req = db.DataRequest()
+    data_req.id = db.uuid4()
     _undictize_datarequest_basic(data_req, data_dict)
     data_req.user_id = context['auth_user_obj'].id
     data_req.open_time = datetime.datetime.now()
+    data_req.last_activity_time = data_req.open_time
+    data_req.comments_count = 0
 
     session.add(data_req)
-    session.commit()
+    stats.apply_deltas(stats.opened_deltas(data_req), {data_req.organization_id: data_req.open_time})
+    change = _log_change(session, constants.CHANGE_CREATED, data_req.id, data_req.user_id)
+    _commit(session, [change])
 
     return _dictize_datarequest(data_req)
 
@@ -180,6 +550,21 @@ def datarequest_show(context, data_dict):
     :param id: The id of the data request to be shown
     :type id: string
 
+    :param fields: The fields to be returned (optional, all of them by
+        default). The id is always returned
+    :type fields: list
+
+    :param include_user: Whether the user is returned (optional)
+    :type include_user: bool
+
+    :param include_organization: Whether the organization is returned
+        (optional)
+    :type include_organization: bool
+
+    :param include_accepted_dataset: Whether the accepted dataset is
+        returned (optional)
+    :type include_accepted_dataset: bool
+
     :returns: A dict with the data request (id, user_id, title, description,
         organization_id, open_time, accepted_dataset, close_time, closed)
     :rtype: dict
@@ -197,17 +582,151 @@ def datarequest_show(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_SHOW, context, data_dict)
 
-    # Get the data request
-    result = db.DataRequest.get(id=datarequest_id)
+    # Get the data request (only the required columns)
+    fields, related = _get_projection(data_dict)
+    columns = _get_columns(fields, related)
+    if columns is None:
+        result = db.DataRequest.get(id=datarequest_id)
+    else:
+        result = db.DataRequest.get_columns(columns, id=datarequest_id)
+
     if not result:
         raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
 
     data_req = result[0]
-    data_dict = _dictize_datarequest(data_req)
+    data_dict = _dictize_datarequest(data_req, fields, related)
+    _fill_excerpts([data_dict])
 
     return data_dict
 
 
+def datarequest_show_many(context, data_dict):
+    '''
+    Action to retrieve the information of several data requests at once.
+    Access rights will be checked only once and all the data requests are
+    retrieved using only one query. The related objects (users, organizations
+    and accepted datasets) shared by several data requests are only retrieved
+    once.
+
+    :param ids: The ids of the data requests to be shown
+    :type ids: list
+
+    :param fields: The fields to be returned (optional, all of them by
+        default). The id is always returned
+    :type fields: list
+
+    :param include_user: Whether the user of each data request is returned
+        (optional)
+    :type include_user: bool
+
+    :param include_organization: Whether the organization of each data
+        request is returned (optional)
+    :type include_organization: bool
+
+    :param include_accepted_dataset: Whether the accepted dataset of each
+        data request is returned (optional)
+    :type include_accepted_dataset: bool
+
+    :returns: A dict with two fields: result (a list with the data requests
+        in the same order as the given ids) and missing (the ids that have
+        not been found)
+    :rtype: dict
+    '''
+
+    model = context['model']
+    ids = data_dict.get('ids', None)
+
+    if isinstance(ids, basestring):
+        ids = ids.split(',')
+
+    if not isinstance(ids, list) or not ids:
+        raise tk.ValidationError({tk._('Data Requests'): [tk._('A list of data request IDs has not been included')]})
+
+    if len(ids) > constants.BULK_MAX_ITEMS:
+        raise tk.ValidationError({tk._('Data Requests'): [tk._('A maximum of %d data requests can be processed at once') % constants.BULK_MAX_ITEMS]})
+
+    # Repeated IDs are only returned once
+    ids = list(OrderedDict.fromkeys(datarequest_id.strip() for datarequest_id in ids
+                                    if isinstance(datarequest_id, basestring) and datarequest_id.strip()))
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_SHOW_MANY, context, data_dict)
+
+    # Get all the data requests at once (only the required columns)
+    fields, related = _get_projection(data_dict)
+    datarequests = dict((data_req.id, data_req) for data_req in
+                        db.DataRequest.get_by_ids(ids, columns=_get_columns(fields, related)))
+
+    found = [datarequests[datarequest_id] for datarequest_id in ids if datarequest_id in datarequests]
+    resolved = _resolve_related(found, related)
+
+    return {
+        'result': _fill_excerpts([_dictize_datarequest(data_req, fields, related, resolved) for data_req in found]),
+        'missing': [datarequest_id for datarequest_id in ids if datarequest_id not in datarequests]
+    }
+
+
+def datarequest_list_for_dataset(context, data_dict):
+    '''
+    Action to retrieve the data requests that have been closed accepting a
+    dataset (the most recently closed first). They are found using the
+    index of the accepted dataset. A NotFound exception will be risen if the
+    dataset does not exist.
+
+    Access rights will be checked before returning the information and an
+    exception will be risen (NotAuthorized) if the user is not authorized.
+
+    :param package_id: The ID or the name of the dataset
+    :type package_id: string
+
+    :param fields: The fields of each data request to be returned
+        (optional, all of them by default). The id is always returned
+    :type fields: list
+
+    :param include_user: Whether the user of each data request is returned
+        (optional)
+    :type include_user: bool
+
+    :param include_organization: Whether the organization of each data
+        request is returned (optional)
+    :type include_organization: bool
+
+    :param include_accepted_dataset: Whether the accepted dataset of each
+        data request is returned (optional)
+    :type include_accepted_dataset: bool
+
+    :returns: A list with the data requests that accepted the dataset
+    :rtype: list
+    '''
+
+    model = context['model']
+    package_id = data_dict.get('package_id', '')
+
+    if not package_id:
+        raise tk.ValidationError(tk._('Dataset ID has not been included'))
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_LIST_FOR_DATASET, context, data_dict)
+
+    # Data requests can reference the dataset by its ID or by its name
+    package = resolver.get_packages([package_id]).get(package_id)
+    if package is None:
+        raise tk.ObjectNotFound(tk._('Dataset %s not found in the data base') % package_id)
+
+    fields, related = _get_projection(data_dict)
+    datarequests = db.DataRequest.get_by_accepted_dataset(sorted(set([package['id'], package['name']])),
+                                                          columns=_get_columns(fields, related))
+    resolved = _resolve_related(datarequests, related)
+
+    return _fill_excerpts([_dictize_datarequest(data_req, fields, related, resolved) for data_req in datarequests])
+
+
 def datarequest_update(context, data_dict):
     '''
     Action to update a data request. The function checks the access rights of
@@ -231,6 +750,11 @@ def datarequest_update(context, data_dict):
         data request.
     :type organization_id: string
 
+    :param include_related: Whether the user, the organization and the
+        accepted dataset are included in the response (optional, true by
+        default)
+    :type include_related: bool
+
     :returns: A dict with the data request (id, user_id, title, description,
         organization_id, open_time, accepted_dataset, close_time, closed)
     :rtype: dict
@@ -249,26 +773,27 @@ def datarequest_update(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_UPDATE, context, data_dict)
 
-    # Get the initial data
-    result = db.DataRequest.get(id=datarequest_id)
-    if not result:
-        raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
-
-    data_req = result[0]
+    # Validate data (the title of the data request itself is not in use)
+    context['updated_datarequest_id'] = datarequest_id
+    validator.validate_datarequest(context, data_dict)
 
-    # Avoid the validator to return an error when the user does not change the title
-    context['avoid_existing_title_check'] = data_req.title == data_dict['title']
+    # The data request is updated with a single statement (it is not loaded before)
+    values = _datarequest_basic_values(data_dict)
+    values['last_activity_time'] = datetime.datetime.now()
+    data_req = db.DataRequest.update_by_id(datarequest_id, **values)
 
-    # Validate data
-    validator.validate_datarequest(context, data_dict)
+    if data_req is None:
+        raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
 
-    # Set the data provided by the user in the data_red
-    _undictize_datarequest_basic(data_req, data_dict)
+    # Statistics are moved to the new organization
+    deltas = stats.moved_deltas(data_req, data_req.previous_organization_id)
+    stats.apply_deltas(deltas, {data_req.organization_id: data_req.last_activity_time})
 
-    session.add(data_req)
-    session.commit()
+    change = _log_change(session, constants.CHANGE_UPDATED, data_req.id, _get_user_id(context))
+    _commit(session, [change])
 
-    return _dictize_datarequest(data_req)
+    related = constants.DATAREQUEST_RELATED if _get_flag(data_dict, 'include_related', True) else ()
+    return _dictize_datarequest(data_req, related=related)
 
 
 def datarequest_index(context, data_dict):
@@ -297,7 +822,9 @@ def datarequest_index(context, data_dict):
         data requests. You can choose 'desc' for retrieving data requests
         in descending order or 'asc' for retrieving data requests in
         ascending order. Data Requests are returned in ascending order
-        by default.
+        by default. In addition, 'most_commented', 'recently_active' and
+        'recently_closed' can be used to sort data requests by their number
+        of comments, their last activity or their close time.
     :type sort: string
 
     :param offset: The first element to be returned (0 by default)
@@ -307,6 +834,22 @@ def datarequest_index(context, data_dict):
         default)
     :type limit: int
 
+    :param fields: The fields of the data requests to be returned
+        (optional, all of them by default). The id is always returned
+    :type fields: list
+
+    :param include_user: Whether the user of each data request is returned
+        (optional)
+    :type include_user: bool
+
+    :param include_organization: Whether the organization of each data
+        request is returned (optional)
+    :type include_organization: bool
+
+    :param include_accepted_dataset: Whether the accepted dataset of each
+        data request is returned (optional)
+    :type include_accepted_dataset: bool
+
     :returns: A dict with three fields: result (a list of data requests),
         facets (a list of the facets that can be used) and count (the total
         number of existing data requests)
@@ -314,8 +857,6 @@ def datarequest_index(context, data_dict):
     '''
 
     model = context['model']
-    organization_show = tk.get_action('organization_show')
-    user_show = tk.get_action('user_show')
 
     # Init the data base
     db.init_db(model)
@@ -327,15 +868,21 @@ def datarequest_index(context, data_dict):
     organization_id = data_dict.get('organization_id', None)
     if organization_id:
         # Get organization ID (organization name is received sometimes)
-        organization_id = organization_show({'ignore_auth': True}, {'id': organization_id}).get('id')
+        organization_id = resolver.get_organization_id(organization_id)
 
     user_id = data_dict.get('user_id', None)
     if user_id:
         # Get user ID (user name is received sometimes)
-        user_id = user_show({'ignore_auth': True}, {'id': user_id}).get('id')
+        user_id = resolver.get_user_id(user_id)
 
-    # Filter by state
+    # Filter by state. It is normalized once (it is a string when it is given in
+    # the query string of a GET request), so the counts of the summaries and the
+    # data requests returned by the query always agree
     closed = data_dict.get('closed', None)
+    if closed is not None and closed != '':
+        closed = _get_flag(data_dict, 'closed', None)
+    else:
+        closed = None
 
     # Free text filter
     q = data_dict.get('q', None)
@@ -343,49 +890,94 @@ def datarequest_index(context, data_dict):
     # Sort. By default, data requests are returned in the order they are created
     # This is something new in version 0.3.0. In previous versions, requests were
     # returned in inverse order
-    desc = False
-    if data_dict.get('sort', None) == 'desc':
-        desc = True
+    order_by, desc = constants.DATAREQUESTS_SORTS.get(data_dict.get('sort', None),
+                                                      constants.DATAREQUESTS_SORTS['asc'])
 
-    # Call the function
-    db_datarequests = db.DataRequest.get_ordered_by_date(organization_id=organization_id,
-                                                         user_id=user_id, closed=closed,
-                                                         q=q, desc=desc)
-
-    # Dictize the results
-    datarequests = []
     offset = data_dict.get('offset', 0)
     limit = data_dict.get('limit', constants.DATAREQUESTS_PER_PAGE)
-    for data_req in db_datarequests[offset:offset + limit]:
-        datarequests.append(_dictize_datarequest(data_req))
-
-    # Facets
-    no_processed_organization_facet = {}
+    fields, related = _get_projection(data_dict)
+    no_processed_organization_facet = OrderedDict()
     CLOSED = 'Closed'
     OPEN = 'Open'
     no_processed_state_facet = {CLOSED: 0, OPEN: 0}
-    for data_req in db_datarequests:
-        if data_req.organization_id:
-            # Facets
-            if data_req.organization_id in no_processed_organization_facet:
-                no_processed_organization_facet[data_req.organization_id] += 1
-            else:
-                no_processed_organization_facet[data_req.organization_id] = 1
 
-        no_processed_state_facet[CLOSED if data_req.closed else OPEN] += 1
+    if q is None and user_id is None:
+        # Counts and facets are read from the summaries of the organizations,
+        # so only the requested page of data requests is loaded
+        if organization_id:
+            summaries = [db.OrganizationSummary.get(organization_id)]
+        else:
+            summaries = db.OrganizationSummary.get_all()
+
+        for summary in summaries:
+            if summary is None:
+                continue
+
+            open_count = summary.open_count if closed is not True else 0
+            closed_count = summary.closed_count if closed is not False else 0
+
+            if summary.organization_id and open_count + closed_count > 0:
+                no_processed_organization_facet[summary.organization_id] = open_count + closed_count
+
+            no_processed_state_facet[OPEN] += open_count
+            no_processed_state_facet[CLOSED] += closed_count
+
+        count = no_processed_state_facet[OPEN] + no_processed_state_facet[CLOSED]
+        db_datarequests = db.DataRequest.get_ordered_by_date(organization_id=organization_id,
+                                                             user_id=user_id, closed=closed,
+                                                             q=q, desc=desc, order_by=order_by,
+                                                             offset=offset, limit=limit,
+                                                             columns=_get_columns(fields, related))
+    else:
+        # The organization and the state of every data request are needed to compute the facets
+        columns = _get_columns(fields, related, 'organization_id', 'closed')
+        db_datarequests = db.DataRequest.get_ordered_by_date(organization_id=organization_id,
+                                                             user_id=user_id, closed=closed,
+                                                             q=q, desc=desc, order_by=order_by,
+                                                             columns=columns)
+
+        for data_req in db_datarequests:
+            if data_req.organization_id:
+                # Facets
+                if data_req.organization_id in no_processed_organization_facet:
+                    no_processed_organization_facet[data_req.organization_id] += 1
+                else:
+                    no_processed_organization_facet[data_req.organization_id] = 1
+
+            no_processed_state_facet[CLOSED if data_req.closed else OPEN] += 1
+
+        count = len(db_datarequests)
+        db_datarequests = db_datarequests[offset:offset + limit]
+
+    # The labels of all the organizations of the facets are retrieved at once. They
+    # are reused for the returned data requests, so they are not read again
+    organizations = resolver.get_organizations(no_processed_organization_facet.keys())
+
+    # Dictize the results. Related objects shared by several data requests are only retrieved once
+    resolved = _resolve_related(db_datarequests, related, dict(
+        (organization_id, organizations.get(organization_id)) for organization_id in no_processed_organization_facet))
+    datarequests = []
+    for data_req in db_datarequests:
+        datarequests.append(_dictize_datarequest(data_req, fields, related, resolved))
+    _fill_excerpts(datarequests)
 
     # Format facets
     organization_facet = []
     for organization_id in no_processed_organization_facet:
-        try:
-            organization = organization_show({'ignore_auth': True}, {'id': organization_id})
-            organization_facet.append({
-                'name': organization.get('name'),
-                'display_name': organization.get('display_name'),
-                'count': no_processed_organization_facet[organization_id]
-            })
-        except:
-            pass
+        organization = organizations.get(organization_id)
+        if organization is None:
+            log.warn('Organization %s of some data requests does not exist' % organization_id)
+            continue
+
+        item = {
+            'name': organization.get('name'),
+            'display_name': organization.get('display_name'),
+            'count': no_processed_organization_facet[organization_id]
+        }
+        # Data requests of deleted organizations are still listed
+        if organization.get('state') == 'deleted':
+            item['state'] = 'deleted'
+        organization_facet.append(item)
 
     state_facet = []
     for state in no_processed_state_facet:
@@ -397,7 +989,7 @@ def datarequest_index(context, data_dict):
             })
 
     result = {
-        'count': len(db_datarequests),
+        'count': count,
         'facets': {},
         'result': datarequests
     }
@@ -421,6 +1013,11 @@ def datarequest_delete(context, data_dict):
     :param id: The ID of the data request to be deleted
     :type id: string
 
+    :param include_related: Whether the user, the organization and the
+        accepted dataset are included in the response (optional, false by
+        default)
+    :type include_related: bool
+
     :returns: A dict with the data request (id, user_id, title, description,
         organization_id, open_time, accepted_dataset, close_time, closed)
     :rtype: dict
@@ -440,16 +1037,17 @@ def datarequest_delete(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_DELETE, context, data_dict)
 
-    # Get the data request
-    result = db.DataRequest.get(id=datarequest_id)
-    if not result:
+    # The data request is deleted with a single statement (it is not loaded before)
+    data_req = db.DataRequest.delete_by_id(datarequest_id)
+    if data_req is None:
         raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
 
-    data_req = result[0]
-    session.delete(data_req)
-    session.commit()
+    stats.apply_deltas(_delete_comments(data_req))
+    change = _log_change(session, constants.CHANGE_DELETED, data_req.id, _get_user_id(context))
+    _commit(session, [change])
 
-    return _dictize_datarequest(data_req)
+    related = constants.DATAREQUEST_RELATED if _get_flag(data_dict, 'include_related', False) else ()
+    return _dictize_datarequest(data_req, related=related)
 
 
 def datarequest_close(context, data_dict):
@@ -485,30 +1083,350 @@ def datarequest_close(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_CLOSE, context, data_dict)
 
-    # Get the data request
-    result = db.DataRequest.get(id=datarequest_id)
-    if not result:
-        raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
-
     # Validate data
     validator.validate_datarequest_closing(context, data_dict)
 
-    data_req = result[0]
+    # The data request is only closed if it was open (a single statement)
+    close_time = datetime.datetime.now()
+    accepted_dataset = _get_accepted_dataset_values(data_dict.get('accepted_dataset_id', None))
+    data_req = db.DataRequest.close(datarequest_id, close_time, **accepted_dataset)
 
-    # Was the data request previously closed?
-    if data_req.closed:
+    if data_req is None:
+        if datarequest_id not in db.DataRequest.get_owners([datarequest_id]):
+            raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
         raise tk.ValidationError([tk._('This Data Request is already closed')])
 
-    data_req.closed = True
-    data_req.accepted_dataset_id = data_dict.get('accepted_dataset_id', None)
-    data_req.close_time = datetime.datetime.now()
-
-    session.add(data_req)
-    session.commit()
+    stats.apply_deltas(stats.closed_deltas(data_req), {data_req.organization_id: close_time})
+    change = _log_change(session, constants.CHANGE_CLOSED, data_req.id, _get_user_id(context))
+    _commit(session, [change])
 
     return _dictize_datarequest(data_req)
 
 
+def datarequest_bulk_create(context, data_dict):
+    '''
+    Action to create several data requests at once. Access rights will be
+    checked only once before creating the data requests. If the user is not
+    allowed a NotAuthorized exception will be risen.
+
+    All the data requests are validated before storing any of them. Invalid
+    data requests are not created and the rest of them are stored in the
+    same transaction (unless chunk_size is given).
+
+    :param datarequests: A list of data requests. Each one is a dict with
+        the same fields accepted by datarequest_create (title, description
+        and organization_id)
+    :type datarequests: list
+
+    :param chunk_size: The number of data requests to be commited together
+        (optional). By default, all of them are commited at once.
+    :type chunk_size: int
+
+    :returns: A list with one result per data request (in the same order).
+        Each result is a dict with the following fields: success, id and
+        title (when the data request has been created) or error (when the
+        data request is not valid)
+    :rtype: list
+    '''
+
+    model = context['model']
+    session = context['session']
+    items, chunk_size = _get_bulk_items(data_dict)
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_BULK_CREATE, context, data_dict)
+
+    # Validate data
+    datarequests = []
+    results = []
+    titles = set()
+
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        datarequest = {
+            'title': item.get('title', ''),
+            'description': item.get('description', ''),
+            'organization_id': item.get('organization_id', '')
+        }
+
+        try:
+            validator.validate_datarequest(context, datarequest)
+
+            # Titles must be unique inside the list too
+            title = datarequest['title'].lower()
+            if title in titles:
+                raise tk.ValidationError({tk._('Title'): [tk._('That title is already in use')]})
+            titles.add(title)
+
+            results.append(None)
+        except tk.ValidationError as e:
+            results.append(_bulk_error(e.error_dict))
+
+        datarequests.append(datarequest)
+
+    # Store the data
+    user_id = context['auth_user_obj'].id
+    open_time = datetime.datetime.now()
+
+    def _create(datarequest):
+        data_req = db.DataRequest()
+        data_req.id = db.uuid4()
+        _undictize_datarequest_basic(data_req, datarequest)
+        data_req.user_id = user_id
+        data_req.open_time = open_time
+        data_req.last_activity_time = open_time
+        data_req.comments_count = 0
+        session.add(data_req)
+        stats.apply_deltas(stats.opened_deltas(data_req), {data_req.organization_id: open_time})
+        change = _log_change(session, constants.CHANGE_CREATED, data_req.id, user_id)
+
+        return {'success': True, 'id': data_req.id, 'title': data_req.title}, change
+
+    return _bulk_write(session, datarequests, results, chunk_size, _create)
+
+
+def datarequest_bulk_close(context, data_dict):
+    '''
+    Action to close several data requests at once. Access rights will be
+    checked only once before closing the data requests. If the user is not
+    allowed to close any of them, a NotAuthorized exception will be risen.
+
+    All the data requests are validated before closing any of them. Data
+    requests that cannot be closed (not found, already closed or invalid
+    accepted dataset) are skipped and the rest of them are closed in the
+    same transaction (unless chunk_size is given).
+
+    :param datarequests: A list of dicts with the id of the data request to
+        be closed and, optionally, the accepted_dataset_id
+    :type datarequests: list
+
+    :param chunk_size: The number of data requests to be commited together
+        (optional). By default, all of them are commited at once.
+    :type chunk_size: int
+
+    :returns: A list with one result per data request (in the same order).
+        Each result is a dict with the following fields: success and id (when
+        the data request has been closed) or error (when it cannot be closed)
+    :rtype: list
+    '''
+
+    model = context['model']
+    session = context['session']
+    items, chunk_size = _get_bulk_items(data_dict)
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_BULK_CLOSE, context, data_dict)
+
+    # Validate data
+    results, datarequests = _bulk_get_datarequests(items)
+
+    for i, item in enumerate(items):
+        if results[i] is not None:
+            continue
+
+        try:
+            if datarequests[item['id']].closed:
+                raise tk.ValidationError({tk._('Data Request'): [tk._('This Data Request is already closed')]})
+
+            validator.validate_datarequest_closing(context, item)
+        except tk.ValidationError as e:
+            results[i] = _bulk_error(e.error_dict)
+
+    # Close the data requests
+    close_time = datetime.datetime.now()
+    user_id = _get_user_id(context)
+
+    def _close(item):
+        # The data request is only closed if it is still open (a single statement)
+        accepted_dataset = _get_accepted_dataset_values(item.get('accepted_dataset_id', None))
+        data_req = db.DataRequest.close(item['id'], close_time, **accepted_dataset)
+
+        if data_req is None:
+            return _bulk_error({tk._('Data Request'): [tk._('This Data Request is already closed')]}), None
+
+        stats.apply_deltas(stats.closed_deltas(data_req), {data_req.organization_id: close_time})
+        change = _log_change(session, constants.CHANGE_CLOSED, data_req.id, user_id)
+
+        return {'success': True, 'id': data_req.id}, change
+
+    return _bulk_write(session, items, results, chunk_size, _close)
+
+
+def datarequest_bulk_delete(context, data_dict):
+    '''
+    Action to delete several data requests at once. Access rights will be
+    checked only once before deleting the data requests. If the user is not
+    allowed to delete any of them, a NotAuthorized exception will be risen.
+
+    Data requests that are not found are skipped and the rest of them are
+    deleted in the same transaction (unless chunk_size is given).
+
+    :param datarequests: A list of dicts with the id of the data request to
+        be deleted
+    :type datarequests: list
+
+    :param chunk_size: The number of data requests to be commited together
+        (optional). By default, all of them are commited at once.
+    :type chunk_size: int
+
+    :returns: A list with one result per data request (in the same order).
+        Each result is a dict with the following fields: success and id (when
+        the data request has been deleted) or error (when it cannot be deleted)
+    :rtype: list
+    '''
+
+    model = context['model']
+    session = context['session']
+    items, chunk_size = _get_bulk_items(data_dict)
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_BULK_DELETE, context, data_dict)
+
+    # Validate data
+    results, datarequests = _bulk_get_datarequests(items)
+
+    # Delete the data requests
+    user_id = _get_user_id(context)
+
+    def _delete(item):
+        # The data request is deleted with a single statement, as in datarequest_delete
+        data_req = db.DataRequest.delete_by_id(item['id'])
+
+        if data_req is None:
+            return _bulk_error({tk._('Data Request'): [tk._('Data Request %s not found in the data base') % item['id']]}), None
+
+        stats.apply_deltas(_delete_comments(data_req))
+        change = _log_change(session, constants.CHANGE_DELETED, data_req.id, user_id)
+
+        return {'success': True, 'id': data_req.id}, change
+
+    return _bulk_write(session, items, results, chunk_size, _delete)
+
+
+def datarequest_changes_since(context, data_dict):
+    '''
+    Returns the changes (creation, update, closing and deletion of data
+    requests and comments) registered after the given cursor, in the same
+    order they were registered. Access rights will be checked before
+    returning the changes. If the user is not allowed, a NotAuthorized
+    exception will be risen.
+
+    :param cursor: The ID of the last change received by the consumer (0 by
+        default, to get the changes from the beginning)
+    :type cursor: int
+
+    :param limit: The max number of changes to be returned (100 by default,
+        1000 at most)
+    :type limit: int
+
+    :returns: A dict with the following fields: changes (a list of changes,
+        each one a dict with the fields id, object_type, object_id,
+        datarequest_id, change_type, user_id and time), cursor (the value to
+        be used in the next call) and has_more (whether there are more changes
+        after the returned ones)
+    :rtype: dict
+    '''
+
+    model = context['model']
+
+    try:
+        cursor = int(data_dict.get('cursor', 0))
+        if cursor < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        raise tk.ValidationError({tk._('Cursor'): [tk._('Cursor must be a positive integer')]})
+
+    try:
+        limit = int(data_dict.get('limit', constants.CHANGES_DEFAULT_LIMIT))
+        if limit < 1 or limit > constants.CHANGES_MAX_LIMIT:
+            raise ValueError()
+    except (TypeError, ValueError):
+        raise tk.ValidationError({tk._('Limit'): [tk._('Limit must be an integer between 1 and %d') % constants.CHANGES_MAX_LIMIT]})
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_CHANGES_SINCE, context, data_dict)
+
+    # One additional change is requested to know if there are more changes
+    changes = db.Change.get_since(cursor, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    return {
+        'changes': [_dictize_change(change) for change in changes],
+        'cursor': changes[-1].id if changes else cursor,
+        'has_more': has_more
+    }
+
+
+def datarequest_stats(context, data_dict):
+    '''
+    Returns statistics about the data requests: the number of data requests
+    opened and closed, the number of comments and the mean and median time
+    to close (in hours) of each organization. The statistics are read from
+    aggregated metrics, so the data requests are not loaded. Access rights
+    will be checked before returning the statistics. If the user is not
+    allowed, a NotAuthorized exception will be risen.
+
+    :param organization_id: The ID or the name of an organization to get only
+        its statistics (optional)
+    :type organization_id: string
+
+    :param since: The first day (YYYY-MM-DD) to be considered (optional)
+    :type since: string
+
+    :param until: The last day (YYYY-MM-DD) to be considered (optional)
+    :type until: string
+
+    :param period: day or month to split the statistics by period (optional)
+    :type period: string
+
+    :returns: A dict with the following fields: results (a list with the
+        statistics of each organization and period, each one a dict with the
+        fields organization_id, period, opened, closed, comments,
+        mean_time_to_close and median_time_to_close) and total (the
+        statistics of all of them). The median time to close is estimated
+        from a histogram.
+    :rtype: dict
+    '''
+
+    model = context['model']
+    organization_id = data_dict.get('organization_id', None)
+    period = data_dict.get('period', None) or None
+
+    try:
+        since = stats.parse_day(data_dict.get('since', None))
+        until = stats.parse_day(data_dict.get('until', None))
+    except (TypeError, ValueError):
+        raise tk.ValidationError({tk._('Date'): [tk._('Dates must follow the format YYYY-MM-DD')]})
+
+    if period is not None and period not in constants.STATS_PERIODS:
+        raise tk.ValidationError({tk._('Period'): [tk._('Period must be one of: %s') % ', '.join(constants.STATS_PERIODS)]})
+
+    # Init the data base
+    db.init_db(model)
+
+    # Check access
+    tk.check_access(constants.DATAREQUEST_STATS, context, data_dict)
+
+    # Organizations can be given by name
+    if organization_id:
+        organization_id = resolver.get_organization_id(organization_id)
+
+    return stats.get_stats(organization_id, since, until, period)
+
+
 def datarequest_comment(context, data_dict):
     '''
     Action to create a comment in a data request. Access rights will be checked
@@ -546,12 +1464,16 @@ def datarequest_comment(context, data_dict):
 
     # Store the data
     comment = db.Comment()
+    comment.id = db.uuid4()
     _undictize_comment_basic(comment, data_dict)
     comment.user_id = context['auth_user_obj'].id
     comment.time = datetime.datetime.now()
 
     session.add(comment)
-    session.commit()
+    organization_id = db.DataRequest.update_activity(comment.datarequest_id, comment.time, 1)
+    stats.apply_deltas(stats.comment_deltas(organization_id, comment.time), {organization_id: comment.time})
+    change = _log_change(session, constants.CHANGE_CREATED, comment.datarequest_id, comment.user_id, comment.id)
+    _commit(session, [change])
 
     return _dictize_comment(comment)
 
@@ -639,6 +1561,12 @@ def datarequest_comment_list(context, data_dict):
     # Get comments
     comments_db = db.Comment.get_ordered_by_date(datarequest_id=datarequest_id, desc=desc)
 
+    # The commenters are retrieved in a single query and then read from the cache
+    try:
+        resolver.get_users(set(comment.user_id for comment in comments_db))
+    except Exception as e:
+        log.warn(e)
+
     comments_list = []
     for comment in comments_db:
         comments_list.append(_dictize_comment(comment))
@@ -658,6 +1586,10 @@ def datarequest_comment_update(context, data_dict):
     :param comment: The updated comment
     :type comment: string
 
+    :param include_related: Whether the user is included in the response
+        (optional, true by default)
+    :type include_related: bool
+
     :returns: A dict with the data request comment (id, user_id, datarequest_id,
         time and comment)
     :rtype: dict
@@ -676,23 +1608,21 @@ def datarequest_comment_update(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_COMMENT_UPDATE, context, data_dict)
 
-    # Get the data request
-    result = db.Comment.get(id=comment_id)
-    if not result:
-        raise tk.ObjectNotFound(tk._('Comment %s not found in the data base') % comment_id)
-
-    comment = result[0]
-
     # Validate data
     validator.validate_comment(context, data_dict)
 
-    # Set the data provided by the user in the data_red
-    _undictize_comment_basic(comment, data_dict)
+    # The comment is updated with a single statement (it is not loaded before)
+    comment = db.Comment.update_by_id(comment_id, **_comment_basic_values(data_dict))
+    if comment is None:
+        raise tk.ObjectNotFound(tk._('Comment %s not found in the data base') % comment_id)
 
-    session.add(comment)
-    session.commit()
+    activity_time = datetime.datetime.now()
+    organization_id = db.DataRequest.update_activity(comment.datarequest_id, activity_time)
+    stats.apply_deltas({}, {organization_id: activity_time})
+    change = _log_change(session, constants.CHANGE_UPDATED, comment.datarequest_id, _get_user_id(context), comment.id)
+    _commit(session, [change])
 
-    return _dictize_comment(comment)
+    return _dictize_comment(comment, _get_flag(data_dict, 'include_related', True))
 
 
 def datarequest_comment_delete(context, data_dict):
@@ -704,6 +1634,10 @@ def datarequest_comment_delete(context, data_dict):
     :param id: The ID of the comment to be deleted
     :type id: string
 
+    :param include_related: Whether the user is included in the response
+        (optional, false by default)
+    :type include_related: bool
+
     :returns: A dict with the data request comment (id, user_id, datarequest_id,
         time and comment)
     :rtype: dict
@@ -722,14 +1656,14 @@ def datarequest_comment_delete(context, data_dict):
     # Check access
     tk.check_access(constants.DATAREQUEST_COMMENT_DELETE, context, data_dict)
 
-    # Get the data request
-    result = db.Comment.get(id=comment_id)
-    if not result:
+    # The comment is deleted with a single statement (it is not loaded before)
+    comment = db.Comment.delete_by_id(comment_id)
+    if comment is None:
         raise tk.ObjectNotFound(tk._('Comment %s not found in the data base') % comment_id)
 
-    comment = result[0]
+    organization_id = db.DataRequest.update_activity(comment.datarequest_id, comments_delta=-1)
+    stats.apply_deltas(stats.comment_deltas(organization_id, comment.time, -1))
+    change = _log_change(session, constants.CHANGE_DELETED, comment.datarequest_id, _get_user_id(context), comment.id)
+    _commit(session, [change])
 
-    session.delete(comment)
-    session.commit()
-
-    return _dictize_comment(comment)
+    return _dictize_comment(comment, _get_flag(data_dict, 'include_related', False))
@@ -18,6 +18,7 @@
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
 import constants
+import db
 from ckan.plugins import toolkit as tk
 
 
@@ -30,6 +31,16 @@ def datarequest_show(context, data_dict):
     return {'success': True}
 
 
+@tk.auth_allow_anonymous_access
+def datarequest_show_many(context, data_dict):
+    return {'success': True}
+
+
+@tk.auth_allow_anonymous_access
+def datarequest_list_for_dataset(context, data_dict):
+    return {'success': True}
+
+
 def auth_if_creator(context, data_dict, show_function):
     # Sometimes data_dict only contains the 'id'
     if 'user_id' not in data_dict:
@@ -39,8 +50,34 @@ def auth_if_creator(context, data_dict, show_function):
     return {'success': data_dict['user_id'] == context.get('auth_user_obj').id}
 
 
+def auth_if_datarequest_creator(context, data_dict):
+    # Only the creator of the data request is retrieved (not the whole data request)
+    if 'user_id' not in data_dict:
+        db.init_db(context['model'])
+        datarequest_id = data_dict.get('id')
+        owners = db.DataRequest.get_owners([datarequest_id])
+
+        if datarequest_id not in owners:
+            raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
+
+        data_dict = {'user_id': owners[datarequest_id]}
+
+    return {'success': data_dict['user_id'] == context.get('auth_user_obj').id}
+
+
+def auth_if_creator_bulk(context, data_dict):
+    # The creators of all the data requests are retrieved at once
+    ids = [item.get('id') for item in data_dict.get('datarequests', []) if isinstance(item, dict)]
+    db.init_db(context['model'])
+    owners = db.DataRequest.get_owners(ids)
+    user_id = context.get('auth_user_obj').id
+
+    # Access is not granted when none of the data requests exist
+    return {'success': bool(owners) and all(owner == user_id for owner in owners.values())}
+
+
 def datarequest_update(context, data_dict):
-    return auth_if_creator(context, data_dict, constants.DATAREQUEST_SHOW)
+    return auth_if_datarequest_creator(context, data_dict)
 
 
 @tk.auth_allow_anonymous_access
@@ -49,11 +86,43 @@ def datarequest_index(context, data_dict):
 
 
 def datarequest_delete(context, data_dict):
-    return auth_if_creator(context, data_dict, constants.DATAREQUEST_SHOW)
+    return auth_if_datarequest_creator(context, data_dict)
 
 
 def datarequest_close(context, data_dict):
-    return auth_if_creator(context, data_dict, constants.DATAREQUEST_SHOW)
+    return auth_if_datarequest_creator(context, data_dict)
+
+
+def datarequest_bulk_create(context, data_dict):
+    return {'success': True}
+
+
+def datarequest_bulk_close(context, data_dict):
+    return auth_if_creator_bulk(context, data_dict)
+
+
+def datarequest_bulk_delete(context, data_dict):
+    return auth_if_creator_bulk(context, data_dict)
+
+
+def datarequest_export(context, data_dict):
+    # Only sysadmins (who skip the auth functions) can export the data requests
+    return {'success': False}
+
+
+def datarequest_metrics(context, data_dict):
+    # Only sysadmins (who skip the auth functions) can read the metrics
+    return {'success': False}
+
+
+@tk.auth_allow_anonymous_access
+def datarequest_changes_since(context, data_dict):
+    return {'success': True}
+
+
+@tk.auth_allow_anonymous_access
+def datarequest_stats(context, data_dict):
+    return {'success': True}
 
 
 def datarequest_comment(context, data_dict):
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+import constants
+import datetime
+import db
+import helpers
+import math
+import platform
+import random
+import stats
+import timeit
+import uuid
+
+# Every object created by the benchmark includes this prefix in its name
+# (users and organizations) or title (data requests)
+PREFIX = u'datarequests-benchmark'
+
+WORDS = (u'air', u'budget', u'census', u'climate', u'crime', u'education', u'energy', u'health',
+         u'housing', u'parking', u'pollution', u'roads', u'schools', u'traffic', u'transport', u'water')
+
+
+def _percentile(values, percentile):
+    '''Returns the given percentile of a sorted list (nearest-rank method)'''
+    index = int(math.ceil(percentile / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def _comments_number(rng, alpha, max_comments):
+    '''
+    Number of comments of a data request. Pareto distributed, so most of the
+    data requests have a few comments and some of them have a lot.
+    '''
+    return min(int(rng.paretovariate(alpha)) - 1, max_comments)
+
+
+def _get_or_create_users(number):
+    users = []
+    for i in range(number):
+        name = u'%s-user-%d' % (PREFIX, i)
+        user = model.User.get(name)
+        if user is None:
+            user = model.User(name=name, email=u'%s@example.com' % name)
+            model.Session.add(user)
+        users.append(user)
+
+    model.Session.commit()
+    return [user.id for user in users]
+
+
+def _get_or_create_organizations(number):
+    organizations = []
+    for i in range(number):
+        name = u'%s-org-%d' % (PREFIX, i)
+        organization = model.Group.get(name)
+        if organization is None:
+            organization = model.Group(name=name, title=u'Benchmark organization %d' % i,
+                                       type='organization', is_organization=True)
+            model.Session.add(organization)
+        organizations.append(organization)
+
+    model.Session.commit()
+    return organizations
+
+
+def seed(datarequests, users=constants.BENCHMARK_USERS, organizations=constants.BENCHMARK_ORGANIZATIONS,
+         comments_alpha=constants.BENCHMARK_COMMENTS_ALPHA, max_comments=constants.BENCHMARK_MAX_COMMENTS,
+         batch_size=constants.BENCHMARK_BATCH_SIZE, seed_value=None):
+    '''
+    Stores the given number of data requests (and their comments) so the
+    actions can be measured at realistic data sizes. Data requests are spread
+    over the last two years and among the users and organizations created for
+    the benchmark (one out of ten does not belong to any organization). A
+    third of them are closed. Statistics are computed again at the end.
+
+    Run it only against a local database: the rows can be removed with clean.
+
+    :returns: The number of data requests and comments stored
+    :rtype: tuple
+    '''
+    db.init_db(model)
+    rng = random.Random(seed_value)
+    user_ids = _get_or_create_users(users)
+    organizations = _get_or_create_organizations(organizations) + [None]
+    now = datetime.datetime.now()
+    stored_comments = 0
+
+    for start in range(0, datarequests, batch_size):
+        datarequest_rows = []
+        comment_rows = []
+
+        for _ in range(start, min(start + batch_size, datarequests)):
+            datarequest_id = unicode(uuid.uuid4())
+            open_time = now - datetime.timedelta(seconds=rng.randint(0, 2 * 365 * 86400))
+            closed = rng.random() < 1 / 3.0
+            close_time = open_time + datetime.timedelta(seconds=rng.randint(60, 90 * 86400)) if closed else None
+            description = u' '.join(rng.sample(WORDS, 5))
+            last_activity_time = close_time or open_time
+
+            comments_number = _comments_number(rng, comments_alpha, max_comments)
+            for _ in range(comments_number):
+                comment = u' '.join(rng.sample(WORDS, 3))
+                time = open_time + datetime.timedelta(seconds=rng.randint(0, 30 * 86400))
+                last_activity_time = max(last_activity_time, time)
+                comment_rows.append({
+                    'id': unicode(uuid.uuid4()),
+                    'user_id': rng.choice(user_ids),
+                    'datarequest_id': datarequest_id,
+                    'time': time,
+                    'comment': comment,
+                    'comment_html': u'<p>%s</p>' % comment
+                })
+
+            user_id = rng.choice(user_ids)
+            organization = organizations[rng.randint(0, len(organizations) - 1)] if rng.random() >= 0.1 else None
+            datarequest_rows.append({
+                'id': datarequest_id,
+                'user_id': user_id,
+                'title': u'%s %s' % (PREFIX, datarequest_id),
+                'description': description,
+                'description_html': u'<p>%s</p>' % description,
+                'excerpt': description[:constants.EXCERPT_MAX_LENGTH],
+                # The names of the organizations are stored like the ones created with the API
+                'organization_id': organization.id if organization else None,
+                'organization_name': organization.name if organization else None,
+                'organization_title': organization.title if organization else None,
+                'open_time': open_time,
+                'closed': closed,
+                'close_time': close_time,
+                'last_activity_time': last_activity_time,
+                'comments_count': comments_number
+            })
+
+        db.DataRequest.insert_many(datarequest_rows)
+        for i in range(0, len(comment_rows), batch_size):
+            db.Comment.insert_many(comment_rows[i:i + batch_size])
+        model.Session.commit()
+        stored_comments += len(comment_rows)
+
+    stats.rebuild()
+
+    return datarequests, stored_comments
+
+
+def clean():
+    '''
+    Removes the data requests and comments created by seed and computes the
+    statistics again. Returns the number of data requests removed.
+    '''
+    db.init_db(model)
+    title_filter = db.DataRequest.title.like(PREFIX + u' %')
+    datarequest_ids = model.Session.query(db.DataRequest.id).filter(title_filter).subquery()
+
+    model.Session.query(db.Comment).filter(db.Comment.datarequest_id.in_(datarequest_ids)) \
+        .delete(synchronize_session=False)
+    removed = model.Session.query(db.DataRequest).filter(title_filter).delete(synchronize_session=False)
+    model.Session.commit()
+    stats.rebuild()
+
+    return removed
+
+
+def _get_sample():
+    '''Returns the data used to build the measured calls'''
+    query = model.Session.query(db.DataRequest).autoflush(False).filter(
+        db.DataRequest.title.like(PREFIX + u' %'))
+
+    total = query.count()
+    datarequest = query.order_by(db.DataRequest.open_time.desc()).first()
+    most_commented = query.order_by(db.DataRequest.comments_count.desc()).first()
+    organization = model.Group.get(u'%s-org-0' % PREFIX)
+    user = model.User.get(u'%s-user-0' % PREFIX)
+
+    if total == 0 or organization is None or user is None:
+        raise tk.ObjectNotFound('The benchmark data has not been stored. Run benchmark-seed first')
+
+    return {
+        'total': total,
+        'datarequest': datarequest,
+        'most_commented': most_commented,
+        'organization_name': organization.name,
+        'user_name': user.name
+    }
+
+
+def get_cases(sample, page_size=constants.DATAREQUESTS_PER_PAGE):
+    '''
+    Returns a list of tuples (name, function) with the operations measured:
+    the listings (with filters, free text, deep pages and facets), the data
+    request page, the comments list, the duplicate check of the create path
+    and the number shown in the header badge.
+    '''
+    def _action(name, data_dict):
+        def _call():
+            context = {'model': model, 'session': model.Session, 'user': sample['user_name'], 'ignore_auth': True}
+            return tk.get_action(name)(context, dict(data_dict))
+        return _call
+
+    datarequest = sample['datarequest']
+    deep_offset = max(sample['total'] - page_size, 0)
+
+    return [
+        ('index', _action(constants.DATAREQUEST_INDEX, {})),
+        ('index_organization', _action(constants.DATAREQUEST_INDEX, {'organization_id': sample['organization_name']})),
+        ('index_closed', _action(constants.DATAREQUEST_INDEX, {'closed': True})),
+        ('index_user', _action(constants.DATAREQUEST_INDEX, {'user_id': sample['user_name']})),
+        ('index_q', _action(constants.DATAREQUEST_INDEX, {'q': WORDS[0]})),
+        ('index_deep_page', _action(constants.DATAREQUEST_INDEX, {'offset': deep_offset, 'limit': page_size})),
+        ('index_most_commented', _action(constants.DATAREQUEST_INDEX, {'sort': 'most_commented'})),
+        ('show', _action(constants.DATAREQUEST_SHOW, {'id': datarequest.id})),
+        ('comment_list', _action(constants.DATAREQUEST_COMMENT_LIST,
+                                 {'datarequest_id': sample['most_commented'].id})),
+        ('duplicate_check', lambda: db.DataRequest.datarequest_exists(datarequest.title)),
+        ('badge', helpers.get_open_datarequests_number)
+    ]
+
+
+def measure(function, repeat):
+    '''
+    Calls the function the given number of times and returns the min, mean,
+    median, p95 and max times, in milliseconds. The session is cleared before
+    each call, so objects loaded by the previous call are not reused.
+    '''
+    times = []
+
+    for _ in range(repeat):
+        model.Session.rollback()
+        model.Session.expunge_all()
+        start = timeit.default_timer()
+        function()
+        times.append((timeit.default_timer() - start) * 1000)
+
+    times.sort()
+    return {
+        'min': round(times[0], 3),
+        'mean': round(sum(times) / len(times), 3),
+        'median': round(_percentile(times, 50), 3),
+        'p95': round(_percentile(times, 95), 3),
+        'max': round(times[-1], 3)
+    }
+
+
+def run(repeat=constants.BENCHMARK_REPEAT, warmup=constants.BENCHMARK_WARMUP):
+    '''
+    Measures all the cases against the data stored by seed. The result is a
+    dict that can be serialized as JSON and compared between releases.
+    '''
+    db.init_db(model)
+    sample = _get_sample()
+    results = {}
+
+    for name, function in get_cases(sample):
+        # Caches (the database ones and the ones of the extension) are warmed up first
+        for _ in range(warmup):
+            function()
+        results[name] = measure(function, repeat)
+
+    return {
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'datarequests': sample['total'],
+        'max_comments': sample['most_commented'].comments_count,
+        'repeat': repeat,
+        'unit': 'ms',
+        'results': results
+    }
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import benchmark
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+import constants
+import db
+import events
+import exporter
+import helpers
+import importer
+import json
+import notifications
+import os
+import resolver
+import routes
+import stats
+import sys
+
+from pylons import config
+
+BATCH_SIZE = 500
+
+
+class DataRequestsCommand(tk.CkanCommand):
+    '''Maintenance tasks of the Data Requests extension
+
+    Usage:
+      datarequests upgrade           - adds the columns and indexes included in newer
+                                       versions of the extension to the existing tables
+                                       (run it after upgrading the extension)
+      datarequests [--all] backfill  - stores the rendered HTML (and the excerpts) of the
+                                       descriptions and comments that have not been
+                                       rendered yet and the number of comments, the last
+                                       activity and the names of the organization and the
+                                       accepted dataset of the data requests that do not
+                                       include them (all of them when --all is given)
+      datarequests [--format=jsonl|csv] [--comments] [--names] [--output=FILE] export
+                                     - exports all the data requests (to the standard
+                                       output unless --output is given), optionally
+                                       including their comments and the names of the
+                                       users and organizations
+      datarequests [--checkpoint=FILE] import FILE
+                                     - imports the data requests (and comments) included
+                                       in a JSON Lines file. When --checkpoint is given,
+                                       the number of imported lines is stored in that file
+                                       so an interrupted import can be resumed
+      datarequests replay-dead-letters
+                                     - runs again the handlers of the events that could
+                                       not be handled (stored in the dead letter table)
+      datarequests send-notifications
+                                     - sends the digests of the pending notifications
+                                       (run it periodically, e.g. with cron)
+      datarequests rebuild-stats     - computes again the statistics of the data requests
+                                       from the data requests and comments tables
+      datarequests vacuum-comments   - removes (in batches) the comments whose data request
+                                       no longer exists
+      datarequests [--datarequests=N] [--seed=N] benchmark-seed
+                                     - stores N data requests (and their comments) to
+                                       measure the performance of the extension. Run it
+                                       only against a local database
+      datarequests [--repeat=N] [--output=FILE] benchmark
+                                     - measures the main operations against the data
+                                       stored by benchmark-seed and writes the results
+                                       (JSON) to the standard output or to FILE
+      datarequests benchmark-clean   - removes the data requests stored by benchmark-seed
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 2
+    min_args = 0
+
+    def __init__(self, name):
+        super(DataRequestsCommand, self).__init__(name)
+
+        # The parser is shared by all the instances of the command
+        if not self.parser.has_option('--all'):
+            self.parser.add_option('--all', dest='all',
+                                   action='store_true', default=False,
+                                   help='Process all the rows, not only the pending ones')
+            self.parser.add_option('--format', dest='format',
+                                   choices=constants.EXPORT_FORMATS, default='jsonl',
+                                   help='Format of the export (jsonl or csv)')
+            self.parser.add_option('--comments', dest='comments',
+                                   action='store_true', default=False,
+                                   help='Include the comments in the export')
+            self.parser.add_option('--names', dest='names',
+                                   action='store_true', default=False,
+                                   help='Include the names of the users and organizations in the export')
+            self.parser.add_option('--output', dest='output', default=None,
+                                   help='File where the export is stored')
+            self.parser.add_option('--checkpoint', dest='checkpoint', default=None,
+                                   help='File where the progress of the import is stored')
+            self.parser.add_option('--datarequests', dest='datarequests', type='int', default=1000,
+                                   help='Number of data requests stored by benchmark-seed')
+            self.parser.add_option('--seed', dest='seed', type='int', default=None,
+                                   help='Seed of the random data generated by benchmark-seed')
+            self.parser.add_option('--repeat', dest='repeat', type='int', default=constants.BENCHMARK_REPEAT,
+                                   help='Number of times each operation is measured by benchmark')
+
+    def _load_config(self):
+        super(DataRequestsCommand, self)._load_config()
+        # CkanCommand only gives routes the host and the protocol of the site, but
+        # render_markdown builds the internal links (e.g. dataset:name) with url_for,
+        # so the mapper is needed to backfill and import descriptions and comments
+        routes.request_config().mapper = config['routes.map']
+
+    def command(self):
+        if not self.args:
+            # default to printing help
+            print self.usage
+            return
+
+        self._load_config()
+        db.init_db(model)
+
+        cmd = self.args[0]
+        if cmd == 'upgrade':
+            self.upgrade()
+        elif cmd == 'backfill':
+            self.backfill()
+        elif cmd == 'export':
+            self.export()
+        elif cmd == 'import' and len(self.args) == 2:
+            self.import_file(self.args[1])
+        elif cmd == 'replay-dead-letters':
+            self.replay_dead_letters()
+        elif cmd == 'send-notifications':
+            self.send_notifications()
+        elif cmd == 'rebuild-stats':
+            self.rebuild_stats()
+        elif cmd == 'vacuum-comments':
+            self.vacuum_comments()
+        elif cmd == 'benchmark-seed':
+            self.benchmark_seed()
+        elif cmd == 'benchmark':
+            self.benchmark()
+        elif cmd == 'benchmark-clean':
+            self.benchmark_clean()
+        else:
+            print self.usage
+            sys.exit(1)
+
+    def upgrade(self):
+        db.upgrade_db(model)
+        print 'Data requests tables upgraded'
+
+    def _backfill_table(self, table, source, renders):
+        updated = 0
+
+        for batch in table.iterate_by_id(BATCH_SIZE):
+            for row in batch:
+                # renders is a list of (target, render) pairs, all of them computed from the source
+                pending = [(target, render) for target, render in renders
+                           if self.options.all or getattr(row, target) is None]
+                for target, render in pending:
+                    setattr(row, target, render(getattr(row, source)))
+
+                if pending:
+                    model.Session.add(row)
+                    updated += 1
+
+            model.Session.commit()
+
+        return updated
+
+    def backfill(self):
+        updated = self._backfill_table(db.DataRequest, 'description', [('description_html', helpers.render_markdown),
+                                                                       ('excerpt', helpers.render_excerpt)])
+        print '%d data requests updated' % updated
+
+        updated = self._backfill_table(db.Comment, 'comment', [('comment_html', helpers.render_markdown)])
+        print '%d comments updated' % updated
+
+        updated = self._backfill_activity()
+        print '%d data requests activities updated' % updated
+
+        updated = self._backfill_related_names()
+        print '%d data requests organization and dataset names updated' % updated
+
+    def _backfill_activity(self):
+        updated = 0
+
+        for batch in db.DataRequest.iterate_by_id(BATCH_SIZE):
+            pending = [datarequest for datarequest in batch if self.options.all or
+                       datarequest.comments_count is None or datarequest.last_activity_time is None]
+            activity = db.Comment.get_activity([datarequest.id for datarequest in pending])
+
+            for datarequest in pending:
+                comments_count, last_comment_time = activity.get(datarequest.id, (0, None))
+                times = [t for t in (datarequest.open_time, datarequest.close_time, last_comment_time) if t]
+                datarequest.comments_count = comments_count
+                datarequest.last_activity_time = max(times) if times else None
+                model.Session.add(datarequest)
+                updated += 1
+
+            model.Session.commit()
+
+        return updated
+
+    def _backfill_related_names(self):
+        updated = 0
+
+        for batch in db.DataRequest.iterate_by_id(BATCH_SIZE):
+            pending = [datarequest for datarequest in batch if self.options.all or
+                       any(getattr(datarequest, '%s_id' % name) and getattr(datarequest, '%s_name' % name) is None
+                           for name in constants.DATAREQUEST_STORED_RELATED)]
+
+            # The organizations and datasets of each batch are retrieved with one query
+            summaries = {
+                'organization': resolver.get_organizations(
+                    set(datarequest.organization_id for datarequest in pending if datarequest.organization_id)),
+                'accepted_dataset': resolver.get_packages(
+                    set(datarequest.accepted_dataset_id for datarequest in pending if datarequest.accepted_dataset_id))
+            }
+
+            for datarequest in pending:
+                for name in constants.DATAREQUEST_STORED_RELATED:
+                    summary = summaries[name].get(getattr(datarequest, '%s_id' % name))
+                    setattr(datarequest, '%s_name' % name, summary['name'] if summary else None)
+                    setattr(datarequest, '%s_title' % name, summary['display_name'] if summary else None)
+                model.Session.add(datarequest)
+                updated += 1
+
+            model.Session.commit()
+
+        return updated
+
+    def export(self):
+        output = open(self.options.output, 'wb') if self.options.output else sys.stdout
+
+        try:
+            for chunk in exporter.export_datarequests(self.options.format, self.options.comments,
+                                                      self.options.names):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def _read_checkpoint(self):
+        if self.options.checkpoint and os.path.exists(self.options.checkpoint):
+            with open(self.options.checkpoint) as f:
+                return int(f.read().strip() or 0)
+
+        return 0
+
+    def _write_checkpoint(self, line_number):
+        # The file is replaced atomically so it is never left half written
+        tmp_path = self.options.checkpoint + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(line_number))
+        os.rename(tmp_path, self.options.checkpoint)
+
+    def import_file(self, path):
+        start_line = self._read_checkpoint()
+        if start_line:
+            print 'Resuming the import after line %d' % start_line
+
+        checkpoint = self._write_checkpoint if self.options.checkpoint else None
+        datarequests_importer = importer.DataRequestsImporter()
+
+        with open(path) as f:
+            datarequests_importer.import_lines(f, start_line, checkpoint)
+
+        print '%d data requests imported' % datarequests_importer.imported_datarequests
+        print '%d comments imported' % datarequests_importer.imported_comments
+        print '%d data requests rejected' % datarequests_importer.rejected
+
+    def replay_dead_letters(self):
+        handled, failed = events.replay_dead_letters()
+        print '%d events handled' % handled
+        print '%d events failed again' % failed
+
+    def send_notifications(self):
+        sent = notifications.send_digests()
+        print '%d digests sent' % sent
+
+    def rebuild_stats(self):
+        rows = stats.rebuild()
+        print '%d statistics rows stored' % rows
+
+    def vacuum_comments(self):
+        removed = 0
+
+        # Each batch is commited on its own to keep the transactions short
+        while True:
+            deleted = db.Comment.delete_orphans(BATCH_SIZE)
+            model.Session.commit()
+            removed += deleted
+
+            if deleted < BATCH_SIZE:
+                break
+
+        print '%d orphan comments removed' % removed
+
+    def benchmark_seed(self):
+        datarequests, comments = benchmark.seed(self.options.datarequests, seed_value=self.options.seed)
+        print '%d data requests stored' % datarequests
+        print '%d comments stored' % comments
+
+    def benchmark(self):
+        result = benchmark.run(self.options.repeat)
+        output = open(self.options.output, 'w') if self.options.output else sys.stdout
+
+        try:
+            json.dump(result, output, indent=2, sort_keys=True)
+            output.write('\n')
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def benchmark_clean(self):
+        removed = benchmark.clean()
+        print '%d data requests removed' % removed
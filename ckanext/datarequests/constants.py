@@ -20,10 +20,19 @@
 DATAREQUESTS_MAIN_PATH = 'datarequest'
 DATAREQUEST_CREATE = 'datarequest_create'
 DATAREQUEST_SHOW = 'datarequest_show'
+DATAREQUEST_SHOW_MANY = 'datarequest_show_many'
+DATAREQUEST_LIST_FOR_DATASET = 'datarequest_list_for_dataset'
 DATAREQUEST_UPDATE = 'datarequest_update'
 DATAREQUEST_INDEX = 'datarequest_index'
 DATAREQUEST_DELETE = 'datarequest_delete'
 DATAREQUEST_CLOSE = 'datarequest_close'
+DATAREQUEST_BULK_CREATE = 'datarequest_bulk_create'
+DATAREQUEST_BULK_CLOSE = 'datarequest_bulk_close'
+DATAREQUEST_BULK_DELETE = 'datarequest_bulk_delete'
+DATAREQUEST_EXPORT = 'datarequest_export'
+DATAREQUEST_METRICS = 'datarequest_metrics'
+DATAREQUEST_CHANGES_SINCE = 'datarequest_changes_since'
+DATAREQUEST_STATS = 'datarequest_stats'
 DATAREQUEST_COMMENT = 'datarequest_comment'
 DATAREQUEST_COMMENT_LIST = 'datarequest_comment_list'
 DATAREQUEST_COMMENT_SHOW = 'datarequest_comment_show'
@@ -31,5 +40,58 @@ DATAREQUEST_COMMENT_UPDATE = 'datarequest_comment_update'
 DATAREQUEST_COMMENT_DELETE = 'datarequest_comment_delete'
 NAME_MAX_LENGTH = 100
 DESCRIPTION_MAX_LENGTH = 1000
+EXCERPT_MAX_LENGTH = 180
 COMMENT_MAX_LENGTH = DESCRIPTION_MAX_LENGTH
 DATAREQUESTS_PER_PAGE = 10
+BULK_MAX_ITEMS = 1000
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+CHANGES_DEFAULT_LIMIT = 100
+CHANGES_MAX_LIMIT = 1000
+# Key of the PostgreSQL advisory lock that serializes the change log writers
+CHANGES_LOCK_KEY = 7021504
+CHANGE_OBJECT_DATAREQUEST = 'datarequest'
+CHANGE_OBJECT_COMMENT = 'comment'
+CHANGE_CREATED = 'created'
+CHANGE_UPDATED = 'updated'
+CHANGE_CLOSED = 'closed'
+CHANGE_DELETED = 'deleted'
+EVENTS_DEFAULT_WORKERS = 2
+EVENTS_DEFAULT_MAX_RETRIES = 3
+EVENTS_DEFAULT_RETRY_DELAY = 1
+EVENTS_REPLAY_BATCH_SIZE = 100
+NOTIFICATIONS_EVENTS = ('comment_created', 'datarequest_closed')
+NOTIFICATIONS_DEFAULT_WINDOW = 60
+NOTIFICATIONS_DEFAULT_TRANSPORT = 'smtp'
+DATAREQUESTS_SORTS = {
+    'asc': ('open_time', False),
+    'desc': ('open_time', True),
+    'most_commented': ('comments_count', True),
+    'recently_active': ('last_activity_time', True),
+    'recently_closed': ('close_time', True)
+}
+DATAREQUEST_FIELDS = ('id', 'user_id', 'title', 'description', 'description_html', 'excerpt', 'organization_id',
+                      'open_time', 'accepted_dataset_id', 'close_time', 'closed', 'last_activity_time',
+                      'comments_count')
+# Fields shown in the lists of data requests (the description is not loaded)
+DATAREQUEST_LIST_FIELDS = ['id', 'title', 'excerpt', 'closed', 'open_time', 'comments_count']
+# Fields shown in the pages of the datasets that have been accepted by data requests
+DATASET_DATAREQUESTS_FIELDS = ['id', 'title', 'close_time']
+# Related objects of a data request (each one is referenced by the field <name>_id)
+DATAREQUEST_RELATED = ('user', 'organization', 'accepted_dataset')
+# Related objects whose name and title are stored with the data request (<name>_name and <name>_title)
+DATAREQUEST_STORED_RELATED = ('organization', 'accepted_dataset')
+STATS_PERIODS = ('day', 'month')
+STATS_CLOSE_BUCKETS = (1, 6, 24, 72, 168, 720, 2160, 8760)
+STATS_REBUILD_BATCH_SIZE = 1000
+RESOLVER_DEFAULT_TTL = 60
+RESOLVER_MAX_SIZE = 1000
+BENCHMARK_USERS = 100
+BENCHMARK_ORGANIZATIONS = 20
+BENCHMARK_COMMENTS_ALPHA = 1.2
+BENCHMARK_MAX_COMMENTS = 1000
+BENCHMARK_BATCH_SIZE = 1000
+BENCHMARK_REPEAT = 20
+BENCHMARK_WARMUP = 2
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
@@ -24,10 +24,13 @@ import ckan.model as model
 import ckan.plugins as plugins
 import ckan.lib.helpers as helpers
 import ckanext.datarequests.constants as constants
+import ckanext.datarequests.exporter as exporter
+import ckanext.datarequests.instrumentation as instrumentation
+import ckanext.datarequests.resolver as resolver
 import functools
 import re
 
-from ckan.common import request
+from ckan.common import request, response
 from urllib import urlencode
 
 
@@ -77,6 +80,13 @@ def user_datarequest_url(params, id):
 
 class DataRequestsUI(base.BaseController):
 
+    def __call__(self, environ, start_response):
+        # The whole request (including the templates) is recorded, so the calls
+        # made for each row of the lists are included in the metrics
+        action = environ.get('pylons.routes_dict', {}).get('action')
+        with instrumentation.record_request('ui:%s' % action):
+            return base.BaseController.__call__(self, environ, start_response)
+
     def _get_context(self):
         return {'model': model, 'session': model.Session,
                 'user': c.user, 'auth_user_obj': c.userobj}
@@ -102,7 +112,8 @@ class DataRequestsUI(base.BaseController):
             page = int(request.GET.get('page', 1))
             limit = constants.DATAREQUESTS_PER_PAGE
             offset = (page - 1) * constants.DATAREQUESTS_PER_PAGE
-            data_dict = {'offset': offset, 'limit': limit}
+            # Only the fields shown in the list are loaded
+            data_dict = {'offset': offset, 'limit': limit, 'fields': constants.DATAREQUEST_LIST_FIELDS}
 
             state = request.GET.get('state', None)
             if state:
@@ -119,14 +130,17 @@ class DataRequestsUI(base.BaseController):
                 data_dict['user_id'] = user_id
 
             sort = request.GET.get('sort', 'desc')
-            sort = sort if sort in ['asc', 'desc'] else 'desc'
+            sort = sort if sort in constants.DATAREQUESTS_SORTS else 'desc'
             if sort is not None:
                 data_dict['sort'] = sort
 
             tk.check_access(constants.DATAREQUEST_INDEX, context, data_dict)
             datarequests_list = tk.get_action(constants.DATAREQUEST_INDEX)(context, data_dict)
 
-            c.filters = [(tk._('Newest'), 'desc'), (tk._('Oldest'), 'asc')]
+            c.filters = [(tk._('Newest'), 'desc'), (tk._('Oldest'), 'asc'),
+                         (tk._('Most commented'), 'most_commented'),
+                         (tk._('Recently active'), 'recently_active'),
+                         (tk._('Recently closed'), 'recently_closed')]
             c.sort = sort
             c.q = q
             c.organization = organization_id
@@ -268,15 +282,60 @@ class DataRequestsUI(base.BaseController):
             tk.abort(403, tk._('You are not authorized to delete the Data Request %s'
                                % id))
 
+    def export(self):
+        context = self._get_context()
+        file_format = request.GET.get('format', 'jsonl')
+        include_comments = request.GET.get('comments', '') == 'true'
+        include_names = request.GET.get('names', '') == 'true'
+
+        def _stream(chunks):
+            # The session is removed once the controller returns, so the one
+            # opened by the export has to be removed when the stream finishes
+            try:
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                model.Session.remove()
+
+        try:
+            tk.check_access(constants.DATAREQUEST_EXPORT, context, None)
+
+            if file_format not in constants.EXPORT_FORMATS:
+                tk.abort(400, tk._('Invalid export format: %s') % file_format)
+            else:
+                chunks = exporter.export_datarequests(file_format, include_comments, include_names)
+                content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+                response.headers['Content-Type'] = '%s; charset=utf-8' % content_type
+                response.headers['Content-Disposition'] = 'attachment; filename="datarequests.%s"' % file_format
+                return _stream(chunks)
+
+        except tk.NotAuthorized as e:
+            log.warn(e)
+            tk.abort(403, tk._('You are not authorized to export the Data Requests'))
+
+    def metrics(self):
+        context = self._get_context()
+
+        try:
+            tk.check_access(constants.DATAREQUEST_METRICS, context, None)
+            response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+            return instrumentation.metrics.render()
+        except tk.NotAuthorized as e:
+            log.warn(e)
+            tk.abort(403, tk._('You are not authorized to read the metrics of the Data Requests'))
+
     def organization_datarequests(self, id):
         context = self._get_context()
         c.group_dict = tk.get_action('organization_show')(context, {'id': id})
+        # The data requests action will not need to retrieve the organization again
+        resolver.store_organization(c.group_dict)
         url_func = functools.partial(org_datarequest_url, id=id)
         return self._show_index(None, id, False, url_func, 'organization/datarequests.html')
 
     def user_datarequests(self, id):
         context = self._get_context()
         c.user_dict = tk.get_action('user_show')(context, {'id': id, 'include_num_followers': True})
+        resolver.store_user(c.user_dict)
         url_func = functools.partial(user_datarequest_url, id=id)
         return self._show_index(id, request.GET.get('organization', ''), True, url_func, 'user/datarequests.html')
 
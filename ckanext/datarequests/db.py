@@ -22,20 +22,123 @@ import sqlalchemy as sa
 import uuid
 
 from sqlalchemy import func
-from sqlalchemy.sql.expression import or_
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+from sqlalchemy.sql.expression import and_, or_
+
+# Tables of the extension, in the order they are created
+TABLES = ('datarequests', 'datarequests_comments', 'datarequests_changes', 'datarequests_dead_letters',
+          'datarequests_notifications', 'datarequests_stats', 'datarequests_organization_summaries')
+
+# PostgreSQL errors risen when a column (duplicate_column) or an index
+# (duplicate_table) already exists
+_DUPLICATE_OBJECT_CODES = ('42701', '42P07')
 
 DataRequest = None
 Comment = None
+Change = None
+DeadLetter = None
+Notification = None
+Stat = None
+OrganizationSummary = None
 
 
 def uuid4():
     return str(uuid.uuid4())
 
 
+def _upsert(model, update, insert):
+    '''
+    Runs the UPDATE statement and, when it does not affect any row, the INSERT
+    one. The row is inserted in a savepoint, so a concurrent creation of the
+    same row does not abort the transaction (the UPDATE is run again instead)
+    '''
+    if model.Session.execute(update).rowcount == 0:
+        savepoint = model.Session.begin_nested()
+        try:
+            model.Session.execute(insert)
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()
+            model.Session.execute(update)
+
+
+def _ignore_duplicates(statement, *args):
+    '''
+    Runs a statement that adds a column or an index. When other process has
+    added it since the table was inspected, the error is ignored
+    '''
+    try:
+        statement(*args)
+    except ProgrammingError as e:
+        if getattr(e.orig, 'pgcode', None) not in _DUPLICATE_OBJECT_CODES:
+            raise
+
+
+def _upgrade_table(engine, table):
+    '''
+    Tables are only created when they do not exist, so the columns added in
+    newer versions of the extension have to be included in existing tables
+    '''
+    inspector = sa.inspect(engine)
+    existing_columns = set(column['name'] for column in inspector.get_columns(table.name))
+
+    for column in table.columns:
+        if column.name not in existing_columns:
+            column_type = column.type.compile(dialect=engine.dialect)
+            _ignore_duplicates(engine.execute, 'ALTER TABLE "%s" ADD COLUMN "%s" %s' %
+                               (table.name, column.name, column_type))
+
+    existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            _ignore_duplicates(index.create, engine)
+
+
+def _map_table(model, cls, table):
+    '''
+    Creates the table (only if it does not exist) and maps the class to it.
+    If any of these steps fails, the table is removed from the metadata so
+    they are run again by the next call to init_db
+    '''
+    try:
+        table.create(checkfirst=True)
+        model.meta.mapper(cls, table)
+    except Exception:
+        model.meta.metadata.remove(table)
+        raise
+
+    return cls
+
+
+def upgrade_db(model):
+    '''
+    Adds the columns and indexes included in newer versions of the extension
+    to the existing tables and fills the summaries of the organizations if
+    they are empty. It is run by the upgrade command and not when the
+    extension is loaded, so web workers never run DDL statements
+    '''
+    init_db(model)
+
+    for table_name in TABLES:
+        _upgrade_table(model.meta.engine, model.meta.metadata.tables[table_name])
+
+    # Empty summaries are filled in their own transaction, so nothing pending
+    # in the session is commited with them
+    with model.meta.engine.begin() as connection:
+        if OrganizationSummary.is_empty(connection):
+            OrganizationSummary.refresh(connection)
+
+
 def init_db(model):
 
     global DataRequest
     global Comment
+    global Change
+    global DeadLetter
+    global Notification
+    global Stat
+    global OrganizationSummary
 
     if DataRequest is None:
 
@@ -48,15 +151,176 @@ def init_db(model):
                 return query.filter_by(**kw).all()
 
             @classmethod
-            def datarequest_exists(cls, title):
-                '''Returns true if there is a Data Request with the same title (case insensitive)'''
-                query = model.Session.query(cls).autoflush(False)
-                return query.filter(func.lower(cls.title) == func.lower(title)).first() is not None
+            def _query(cls, columns=None):
+                '''Returns a query of the instances or (when given) only of some of their columns'''
+                entities = [getattr(cls, column) for column in columns] if columns else [cls]
+                return model.Session.query(*entities).autoflush(False)
 
             @classmethod
-            def get_ordered_by_date(cls, organization_id=None, user_id=None, closed=None, q=None, desc=False):
-                '''Personalized query'''
+            def get_columns(cls, columns, **kw):
+                '''Finds all the instances required, but only the given columns are loaded'''
+                return cls._query(columns).filter_by(**kw).all()
+
+            @classmethod
+            def iterate_by_id(cls, batch_size):
+                '''Returns all the instances in batches of batch_size elements (ordered by id)'''
+                last_id = u''
+                while True:
+                    query = model.Session.query(cls).autoflush(False)
+                    batch = query.filter(cls.id > last_id).order_by(cls.id.asc()).limit(batch_size).all()
+                    if not batch:
+                        break
+                    yield batch
+                    last_id = batch[-1].id
+
+            @classmethod
+            def get_by_ids(cls, ids, columns=None):
+                '''
+                Finds all the instances whose id is included in the given list. When
+                columns are given, only those columns are loaded
+                '''
+                if not ids:
+                    return []
+                return cls._query(columns).filter(cls.id.in_(ids)).all()
+
+            @classmethod
+            def get_by_accepted_dataset(cls, package_ids, columns=None):
+                '''
+                Finds the data requests closed accepting a dataset (any of the given
+                ids, e.g. its ID and its name), the most recently closed first. When
+                columns are given, only those columns are loaded
+                '''
+                query = cls._query(columns).filter(cls.accepted_dataset_id.in_(package_ids))
+                return query.order_by(cls.close_time.desc().nullslast()).all()
+
+            @classmethod
+            def stream(cls, batch_size):
+                '''
+                Returns all the instances (ordered by open time) using a server-side cursor,
+                so only batch_size rows are kept in memory at the same time
+                '''
+                query = model.Session.query(cls).autoflush(False).order_by(cls.open_time.asc(), cls.id.asc())
+                return query.execution_options(stream_results=True).yield_per(batch_size)
+
+            @classmethod
+            def get_owners(cls, ids):
+                '''Returns a dict with the creator of each one of the given data requests'''
+                if not ids:
+                    return {}
+                query = model.Session.query(cls.id, cls.user_id).autoflush(False)
+                return dict(query.filter(cls.id.in_(ids)).all())
+
+            @classmethod
+            def datarequest_exists(cls, title, exclude_id=None):
+                '''
+                Returns true if there is a Data Request with the same title (case insensitive).
+                The data request exclude_id (the one being updated) is not taken into account.
+                '''
                 query = model.Session.query(cls).autoflush(False)
+                query = query.filter(func.lower(cls.title) == func.lower(title))
+                if exclude_id:
+                    query = query.filter(cls.id != exclude_id)
+                return query.first() is not None
+
+            @classmethod
+            def get_lowercase_titles(cls):
+                '''Returns a set with the titles (in lower case) of all the existing data requests'''
+                query = model.Session.query(func.lower(cls.title)).autoflush(False)
+                return set(title for (title,) in query.all())
+
+            @classmethod
+            def get_existing_ids(cls, ids):
+                '''Returns a set with the given IDs that are already used by some data request'''
+                if not ids:
+                    return set()
+                query = model.Session.query(cls.id).autoflush(False)
+                return set(object_id for (object_id,) in query.filter(cls.id.in_(ids)).all())
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(datarequests_table.insert().values(rows))
+
+            @classmethod
+            def update_activity(cls, datarequest_id, time=None, comments_delta=0):
+                '''
+                Updates the last activity time and the number of comments of a data
+                request using a single UPDATE statement, so concurrent comments are
+                counted properly. Returns the organization of the data request.
+                '''
+                values = {'comments_count': func.coalesce(cls.comments_count, 0) + comments_delta}
+                if time is not None:
+                    values['last_activity_time'] = time
+
+                statement = datarequests_table.update().where(cls.id == datarequest_id).values(**values)
+                return model.Session.execute(statement.returning(datarequests_table.c.organization_id)).scalar()
+
+            @classmethod
+            def close(cls, datarequest_id, close_time, accepted_dataset_id=None, **values):
+                '''
+                Closes a data request using a single conditional UPDATE statement, so
+                it can only be closed once even when it is closed concurrently. Other
+                values (e.g. the name of the accepted dataset) can be stored too.
+                Returns the updated row or None if the data request does not exist or
+                it was already closed.
+                '''
+                statement = datarequests_table.update().where(
+                    and_(cls.id == datarequest_id, cls.closed == False)).values(
+                    closed=True, close_time=close_time, last_activity_time=close_time,
+                    accepted_dataset_id=accepted_dataset_id, **values)
+                return model.Session.execute(statement.returning(*datarequests_table.c)).first()
+
+            @classmethod
+            def update_by_id(cls, datarequest_id, **values):
+                '''
+                Updates a data request using a single UPDATE statement. Returns the
+                updated row, including the organization of the data request before the
+                update (previous_organization_id), or None if it does not exist.
+                '''
+                previous = datarequests_table.alias('previous')
+                statement = datarequests_table.update().where(
+                    and_(cls.id == datarequest_id, previous.c.id == cls.id)).values(**values)
+                columns = list(datarequests_table.c) + [previous.c.organization_id.label('previous_organization_id')]
+                return model.Session.execute(statement.returning(*columns)).first()
+
+            @classmethod
+            def update_related_names(cls, related, object_id, name, title):
+                '''
+                Stores the name and title of an organization or a dataset (related is
+                organization or accepted_dataset) in all the data requests that
+                reference it using a single UPDATE statement. Only the data requests
+                whose stored values are outdated are written. Returns the number of
+                updated data requests.
+                '''
+                name_column = datarequests_table.c['%s_name' % related]
+                title_column = datarequests_table.c['%s_title' % related]
+                outdated = or_(func.coalesce(name_column, u'') != (name or u''),
+                               func.coalesce(title_column, u'') != (title or u''))
+                statement = datarequests_table.update().where(
+                    and_(datarequests_table.c['%s_id' % related] == object_id, outdated)).values(
+                    {name_column: name, title_column: title})
+                return model.Session.execute(statement).rowcount
+
+            @classmethod
+            def delete_by_id(cls, datarequest_id):
+                '''
+                Deletes a data request using a single DELETE statement. Returns the
+                deleted row or None if the data request does not exist.
+                '''
+                statement = datarequests_table.delete().where(cls.id == datarequest_id)
+                return model.Session.execute(statement.returning(*datarequests_table.c)).first()
+
+            @classmethod
+            def get_ordered_by_date(cls, organization_id=None, user_id=None, closed=None, q=None, desc=False,
+                                    order_by='open_time', offset=None, limit=None, columns=None):
+                '''
+                Personalized query. Results can be ordered by open_time, close_time,
+                last_activity_time or comments_count (all of them are indexed). When
+                offset or limit are given, only that page of results is returned. When
+                columns are given, only those columns are loaded
+                '''
+                query = cls._query(columns)
 
                 params = {}
 
@@ -73,34 +337,57 @@ def init_db(model):
                     search_expr = '%{0}%'.format(q)
                     query = query.filter(or_(cls.title.ilike(search_expr), cls.description.ilike(search_expr)))
 
-                order_by_filter = cls.open_time.desc() if desc else cls.open_time.asc()
+                # NULLs are placed at the end (close_time is only set for closed data
+                # requests), in the same way than in the indexes
+                column = getattr(cls, order_by)
+                order_by_filter = column.desc().nullslast() if desc else column.asc()
+
+                query = query.filter_by(**params).order_by(order_by_filter)
 
-                return query.filter_by(**params).order_by(order_by_filter).all()
+                if offset:
+                    query = query.offset(offset)
+
+                if limit is not None:
+                    query = query.limit(limit)
+
+                return query.all()
 
             @classmethod
             def get_open_datarequests_number(cls):
                 '''Returns the number of data requests that are open'''
                 return model.Session.query(func.count(cls.id)).filter_by(closed=False).scalar()
 
-        DataRequest = _DataRequest
-
         # FIXME: References to the other tables...
         datarequests_table = sa.Table('datarequests', model.meta.metadata,
             sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
             sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('title', sa.types.Unicode(constants.NAME_MAX_LENGTH), primary_key=True, default=u''),
             sa.Column('description', sa.types.Unicode(constants.DESCRIPTION_MAX_LENGTH), primary_key=False, default=u''),
+            sa.Column('description_html', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('excerpt', sa.types.UnicodeText, primary_key=False, default=None),
             sa.Column('organization_id', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('organization_name', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('organization_title', sa.types.UnicodeText, primary_key=False, default=None),
             sa.Column('open_time', sa.types.DateTime, primary_key=False, default=None),
             sa.Column('accepted_dataset_id', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('accepted_dataset_name', sa.types.UnicodeText, primary_key=False, default=None),
+            sa.Column('accepted_dataset_title', sa.types.UnicodeText, primary_key=False, default=None),
             sa.Column('close_time', sa.types.DateTime, primary_key=False, default=None),
-            sa.Column('closed', sa.types.Boolean, primary_key=False, default=False)
+            sa.Column('closed', sa.types.Boolean, primary_key=False, default=False),
+            sa.Column('last_activity_time', sa.types.DateTime, primary_key=False, default=None),
+            sa.Column('comments_count', sa.types.Integer, primary_key=False, default=0)
         )
 
-        # Create the table only if it does not exist
-        datarequests_table.create(checkfirst=True)
+        # Indexes used to sort the data requests
+        for column_name in ('close_time', 'last_activity_time', 'comments_count'):
+            column = datarequests_table.c[column_name]
+            sa.Index('datarequests_%s_idx' % column_name, column.desc().nullslast())
+
+        # Index used to find the data requests that accepted a dataset
+        sa.Index('datarequests_accepted_dataset_id_idx', datarequests_table.c.accepted_dataset_id)
 
-        model.meta.mapper(DataRequest, datarequests_table,)
+        # Create the table only if it does not exist
+        DataRequest = _map_table(model, _DataRequest, datarequests_table)
 
 
     if Comment is None:
@@ -112,6 +399,83 @@ def init_db(model):
                 query = model.Session.query(cls).autoflush(False)
                 return query.filter_by(**kw).all()
 
+            @classmethod
+            def iterate_by_id(cls, batch_size):
+                '''Returns all the instances in batches of batch_size elements (ordered by id)'''
+                last_id = u''
+                while True:
+                    query = model.Session.query(cls).autoflush(False)
+                    batch = query.filter(cls.id > last_id).order_by(cls.id.asc()).limit(batch_size).all()
+                    if not batch:
+                        break
+                    yield batch
+                    last_id = batch[-1].id
+
+            @classmethod
+            def get_existing_ids(cls, ids):
+                '''Returns a set with the given IDs that are already used by some comment'''
+                if not ids:
+                    return set()
+                query = model.Session.query(cls.id).autoflush(False)
+                return set(object_id for (object_id,) in query.filter(cls.id.in_(ids)).all())
+
+            @classmethod
+            def get_by_datarequest_ids(cls, datarequest_ids):
+                '''Finds the comments of all the given data requests (ordered by date)'''
+                if not datarequest_ids:
+                    return []
+                query = model.Session.query(cls).autoflush(False)
+                return query.filter(cls.datarequest_id.in_(datarequest_ids)).order_by(cls.time.asc()).all()
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(comments_table.insert().values(rows))
+
+            @classmethod
+            def update_by_id(cls, comment_id, **values):
+                '''
+                Updates a comment using a single UPDATE statement. Returns the updated
+                row or None if the comment does not exist.
+                '''
+                statement = comments_table.update().where(cls.id == comment_id).values(**values)
+                return model.Session.execute(statement.returning(*comments_table.c)).first()
+
+            @classmethod
+            def delete_by_id(cls, comment_id):
+                '''
+                Deletes a comment using a single DELETE statement. Returns the deleted
+                row or None if the comment does not exist.
+                '''
+                statement = comments_table.delete().where(cls.id == comment_id)
+                return model.Session.execute(statement.returning(*comments_table.c)).first()
+
+            @classmethod
+            def delete_by_datarequest_ids(cls, datarequest_ids):
+                '''
+                Deletes all the comments of the given data requests using a single
+                DELETE statement. Returns the deleted rows (datarequest_id and time).
+                '''
+                if not datarequest_ids:
+                    return []
+                statement = comments_table.delete().where(cls.datarequest_id.in_(datarequest_ids))
+                columns = (comments_table.c.datarequest_id, comments_table.c.time)
+                return model.Session.execute(statement.returning(*columns)).fetchall()
+
+            @classmethod
+            def delete_orphans(cls, batch_size):
+                '''
+                Deletes (at most) batch_size comments whose data request no longer
+                exists using a single DELETE statement. Returns the number of comments
+                deleted.
+                '''
+                datarequests = model.meta.metadata.tables['datarequests']
+                orphans = sa.select([comments_table.c.id]).where(
+                    ~sa.exists().where(datarequests.c.id == comments_table.c.datarequest_id)).limit(batch_size)
+                statement = comments_table.delete().where(comments_table.c.id.in_(orphans))
+                return model.Session.execute(statement).rowcount
+
             @classmethod
             def get_ordered_by_date(cls, datarequest_id, desc=False):
                 '''Personalized query'''
@@ -119,6 +483,21 @@ def init_db(model):
                 order_by_filter = cls.time.desc() if desc else cls.time.asc()
                 return query.filter_by(datarequest_id=datarequest_id).order_by(order_by_filter).all()
 
+            @classmethod
+            def get_activity(cls, datarequest_ids):
+                '''Returns a dict with the number of comments and the time of the last one of each data request'''
+                if not datarequest_ids:
+                    return {}
+                query = model.Session.query(cls.datarequest_id, func.count(cls.id), func.max(cls.time)).autoflush(False)
+                query = query.filter(cls.datarequest_id.in_(datarequest_ids)).group_by(cls.datarequest_id)
+                return dict((datarequest_id, (count, time)) for datarequest_id, count, time in query.all())
+
+            @classmethod
+            def get_commenters(cls, datarequest_id):
+                '''Returns the IDs of the users that have commented a data request'''
+                query = model.Session.query(cls.user_id).autoflush(False).distinct()
+                return [user_id for (user_id,) in query.filter_by(datarequest_id=datarequest_id).all()]
+
             @classmethod
             def get_datarequest_comments_number(cls, **kw):
                 '''
@@ -126,18 +505,262 @@ def init_db(model):
                 '''
                 return model.Session.query(func.count(cls.id)).filter_by(**kw).scalar()
 
-        Comment = _Comment
-
         # FIXME: References to the other tables...
         comments_table = sa.Table('datarequests_comments', model.meta.metadata,
             sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
             sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=True, default=uuid4),
             sa.Column('time', sa.types.DateTime, primary_key=True, default=u''),
-            sa.Column('comment', sa.types.Unicode(constants.COMMENT_MAX_LENGTH), primary_key=False, default=u'')
+            sa.Column('comment', sa.types.Unicode(constants.COMMENT_MAX_LENGTH), primary_key=False, default=u''),
+            sa.Column('comment_html', sa.types.UnicodeText, primary_key=False, default=None)
+        )
+
+        # Create the table only if it does not exist
+        Comment = _map_table(model, _Comment, comments_table)
+
+    if Change is None:
+        class _Change(model.DomainObject):
+
+            @classmethod
+            def lock(cls):
+                '''
+                Takes the lock of the change log until the current transaction ends. It
+                has to be taken before adding a change, so the IDs (used as cursor by the
+                consumers) are assigned in the same order the transactions are commited
+                and a consumer never skips a change commited after a more recent one
+                '''
+                model.Session.execute(sa.select([func.pg_advisory_xact_lock(constants.CHANGES_LOCK_KEY)]))
+
+            @classmethod
+            def get_since(cls, cursor, limit):
+                '''Returns the first limit changes whose id is greater than the given cursor'''
+                query = model.Session.query(cls).autoflush(False)
+                return query.filter(cls.id > cursor).order_by(cls.id.asc()).limit(limit).all()
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(changes_table.insert().values(rows))
+
+        # The ID is used as cursor by the consumers of the change log
+        changes_table = sa.Table('datarequests_changes', model.meta.metadata,
+            sa.Column('id', sa.types.Integer, primary_key=True, autoincrement=True),
+            sa.Column('object_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('object_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('change_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('time', sa.types.DateTime, primary_key=False, default=None)
+        )
+
+        # Create the table only if it does not exist
+        Change = _map_table(model, _Change, changes_table)
+
+    if DeadLetter is None:
+        class _DeadLetter(model.DomainObject):
+
+            @classmethod
+            def iterate_by_id(cls, batch_size):
+                '''Returns all the instances in batches of batch_size elements (ordered by id)'''
+                last_id = 0
+                while True:
+                    query = model.Session.query(cls).autoflush(False)
+                    batch = query.filter(cls.id > last_id).order_by(cls.id.asc()).limit(batch_size).all()
+                    if not batch:
+                        break
+                    yield batch
+                    last_id = batch[-1].id
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(dead_letters_table.insert().values(rows))
+
+        # Events that could not be handled by some of the event handlers
+        dead_letters_table = sa.Table('datarequests_dead_letters', model.meta.metadata,
+            sa.Column('id', sa.types.Integer, primary_key=True, autoincrement=True),
+            sa.Column('event_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('event', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('handler', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('error', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('attempts', sa.types.Integer, primary_key=False, default=0),
+            sa.Column('time', sa.types.DateTime, primary_key=False, default=None)
+        )
+
+        # Create the table only if it does not exist
+        DeadLetter = _map_table(model, _DeadLetter, dead_letters_table)
+
+    if Notification is None:
+        class _Notification(model.DomainObject):
+
+            @classmethod
+            def get_due_recipients(cls, cutoff):
+                '''Returns the users whose oldest pending notification was created before the cutoff'''
+                query = model.Session.query(cls.recipient_id).autoflush(False).group_by(cls.recipient_id)
+                return [recipient_id for (recipient_id,) in query.having(func.min(cls.time) <= cutoff).all()]
+
+            @classmethod
+            def get_by_recipient(cls, recipient_id):
+                '''Returns the pending notifications of a user (ordered by id)'''
+                query = model.Session.query(cls).autoflush(False)
+                return query.filter_by(recipient_id=recipient_id).order_by(cls.id.asc()).all()
+
+            @classmethod
+            def delete_by_ids(cls, ids):
+                '''Deletes all the given notifications using a single DELETE statement'''
+                if ids:
+                    model.Session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(notifications_table.insert().values(rows))
+
+        # Notifications pending to be included in a digest
+        notifications_table = sa.Table('datarequests_notifications', model.meta.metadata,
+            sa.Column('id', sa.types.Integer, primary_key=True, autoincrement=True),
+            sa.Column('recipient_id', sa.types.UnicodeText, primary_key=False, default=u'', index=True),
+            sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('event_type', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('object_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
+            sa.Column('time', sa.types.DateTime, primary_key=False, default=None)
+        )
+
+        # Create the table only if it does not exist
+        Notification = _map_table(model, _Notification, notifications_table)
+
+    if Stat is None:
+        class _Stat(model.DomainObject):
+
+            @classmethod
+            def increment(cls, organization_id, day, metric, delta):
+                '''Adds delta to the value of a metric. The row is created when it does not exist'''
+                where = and_(stats_table.c.organization_id == organization_id,
+                             stats_table.c.day == day, stats_table.c.metric == metric)
+                update = stats_table.update().where(where).values(value=stats_table.c.value + delta)
+                insert = stats_table.insert().values(organization_id=organization_id, day=day,
+                                                     metric=metric, value=delta)
+                _upsert(model, update, insert)
+
+            @classmethod
+            def get_totals(cls, organization_id=None, since=None, until=None, period=None):
+                '''
+                Returns the sum of each metric per organization (and per period,
+                day or month, when given) between the given days (both included)
+                '''
+                columns = [cls.organization_id]
+                if period:
+                    columns.append(func.date_trunc(period, cls.day))
+                columns.append(cls.metric)
+
+                query = model.Session.query(*(columns + [func.sum(cls.value)])).autoflush(False)
+
+                if organization_id is not None:
+                    query = query.filter(cls.organization_id == organization_id)
+
+                if since is not None:
+                    query = query.filter(cls.day >= since)
+
+                if until is not None:
+                    query = query.filter(cls.day <= until)
+
+                return query.group_by(*columns).order_by(*columns).all()
+
+            @classmethod
+            def delete_all(cls):
+                model.Session.execute(stats_table.delete())
+
+            @classmethod
+            def insert_many(cls, rows):
+                '''Inserts all the given rows (dicts) using a single multi-row INSERT statement'''
+                if rows:
+                    model.Session.execute(stats_table.insert().values(rows))
+
+        # Metrics of the data requests aggregated per organization and day. Data
+        # requests without organization are stored with an empty organization_id
+        stats_table = sa.Table('datarequests_stats', model.meta.metadata,
+            sa.Column('organization_id', sa.types.UnicodeText, primary_key=True, default=u''),
+            sa.Column('day', sa.types.Date, primary_key=True),
+            sa.Column('metric', sa.types.UnicodeText, primary_key=True),
+            sa.Column('value', sa.types.BigInteger, primary_key=False, default=0)
         )
 
         # Create the table only if it does not exist
-        comments_table.create(checkfirst=True)
+        Stat = _map_table(model, _Stat, stats_table)
+
+    if OrganizationSummary is None:
+        class _OrganizationSummary(model.DomainObject):
+
+            @classmethod
+            def update(cls, organization_id, open_delta=0, closed_delta=0, activity_time=None):
+                '''
+                Adds the deltas to the number of open and closed data requests of
+                an organization and sets its last activity (if activity_time is more
+                recent). The row is created when it does not exist.
+                '''
+                table = summaries_table
+                values = {
+                    'open_count': table.c.open_count + open_delta,
+                    'closed_count': table.c.closed_count + closed_delta
+                }
+
+                if activity_time is not None:
+                    values['last_activity_time'] = func.greatest(func.coalesce(table.c.last_activity_time, activity_time),
+                                                                 activity_time)
+
+                update = table.update().where(table.c.organization_id == organization_id).values(**values)
+                insert = table.insert().values(organization_id=organization_id, open_count=open_delta,
+                                               closed_count=closed_delta, last_activity_time=activity_time)
+                _upsert(model, update, insert)
+
+            @classmethod
+            def get(cls, organization_id):
+                '''Returns the summary of an organization (u'' for the data requests without organization)'''
+                return model.Session.query(cls).autoflush(False).filter_by(organization_id=organization_id).first()
+
+            @classmethod
+            def get_all(cls):
+                return model.Session.query(cls).autoflush(False).order_by(cls.organization_id.asc()).all()
+
+            @classmethod
+            def is_empty(cls, connection):
+                '''Returns whether there are no summaries (e.g. the table has just been created)'''
+                return connection.execute(sa.select([func.count()]).select_from(summaries_table)).scalar() == 0
+
+            @classmethod
+            def refresh(cls, connection=None):
+                '''
+                Computes again the summaries of all the organizations from the data
+                requests table, using the given connection or the session
+                '''
+                connection = connection if connection is not None else model.Session
+                datarequests = model.meta.metadata.tables['datarequests']
+                organization_id = func.coalesce(datarequests.c.organization_id, u'')
+                query = sa.select([
+                    organization_id,
+                    func.sum(sa.case([(datarequests.c.closed == True, 0)], else_=1)),
+                    func.sum(sa.case([(datarequests.c.closed == True, 1)], else_=0)),
+                    func.max(datarequests.c.last_activity_time)
+                ]).group_by(organization_id)
+
+                connection.execute(summaries_table.delete())
+                connection.execute(summaries_table.insert().from_select(
+                    ['organization_id', 'open_count', 'closed_count', 'last_activity_time'], query))
+
+        # Number of open and closed data requests and last activity of each
+        # organization (u'' for the data requests without organization), so
+        # organization pages and facets do not have to read the data requests
+        summaries_table = sa.Table('datarequests_organization_summaries', model.meta.metadata,
+            sa.Column('organization_id', sa.types.UnicodeText, primary_key=True, default=u''),
+            sa.Column('open_count', sa.types.Integer, primary_key=False, default=0),
+            sa.Column('closed_count', sa.types.Integer, primary_key=False, default=0),
+            sa.Column('last_activity_time', sa.types.DateTime, primary_key=False, default=None)
+        )
 
-        model.meta.mapper(Comment, comments_table,)
+        # Create the table only if it does not exist. The upgrade command fills
+        # it with the data requests created with previous versions
+        OrganizationSummary = _map_table(model, _OrganizationSummary, summaries_table)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import ckan.plugins as plugins
+import constants
+import datetime
+import db
+import json
+import logging
+import Queue
+import threading
+import time
+
+from interfaces import IDataRequestEvents
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+# Handlers registered by the extension itself (the rest of them are
+# provided by the plugins that implement IDataRequestEvents)
+_subscribers = []
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def subscribe(handler):
+    '''Registers a function that will be called with every event'''
+    if handler not in _subscribers:
+        _subscribers.append(handler)
+
+
+def get_handlers():
+    handlers = list(_subscribers)
+    handlers.extend(plugin.handle_datarequest_event
+                    for plugin in plugins.PluginImplementations(IDataRequestEvents))
+    return handlers
+
+
+def get_handler_name(handler):
+    owner = getattr(handler, 'im_self', None)
+    if owner is not None:
+        return '%s.%s.%s' % (type(owner).__module__, type(owner).__name__, handler.__name__)
+
+    return '%s.%s' % (handler.__module__, handler.__name__)
+
+
+class EventDispatcher(object):
+    '''
+    Runs the handlers of the events in a pool of background threads, so the
+    time needed to handle the events is not added to the requests. Failed
+    handlers are retried (waiting retry_delay seconds, doubled on every
+    attempt) and the events that cannot be handled are stored in the dead
+    letter table. When workers is 0, handlers are run synchronously.
+    '''
+
+    def __init__(self, workers, max_retries, retry_delay):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Threads are started with the first event (and not when the module
+        # is loaded) so they are not lost when the server forks its workers
+        with self._lock:
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._work, name='datarequests-events-%d' % i)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            handler, event = self._queue.get()
+            try:
+                self.run(handler, event)
+            finally:
+                # Each job uses its own session
+                model.Session.remove()
+                self._queue.task_done()
+
+    def run(self, handler, event):
+        '''
+        Runs a handler, retrying it when it fails. Returns True if the event
+        has been handled and False if it has been sent to the dead letter
+        table.
+        '''
+        attempts = 0
+
+        while True:
+            try:
+                handler(event)
+                return True
+            except Exception as e:
+                attempts += 1
+                if attempts > self.max_retries:
+                    log.exception('Event %s could not be handled by %s' % (event['type'], get_handler_name(handler)))
+                    self._store_dead_letter(handler, event, e, attempts)
+                    return False
+
+                model.Session.rollback()
+                time.sleep(self.retry_delay * 2 ** (attempts - 1))
+
+    def _store_dead_letter(self, handler, event, error, attempts):
+        try:
+            model.Session.rollback()
+            db.init_db(model)
+            db.DeadLetter.insert_many([{
+                'event_type': event['type'],
+                'event': json.dumps(event),
+                'handler': get_handler_name(handler),
+                'error': repr(error),
+                'attempts': attempts,
+                'time': datetime.datetime.now()
+            }])
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            log.exception('Event %s could not be stored in the dead letter table' % event['type'])
+
+    def dispatch(self, event):
+        handlers = get_handlers()
+
+        if self.workers > 0 and handlers:
+            self._start()
+
+        for handler in handlers:
+            if self.workers > 0:
+                self._queue.put((handler, event))
+            else:
+                self.run(handler, event)
+
+
+def get_dispatcher():
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EventDispatcher(
+                int(config.get('ckan.datarequests.events.workers', constants.EVENTS_DEFAULT_WORKERS)),
+                int(config.get('ckan.datarequests.events.max_retries', constants.EVENTS_DEFAULT_MAX_RETRIES)),
+                float(config.get('ckan.datarequests.events.retry_delay', constants.EVENTS_DEFAULT_RETRY_DELAY)))
+
+    return _dispatcher
+
+
+def publish(event):
+    '''
+    Dispatches an event. It must be called once the change that generated the
+    event has been commited.
+
+    :param event: The entry of the change log that describes the change
+        (object_type, object_id, datarequest_id, change_type, user_id and
+        time)
+    :type event: dict
+    '''
+    event = dict(event, type='%s_%s' % (event['object_type'], event['change_type']))
+    get_dispatcher().dispatch(event)
+
+
+def replay_dead_letters(batch_size=constants.EVENTS_REPLAY_BATCH_SIZE):
+    '''
+    Runs again (synchronously) the handlers of the events stored in the dead
+    letter table. Events handled successfully are removed from the table and
+    the attempts of the rest of them are updated.
+
+    :returns: The number of events handled and the number of events that
+        failed again
+    :rtype: tuple
+    '''
+    db.init_db(model)
+    handlers = dict((get_handler_name(handler), handler) for handler in get_handlers())
+    handled = failed = 0
+
+    for batch in db.DeadLetter.iterate_by_id(batch_size):
+        for dead_letter in batch:
+            handler = handlers.get(dead_letter.handler)
+
+            try:
+                if handler is None:
+                    raise Exception('Handler %s is not available' % dead_letter.handler)
+
+                handler(json.loads(dead_letter.event))
+                model.Session.delete(dead_letter)
+                handled += 1
+            except Exception as e:
+                log.warn('Event %s could not be handled by %s: %r' % (dead_letter.event_type, dead_letter.handler, e))
+                model.Session.rollback()
+                dead_letter.attempts += 1
+                dead_letter.error = repr(e)
+                dead_letter.time = datetime.datetime.now()
+                model.Session.add(dead_letter)
+                failed += 1
+
+            model.Session.commit()
+
+    return handled, failed
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import constants
+import csv
+import db
+import itertools
+import json
+
+from cStringIO import StringIO
+
+DATAREQUEST_FIELDS = ['id', 'user_id', 'title', 'description', 'organization_id', 'open_time',
+                      'accepted_dataset_id', 'close_time', 'closed']
+COMMENT_FIELDS = ['id', 'user_id', 'time', 'comment']
+NAME_FIELDS = ['user_name', 'organization_name']
+
+
+def _serialize(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _get_names(table, ids):
+    '''Returns a dict with the name of each one of the given users or organizations'''
+    ids = set(ids)
+    ids.discard(None)
+    ids.discard(u'')
+
+    if not ids:
+        return {}
+
+    return dict(model.Session.query(table.id, table.name).filter(table.id.in_(ids)).all())
+
+
+def _get_comments(datarequest_ids):
+    comments = {}
+
+    for comment in db.Comment.get_by_datarequest_ids(datarequest_ids):
+        comments.setdefault(comment.datarequest_id, []).append(comment)
+
+    return comments
+
+
+def _dictize_batch(batch, include_comments, include_names):
+    comments = _get_comments([d.id for d in batch]) if include_comments else {}
+    users = {}
+    organizations = {}
+
+    if include_names:
+        user_ids = [d.user_id for d in batch]
+        for datarequest_comments in comments.values():
+            user_ids.extend(c.user_id for c in datarequest_comments)
+
+        users = _get_names(model.User, user_ids)
+        organizations = _get_names(model.Group, [d.organization_id for d in batch])
+
+    for datarequest in batch:
+        data_dict = dict((field, _serialize(getattr(datarequest, field))) for field in DATAREQUEST_FIELDS)
+
+        if include_names:
+            data_dict['user_name'] = users.get(datarequest.user_id)
+            data_dict['organization_name'] = organizations.get(datarequest.organization_id)
+
+        if include_comments:
+            data_dict['comments'] = []
+            for comment in comments.get(datarequest.id, []):
+                comment_dict = dict((field, _serialize(getattr(comment, field))) for field in COMMENT_FIELDS)
+                if include_names:
+                    comment_dict['user_name'] = users.get(comment.user_id)
+                data_dict['comments'].append(comment_dict)
+
+        yield data_dict
+
+
+def _iterate_batches(batch_size):
+    rows = iter(db.DataRequest.stream(batch_size))
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def _encode_csv_value(value):
+    if isinstance(value, list):
+        value = json.dumps(value)
+    elif value is None:
+        value = u''
+
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def _export_jsonl(batches, include_comments, include_names):
+    for batch in batches:
+        data_dicts = _dictize_batch(batch, include_comments, include_names)
+        yield ''.join(json.dumps(data_dict) + '\n' for data_dict in data_dicts)
+
+
+def _export_csv(batches, include_comments, include_names):
+    fields = list(DATAREQUEST_FIELDS)
+    if include_names:
+        fields.extend(NAME_FIELDS)
+    if include_comments:
+        fields.append('comments')
+
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+
+    for batch in batches:
+        for data_dict in _dictize_batch(batch, include_comments, include_names):
+            writer.writerow([_encode_csv_value(data_dict[field]) for field in fields])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    # The header has not been returned yet when there are no data requests
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def export_datarequests(file_format='jsonl', include_comments=False, include_names=False,
+                        batch_size=constants.EXPORT_BATCH_SIZE):
+    '''
+    Serializes all the data requests as JSON Lines or CSV. Data requests are
+    read using a server-side cursor and processed in batches of batch_size
+    elements: comments and user and organization names are retrieved with one
+    query per batch, so the memory used by the export does not depend on the
+    number of data requests.
+
+    :param file_format: The output format (``jsonl`` or ``csv``)
+    :type file_format: string
+
+    :param include_comments: Whether the comments of each data request should
+        be included. In CSV files, comments are stored as a JSON list.
+    :type include_comments: bool
+
+    :param include_names: Whether the names of the users and organizations
+        should be included
+    :type include_names: bool
+
+    :returns: An iterator with the chunks (strings) of the export
+    :rtype: iterator
+    '''
+
+    if file_format not in constants.EXPORT_FORMATS:
+        raise ValueError('Invalid format: %s' % file_format)
+
+    db.init_db(model)
+
+    export = _export_jsonl if file_format == 'jsonl' else _export_csv
+    return export(_iterate_batches(batch_size), include_comments, include_names)
@@ -17,9 +17,62 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import ckan.lib.helpers as h
 import ckan.model as model
 import ckan.plugins.toolkit as tk
+import constants
 import db
+import resolver
+
+from HTMLParser import HTMLParser
+from pylons import config
+
+_dataset_datarequests = None
+
+
+def render_markdown(text):
+    '''
+    Descriptions and comments are rendered (and sanitized) when they are
+    stored, so the HTML returned by this function is the one shown in the
+    templates
+    '''
+    return unicode(h.render_markdown(text)) if text else u''
+
+
+def render_excerpt(text):
+    '''
+    Returns the plain text extract of a description shown in the lists of data
+    requests. It is stored along with the description, so lists do not load
+    the description nor extract it on every render
+    '''
+    if not text:
+        return u''
+    extract = h.markdown_extract(text, extract_length=constants.EXCERPT_MAX_LENGTH)
+    # The extract keeps the HTML entities of the rendered markdown, but the templates escape it
+    return HTMLParser().unescape(unicode(extract))
+
+
+def update_related_names(entity):
+    '''
+    Stores the name and title of an updated organization or dataset in the
+    data requests that reference it (they are cleared when the dataset is
+    private or deleted). Other groups are ignored
+    '''
+    name, title = entity.name, entity.title or entity.name
+
+    if hasattr(entity, 'is_organization'):
+        if not entity.is_organization:
+            return
+        related = 'organization'
+    else:
+        related = 'accepted_dataset'
+        # The names of private and deleted datasets are not shown with the data requests
+        if entity.private or entity.state != 'active':
+            name = title = None
+
+    # DB should be initialized
+    db.init_db(model)
+    db.DataRequest.update_related_names(related, entity.id, name, title)
 
 
 def get_comments_number(datarequest_id):
@@ -33,6 +86,36 @@ def get_comments_badge(datarequest_id):
                              {'comments_count': get_comments_number(datarequest_id)})
 
 
+def _get_dataset_datarequests_cache():
+    global _dataset_datarequests
+
+    if _dataset_datarequests is None:
+        ttl = float(config.get('ckan.datarequests.resolver.ttl', constants.RESOLVER_DEFAULT_TTL))
+        _dataset_datarequests = resolver.TTLCache(ttl, constants.RESOLVER_MAX_SIZE, 'dataset_datarequests')
+
+    return _dataset_datarequests
+
+
+def get_dataset_datarequests(package_id):
+    '''
+    Returns the data requests that have been closed accepting the given dataset
+    (only the fields shown in the dataset page). They are cached, so dataset
+    pages do not query the data requests on every view
+    '''
+    cache = _get_dataset_datarequests_cache()
+    datarequests = cache.get(package_id)
+
+    if datarequests is None:
+        data_dict = {'package_id': package_id, 'fields': constants.DATASET_DATAREQUESTS_FIELDS}
+        try:
+            datarequests = tk.get_action(constants.DATAREQUEST_LIST_FOR_DATASET)({'ignore_auth': True}, data_dict)
+        except tk.ObjectNotFound:
+            datarequests = []
+        cache.set(package_id, datarequests)
+
+    return datarequests
+
+
 def get_open_datarequests_number():
     # DB should be initialized
     db.init_db(model)
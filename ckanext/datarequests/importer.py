@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+import constants
+import datetime
+import db
+import helpers
+import json
+import logging
+import resolver
+import stats
+
+log = logging.getLogger(__name__)
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def _parse_time(value, default):
+    if not value:
+        return default
+
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except (TypeError, ValueError):
+            pass
+
+    raise ValueError(value)
+
+
+class _Row(object):
+    '''Gives access to the values of a row as attributes, like a mapped object'''
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _get_record_ids(records):
+    '''Returns the IDs of the data requests and the comments included in the given records'''
+    datarequest_ids = set()
+    comment_ids = set()
+
+    for record in records:
+        if isinstance(record, dict):
+            if record.get('id'):
+                datarequest_ids.add(record['id'])
+            comments = record.get('comments')
+            if isinstance(comments, list):
+                comment_ids.update(c['id'] for c in comments if isinstance(c, dict) and c.get('id'))
+
+    return datarequest_ids, comment_ids
+
+
+class DataRequestsImporter(object):
+    '''
+    Imports data requests (and their comments) from JSON Lines files with the
+    same format used by the export. Records are validated in batches against
+    the titles and organizations loaded when the importer is created (and the
+    IDs already used and the accepted datasets, loaded once per batch), and
+    each batch is stored with multi-row INSERT statements and a single commit.
+    '''
+
+    def __init__(self, batch_size=constants.IMPORT_BATCH_SIZE):
+        db.init_db(model)
+        self.batch_size = batch_size
+        self.titles = db.DataRequest.get_lowercase_titles()
+        self.organizations = self._get_organizations()
+        self.packages = {}
+        self.datarequest_ids = set()
+        self.comment_ids = set()
+        self.imported_datarequests = 0
+        self.imported_comments = 0
+        self.rejected = 0
+
+    def _get_organizations(self):
+        '''
+        Returns a dict with the ID, the name and the title of each organization
+        indexed by both its ID and its name
+        '''
+        organizations = {}
+        query = model.Session.query(model.Group.id, model.Group.name, model.Group.title).filter(
+            model.Group.is_organization == True)
+
+        for organization_id, organization_name, organization_title in query.all():
+            # The display name of CKAN groups is their title, or their name if they have no title
+            organization = {'id': organization_id, 'name': organization_name,
+                            'title': organization_title or organization_name}
+            organizations[organization_id] = organization
+            organizations[organization_name] = organization
+
+        return organizations
+
+    def _validate_comments(self, datarequest_id, comments, now):
+        rows = []
+
+        if not isinstance(comments, list):
+            raise tk.ValidationError({tk._('Comments'): [tk._('Comments must be a list')]})
+
+        for comment in comments:
+            text = comment.get('comment', '') if isinstance(comment, dict) else ''
+
+            if not text:
+                raise tk.ValidationError({tk._('Comment'): [tk._('Comments must be a minimum of 1 character long')]})
+
+            if len(text) > constants.COMMENT_MAX_LENGTH:
+                raise tk.ValidationError({tk._('Comment'): [tk._('Comments must be a maximum of %d characters long') % constants.COMMENT_MAX_LENGTH]})
+
+            comment_id = comment.get('id')
+            if comment_id and (comment_id in self.comment_ids or comment_id in [row['id'] for row in rows]):
+                raise tk.ValidationError({tk._('Comment'): [tk._('That ID is already in use')]})
+
+            try:
+                time = _parse_time(comment.get('time'), now)
+            except ValueError:
+                raise tk.ValidationError({tk._('Comment'): [tk._('Invalid date: %s') % comment.get('time')]})
+
+            # Comments are stored as they are exported, which are already escaped
+            # like the ones created with datarequest_comment (so they are not
+            # escaped again and their length is checked on the stored value)
+            rows.append({
+                'id': comment_id or db.uuid4(),
+                'user_id': comment.get('user_id') or u'',
+                'datarequest_id': datarequest_id,
+                'time': time,
+                'comment': text,
+                'comment_html': helpers.render_markdown(text)
+            })
+
+        return rows
+
+    def _validate(self, record, now):
+        '''
+        Validates a record and returns the row of the data request and the
+        rows of its comments. A ValidationError is raised if the record is
+        not valid.
+        '''
+        if not isinstance(record, dict):
+            raise tk.ValidationError({tk._('Data Request'): [tk._('Data Request must be an object')]})
+
+        errors = {}
+        datarequest_id = record.get('id')
+        title = record.get('title') or u''
+        description = record.get('description') or u''
+        organization_id = record.get('organization_id') or None
+        organization = None
+
+        # Check ID
+        if datarequest_id and datarequest_id in self.datarequest_ids:
+            errors[tk._('ID')] = [tk._('That ID is already in use')]
+
+        # Check title
+        if len(title) > constants.NAME_MAX_LENGTH:
+            errors[tk._('Title')] = [tk._('Title must be a maximum of %d characters long') % constants.NAME_MAX_LENGTH]
+
+        if not title:
+            errors[tk._('Title')] = [tk._('Title cannot be empty')]
+        elif title.lower() in self.titles:
+            errors[tk._('Title')] = [tk._('That title is already in use')]
+
+        # Check description
+        if len(description) > constants.DESCRIPTION_MAX_LENGTH:
+            errors[tk._('Description')] = [tk._('Description must be a maximum of %d characters long') % constants.DESCRIPTION_MAX_LENGTH]
+
+        # Check organization
+        if organization_id:
+            organization = self.organizations.get(organization_id)
+            if organization is None:
+                errors[tk._('Organization')] = [tk._('Organization is not valid')]
+
+        # Check state
+        closed = record.get('closed', False)
+        if not isinstance(closed, bool):
+            errors[tk._('Closed')] = [tk._('Closed must be true or false')]
+
+        # Check dates
+        try:
+            open_time = _parse_time(record.get('open_time'), now)
+            close_time = _parse_time(record.get('close_time'), None)
+        except ValueError as e:
+            errors[tk._('Date')] = [tk._('Invalid date: %s') % e]
+        else:
+            # Open data requests cannot have a close time. Closed ones without it are
+            # closed now, so they are counted as closed in the statistics
+            if close_time and closed is False:
+                errors[tk._('Date')] = [tk._('Open data requests cannot have a close date')]
+            elif closed is True and not close_time:
+                close_time = now
+
+        if len(errors) > 0:
+            raise tk.ValidationError(errors)
+
+        datarequest_id = datarequest_id or db.uuid4()
+        comments = self._validate_comments(datarequest_id, record.get('comments', []), now)
+        activity_times = [open_time, close_time] + [comment['time'] for comment in comments]
+
+        # The names of the organization and the accepted dataset are stored with the
+        # data request, like the ones created with the API. Datasets that are not found
+        # are kept as they are given
+        accepted_dataset_id = record.get('accepted_dataset_id') or None
+        package = self.packages.get(accepted_dataset_id) if accepted_dataset_id else None
+
+        datarequest = {
+            'id': datarequest_id,
+            'user_id': record.get('user_id') or u'',
+            'title': title,
+            'description': description,
+            'description_html': helpers.render_markdown(description),
+            'excerpt': helpers.render_excerpt(description),
+            'organization_id': organization['id'] if organization else None,
+            'organization_name': organization['name'] if organization else None,
+            'organization_title': organization['title'] if organization else None,
+            'open_time': open_time,
+            'accepted_dataset_id': package['id'] if package else accepted_dataset_id,
+            'accepted_dataset_name': package['name'] if package else None,
+            'accepted_dataset_title': package['display_name'] if package else None,
+            'close_time': close_time,
+            'closed': closed,
+            'last_activity_time': max(t for t in activity_times if t),
+            'comments_count': len(comments)
+        }
+
+        return datarequest, comments
+
+    def _change(self, object_type, object_id, datarequest_id, user_id, now):
+        return {
+            'object_type': object_type,
+            'object_id': object_id,
+            'datarequest_id': datarequest_id,
+            'change_type': constants.CHANGE_CREATED,
+            'user_id': user_id,
+            'time': now
+        }
+
+    def _store_batch(self, batch):
+        now = datetime.datetime.now()
+        datarequests = []
+        comments = []
+
+        records = []
+
+        for line_number, line in batch:
+            try:
+                records.append((line_number, json.loads(line)))
+            except ValueError as e:
+                # Lines that are not valid JSON
+                log.warn('Line %d rejected: %s' % (line_number, e))
+                self.rejected += 1
+
+        # The IDs of the batch that are already in use are loaded with a
+        # single query per table, so duplicated records are rejected instead
+        # of aborting the INSERT of the whole batch
+        datarequest_ids, comment_ids = _get_record_ids(record for _, record in records)
+        self.datarequest_ids = db.DataRequest.get_existing_ids(datarequest_ids)
+        self.comment_ids = db.Comment.get_existing_ids(comment_ids)
+
+        # The accepted datasets of the batch are read with a single query too
+        self.packages = resolver.get_packages(set(
+            record['accepted_dataset_id'] for _, record in records
+            if isinstance(record, dict) and isinstance(record.get('accepted_dataset_id'), basestring)
+            and record['accepted_dataset_id']))
+
+        for line_number, record in records:
+            try:
+                datarequest, datarequest_comments = self._validate(record, now)
+            except tk.ValidationError as e:
+                log.warn('Line %d rejected: %s' % (line_number, e.error_dict))
+                self.rejected += 1
+            else:
+                # Titles and IDs of the current batch are also taken into account
+                self.titles.add(datarequest['title'].lower())
+                self.datarequest_ids.add(datarequest['id'])
+                self.comment_ids.update(comment['id'] for comment in datarequest_comments)
+                datarequests.append(datarequest)
+                comments.extend(datarequest_comments)
+
+        changes = [self._change(constants.CHANGE_OBJECT_DATAREQUEST, d['id'], d['id'], d['user_id'], now)
+                   for d in datarequests]
+        changes.extend(self._change(constants.CHANGE_OBJECT_COMMENT, c['id'], c['datarequest_id'], c['user_id'], now)
+                       for c in comments)
+
+        organizations = dict((d['id'], d['organization_id']) for d in datarequests)
+        deltas = stats.merge_deltas(*[stats.datarequest_deltas(_Row(d)) for d in datarequests] +
+                                    [stats.comment_deltas(organizations[c['datarequest_id']], c['time']) for c in comments])
+        activity = {}
+        for d in datarequests:
+            time = d['last_activity_time']
+            activity[d['organization_id']] = max(activity.get(d['organization_id'], time), time)
+
+        db.DataRequest.insert_many(datarequests)
+        for chunk in _chunks(comments, self.batch_size):
+            db.Comment.insert_many(chunk)
+        stats.apply_deltas(deltas, activity)
+
+        # The lock of the change log is only taken for the last statements of
+        # the batch, so it is not held while the rest of the batch is written
+        db.Change.lock()
+        for chunk in _chunks(changes, self.batch_size):
+            db.Change.insert_many(chunk)
+
+        model.Session.commit()
+
+        self.imported_datarequests += len(datarequests)
+        self.imported_comments += len(comments)
+
+    def import_lines(self, lines, start_line=0, checkpoint=None):
+        '''
+        Imports the data requests included in the given lines. Invalid records
+        are logged and skipped.
+
+        :param lines: The lines (JSON objects) to be imported
+        :type lines: iterable
+
+        :param start_line: The number of lines that have already been imported
+            in a previous execution. These lines are skipped.
+        :type start_line: int
+
+        :param checkpoint: Function called with the number of processed lines
+            each time that a batch is commited
+        :type checkpoint: function
+        '''
+        batch = []
+        line_number = 0
+
+        for line_number, line in enumerate(lines, 1):
+            if line_number <= start_line or not line.strip():
+                continue
+
+            batch.append((line_number, line))
+
+            if len(batch) == self.batch_size:
+                self._store_batch(batch)
+                batch = []
+                if checkpoint:
+                    checkpoint(line_number)
+
+        if batch:
+            self._store_batch(batch)
+
+        if checkpoint and line_number > start_line:
+            checkpoint(line_number)
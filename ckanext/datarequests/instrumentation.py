@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.plugins.toolkit as tk
+import constants
+import contextlib
+import functools
+import json
+import logging
+import sqlalchemy as sa
+import threading
+import timeit
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+_listener_lock = threading.Lock()
+_listening = False
+
+# Calls slower than this threshold (seconds) are logged. None disables the log
+_slow_action_threshold = None
+
+
+def configure(slow_action_threshold=None):
+    '''
+    Sets the threshold (in milliseconds) above which the calls to the actions
+    are logged as slow actions. Slow actions are not logged when it is None.
+    '''
+    global _slow_action_threshold
+    _slow_action_threshold = float(slow_action_threshold) / 1000 if slow_action_threshold else None
+
+
+def _escape(value):
+    return unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+
+class Metrics(object):
+    '''
+    Thread safe registry of the metrics of the actions (calls, errors, wall
+    time, SQL time and number of queries) and of the caches (hits and misses)
+    of the current process. They are rendered in the Prometheus text format.
+    '''
+
+    def __init__(self, buckets=constants.METRICS_DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.actions = {}
+        self.caches = {}
+
+    def observe_action(self, name, duration, sql_time, queries, error):
+        with self._lock:
+            action = self.actions.get(name)
+            if action is None:
+                action = self.actions[name] = {
+                    'count': 0, 'errors': 0, 'duration': 0.0, 'sql_time': 0.0, 'queries': 0,
+                    'buckets': [0] * len(self.buckets)
+                }
+
+            action['count'] += 1
+            action['errors'] += 1 if error else 0
+            action['duration'] += duration
+            action['sql_time'] += sql_time
+            action['queries'] += queries
+
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    action['buckets'][i] += 1
+                    break
+
+    def observe_cache(self, cache, hit):
+        key = (cache, 'hit' if hit else 'miss')
+        with self._lock:
+            self.caches[key] = self.caches.get(key, 0) + 1
+
+    def render(self):
+        with self._lock:
+            actions = sorted((name, dict(values, buckets=list(values['buckets'])))
+                             for name, values in self.actions.iteritems())
+            caches = sorted(self.caches.iteritems())
+
+        lines = []
+
+        def _metric(name, metric_type, description, samples):
+            lines.append(u'# HELP %s %s' % (name, description))
+            lines.append(u'# TYPE %s %s' % (name, metric_type))
+            for suffix, labels, value in samples:
+                labels = u','.join(u'%s="%s"' % (key, _escape(label)) for key, label in labels)
+                lines.append(u'%s%s{%s} %s' % (name, suffix, labels, repr(value) if isinstance(value, float) else value))
+
+        histogram = []
+        for name, values in actions:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values['buckets']):
+                cumulative += count
+                histogram.append((u'_bucket', [('action', name), ('le', repr(float(bound)))], cumulative))
+            histogram.append((u'_bucket', [('action', name), ('le', '+Inf')], values['count']))
+            histogram.append((u'_sum', [('action', name)], values['duration']))
+            histogram.append((u'_count', [('action', name)], values['count']))
+
+        _metric(u'datarequests_action_duration_seconds', u'histogram',
+                u'Wall time of the calls to the data requests actions', histogram)
+        _metric(u'datarequests_action_errors_total', u'counter',
+                u'Calls to the data requests actions that raised an exception',
+                [(u'', [('action', name)], values['errors']) for name, values in actions])
+        _metric(u'datarequests_action_sql_seconds_total', u'counter',
+                u'Time spent executing SQL statements in the data requests actions',
+                [(u'', [('action', name)], values['sql_time']) for name, values in actions])
+        _metric(u'datarequests_action_queries_total', u'counter',
+                u'SQL statements executed by the data requests actions',
+                [(u'', [('action', name)], values['queries']) for name, values in actions])
+        _metric(u'datarequests_cache_requests_total', u'counter',
+                u'Lookups in the caches of the data requests extension',
+                [(u'', [('cache', cache), ('result', result)], value) for (cache, result), value in caches])
+
+        return u'\n'.join(lines) + u'\n'
+
+
+metrics = Metrics()
+
+
+class Recorder(object):
+    '''
+    Records the SQL statements, the nested action calls and the auth checks
+    performed by the current thread while the recorder is active. Recorders
+    can be nested: every active recorder records all the calls.
+    '''
+
+    def __init__(self):
+        self.queries = []
+        self.sql_time = 0.0
+        self.actions = []
+        self.auth_checks = []
+        self.cache_hits = {}
+        self.cache_misses = {}
+
+    def __enter__(self):
+        _listen()
+        _get_recorders().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _get_recorders().remove(self)
+        return False
+
+
+def _get_recorders():
+    recorders = getattr(_local, 'recorders', None)
+    if recorders is None:
+        recorders = _local.recorders = []
+    return recorders
+
+
+# The start time is a single value per connection rather than a stack, and
+# it is also removed when the statement fails (it never reaches
+# after_cursor_execute), so nothing is left behind on pooled connections
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorders = getattr(_local, 'recorders', None)
+    if recorders:
+        for recorder in recorders:
+            recorder.queries.append(statement)
+        conn.info['datarequests_query_start'] = timeit.default_timer()
+    else:
+        conn.info.pop('datarequests_query_start', None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('datarequests_query_start', None)
+    if start is not None:
+        elapsed = timeit.default_timer() - start
+        for recorder in getattr(_local, 'recorders', ()):
+            recorder.sql_time += elapsed
+
+
+def _dbapi_error(conn, cursor, statement, parameters, context, exception):
+    conn.info.pop('datarequests_query_start', None)
+
+
+def _listen():
+    '''Starts recording the statements executed by all the engines (only once)'''
+    global _listening
+
+    with _listener_lock:
+        if not _listening:
+            sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+            sa.event.listen(sa.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+            sa.event.listen(sa.engine.Engine, 'dbapi_error', _dbapi_error)
+            _listening = True
+
+
+def _record(attribute, name):
+    for recorder in getattr(_local, 'recorders', ()):
+        getattr(recorder, attribute).append(name)
+
+
+def record_cache(cache, hit):
+    '''Records a lookup in one of the caches of the extension'''
+    for recorder in getattr(_local, 'recorders', ()):
+        counters = recorder.cache_hits if hit else recorder.cache_misses
+        counters[cache] = counters.get(cache, 0) + 1
+
+    metrics.observe_cache(cache, hit)
+
+
+def get_action(name):
+    '''
+    Same as tk.get_action, but calls to the returned action are recorded as
+    nested actions. Used to call the CKAN actions from the extension.
+    '''
+    function = tk.get_action(name)
+
+    def _call(context, data_dict):
+        _record('actions', name)
+        return function(context, data_dict)
+
+    return _call
+
+
+def _finish(name, recorder, start, args, error):
+    duration = timeit.default_timer() - start
+    metrics.observe_action(name, duration, recorder.sql_time, len(recorder.queries), error)
+
+    log.debug('%s: %d queries, %d nested actions, %d auth checks' % (
+        name, len(recorder.queries), len(recorder.actions), len(recorder.auth_checks)))
+
+    if _slow_action_threshold is not None and duration >= _slow_action_threshold:
+        context = args[0] if args and isinstance(args[0], dict) else {}
+        log.warning('Slow action: %s' % json.dumps({
+            'action': name,
+            'user': context.get('user'),
+            'duration_ms': round(duration * 1000, 3),
+            'sql_ms': round(recorder.sql_time * 1000, 3),
+            'queries': len(recorder.queries),
+            'nested_actions': recorder.actions,
+            'auth_checks': len(recorder.auth_checks),
+            'cache_hits': recorder.cache_hits,
+            'cache_misses': recorder.cache_misses,
+            'error': error
+        }, sort_keys=True))
+
+
+@contextlib.contextmanager
+def _measure(name, args=()):
+    recorder = Recorder()
+    start = timeit.default_timer()
+
+    try:
+        with recorder:
+            yield recorder
+    except Exception:
+        _finish(name, recorder, start, args, True)
+        raise
+
+    _finish(name, recorder, start, args, False)
+
+
+def instrument_action(name, function):
+    '''
+    Wraps an action of the extension. The call is recorded as a nested action
+    by the recorders already active. The wall time, SQL time and number of
+    queries of the call are added to the metrics, and the call is logged
+    when it is slower than the configured threshold.
+    '''
+    @functools.wraps(function)
+    def _action(*args, **kwargs):
+        _record('actions', name)
+        with _measure(name, args):
+            return function(*args, **kwargs)
+
+    _action.__wrapped__ = function
+    return _action
+
+
+def record_request(name):
+    '''
+    Records all the calls made while a page of the extension is built. Unlike
+    the recorders of the actions, it includes the calls made by the templates
+    (e.g. the helpers and auth checks called for each row of a list). The
+    request is added to the metrics and logged when it is slow, as the
+    actions are. The recorder is returned so the calls can be checked.
+    '''
+    return _measure(name)
+
+
+def instrument_auth(name, function):
+    '''Wraps an auth function of the extension so its calls are recorded'''
+    @functools.wraps(function)
+    def _auth(*args, **kwargs):
+        _record('auth_checks', name)
+        return function(*args, **kwargs)
+
+    _auth.__wrapped__ = function
+    return _auth
+
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+from ckan.plugins.interfaces import Interface
+
+
+class IDataRequestEvents(Interface):
+    '''
+    Allows plugins to react to the changes of data requests and comments.
+    Events are dispatched once the change has been commited, out of the
+    request that performed it.
+    '''
+
+    def handle_datarequest_event(self, event):
+        '''
+        Called for every event. The event is a dict with the following fields:
+        type (e.g. datarequest_created or comment_deleted), object_type,
+        object_id, datarequest_id, change_type, user_id and time.
+
+        Exceptions are retried and the events whose handling keeps failing
+        are stored in the dead letter table.
+        '''
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import codecs
+import constants
+import datetime
+import db
+import logging
+
+from ckan.lib import mailer
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+DIGEST_SUBJECT = u'Activity in the data requests you follow'
+
+
+class SMTPTransport(object):
+    '''Sends the digests by email using the SMTP server configured in CKAN'''
+
+    def send(self, user, subject, body):
+        mailer.mail_user(user, subject, body)
+
+
+class FileTransport(object):
+    '''Appends the digests to a local file. Useful for development and tests'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, user, subject, body):
+        with codecs.open(self.path, 'a', 'utf-8') as f:
+            f.write(u'To: %s <%s>\nSubject: %s\n\n%s\n\n' % (user.display_name, user.email, subject, body))
+
+
+def get_transport():
+    '''
+    Returns the transport set in ckan.datarequests.notifications.transport:
+    smtp, file (the path is set in ckan.datarequests.notifications.file) or
+    the path of a custom class (package.module:Class) whose instances
+    implement the method send(user, subject, body)
+    '''
+    transport = config.get('ckan.datarequests.notifications.transport', constants.NOTIFICATIONS_DEFAULT_TRANSPORT)
+
+    if transport == 'smtp':
+        return SMTPTransport()
+    elif transport == 'file':
+        return FileTransport(config.get('ckan.datarequests.notifications.file'))
+    else:
+        module_name, class_name = transport.split(':', 1)
+        module = __import__(module_name, fromlist=[class_name])
+        return getattr(module, class_name)()
+
+
+def record_event(event):
+    '''
+    Event handler that stores a pending notification for each user following
+    the data request (its creator and the users that have commented it),
+    except for the one that has performed the change.
+    '''
+    if event['type'] not in constants.NOTIFICATIONS_EVENTS:
+        return
+
+    db.init_db(model)
+    result = db.DataRequest.get(id=event['datarequest_id'])
+    if not result:
+        return
+
+    recipients = set(db.Comment.get_commenters(event['datarequest_id']))
+    recipients.add(result[0].user_id)
+    recipients.discard(event['user_id'])
+    recipients.discard(u'')
+
+    now = datetime.datetime.now()
+    db.Notification.insert_many([{
+        'recipient_id': recipient_id,
+        'datarequest_id': event['datarequest_id'],
+        'event_type': event['type'],
+        'object_id': event['object_id'],
+        'user_id': event['user_id'],
+        'time': now
+    } for recipient_id in sorted(recipients)])
+    model.Session.commit()
+
+
+def _compose_digest(notifications, datarequests):
+    site_url = config.get('ckan.site_url', '').rstrip('/')
+    order = []
+    summary = {}
+
+    # Notifications are grouped by data request, keeping the order of arrival
+    for notification in notifications:
+        if notification.datarequest_id not in summary:
+            summary[notification.datarequest_id] = {'comments': 0, 'closed': False}
+            order.append(notification.datarequest_id)
+
+        if notification.event_type == 'comment_created':
+            summary[notification.datarequest_id]['comments'] += 1
+        else:
+            summary[notification.datarequest_id]['closed'] = True
+
+    body = []
+    for datarequest_id in order:
+        if datarequest_id not in datarequests:
+            # The data request has been deleted in the meantime
+            continue
+
+        activity = []
+        if summary[datarequest_id]['comments']:
+            activity.append(u'%d new comment(s)' % summary[datarequest_id]['comments'])
+        if summary[datarequest_id]['closed']:
+            activity.append(u'closed')
+
+        body.append(u'* %s: %s\n  %s/%s/%s' % (datarequests[datarequest_id].title, u', '.join(activity),
+                                              site_url, constants.DATAREQUESTS_MAIN_PATH, datarequest_id))
+
+    return u'\n'.join(body)
+
+
+def send_digests(transport=None):
+    '''
+    Sends a digest to every user whose oldest pending notification is older
+    than the window set in ckan.datarequests.notifications.window (minutes),
+    so all the notifications generated within the window are coalesced in a
+    single message. Notifications are removed once they have been sent.
+
+    :returns: The number of digests sent
+    :rtype: int
+    '''
+    db.init_db(model)
+    transport = transport or get_transport()
+    window = int(config.get('ckan.datarequests.notifications.window', constants.NOTIFICATIONS_DEFAULT_WINDOW))
+    cutoff = datetime.datetime.now() - datetime.timedelta(minutes=window)
+    sent = 0
+
+    for recipient_id in db.Notification.get_due_recipients(cutoff):
+        notifications = db.Notification.get_by_recipient(recipient_id)
+        datarequest_ids = list(set(n.datarequest_id for n in notifications))
+        datarequests = dict((d.id, d) for d in db.DataRequest.get_by_ids(datarequest_ids))
+        user = model.User.get(recipient_id)
+        body = _compose_digest(notifications, datarequests)
+
+        # Users without email and digests without data requests are discarded
+        if user is not None and user.email and body:
+            try:
+                transport.send(user, DIGEST_SUBJECT, body)
+                sent += 1
+            except Exception:
+                # Notifications are kept so they are sent in the next execution
+                log.exception('Digest could not be sent to %s' % recipient_id)
+                model.Session.rollback()
+                continue
+
+        db.Notification.delete_by_ids([n.id for n in notifications])
+        model.Session.commit()
+
+    return sent
@@ -22,8 +22,12 @@ import ckan.plugins.toolkit as tk
 import auth
 import actions
 import constants
+import events
 import helpers
+import instrumentation
+import notifications
 import os
+import querylog
 import sys
 
 from functools import partial
@@ -43,6 +47,8 @@ class DataRequestsPlugin(p.SingletonPlugin):
     p.implements(p.IConfigurer)
     p.implements(p.IRoutes, inherit=True)
     p.implements(p.ITemplateHelpers)
+    p.implements(p.IOrganizationController, inherit=True)
+    p.implements(p.IPackageController, inherit=True)
 
     # ITranslation only available in 2.5+
     try:
@@ -53,8 +59,17 @@ class DataRequestsPlugin(p.SingletonPlugin):
     def __init__(self, name=None):
         self.comments_enabled = get_config_bool_value('ckan.datarequests.comments', True)
         self._show_datarequests_badge = get_config_bool_value('ckan.datarequests.show_datarequests_badge')
+        self.notifications_enabled = get_config_bool_value('ckan.datarequests.notifications')
+        self.dataset_datarequests_enabled = get_config_bool_value('ckan.datarequests.show_dataset_datarequests')
         self.name = 'datarequests'
 
+        instrumentation.configure(config.get('ckan.datarequests.slow_action_threshold'))
+        querylog.configure(config.get('ckan.datarequests.slow_query_threshold'),
+                           config.get('ckan.datarequests.slow_query_explain_rate'))
+
+        if self.notifications_enabled:
+            events.subscribe(notifications.record_event)
+
     ######################################################################
     ############################## IACTIONS ##############################
     ######################################################################
@@ -63,10 +78,17 @@ class DataRequestsPlugin(p.SingletonPlugin):
         additional_actions = {
             constants.DATAREQUEST_CREATE: actions.datarequest_create,
             constants.DATAREQUEST_SHOW: actions.datarequest_show,
+            constants.DATAREQUEST_SHOW_MANY: actions.datarequest_show_many,
+            constants.DATAREQUEST_LIST_FOR_DATASET: actions.datarequest_list_for_dataset,
             constants.DATAREQUEST_UPDATE: actions.datarequest_update,
             constants.DATAREQUEST_INDEX: actions.datarequest_index,
             constants.DATAREQUEST_DELETE: actions.datarequest_delete,
-            constants.DATAREQUEST_CLOSE: actions.datarequest_close
+            constants.DATAREQUEST_CLOSE: actions.datarequest_close,
+            constants.DATAREQUEST_BULK_CREATE: actions.datarequest_bulk_create,
+            constants.DATAREQUEST_BULK_CLOSE: actions.datarequest_bulk_close,
+            constants.DATAREQUEST_BULK_DELETE: actions.datarequest_bulk_delete,
+            constants.DATAREQUEST_CHANGES_SINCE: actions.datarequest_changes_since,
+            constants.DATAREQUEST_STATS: actions.datarequest_stats
         }
 
         if self.comments_enabled:
@@ -76,7 +98,9 @@ class DataRequestsPlugin(p.SingletonPlugin):
             additional_actions[constants.DATAREQUEST_COMMENT_UPDATE] = actions.datarequest_comment_update
             additional_actions[constants.DATAREQUEST_COMMENT_DELETE] = actions.datarequest_comment_delete
 
-        return additional_actions
+        # Queries and nested actions are recorded for every call
+        return dict((name, instrumentation.instrument_action(name, function))
+                    for name, function in additional_actions.iteritems())
 
     ######################################################################
     ########################### AUTH FUNCTIONS ###########################
@@ -86,10 +110,19 @@ class DataRequestsPlugin(p.SingletonPlugin):
         auth_functions = {
             constants.DATAREQUEST_CREATE: auth.datarequest_create,
             constants.DATAREQUEST_SHOW: auth.datarequest_show,
+            constants.DATAREQUEST_SHOW_MANY: auth.datarequest_show_many,
+            constants.DATAREQUEST_LIST_FOR_DATASET: auth.datarequest_list_for_dataset,
             constants.DATAREQUEST_UPDATE: auth.datarequest_update,
             constants.DATAREQUEST_INDEX: auth.datarequest_index,
             constants.DATAREQUEST_DELETE: auth.datarequest_delete,
             constants.DATAREQUEST_CLOSE: auth.datarequest_close,
+            constants.DATAREQUEST_BULK_CREATE: auth.datarequest_bulk_create,
+            constants.DATAREQUEST_BULK_CLOSE: auth.datarequest_bulk_close,
+            constants.DATAREQUEST_BULK_DELETE: auth.datarequest_bulk_delete,
+            constants.DATAREQUEST_EXPORT: auth.datarequest_export,
+            constants.DATAREQUEST_METRICS: auth.datarequest_metrics,
+            constants.DATAREQUEST_CHANGES_SINCE: auth.datarequest_changes_since,
+            constants.DATAREQUEST_STATS: auth.datarequest_stats,
         }
 
         if self.comments_enabled:
@@ -99,7 +132,9 @@ class DataRequestsPlugin(p.SingletonPlugin):
             auth_functions[constants.DATAREQUEST_COMMENT_UPDATE] = auth.datarequest_comment_update
             auth_functions[constants.DATAREQUEST_COMMENT_DELETE] = auth.datarequest_comment_delete
 
-        return auth_functions
+        # Auth checks (e.g. the ones of the templates) are recorded too
+        return dict((name, instrumentation.instrument_auth(name, function))
+                    for name, function in auth_functions.iteritems())
 
     ######################################################################
     ############################ ICONFIGURER #############################
@@ -131,6 +166,16 @@ class DataRequestsPlugin(p.SingletonPlugin):
                   controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
                   action='new', conditions=dict(method=['GET', 'POST']))
 
+        # Export all the Data Requests (it must be defined before datarequest_show)
+        m.connect('datarequests_export', '/%s/export' % constants.DATAREQUESTS_MAIN_PATH,
+                  controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+                  action='export', conditions=dict(method=['GET']))
+
+        # Metrics of the actions (it must be defined before datarequest_show)
+        m.connect('datarequests_metrics', '/%s/metrics' % constants.DATAREQUESTS_MAIN_PATH,
+                  controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+                  action='metrics', conditions=dict(method=['GET']))
+
         # Show a Data Request
         m.connect('datarequest_show', '/%s/{id}' % constants.DATAREQUESTS_MAIN_PATH,
                   controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
@@ -186,9 +231,20 @@ class DataRequestsPlugin(p.SingletonPlugin):
             'get_comments_number': helpers.get_comments_number,
             'get_comments_badge': helpers.get_comments_badge,
             'get_open_datarequests_number': helpers.get_open_datarequests_number,
-            'get_open_datarequests_badge': partial(helpers.get_open_datarequests_badge, self._show_datarequests_badge)
+            'get_open_datarequests_badge': partial(helpers.get_open_datarequests_badge, self._show_datarequests_badge),
+            'show_dataset_datarequests': lambda: self.dataset_datarequests_enabled,
+            'get_dataset_datarequests': helpers.get_dataset_datarequests
         }
 
+    ######################################################################
+    ############# IORGANIZATIONCONTROLLER & IPACKAGECONTROLLER ###########
+    ######################################################################
+
+    def edit(self, entity):
+        # Both interfaces call this method when an organization or a dataset is
+        # updated, so the names stored in the data requests are kept up to date
+        helpers.update_related_names(entity)
+
     ######################################################################
     ########################### ITRANSLATION #############################
     ######################################################################
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import random
+import re
+import sqlalchemy as sa
+import threading
+import timeit
+
+log = logging.getLogger(__name__)
+
+# All the tables of the extension are prefixed with datarequests
+STATEMENT_PATTERN = re.compile(r'\bdatarequests\w*\b')
+# Savepoint that isolates the EXPLAIN from the transaction of the caller
+EXPLAIN_SAVEPOINT = 'datarequests_explain'
+
+_lock = threading.Lock()
+_listening = False
+_threshold = None
+_explain_rate = 0.0
+
+
+def configure(threshold=None, explain_rate=0):
+    '''
+    Enables the slow query log: statements on the tables of the extension
+    that take more than threshold milliseconds are logged with their bind
+    parameters. The plan of a fraction (explain_rate, between 0 and 1) of the
+    slow SELECT statements is captured with EXPLAIN (ANALYZE, BUFFERS) when
+    the database is PostgreSQL. The log is disabled when threshold is None.
+    '''
+    global _listening, _threshold, _explain_rate
+
+    _threshold = float(threshold) / 1000 if threshold not in (None, '') else None
+    _explain_rate = float(explain_rate or 0)
+
+    with _lock:
+        if _threshold is not None and not _listening:
+            sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+            sa.event.listen(sa.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+            sa.event.listen(sa.engine.Engine, 'dbapi_error', _dbapi_error)
+            _listening = True
+
+
+# A single start time is kept per connection and it is removed when the
+# statement fails (see instrumentation)
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _threshold is not None:
+        conn.info['datarequests_slow_query_start'] = timeit.default_timer()
+    else:
+        conn.info.pop('datarequests_slow_query_start', None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('datarequests_slow_query_start', None)
+    if start is None:
+        return
+
+    duration = timeit.default_timer() - start
+    threshold = _threshold
+
+    if threshold is not None and duration >= threshold and STATEMENT_PATTERN.search(statement):
+        record = {
+            'statement': statement,
+            'parameters': parameters,
+            'duration_ms': round(duration * 1000, 3)
+        }
+
+        if not executemany and _explain_rate and random.random() < _explain_rate:
+            record['plan'] = _explain(conn, statement, parameters)
+
+        log.warning('Slow query: %s' % json.dumps(record, default=unicode, sort_keys=True))
+
+
+def _dbapi_error(conn, cursor, statement, parameters, context, exception):
+    conn.info.pop('datarequests_slow_query_start', None)
+
+
+def _explain(conn, statement, parameters):
+    '''
+    Returns the plan of a statement (a list of lines) or None when it cannot
+    be captured. The plan is only captured for SELECT statements, since
+    EXPLAIN ANALYZE executes the statement again.
+    '''
+    if conn.dialect.name != 'postgresql' or not statement.lstrip().upper().startswith('SELECT'):
+        return None
+
+    # The DBAPI cursor is used directly so the EXPLAIN does not go through the
+    # listeners. It runs in the transaction of the caller, so it is wrapped in
+    # a savepoint: if it fails (e.g. statement_timeout), only the savepoint is
+    # rolled back and the transaction can still be used
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('SAVEPOINT %s' % EXPLAIN_SAVEPOINT)
+        try:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT %s' % EXPLAIN_SAVEPOINT)
+            raise
+        finally:
+            cursor.execute('RELEASE SAVEPOINT %s' % EXPLAIN_SAVEPOINT)
+        return plan
+    except Exception as e:
+        log.warn('The plan of a slow query could not be captured: %r' % e)
+        return None
+    finally:
+        cursor.close()
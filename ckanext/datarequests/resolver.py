@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import constants
+import hashlib
+import instrumentation
+import threading
+import time
+
+from pylons import config
+from sqlalchemy.sql.expression import or_
+
+# Only the basic fields of the organizations are needed
+ORGANIZATION_SHOW_PARAMS = {'include_datasets': False, 'include_extras': False, 'include_users': False}
+
+
+class TTLCache(object):
+    '''
+    Thread safe dict whose entries expire ttl seconds after being stored.
+    When max_size entries are stored, the expired ones are removed (or all of
+    them if none has expired).
+    '''
+
+    def __init__(self, ttl, max_size, name=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.name = name
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = None
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, expiration = entry
+                if expiration <= time.time():
+                    del self._entries[key]
+                    value = None
+
+        if self.name:
+            instrumentation.record_cache(self.name, value is not None)
+
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.time()
+
+            if len(self._entries) >= self.max_size:
+                for entry_key, (_, expiration) in self._entries.items():
+                    if expiration <= now:
+                        del self._entries[entry_key]
+
+                if len(self._entries) >= self.max_size:
+                    self._entries.clear()
+
+            self._entries[key] = (value, now + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class UserSummary(object):
+    '''
+    Fields of a user that are shown next to data requests and comments. The
+    rest of the fields returned by user_show are never used, so they are
+    neither retrieved nor cached.
+    '''
+
+    __slots__ = ('id', 'name', 'display_name', 'email_hash')
+
+    def __init__(self, id, name, display_name, email_hash):
+        self.id = id
+        self.name = name
+        self.display_name = display_name
+        self.email_hash = email_hash
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+
+_organizations = None
+_users = None
+_user_summaries = None
+_caches_lock = threading.Lock()
+
+
+def _get_caches():
+    global _organizations, _users, _user_summaries
+
+    with _caches_lock:
+        if _organizations is None:
+            ttl = float(config.get('ckan.datarequests.resolver.ttl', constants.RESOLVER_DEFAULT_TTL))
+            _organizations = TTLCache(ttl, constants.RESOLVER_MAX_SIZE, 'organizations')
+            _users = TTLCache(ttl, constants.RESOLVER_MAX_SIZE, 'user_ids')
+            _user_summaries = TTLCache(ttl, constants.RESOLVER_MAX_SIZE, 'users')
+
+    return _organizations, _users, _user_summaries
+
+
+def clear():
+    '''Removes all the cached organizations and users'''
+    for cache in _get_caches():
+        cache.clear()
+
+
+def store_organization(organization):
+    '''
+    Caches the basic fields (id, name, display_name and state) of an
+    organization that has already been retrieved, so it can be found by ID
+    and by name
+    '''
+    summary = {
+        'id': organization.get('id'),
+        'name': organization.get('name'),
+        'display_name': organization.get('display_name'),
+        'state': organization.get('state')
+    }
+
+    organizations, _, _ = _get_caches()
+    for key in set([summary['id'], summary['name']]):
+        if key:
+            organizations.set(key, summary)
+
+    return summary
+
+
+def store_user(user):
+    '''Caches the ID of a user that has already been retrieved, so it can be found by ID and by name'''
+    _, users, _ = _get_caches()
+    for key in set([user.get('id'), user.get('name')]):
+        if key:
+            users.set(key, user.get('id'))
+
+    return user.get('id')
+
+
+def _query_organizations(organization_ids):
+    '''
+    Returns the id, name, title and state of the organizations whose ID or
+    name is included in the given list. Only these columns of the group
+    table are read, in a single query.
+    '''
+    group = model.Group
+    return model.Session.query(group.id, group.name, group.title, group.state).filter(
+        group.is_organization == True,
+        or_(group.id.in_(organization_ids), group.name.in_(organization_ids))).all()
+
+
+def get_organization(organization_id):
+    '''
+    Returns the basic fields (id, name, display_name and state) of an organization
+    given its ID or its name. A tk.ObjectNotFound exception is raised when
+    the organization does not exist.
+    '''
+    organizations, _, _ = _get_caches()
+    organization = organizations.get(organization_id)
+
+    if organization is None:
+        data_dict = dict(ORGANIZATION_SHOW_PARAMS, id=organization_id)
+        organization_show = instrumentation.get_action('organization_show')
+        organization = store_organization(organization_show({'ignore_auth': True}, data_dict))
+        organizations.set(organization_id, organization)
+
+    return organization
+
+
+def get_organizations(organization_ids):
+    '''
+    Bulk form of get_organization. Returns a dict with the basic fields of
+    each organization indexed by the given IDs (or names). The organizations
+    that are not cached are retrieved in a single query. Organizations that
+    do not exist are not included.
+    '''
+    organizations, _, _ = _get_caches()
+    result = {}
+    missing = set()
+
+    for organization_id in organization_ids:
+        organization = organizations.get(organization_id)
+        if organization is None:
+            missing.add(organization_id)
+        else:
+            result[organization_id] = organization
+
+    if missing:
+        for row in _query_organizations(sorted(missing)):
+            # The display name of CKAN groups is their title, or their name if they have no title
+            organization = store_organization({
+                'id': row.id,
+                'name': row.name,
+                'display_name': row.title or row.name,
+                'state': row.state
+            })
+
+            for key in (row.id, row.name):
+                if key in missing:
+                    result[key] = organization
+
+    return result
+
+
+def _query_packages(package_ids):
+    '''
+    Returns the id, name, title, state and private flag of the datasets whose
+    ID or name is included in the given list. Only these columns of the
+    package table are read, in a single query.
+    '''
+    package = model.Package
+    return model.Session.query(package.id, package.name, package.title, package.state, package.private).filter(
+        or_(package.id.in_(package_ids), package.name.in_(package_ids))).all()
+
+
+def is_public_package(package):
+    '''Returns whether a dataset (as returned by get_packages) can be shown to every user'''
+    return package['state'] == 'active' and not package['private']
+
+
+def get_packages(package_ids, include_private=False):
+    '''
+    Returns a dict with the basic fields (id, name and display_name, along with
+    the state and the private flag) of each dataset indexed by the given IDs
+    (or names). Datasets are only retrieved when data requests are closed, so
+    they are not cached. Datasets that do not exist are not included, nor
+    the private and deleted ones unless include_private is True.
+    '''
+    result = {}
+    package_ids = set(package_ids)
+
+    if package_ids:
+        for row in _query_packages(sorted(package_ids)):
+            # The display name of CKAN datasets is their title, or their name if they have no title
+            package = {'id': row.id, 'name': row.name, 'display_name': row.title or row.name,
+                       'state': row.state, 'private': row.private}
+            if not include_private and not is_public_package(package):
+                continue
+
+            for key in (row.id, row.name):
+                if key in package_ids:
+                    result[key] = package
+
+    return result
+
+
+def get_organization_id(organization_id):
+    '''Returns the ID of an organization given its ID or its name'''
+    return get_organization(organization_id)['id']
+
+
+def get_user_id(user_id):
+    '''
+    Returns the ID of a user given its ID or its name. A tk.ObjectNotFound
+    exception is raised when the user does not exist.
+    '''
+    _, users, _ = _get_caches()
+    result = users.get(user_id)
+
+    if result is None:
+        result = store_user(instrumentation.get_action('user_show')({'ignore_auth': True}, {'id': user_id}))
+        users.set(user_id, result)
+
+    return result
+
+
+def _email_hash(email):
+    # Same hash CKAN uses to show the gravatar of the users
+    return hashlib.md5(email.strip().lower().encode('utf8') if email else '').hexdigest()
+
+
+def _query_users(user_ids):
+    '''
+    Returns the id, name, fullname and email of the users whose ID or name is
+    included in the given list. Only these columns of the user table are
+    read, in a single query.
+    '''
+    user = model.User
+    return model.Session.query(user.id, user.name, user.fullname, user.email).filter(
+        or_(user.id.in_(user_ids), user.name.in_(user_ids))).all()
+
+
+def get_users(user_ids):
+    '''
+    Returns a dict with the summary (UserSummary) of each user indexed by the
+    given IDs (or names). The users that are not cached are retrieved in a
+    single query. Users that do not exist are not included.
+    '''
+    _, _, summaries = _get_caches()
+    result = {}
+    missing = set()
+
+    for user_id in user_ids:
+        summary = summaries.get(user_id)
+        if summary is None:
+            missing.add(user_id)
+        else:
+            result[user_id] = summary
+
+    if missing:
+        for row in _query_users(sorted(missing)):
+            # The display name of CKAN users is their full name, or their name if they have no full name
+            summary = UserSummary(row.id, row.name, row.fullname or row.name, _email_hash(row.email))
+
+            for key in set([row.id, row.name]):
+                summaries.set(key, summary)
+                if key in missing:
+                    result[key] = summary
+
+    return result
+
+
+def get_user(user_id):
+    '''
+    Returns the summary (UserSummary) of a user given its ID or its name, or
+    None if the user does not exist
+    '''
+    return get_users([user_id]).get(user_id)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckan.model as model
+import constants
+import datetime
+import db
+
+from collections import OrderedDict, namedtuple
+
+OPENED = u'opened'
+CLOSED = u'closed'
+COMMENTS = u'comments'
+TIME_TO_CLOSE = u'time_to_close'
+TIME_TO_CLOSE_BUCKET = u'time_to_close_bucket_%s'
+
+# The fields of a data request used to compute its metrics
+_Snapshot = namedtuple('_Snapshot', ['organization_id', 'open_time', 'closed', 'close_time'])
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m'
+}
+
+
+# Changes of the metrics are expressed as deltas: dicts whose keys are tuples
+# (organization_id, day, metric) and whose values are the increments
+
+def _key(organization_id, time, metric):
+    return (organization_id or u'', time.date(), metric)
+
+
+def _bucket(seconds):
+    '''Returns the metric of the histogram bucket that includes the given time to close'''
+    hours = seconds / 3600.0
+    for bound in constants.STATS_CLOSE_BUCKETS:
+        if hours <= bound:
+            return TIME_TO_CLOSE_BUCKET % bound
+    return TIME_TO_CLOSE_BUCKET % 'inf'
+
+
+def _add(deltas, new_deltas):
+    for key, delta in new_deltas.iteritems():
+        deltas[key] = deltas.get(key, 0) + delta
+    return deltas
+
+
+def merge_deltas(*deltas_list):
+    result = {}
+    for deltas in deltas_list:
+        _add(result, deltas)
+    return result
+
+
+def opened_deltas(datarequest, sign=1):
+    return {_key(datarequest.organization_id, datarequest.open_time, OPENED): sign}
+
+
+def closed_deltas(datarequest, sign=1):
+    if not datarequest.closed or not datarequest.close_time:
+        return {}
+
+    delta = datarequest.close_time - datarequest.open_time
+    seconds = delta.days * 86400 + delta.seconds
+    organization_id, close_time = datarequest.organization_id, datarequest.close_time
+
+    return {
+        _key(organization_id, close_time, CLOSED): sign,
+        _key(organization_id, close_time, TIME_TO_CLOSE): sign * seconds,
+        _key(organization_id, close_time, _bucket(seconds)): sign
+    }
+
+
+def datarequest_deltas(datarequest, sign=1):
+    return merge_deltas(opened_deltas(datarequest, sign), closed_deltas(datarequest, sign))
+
+
+def moved_deltas(datarequest, previous_organization_id):
+    '''
+    Returns the deltas that move the metrics of a data request from its
+    previous organization to the current one (no deltas if it has not changed)
+    '''
+    if datarequest.organization_id == previous_organization_id:
+        return {}
+
+    previous = _Snapshot(previous_organization_id, datarequest.open_time, datarequest.closed, datarequest.close_time)
+    return merge_deltas(datarequest_deltas(previous, -1), datarequest_deltas(datarequest))
+
+
+def comment_deltas(organization_id, time, sign=1):
+    return {_key(organization_id, time, COMMENTS): sign}
+
+
+def apply_deltas(deltas, activity=None):
+    '''
+    Updates the aggregated metrics and the summaries of the organizations in
+    the current transaction. Rows are always updated in the same order to
+    avoid deadlocks between concurrent transactions.
+
+    :param deltas: The changes of the metrics
+    :type deltas: dict
+
+    :param activity: The time of the last activity of each organization
+        involved in the change (optional)
+    :type activity: dict
+    '''
+    # Open data requests are the opened ones that have not been closed yet
+    summaries = {}
+    for (organization_id, day, metric), delta in deltas.iteritems():
+        if metric in (OPENED, CLOSED):
+            summary = summaries.setdefault(organization_id, [0, 0, None])
+            summary[0] += delta if metric == OPENED else -delta
+            summary[1] += delta if metric == CLOSED else 0
+
+    for organization_id, time in (activity or {}).iteritems():
+        summaries.setdefault(organization_id or u'', [0, 0, None])[2] = time
+
+    for (organization_id, day, metric), delta in sorted(deltas.iteritems()):
+        if delta:
+            db.Stat.increment(organization_id, day, metric, delta)
+
+    for organization_id, (open_delta, closed_delta, time) in sorted(summaries.iteritems()):
+        if open_delta or closed_delta or time is not None:
+            db.OrganizationSummary.update(organization_id, open_delta, closed_delta, time)
+
+
+def rebuild(batch_size=constants.STATS_REBUILD_BATCH_SIZE):
+    '''
+    Computes again all the aggregated metrics (and the summaries of the
+    organizations) from the data requests and comments tables. Returns the
+    number of metric rows stored.
+    '''
+    db.init_db(model)
+    deltas = {}
+    organizations = {}
+
+    for batch in db.DataRequest.iterate_by_id(batch_size):
+        for datarequest in batch:
+            organizations[datarequest.id] = datarequest.organization_id
+            _add(deltas, datarequest_deltas(datarequest))
+
+    for batch in db.Comment.iterate_by_id(batch_size):
+        for comment in batch:
+            # Comments of data requests that no longer exist are ignored
+            if comment.datarequest_id in organizations:
+                _add(deltas, comment_deltas(organizations[comment.datarequest_id], comment.time))
+
+    rows = [{'organization_id': organization_id, 'day': day, 'metric': metric, 'value': value}
+            for (organization_id, day, metric), value in sorted(deltas.iteritems()) if value]
+
+    db.Stat.delete_all()
+    for i in range(0, len(rows), batch_size):
+        db.Stat.insert_many(rows[i:i + batch_size])
+    db.OrganizationSummary.refresh()
+    model.Session.commit()
+
+    return len(rows)
+
+
+def parse_day(value):
+    '''Parses a day (YYYY-MM-DD). Raises ValueError if the day is not valid'''
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _median_time_to_close(metrics):
+    '''
+    Estimates the median time to close (in hours) from the histogram,
+    interpolating linearly inside the bucket that contains it
+    '''
+    buckets = [(bound, metrics.get(TIME_TO_CLOSE_BUCKET % bound, 0)) for bound in constants.STATS_CLOSE_BUCKETS]
+    buckets.append((None, metrics.get(TIME_TO_CLOSE_BUCKET % 'inf', 0)))
+    total = sum(count for _, count in buckets)
+
+    if total <= 0:
+        return None
+
+    target = total / 2.0
+    cumulative = 0
+    lower = 0
+
+    for upper, count in buckets:
+        if count > 0 and cumulative + count >= target:
+            if upper is None:
+                return float(lower)
+            return round(lower + (upper - lower) * (target - cumulative) / count, 2)
+
+        cumulative += count
+        if upper is not None:
+            lower = upper
+
+    return float(lower)
+
+
+def _summarize(metrics):
+    closed = metrics.get(CLOSED, 0)
+    mean = round(metrics.get(TIME_TO_CLOSE, 0) / 3600.0 / closed, 2) if closed > 0 else None
+
+    return {
+        'opened': metrics.get(OPENED, 0),
+        'closed': closed,
+        'comments': metrics.get(COMMENTS, 0),
+        'mean_time_to_close': mean,
+        'median_time_to_close': _median_time_to_close(metrics)
+    }
+
+
+def get_stats(organization_id=None, since=None, until=None, period=None):
+    '''
+    Returns the statistics of each organization (and period, if given) and
+    the total ones. Only the aggregated rows are read.
+    '''
+    groups = OrderedDict()
+    total = {}
+
+    for row in db.Stat.get_totals(organization_id, since, until, period):
+        if period:
+            row_organization_id, row_period, metric, value = row
+        else:
+            (row_organization_id, metric, value), row_period = row, None
+
+        metrics = groups.setdefault((row_organization_id, row_period), {})
+        metrics[metric] = metrics.get(metric, 0) + int(value)
+        total[metric] = total.get(metric, 0) + int(value)
+
+    results = []
+    for (row_organization_id, row_period), metrics in groups.iteritems():
+        result = _summarize(metrics)
+        result['organization_id'] = row_organization_id or None
+        if period:
+            result['period'] = row_period.strftime(PERIOD_FORMATS[period])
+        results.append(result)
+
+    return {'results': results, 'total': _summarize(total)}
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+
+from ckanext.datarequests.instrumentation import Recorder
+
+
+@contextlib.contextmanager
+def assert_max_calls(queries=None, actions=None, auth_checks=None):
+    '''
+    Fails when the code run inside the block executes more SQL statements,
+    nested actions or auth checks than the given upper bounds (None means
+    that the calls are not limited). The recorder is returned so the calls
+    can be checked in detail.
+    '''
+    with Recorder() as recorder:
+        yield recorder
+
+    for attribute, limit in (('queries', queries), ('actions', actions), ('auth_checks', auth_checks)):
+        calls = getattr(recorder, attribute)
+        if limit is not None and len(calls) > limit:
+            raise AssertionError('%d %s performed (at most %d expected):\n%s' % (
+                len(calls), attribute.replace('_', ' '), limit, '\n'.join(calls)))
@@ -19,12 +19,18 @@
 
 import ckanext.datarequests.actions as actions
 import ckanext.datarequests.constants as constants
+import ckanext.datarequests.instrumentation as instrumentation
 import datetime
+import itertools
+import query_counts
 import test_actions_data as test_data
+import threading
+import time
 import unittest
 
 from mock import MagicMock
 from nose_parameterized import parameterized
+from test_actions_data import OrganizationRow, PackageRow
 
 
 class ActionsTest(unittest.TestCase):
@@ -33,7 +39,6 @@ class ActionsTest(unittest.TestCase):
         # Mocks
         self._tk = actions.tk
         actions.tk = MagicMock()
-        actions.USERS_CACHE = {}
         actions.tk.ObjectNotFound = self._tk.ObjectNotFound
         actions.tk.ValidationError = self._tk.ValidationError
 
@@ -49,6 +54,23 @@ class ActionsTest(unittest.TestCase):
         self._datetime = actions.datetime
         actions.datetime = MagicMock()
 
+        self._events = actions.events
+        actions.events = MagicMock()
+
+        self._stats = actions.stats
+        actions.stats = MagicMock()
+
+        # Names are resolved with the mocked toolkit and nothing is cached between tests
+        self._instrumentation_tk = instrumentation.tk
+        instrumentation.tk = actions.tk
+        actions.resolver.clear()
+        self._query_organizations = actions.resolver._query_organizations
+        actions.resolver._query_organizations = MagicMock(return_value=[])
+        self._query_users = actions.resolver._query_users
+        actions.resolver._query_users = MagicMock(return_value=[])
+        self._query_packages = actions.resolver._query_packages
+        actions.resolver._query_packages = MagicMock(return_value=[])
+
         self.context = {
             'user': 'example_usr',
             'auth_user_obj': MagicMock(),
@@ -63,10 +85,18 @@ class ActionsTest(unittest.TestCase):
         actions.db = self._db
         actions.validator = self._validator
         actions.datetime = self._datetime
+        actions.events = self._events
+        actions.stats = self._stats
+        instrumentation.tk = self._instrumentation_tk
+        actions.resolver._query_organizations = self._query_organizations
+        actions.resolver._query_users = self._query_users
+        actions.resolver._query_packages = self._query_packages
+        actions.resolver.clear()
 
     def _check_comment(self, comment, response, user):
         self.assertEquals(comment.id, response['id'])
         self.assertEquals(comment.comment, response['comment'])
+        self.assertEquals(comment.comment_html, response['comment_html'])
         self.assertEquals(str(comment.time), response['time'])
         self.assertEquals(comment.user_id, response['user_id'])
         self.assertEquals(user, response['user'])
@@ -78,10 +108,13 @@ class ActionsTest(unittest.TestCase):
         self.assertEquals(user, response['user'])
         self.assertEquals(datarequest.title, response['title'])
         self.assertEquals(datarequest.description, response['description'])
+        self.assertEquals(datarequest.description_html, response['description_html'])
         self.assertEquals(datarequest.organization_id, response['organization_id'])
         self.assertEquals(str(datarequest.open_time), response['open_time'])
         self.assertEquals(datarequest.closed, response['closed'])
         self.assertEquals(datarequest.accepted_dataset_id, response['accepted_dataset_id'])
+        self.assertEquals(str(datarequest.last_activity_time), response['last_activity_time'])
+        self.assertEquals(datarequest.comments_count, response['comments_count'])
 
         if organization:
             self.assertEquals(organization, response['organization'])
@@ -95,6 +128,32 @@ class ActionsTest(unittest.TestCase):
             self.assertIsNone(response['close_time'])
 
 
+    def _check_change(self, change_type, datarequest_id, comment_id=None):
+        change = actions.db.Change.return_value
+        actions.db.Change.assert_called_once_with()
+        actions.db.Change.lock.assert_called_once_with()
+        self.context['session'].add.assert_any_call(change)
+
+        self.assertEquals(change_type, change.change_type)
+        self.assertEquals(datarequest_id, change.datarequest_id)
+        self.assertEquals(self.context['auth_user_obj'].id, change.user_id)
+        if comment_id:
+            self.assertEquals(constants.CHANGE_OBJECT_COMMENT, change.object_type)
+            self.assertEquals(comment_id, change.object_id)
+        else:
+            self.assertEquals(constants.CHANGE_OBJECT_DATAREQUEST, change.object_type)
+            self.assertEquals(datarequest_id, change.object_id)
+
+        # The event is published once the change has been commited
+        actions.events.publish.assert_called_once_with({
+            'object_type': change.object_type,
+            'object_id': change.object_id,
+            'datarequest_id': datarequest_id,
+            'change_type': change_type,
+            'user_id': self.context['auth_user_obj'].id,
+            'time': str(change.time)
+        })
+
     ######################################################################
     ################################# AUX ################################
     ######################################################################
@@ -135,9 +194,11 @@ class ActionsTest(unittest.TestCase):
         self.assertEquals(0, actions.tk.check_access.call_count)
         self.assertEquals(0, actions.db.DataRequest.get.call_count)
 
-    def _test_comment_not_found(self, function, action, request_data):
+    def _test_comment_not_found(self, function, action, request_data, db_function=None):
         # Configure the mock
         actions.db.Comment.get.return_value = []
+        if db_function:
+            db_function.return_value = None
 
         # Call the function
         with self.assertRaises(self._tk.ObjectNotFound):
@@ -146,7 +207,10 @@ class ActionsTest(unittest.TestCase):
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(action, self.context, request_data)
-        actions.db.Comment.get.assert_called_once_with(id=request_data['id'])
+        if db_function:
+            self.assertEquals(request_data['id'], db_function.call_args[0][0])
+        else:
+            actions.db.Comment.get.assert_called_once_with(id=request_data['id'])
 
 
     ######################################################################
@@ -191,10 +255,7 @@ class ActionsTest(unittest.TestCase):
         actions.datetime.datetime.now = MagicMock(return_value=current_time)
 
         # Mock actions
-        default_user = {'user': 1}
-        default_org = {'org': 2}
-        default_pkg = None      # Accepted dataset cannot be different from None at this time
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
         result = actions.datarequest_create(self.context, test_data.create_request_data)
@@ -207,18 +268,27 @@ class ActionsTest(unittest.TestCase):
         actions.validator.validate_datarequest.assert_called_once_with(self.context, test_data.create_request_data)
         actions.db.DataRequest.assert_called_once()
 
-        self.context['session'].add.assert_called_once_with(datarequest)
+        self.context['session'].add.assert_any_call(datarequest)
         self.context['session'].commit.assert_called_once()
+        self._check_change(constants.CHANGE_CREATED, actions.db.uuid4.return_value)
+        self.assertEquals(datarequest.open_time, datarequest.last_activity_time)
+        self.assertEquals(0, datarequest.comments_count)
+        actions.stats.opened_deltas.assert_called_once_with(datarequest)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.opened_deltas.return_value,
+                                                           {datarequest.organization_id: current_time})
 
         # Check the object stored in the database
+        self.assertEquals(actions.db.uuid4.return_value, datarequest.id)
         self.assertEquals(self.context['auth_user_obj'].id, datarequest.user_id)
         self.assertEquals(test_data.create_request_data['title'], datarequest.title)
         self.assertEquals(test_data.create_request_data['description'], datarequest.description)
+        self.assertEquals(u'<p>%s</p>' % test_data.create_request_data['description'], datarequest.description_html)
         self.assertEquals(test_data.create_request_data['organization_id'], datarequest.organization_id)
         self.assertEquals(current_time, datarequest.open_time)
 
         # Check the returned object
-        self._check_basic_response(datarequest, result, default_user, default_org, default_pkg)
+        organization = test_data._organization_dict(test_data.create_request_data['organization_id'])
+        self._check_basic_response(datarequest, result, test_data._user_dict(datarequest.user_id), organization)
 
 
     ######################################################################
@@ -239,22 +309,20 @@ class ActionsTest(unittest.TestCase):
         actions.db.DataRequest.get.return_value = [datarequest]
 
         # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
-        default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        test_data._initialize_basic_actions(actions)
 
-        # Call the function
-        result = actions.datarequest_show(self.context, test_data.show_request_data)
+        # Call the function. The user, the organization and the dataset are read from their tables
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show(self.context, test_data.show_request_data)
 
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_SHOW, self.context, test_data.show_request_data)
         actions.db.DataRequest.get.assert_called_once_with(id=test_data.show_request_data['id'])
 
-        org = default_org if org_checked else None
-        pkg = default_pkg if pkg_checked else None
-        self._check_basic_response(datarequest, result, default_user, org, pkg)
+        org = test_data._organization_dict(datarequest.organization_id) if org_checked else None
+        pkg = test_data._package_dict(datarequest.accepted_dataset_id) if pkg_checked else None
+        self._check_basic_response(datarequest, result, test_data._user_dict(datarequest.user_id), org, pkg)
 
     def test_datarequest_show_found_org_open(self):
         datarequest = test_data._generate_basic_datarequest()
@@ -283,6 +351,298 @@ class ActionsTest(unittest.TestCase):
 
         self._test_datarequest_show_found(datarequest, org_checked, pkg_checked)
 
+    @parameterized.expand([
+        # Fields, include flags, expected columns, expected keys, organization read
+        (['title', 'closed'], {}, ['id', 'title', 'closed'], ['id', 'title', 'closed'], False),
+        ('title,closed', {}, ['id', 'title', 'closed'], ['id', 'title', 'closed'], False),
+        (['id', 'title', 'user'], {}, ['id', 'title', 'user_id'], ['id', 'title', 'user'], False),
+        (['title'], {'include_organization': 'true'}, ['id', 'title', 'organization_id', 'organization_name',
+            'organization_title'], ['id', 'title', 'organization'], True),
+        (['title', 'organization'], {'include_organization': False}, ['id', 'title'], ['id', 'title'], False),
+        (['organization_id', 'organization'], {}, ['id', 'organization_id', 'organization_name', 'organization_title'],
+            ['id', 'organization_id', 'organization'], True),
+    ])
+    def test_datarequest_show_fields(self, fields, flags, expected_columns, expected_keys, organization_read):
+        datarequest = test_data._generate_basic_datarequest()
+        datarequest.accepted_dataset_id = 'pkg_id'
+        actions.db.DataRequest.get_columns.return_value = [datarequest]
+        test_data._initialize_basic_actions(actions)
+        request_data = dict(test_data.show_request_data, fields=fields, **flags)
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show(self.context, request_data)
+
+        # Only the required columns are loaded and the related objects are only retrieved when requested
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        actions.db.DataRequest.get_columns.assert_called_once_with(expected_columns, id=request_data['id'])
+        self.assertEquals(sorted(expected_keys), sorted(result.keys()))
+        self.assertEquals(int(organization_read), actions.resolver._query_organizations.call_count)
+        self.assertEquals(0, actions.resolver._query_packages.call_count)
+        self.assertEquals(datarequest.id, result['id'])
+        if organization_read:
+            self.assertEquals(test_data._organization_dict(datarequest.organization_id), result['organization'])
+
+    @parameterized.expand([
+        ({'include_user': False}, False, True),
+        ({'include_organization': 'false', 'include_accepted_dataset': 'false'}, True, False),
+        ({'include_user': False, 'include_organization': False, 'include_accepted_dataset': False}, False, False),
+    ])
+    def test_datarequest_show_include_flags(self, flags, user_included, others_included):
+        datarequest = test_data._generate_basic_datarequest()
+        datarequest.accepted_dataset_id = 'pkg_id'
+        actions.db.DataRequest.get.return_value = [datarequest]
+        test_data._initialize_basic_actions(actions)
+        request_data = dict(test_data.show_request_data, **flags)
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show(self.context, request_data)
+
+        # All the fields are returned, but the related objects that are not requested are None
+        actions.db.DataRequest.get.assert_called_once_with(id=request_data['id'])
+        self.assertEquals(set(constants.DATAREQUEST_FIELDS + constants.DATAREQUEST_RELATED), set(result.keys()))
+        # Related objects are read from their tables instead of calling user_show, organization_show and package_show
+        self.assertEquals(user_included, result['user'] is not None)
+        self.assertEquals(int(user_included), actions.resolver._query_users.call_count)
+        self.assertEquals(others_included, result['organization'] is not None)
+        self.assertEquals(int(others_included), actions.resolver._query_organizations.call_count)
+        self.assertEquals(others_included, result['accepted_dataset'] is not None)
+        self.assertEquals(int(others_included), actions.resolver._query_packages.call_count)
+
+    def test_datarequest_show_stored_names(self):
+        datarequest = test_data._generate_basic_datarequest(organization_id='org_id')
+        datarequest.organization_name = u'org'
+        datarequest.organization_title = u'Organization'
+        datarequest.accepted_dataset_id = 'pkg_id'
+        datarequest.accepted_dataset_name = u'pkg'
+        datarequest.accepted_dataset_title = u'Dataset'
+        actions.db.DataRequest.get.return_value = [datarequest]
+        test_data._initialize_basic_actions(actions)
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show(self.context, test_data.show_request_data)
+
+        # The organization and the dataset are built from the stored names
+        self.assertEquals(0, actions.resolver._query_organizations.call_count)
+        self.assertEquals(0, actions.resolver._query_packages.call_count)
+        self.assertEquals({'id': 'org_id', 'name': u'org', 'title': u'Organization', 'display_name': u'Organization'},
+                          result['organization'])
+        self.assertEquals({'id': 'pkg_id', 'name': u'pkg', 'title': u'Dataset', 'display_name': u'Dataset'},
+                          result['accepted_dataset'])
+
+    @parameterized.expand([
+        ({'fields': ['title', 'password']},),
+        ({'fields': {'title': True}},)
+    ])
+    def test_datarequest_show_invalid_fields(self, params):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_show(self.context, dict(test_data.show_request_data, **params))
+
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_columns.call_count)
+
+
+    ######################################################################
+    ############################# SHOW MANY ##############################
+    ######################################################################
+
+    @parameterized.expand([
+        ({},),
+        ({'ids': []},),
+        ({'ids': {'id': 'dr1'}},),
+        ({'ids': ['dr%d' % i for i in range(constants.BULK_MAX_ITEMS + 1)]},)
+    ])
+    def test_datarequest_show_many_invalid(self, request_data):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_show_many(self.context, request_data)
+
+        self.assertEquals(0, actions.tk.check_access.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_by_ids.call_count)
+
+    def test_datarequest_show_many_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+        request_data = {'ids': ['dr1']}
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_show_many(self.context, request_data)
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_SHOW_MANY, self.context, request_data)
+        self.assertEquals(0, actions.db.DataRequest.get_by_ids.call_count)
+
+    @parameterized.expand([
+        (['dr3', 'dr1', 'missing', 'dr2', 'dr1'],),
+        ('dr3,dr1,missing,dr2',)
+    ])
+    def test_datarequest_show_many(self, ids):
+        # All the data requests belong to the same user and organization and accept the same dataset
+        datarequests = [test_data._generate_basic_datarequest(id='dr%d' % i) for i in range(1, 4)]
+        for datarequest in datarequests:
+            datarequest.accepted_dataset_id = 'pkg_id'
+        actions.db.DataRequest.get_by_ids.return_value = datarequests
+
+        test_data._initialize_basic_actions(actions)
+        organization_id = datarequests[0].organization_id
+        default_org = test_data._organization_dict(organization_id)
+        default_pkg = test_data._package_dict('pkg_id')
+        request_data = {'ids': ids}
+
+        # Call the function. Each related object is only retrieved once and no action is called
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show_many(self.context, request_data)
+
+        actions.resolver._query_organizations.assert_called_once_with([organization_id])
+        actions.resolver._query_packages.assert_called_once_with(['pkg_id'])
+
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_SHOW_MANY, self.context, request_data)
+        actions.db.DataRequest.get_by_ids.assert_called_once_with(['dr3', 'dr1', 'missing', 'dr2'], columns=None)
+
+        # The order of the given ids is kept and the missing ones are reported
+        self.assertEquals(['dr3', 'dr1', 'dr2'], [datarequest['id'] for datarequest in result['result']])
+        self.assertEquals(['missing'], result['missing'])
+        for datarequest in result['result']:
+            self._check_basic_response(datarequests[int(datarequest['id'][2]) - 1], datarequest,
+                                       test_data._user_dict(datarequest['user_id']), default_org, default_pkg)
+
+    @parameterized.expand([
+        (10,),
+        (50,)
+    ])
+    def test_datarequest_show_many_related_queries(self, number):
+        # Every data request has its own organization and accepted dataset
+        datarequests = []
+        for i in range(number):
+            datarequest = test_data._generate_basic_datarequest(id='dr%d' % i, organization_id='org%d' % i)
+            datarequest.accepted_dataset_id = 'pkg%d' % i
+            datarequests.append(datarequest)
+        actions.db.DataRequest.get_by_ids.return_value = datarequests
+        test_data._initialize_basic_actions(actions)
+        actions.resolver._query_organizations.side_effect = lambda ids: [
+            OrganizationRow(object_id, object_id, u'', 'active') for object_id in ids]
+        actions.resolver._query_packages.side_effect = lambda ids: [
+            PackageRow(object_id, object_id, None) for object_id in ids]
+
+        # Call the function. No action is called, whatever the number of data requests
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show_many(self.context, {'ids': [dr.id for dr in datarequests]})
+
+        # Each kind of related object is read in a single query
+        self.assertEquals(1, actions.resolver._query_users.call_count)
+        self.assertEquals(1, actions.resolver._query_organizations.call_count)
+        self.assertEquals(1, actions.resolver._query_packages.call_count)
+        for i, datarequest in enumerate(result['result']):
+            self.assertEquals({'id': 'org%d' % i, 'name': 'org%d' % i, 'title': 'org%d' % i,
+                               'display_name': 'org%d' % i}, datarequest['organization'])
+            self.assertEquals({'id': 'pkg%d' % i, 'name': 'pkg%d' % i, 'title': 'pkg%d' % i,
+                               'display_name': 'pkg%d' % i}, datarequest['accepted_dataset'])
+
+    def test_datarequest_show_many_fields(self):
+        datarequests = [test_data._generate_basic_datarequest(id='dr%d' % i) for i in range(1, 3)]
+        actions.db.DataRequest.get_by_ids.return_value = datarequests
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_show_many(self.context, {'ids': ['dr1', 'dr2'], 'fields': ['title']})
+
+        # Only the required columns are loaded
+        actions.db.DataRequest.get_by_ids.assert_called_once_with(['dr1', 'dr2'], columns=['id', 'title'])
+        self.assertEquals([{'id': dr.id, 'title': dr.title} for dr in datarequests], result['result'])
+        self.assertEquals([], result['missing'])
+
+    @parameterized.expand([
+        (['excerpt', 'comments_count'], True),
+        (['description', 'excerpt', 'comments_count'], False)
+    ])
+    def test_datarequest_show_many_not_backfilled(self, fields, description_query):
+        # The excerpt and the comments count of the data requests stored by
+        # previous versions are NULL until backfill is run
+        datarequests = [test_data._generate_basic_datarequest(id='dr%d' % i, description='Description *%d*' % i)
+                        for i in range(1, 4)]
+        for datarequest in datarequests[:2]:
+            datarequest.excerpt = None
+            datarequest.comments_count = None
+        actions.db.DataRequest.get_by_ids.side_effect = [datarequests, datarequests[:2]]
+
+        # Call the function
+        result = actions.datarequest_show_many(self.context, {'ids': ['dr1', 'dr2', 'dr3'], 'fields': fields})
+
+        # The missing excerpts are rendered from the descriptions (retrieved
+        # with a single query when they are not loaded)
+        excerpts = [actions.helpers.render_excerpt('Description *1*'), actions.helpers.render_excerpt('Description *2*'),
+                    'Description *3*']
+        self.assertEquals(excerpts, [datarequest['excerpt'] for datarequest in result['result']])
+        self.assertEquals(2 if description_query else 1, actions.db.DataRequest.get_by_ids.call_count)
+        if description_query:
+            self.assertEquals(['id', 'description'], actions.db.DataRequest.get_by_ids.call_args[1]['columns'])
+            self.assertEquals(['dr1', 'dr2'], sorted(actions.db.DataRequest.get_by_ids.call_args[0][0]))
+
+        # Missing counts are not replaced, so the templates count the comments
+        self.assertEquals([None, None, 3], [datarequest['comments_count'] for datarequest in result['result']])
+
+
+    ######################################################################
+    ########################## LIST FOR DATASET ##########################
+    ######################################################################
+
+    def test_datarequest_list_for_dataset_no_id(self):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_list_for_dataset(self.context, {})
+
+        self.assertEquals(0, actions.tk.check_access.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_by_accepted_dataset.call_count)
+
+    def test_datarequest_list_for_dataset_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+        request_data = {'package_id': 'pkg'}
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_list_for_dataset(self.context, request_data)
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_LIST_FOR_DATASET, self.context, request_data)
+        self.assertEquals(0, actions.db.DataRequest.get_by_accepted_dataset.call_count)
+
+    @parameterized.expand([
+        ([],),
+        ([PackageRow('pkg_id', 'pkg', u'Dataset', 'active', True)],),
+        ([PackageRow('pkg_id', 'pkg', u'Dataset', 'deleted', False)],)
+    ])
+    def test_datarequest_list_for_dataset_not_found(self, rows):
+        # Private and deleted datasets are not found either
+        actions.resolver._query_packages.return_value = rows
+
+        with self.assertRaises(self._tk.ObjectNotFound):
+            actions.datarequest_list_for_dataset(self.context, {'package_id': 'pkg'})
+
+        actions.resolver._query_packages.assert_called_once_with(['pkg'])
+        self.assertEquals(0, actions.db.DataRequest.get_by_accepted_dataset.call_count)
+
+    @parameterized.expand([
+        ('pkg_id',),
+        ('pkg',)
+    ])
+    def test_datarequest_list_for_dataset(self, package_id):
+        datarequests = [test_data._generate_basic_datarequest(id='dr%d' % i) for i in range(1, 3)]
+        for i, datarequest in enumerate(datarequests):
+            datarequest.close_time = datetime.datetime(2016, 1, 2 - i)
+        actions.db.DataRequest.get_by_accepted_dataset.return_value = datarequests
+        actions.resolver._query_packages.return_value = [PackageRow('pkg_id', 'pkg', u'Dataset')]
+        request_data = {'package_id': package_id, 'fields': ['title', 'close_time']}
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            result = actions.datarequest_list_for_dataset(self.context, request_data)
+
+        # Data requests are found by the ID and by the name of the dataset and only the required columns are loaded
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_LIST_FOR_DATASET, self.context, request_data)
+        actions.db.DataRequest.get_by_accepted_dataset.assert_called_once_with(['pkg', 'pkg_id'],
+                                                                               columns=['id', 'title', 'close_time'])
+        self.assertEquals([{'id': dr.id, 'title': dr.title, 'close_time': str(dr.close_time)} for dr in datarequests],
+                          result)
+
 
     ######################################################################
     ############################### UPDATE ###############################
@@ -298,62 +658,85 @@ class ActionsTest(unittest.TestCase):
         self._test_no_id(actions.datarequest_update)
 
     def test_datarequest_update_not_found(self):
-        self._test_not_found(actions.datarequest_update, constants.DATAREQUEST_UPDATE, test_data.update_request_data)
-        self.assertEquals(0, actions.validator.validate_datarequest.call_count)
+        # Configure the mock
+        actions.db.DataRequest.update_by_id.return_value = None
+
+        # Call the function
+        with self.assertRaises(self._tk.ObjectNotFound):
+            actions.datarequest_update(self.context, test_data.update_request_data)
+
+        # Assertions
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_UPDATE, self.context, test_data.update_request_data)
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
         self.assertEquals(0, self.context['session'].add.call_count)
         self.assertEquals(0, self.context['session'].commit.call_count)
+        self.assertEquals(0, actions.stats.apply_deltas.call_count)
 
     @parameterized.expand([
-        (True,),
-        # Title checked does not depends on the organization and the dataset returned.
-        # For this reason it is not necessary to execute the test with all the possible combinations
-        (False,),
-        (False, 'org_id', None),
-        (False, None,     'pkg_id'),
-        (False, 'org_id', 'pkg_id')
+        (None,           None,     None),
+        ('org_id',       None,     None),
+        (None,           'pkg_id', None),
+        ('org_id',       'pkg_id', None),
+        ('organization', None,     None),
+        ('org_id',       'pkg_id', True),
+        ('org_id',       'pkg_id', 'false'),
+        ('org_id',       'pkg_id', False)
     ])
-    def test_datarequest_update(self, title_checked, organization_id=None, accepted_dataset_id=None):
-        # Configure the mock
-        datarequest = test_data._generate_basic_datarequest()
-        datarequest.organization_id = organization_id
+    def test_datarequest_update(self, previous_organization_id, accepted_dataset_id, include_related):
+        # Configure the mock (the updated row is returned by the data base)
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+        request_data = test_data.update_request_data.copy()
+        datarequest = test_data._generate_basic_datarequest(title=request_data['title'],
+                                                            description=request_data['description'],
+                                                            organization_id=request_data['organization_id'])
         datarequest.accepted_dataset_id = accepted_dataset_id
-        # Title should not be checked when it does not change
-        datarequest.title = test_data.create_request_data['title'] + 'a' if title_checked else test_data.create_request_data['title']
-        actions.db.DataRequest.get.return_value = [datarequest]
+        datarequest.last_activity_time = current_time
+        datarequest.previous_organization_id = previous_organization_id
+        actions.db.DataRequest.update_by_id.return_value = datarequest
 
-        # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
-        default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        if include_related is not None:
+            request_data['include_related'] = include_related
 
-        # Store previous user (needed to check that it has not been modified)
-        previous_user_id = datarequest.user_id
+        # Mock actions
+        test_data._initialize_basic_actions(actions)
+        default_org = test_data._organization_dict(request_data['organization_id'])
 
         # Call the action
-        result = actions.datarequest_update(self.context, test_data.update_request_data)
+        result = actions.datarequest_update(self.context, request_data)
 
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
-        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_UPDATE, self.context, test_data.update_request_data)
-        actions.db.DataRequest.get.assert_called_once_with(id=test_data.update_request_data['id'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_UPDATE, self.context, request_data)
         expected_context = self.context.copy()
-        expected_context['avoid_existing_title_check'] = not title_checked
-        actions.validator.validate_datarequest.assert_called_once_with(expected_context, test_data.update_request_data)
+        expected_context['updated_datarequest_id'] = request_data['id']
+        actions.validator.validate_datarequest.assert_called_once_with(expected_context, request_data)
 
-        self.context['session'].add.assert_called_once_with(datarequest)
+        # The data request is updated with a single statement (it is not loaded before)
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        actions.db.DataRequest.update_by_id.assert_called_once_with(
+            request_data['id'], title=request_data['title'], description=request_data['description'],
+            description_html=actions.helpers.render_markdown(request_data['description']),
+            excerpt=actions.helpers.render_excerpt(request_data['description']),
+            organization_id=request_data['organization_id'], last_activity_time=current_time,
+            organization_name=default_org['name'], organization_title=default_org['title'])
         self.context['session'].commit.assert_called_once()
+        self._check_change(constants.CHANGE_UPDATED, datarequest.id)
 
-        # Check the object stored in the database
-        self.assertEquals(previous_user_id, datarequest.user_id)
-        self.assertEquals(test_data.update_request_data['title'], datarequest.title)
-        self.assertEquals(test_data.update_request_data['description'], datarequest.description)
-        self.assertEquals(test_data.update_request_data['organization_id'], datarequest.organization_id)
+        # Statistics are moved to the new organization
+        actions.stats.moved_deltas.assert_called_once_with(datarequest, previous_organization_id)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.moved_deltas.return_value,
+                                                           {datarequest.organization_id: current_time})
 
-        # Check the result
-        org = default_org if organization_id else None
-        pkg = default_pkg if accepted_dataset_id else None
-        self._check_basic_response(datarequest, result, default_user, org, pkg)
+        # Check the result (related objects are included by default)
+        if include_related in (None, True):
+            pkg = test_data._package_dict(accepted_dataset_id) if accepted_dataset_id else None
+            self._check_basic_response(datarequest, result, test_data._user_dict(datarequest.user_id), default_org, pkg)
+        else:
+            self._check_basic_response(datarequest, result, None)
+            self.assertIsNone(result['organization'])
+            self.assertIsNone(result['accepted_dataset'])
+            self.assertEquals(0, actions.tk.get_action.call_count)
 
 
     ######################################################################
@@ -363,6 +746,18 @@ class ActionsTest(unittest.TestCase):
     def test_datarequest_index_not_authorized(self):
         self._test_not_authorized(actions.datarequest_index, constants.DATAREQUEST_INDEX, {})
 
+    def _summaries(self, datarequests):
+        summaries = {}
+        for datarequest in datarequests:
+            organization_id = datarequest.organization_id or u''
+            summary = summaries.setdefault(organization_id, MagicMock(organization_id=organization_id,
+                                                                      open_count=0, closed_count=0))
+            if datarequest.closed:
+                summary.closed_count += 1
+            else:
+                summary.open_count += 1
+        return [summaries[organization_id] for organization_id in sorted(summaries)]
+
     @parameterized.expand([
         (test_data.datarequest_index_test_case_1,),
         (test_data.datarequest_index_test_case_2,),
@@ -380,29 +775,47 @@ class ActionsTest(unittest.TestCase):
         (test_data.datarequest_index_test_case_14,),
         (test_data.datarequest_index_test_case_15,),
         (test_data.datarequest_index_test_case_16,),
-        (test_data.datarequest_index_test_case_17,)
+        (test_data.datarequest_index_test_case_17,),
+        (test_data.datarequest_index_test_case_18,),
+        (test_data.datarequest_index_test_case_19,),
+        (test_data.datarequest_index_test_case_20,),
+        (test_data.datarequest_index_test_case_21,)
     ])
     def test_datarequest_index(self, test_case):
 
         content = test_case['content']
-        expected_ddbb_params = test_case['expected_ddbb_params']
+        # All the columns are loaded by default
+        expected_ddbb_params = dict(test_case['expected_ddbb_params'], columns=None)
         ddbb_response = test_case['ddbb_response']
         expected_response = test_case['expected_response']
         _organization_show = test_case['organization_show_func']
         _user_show = test_case.get('user_show_func', None)
 
-        # Set the mocks
+        # Set the mocks. Listings without free text and user filters read the
+        # counts from the summaries of the organizations and only load one page
+        if 'q' not in content and 'user_id' not in content:
+            offset = content.get('offset', 0)
+            limit = content.get('limit', constants.DATAREQUESTS_PER_PAGE)
+            expected_ddbb_params = dict(expected_ddbb_params, offset=offset, limit=limit)
+            actions.db.OrganizationSummary.get_all.return_value = self._summaries(ddbb_response)
+            ddbb_response = ddbb_response[offset:offset + limit]
+
         actions.db.DataRequest.get_ordered_by_date.return_value = ddbb_response
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
-        default_user = {'user': 3, 'id': test_data.user_default_id}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        test_data._initialize_basic_actions(actions)
         actions.tk._ = lambda x: x
 
         # Modify the default behaviour of 'organization_show'
         organization_show = actions.tk.get_action('organization_show')
         organization_show.side_effect = _organization_show
 
+        # The labels of the facets are read from the group table
+        def _query_organizations(organization_ids):
+            return [OrganizationRow(organization_id, organization_id,
+                                    _organization_show(None, {'id': organization_id})['display_name'], 'active')
+                    for organization_id in organization_ids]
+
+        actions.resolver._query_organizations.side_effect = _query_organizations
+
         # Call the function
         response = actions.datarequest_index(self.context, content)
 
@@ -416,34 +829,31 @@ class ActionsTest(unittest.TestCase):
 
         # The initial one to get the real ID and not the name
         if 'organization_id' in content:
-            organization_show.assert_any_call({'ignore_auth': True}, {'id': content['organization_id']})
+            organization_show.assert_any_call({'ignore_auth': True}, dict(actions.resolver.ORGANIZATION_SHOW_PARAMS,
+                                                                           id=content['organization_id']))
             expected_organization_show_calls += 1
 
-        # The reamining ones to include the display name into the facets
+        # The labels of the facets are retrieved in a single query
         if 'organization' in expected_response['facets']:
-            expected_organization_show_calls += len(expected_response['facets']['organization']['items'])
-            for organization_facet in expected_response['facets']['organization']['items']:
-                organization_show.assert_any_call({'ignore_auth': True}, {'id': organization_facet['name']})
-
-        # We have to substract the number of times that the function is called to parse
-        # the datarequest that will be returned
-        count = 0
-        datarequests = expected_response['result']
-        for datarequest in datarequests:
-            if datarequest['organization_id']:
-                count += 1
-            datarequest['user'] = default_user
+            expected_names = [item['name'] for item in expected_response['facets']['organization']['items']]
+            actions.resolver._query_organizations.assert_called_once_with(sorted(expected_names))
+        else:
+            self.assertEquals(0, actions.resolver._query_organizations.call_count)
 
-        # Assert that organization_show has been called the appropriate number of times
-        self.assertEquals(organization_show.call_count - count, expected_organization_show_calls)
+        # The organizations of the returned data requests are read with the labels of the
+        # facets, so organization_show is never called to parse them
+        self.assertEquals(expected_organization_show_calls, organization_show.call_count)
 
         # user, organization and accepted_dataset are None by default. The value of these fields
-        # must be set based on the value returned by the defined actions
+        # must be set based on the value returned by the defined mocks
+        datarequests = expected_response['result']
         for datarequest in datarequests:
-            datarequest['user'] = default_user
+            datarequest['user'] = test_data._user_dict(datarequest['user_id'])
             datarequest['accepted_dataset'] = None
             organization_id = datarequest['organization_id']
-            datarequest['organization'] = _organization_show(None, {'id': organization_id}) if organization_id else None
+            display_name = _organization_show(None, {'id': organization_id})['display_name'] if organization_id else None
+            datarequest['organization'] = {'id': organization_id, 'name': organization_id, 'title': display_name,
+                                           'display_name': display_name} if organization_id else None
 
         # Check that the result is correct
         # We cannot execute self.assertEquals (for facets) because items
@@ -464,6 +874,113 @@ class ActionsTest(unittest.TestCase):
                 self.assertIn(item, response['facets'][facet]['items'])
 
 
+    @parameterized.expand([
+        ({}, None, 4, {'Open': 3, 'Closed': 1}),
+        ({'closed': True}, True, 1, {'Closed': 1}),
+        ({'closed': False}, False, 3, {'Open': 3}),
+        # Values received in the query string of GET requests
+        ({'closed': 'True'}, True, 1, {'Closed': 1}),
+        ({'closed': 'false'}, False, 3, {'Open': 3}),
+        ({'closed': ''}, None, 4, {'Open': 3, 'Closed': 1})
+    ])
+    def test_datarequest_index_organization_summary(self, content, closed, expected_count, expected_states):
+        summary = MagicMock(organization_id=u'org_id', open_count=3, closed_count=1)
+        actions.db.OrganizationSummary.get.return_value = summary
+        actions.db.DataRequest.get_ordered_by_date.return_value = []
+        organization_show = actions.tk.get_action.return_value
+        organization_show.return_value = {'id': u'org_id', 'name': 'org', 'display_name': 'Org'}
+        actions.tk._ = lambda x: x
+        content = dict(content, organization_id='org', offset=10, limit=5)
+
+        response = actions.datarequest_index(self.context, content)
+
+        # Only the summary of the organization and the requested page are read
+        actions.db.OrganizationSummary.get.assert_called_once_with(u'org_id')
+        self.assertEquals(0, actions.db.OrganizationSummary.get_all.call_count)
+        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(
+            organization_id=u'org_id', user_id=None, closed=closed, q=None, desc=False,
+            order_by='open_time', offset=10, limit=5, columns=None)
+
+        self.assertEquals(expected_count, response['count'])
+        self.assertEquals([{'name': 'org', 'display_name': 'Org', 'count': expected_count}],
+                          response['facets']['organization']['items'])
+        self.assertEquals(expected_states, dict((item['display_name'], item['count'])
+                                                for item in response['facets']['state']['items']))
+
+    def test_datarequest_index_organization_facet_deleted(self):
+        actions.db.DataRequest.get_ordered_by_date.return_value = [
+            test_data._generate_basic_datarequest(organization_id='active_id'),
+            test_data._generate_basic_datarequest(organization_id='deleted_id'),
+            test_data._generate_basic_datarequest(organization_id='purged_id')
+        ]
+        actions.resolver._query_organizations.return_value = [
+            OrganizationRow('active_id', 'active', u'Active', 'active'),
+            OrganizationRow('deleted_id', 'deleted', u'', 'deleted')
+        ]
+        actions.tk._ = lambda x: x
+
+        response = actions.datarequest_index(self.context, {'q': test_data.FREE_TEXT})
+
+        # Deleted organizations are flagged and the ones that do not exist are left out
+        actions.resolver._query_organizations.assert_called_once_with(['active_id', 'deleted_id', 'purged_id'])
+        self.assertEquals(sorted([
+            {'name': 'active', 'display_name': u'Active', 'count': 1},
+            {'name': 'deleted', 'display_name': 'deleted', 'count': 1, 'state': 'deleted'}
+        ]), sorted(response['facets']['organization']['items']))
+
+    @parameterized.expand([
+        (10,),
+        (50,)
+    ])
+    def test_datarequest_index_nested_actions(self, page_size):
+        datarequests = [test_data._generate_basic_datarequest(organization_id=None) for _ in range(page_size)]
+        actions.db.DataRequest.get_ordered_by_date.return_value = datarequests
+        actions.db.OrganizationSummary.get_all.return_value = [
+            MagicMock(organization_id=u'org%d' % i, open_count=1, closed_count=0) for i in range(page_size)
+        ]
+        actions.resolver._query_organizations.return_value = [
+            OrganizationRow(u'org%d' % i, u'org%d' % i, u'Org', 'active') for i in range(page_size)
+        ]
+        actions.tk._ = lambda x: x
+
+        # The creator is read in a single query and the facets do not call any action, whatever the page size
+        with query_counts.assert_max_calls(actions=0) as recorder:
+            response = actions.datarequest_index(self.context, {'limit': page_size})
+
+        self.assertEquals([], recorder.actions)
+        self.assertEquals(1, actions.resolver._query_users.call_count)
+        self.assertEquals(page_size, len(response['result']))
+        self.assertEquals(page_size, len(response['facets']['organization']['items']))
+        self.assertEquals(1, actions.resolver._query_organizations.call_count)
+
+    @parameterized.expand([
+        ({}, ['id', 'title']),
+        ({'q': 'free-text'}, ['id', 'title', 'organization_id', 'closed'])
+    ])
+    def test_datarequest_index_fields(self, params, expected_columns):
+        datarequests = [test_data._generate_basic_datarequest(id='dr%d' % i) for i in range(3)]
+        actions.db.DataRequest.get_ordered_by_date.return_value = datarequests
+        actions.db.OrganizationSummary.get_all.return_value = []
+        actions.tk._ = lambda x: x
+
+        # Call the function
+        with query_counts.assert_max_calls(actions=0):
+            response = actions.datarequest_index(self.context, dict(params, fields=['title']))
+
+        # Only the required columns are loaded (the facets also need the organization and the state)
+        self.assertEquals(expected_columns, actions.db.DataRequest.get_ordered_by_date.call_args[1]['columns'])
+        self.assertEquals([{'id': dr.id, 'title': dr.title} for dr in datarequests], response['result'])
+
+    def test_datarequest_index_organization_without_summary(self):
+        actions.db.OrganizationSummary.get.return_value = None
+        actions.db.DataRequest.get_ordered_by_date.return_value = []
+        actions.tk.get_action.return_value.return_value = {'id': u'org_id'}
+
+        response = actions.datarequest_index(self.context, {'organization_id': 'org'})
+
+        self.assertEquals({'count': 0, 'facets': {}, 'result': []}, response)
+
+
     ######################################################################
     ############################### DELETE ###############################
     ######################################################################
@@ -472,42 +989,79 @@ class ActionsTest(unittest.TestCase):
         self._test_not_authorized(actions.datarequest_delete, constants.DATAREQUEST_DELETE, test_data.delete_request_data)
 
     def test_datarequest_delete_not_found(self):
-        self._test_not_found(actions.datarequest_delete, constants.DATAREQUEST_DELETE, test_data.delete_request_data)
+        # Configure the mock
+        actions.db.DataRequest.delete_by_id.return_value = None
+
+        # Call the function
+        with self.assertRaises(self._tk.ObjectNotFound):
+            actions.datarequest_delete(self.context, test_data.delete_request_data)
+
+        # Assertions
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_DELETE, self.context, test_data.delete_request_data)
+        actions.db.DataRequest.delete_by_id.assert_called_once_with(test_data.delete_request_data['id'])
+        self.assertEquals(0, self.context['session'].commit.call_count)
+        self.assertEquals(0, actions.stats.apply_deltas.call_count)
 
     def test_datarequest_delete_no_id(self):
         self._test_no_id(actions.datarequest_delete)
 
     @parameterized.expand([
-        (None,     None),
-        ('org_id', None),
-        (None,     'pkg_id'),
-        ('org_id', 'pkg_id')
+        (None,     None,     None),
+        ('org_id', 'pkg_id', None),
+        (None,     None,     True),
+        ('org_id', None,     True),
+        (None,     'pkg_id', 'true'),
+        ('org_id', 'pkg_id', True)
     ])
-    def test_datarequest_delete(self, organization_id, accepted_dataset_id):
-        # Configure the mock
+    def test_datarequest_delete(self, organization_id, accepted_dataset_id, include_related):
+        # Configure the mock (the deleted row is returned by the data base)
         datarequest = test_data._generate_basic_datarequest()
         datarequest.organization_id = organization_id
         datarequest.accepted_dataset_id = accepted_dataset_id
-        actions.db.DataRequest.get.return_value = [datarequest]
+        actions.db.DataRequest.delete_by_id.return_value = datarequest
+        comments = [test_data._generate_basic_comment(), test_data._generate_basic_comment()]
+        actions.db.Comment.delete_by_datarequest_ids.return_value = comments
+        request_data = test_data.delete_request_data.copy()
+
+        if include_related is not None:
+            request_data['include_related'] = include_related
 
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
-        default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
-        expected_data_dict = test_data.delete_request_data.copy()
-        result = actions.datarequest_delete(self.context, test_data.delete_request_data)
+        expected_data_dict = request_data.copy()
+        result = actions.datarequest_delete(self.context, request_data)
 
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_DELETE, self.context, expected_data_dict)
-        self.context['session'].delete.assert_called_once_with(datarequest)
+        actions.db.DataRequest.delete_by_id.assert_called_once_with(request_data['id'])
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self.assertEquals(0, self.context['session'].delete.call_count)
         self.context['session'].commit.assert_called_once_with()
-
-        org = default_org if organization_id else None
-        pkg = default_pkg if accepted_dataset_id else None
-        self._check_basic_response(datarequest, result, default_user, org, pkg)
+        self._check_change(constants.CHANGE_DELETED, datarequest.id)
+
+        # Comments are deleted in the same transaction and their statistics are removed too
+        actions.db.Comment.delete_by_datarequest_ids.assert_called_once_with([datarequest.id])
+        actions.stats.datarequest_deltas.assert_called_once_with(datarequest, -1)
+        self.assertEquals([((organization_id, comment.time, -1), {}) for comment in comments],
+                          actions.stats.comment_deltas.call_args_list)
+        actions.stats.merge_deltas.assert_called_once_with(actions.stats.datarequest_deltas.return_value,
+                                                           actions.stats.comment_deltas.return_value,
+                                                           actions.stats.comment_deltas.return_value)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.merge_deltas.return_value)
+
+        # Related objects are not retrieved by default
+        if not include_related:
+            self._check_basic_response(datarequest, result, None)
+            self.assertIsNone(result['organization'])
+            self.assertIsNone(result['accepted_dataset'])
+            self.assertEquals(0, actions.tk.get_action.call_count)
+            return
+
+        org = test_data._organization_dict(organization_id) if organization_id else None
+        pkg = test_data._package_dict(accepted_dataset_id) if accepted_dataset_id else None
+        self._check_basic_response(datarequest, result, test_data._user_dict(datarequest.user_id), org, pkg)
 
 
     ######################################################################
@@ -523,11 +1077,28 @@ class ActionsTest(unittest.TestCase):
     def test_datarequest_close_no_id(self):
         self._test_no_id(actions.datarequest_close)
 
-    def test_datarequest_close_not_found_no_accepted_ds(self):
-        self._test_not_found(actions.datarequest_close, constants.DATAREQUEST_CLOSE, test_data.close_request_data)
+    @parameterized.expand([
+        ({}, ),
+        ({'example_uuidv4': 'user_id'}, )
+    ])
+    def test_datarequest_close_not_updated(self, owners):
+        # Configure the mock
+        actions.db.DataRequest.close.return_value = None
+        actions.db.DataRequest.get_owners.return_value = owners
+        request_data = test_data.close_request_data.copy()
+        expected_exception = self._tk.ValidationError if owners else self._tk.ObjectNotFound
+
+        # Call the function
+        with self.assertRaises(expected_exception):
+            actions.datarequest_close(self.context, request_data)
 
-    def test_datarequest_close_not_found_accepted_ds(self):
-        self._test_not_found(actions.datarequest_close, constants.DATAREQUEST_CLOSE, test_data.close_request_data_accepted_ds)
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CLOSE, self.context, request_data)
+        actions.db.DataRequest.get_owners.assert_called_once_with([request_data['id']])
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self.assertEquals(0, self.context['session'].commit.call_count)
+        self.assertEquals(0, actions.stats.apply_deltas.call_count)
 
     @parameterized.expand([
         (test_data.close_request_data, False, None),
@@ -541,14 +1112,23 @@ class ActionsTest(unittest.TestCase):
         actions.datetime.datetime.now = MagicMock(return_value=current_time)
         datarequest = test_data._generate_basic_datarequest()
         datarequest.organization_id = organization_id
-        datarequest.accepted_dataset_id = None
-        actions.db.DataRequest.get.return_value = [datarequest]
+        datarequest.closed = True
+        datarequest.close_time = current_time
+        datarequest.last_activity_time = current_time
 
-        # Mock actions
-        default_pkg = {'pkg': 1}
-        default_org = {'org': 2}
-        default_user = {'user': 3}
-        test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
+        # The ID, name and title of the accepted dataset are stored with the data request
+        expected_values = {'accepted_dataset_id': None, 'accepted_dataset_name': None, 'accepted_dataset_title': None}
+        if expected_accepted_ds:
+            expected_values = {'accepted_dataset_id': 'dataset_id', 'accepted_dataset_name': 'uuid_v4_ds',
+                               'accepted_dataset_title': u'Dataset'}
+        for key, value in expected_values.iteritems():
+            setattr(datarequest, key, value)
+        actions.db.DataRequest.close.return_value = datarequest
+
+        # Mock actions. The accepted dataset is given by name
+        test_data._initialize_basic_actions(actions)
+        actions.resolver._query_packages.side_effect = None
+        actions.resolver._query_packages.return_value = [PackageRow('dataset_id', 'uuid_v4_ds', u'Dataset')]
 
         # Call the function
         expected_data_dict = data.copy()
@@ -557,20 +1137,484 @@ class ActionsTest(unittest.TestCase):
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CLOSE, self.context, expected_data_dict)
-        self.context['session'].add.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once_with()
+        self._check_change(constants.CHANGE_CLOSED, datarequest.id)
+        actions.stats.closed_deltas.assert_called_once_with(datarequest)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.closed_deltas.return_value,
+                                                           {datarequest.organization_id: current_time})
 
-        # The data object returned by the database has been modified appropriately
-        self.assertTrue(datarequest.closed)
-        self.assertEquals(datarequest.close_time, current_time)
+        # The data request is closed by a single statement (it is not loaded before). The
+        # returned dataset is built from the stored names, so it is only read once
         if expected_accepted_ds:
-            self.assertEquals(datarequest.accepted_dataset_id, data['accepted_dataset_id'])
+            actions.resolver._query_packages.assert_called_once_with(['uuid_v4_ds'])
         else:
-            self.assertIsNone(datarequest.accepted_dataset_id)
+            self.assertEquals(0, actions.resolver._query_packages.call_count)
+        actions.db.DataRequest.close.assert_called_once_with(data['id'], current_time, **expected_values)
+        self.assertEquals(0, actions.db.DataRequest.get.call_count)
+        self.assertEquals(0, actions.db.DataRequest.get_owners.call_count)
+
+        org = test_data._organization_dict(organization_id) if organization_id else None
+        pkg = {'id': 'dataset_id', 'name': 'uuid_v4_ds', 'title': u'Dataset', 'display_name': u'Dataset'}
+        self._check_basic_response(datarequest, result, test_data._user_dict(datarequest.user_id), org,
+                                   pkg if expected_accepted_ds else None)
+        if not expected_accepted_ds:
+            self.assertIsNone(result['accepted_dataset'])
+
+    @parameterized.expand([
+        ('active', True),
+        ('deleted', False)
+    ])
+    def test_datarequest_close_not_public_dataset(self, state, private):
+        datarequest = test_data._generate_basic_datarequest()
+        datarequest.closed = True
+        datarequest.accepted_dataset_id = 'dataset_id'
+        actions.db.DataRequest.close.return_value = datarequest
+
+        test_data._initialize_basic_actions(actions)
+        actions.resolver._query_packages.side_effect = None
+        actions.resolver._query_packages.return_value = [PackageRow('dataset_id', 'uuid_v4_ds', u'Dataset', state, private)]
+
+        # Call the function
+        result = actions.datarequest_close(self.context, test_data.close_request_data_accepted_ds)
+
+        # The ID of the dataset is stored, but not its name nor its title, and it is not returned
+        actions.db.DataRequest.close.assert_called_once_with(
+            test_data.close_request_data_accepted_ds['id'], actions.datetime.datetime.now.return_value,
+            accepted_dataset_id='dataset_id', accepted_dataset_name=None, accepted_dataset_title=None)
+        self.assertIsNone(result['accepted_dataset'])
+
+
+    ######################################################################
+    ################################ BULK ################################
+    ######################################################################
+
+    @parameterized.expand([
+        (actions.datarequest_bulk_create, {}),
+        (actions.datarequest_bulk_create, {'datarequests': []}),
+        (actions.datarequest_bulk_close,  {'datarequests': 'invalid'}),
+        (actions.datarequest_bulk_close,  {'datarequests': [{'id': 'id'}], 'chunk_size': -1}),
+        (actions.datarequest_bulk_delete, {'datarequests': [{'id': 'id'}], 'chunk_size': 'invalid'}),
+        (actions.datarequest_bulk_delete, {'datarequests': [{'id': 'id'}] * (constants.BULK_MAX_ITEMS + 1)})
+    ])
+    def test_datarequest_bulk_invalid_list(self, function, request_data):
+        with self.assertRaises(self._tk.ValidationError):
+            function(self.context, request_data)
+
+        self.assertEquals(0, actions.db.init_db.call_count)
+        self.assertEquals(0, actions.tk.check_access.call_count)
+        self.assertEquals(0, self.context['session'].commit.call_count)
+
+    @parameterized.expand([
+        (actions.datarequest_bulk_create, constants.DATAREQUEST_BULK_CREATE),
+        (actions.datarequest_bulk_close,  constants.DATAREQUEST_BULK_CLOSE),
+        (actions.datarequest_bulk_delete, constants.DATAREQUEST_BULK_DELETE)
+    ])
+    def test_datarequest_bulk_not_authorized(self, function, action):
+        request_data = {'datarequests': [{'id': 'id'}]}
+        self._test_not_authorized(function, action, request_data)
+        self.assertEquals(0, actions.db.DataRequest.get_by_ids.call_count)
+        self.assertEquals(0, self.context['session'].commit.call_count)
+
+    @parameterized.expand([
+        (0, 1),
+        (1, 3),
+        (2, 2)
+    ])
+    def test_datarequest_bulk_create(self, chunk_size, expected_commits):
+        # Configure the mocks
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+        actions.db.uuid4.side_effect = ['id1', 'id2', 'id3']
+        actions.db.DataRequest.side_effect = lambda: MagicMock()
+        actions.tk._ = lambda x: x
+
+        def _validate_datarequest(context, data_dict):
+            if data_dict['title'] == 'invalid':
+                raise self._tk.ValidationError({'Title': ['Title is not valid']})
+
+        actions.validator.validate_datarequest.side_effect = _validate_datarequest
+
+        request_data = {
+            'chunk_size': chunk_size,
+            'datarequests': [
+                {'title': 'Title 1', 'description': 'Description 1', 'organization_id': 'org'},
+                {'title': 'invalid'},
+                {'title': 'Title 2'},
+                {'title': 'title 1'},
+                {'title': 'Title 3'}
+            ]
+        }
+
+        # Call the function
+        result = actions.datarequest_bulk_create(self.context, request_data)
+
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_BULK_CREATE, self.context, request_data)
+        self.assertEquals(5, actions.validator.validate_datarequest.call_count)
+        actions.validator.validate_datarequest.assert_any_call(self.context, {'title': 'Title 2', 'description': '',
+                                                                             'organization_id': ''})
+
+        self.assertEquals([
+            {'success': True, 'id': 'id1', 'title': 'Title 1'},
+            {'success': False, 'error': {'Title': ['Title is not valid']}},
+            {'success': True, 'id': 'id2', 'title': 'Title 2'},
+            {'success': False, 'error': {'Title': ['That title is already in use']}},
+            {'success': True, 'id': 'id3', 'title': 'Title 3'}
+        ], result)
+
+        # Only valid data requests are stored
+        self.assertEquals(3, actions.db.DataRequest.call_count)
+        self.assertEquals(3, actions.db.Change.call_count)
+        self.assertEquals(3, actions.events.publish.call_count)
+        self.assertEquals(6, self.context['session'].add.call_count)
+        datarequest = self.context['session'].add.call_args_list[0][0][0]
+        self.assertEquals('Title 1', datarequest.title)
+        self.assertEquals('Description 1', datarequest.description)
+        self.assertEquals('org', datarequest.organization_id)
+        self.assertEquals(self.context['auth_user_obj'].id, datarequest.user_id)
+        self.assertEquals(current_time, datarequest.open_time)
+        self.assertEquals(3, actions.stats.apply_deltas.call_count)
+        self.assertEquals(expected_commits, self.context['session'].commit.call_count)
+
+    def _generate_bulk_datarequests(self):
+        open_datarequest = test_data._generate_basic_datarequest(id='open')
+        closed_datarequest = test_data._generate_basic_datarequest(id='closed', closed=True)
+        actions.db.DataRequest.get_by_ids.return_value = [open_datarequest, closed_datarequest]
+        actions.tk._ = lambda x: x
+
+        return open_datarequest, closed_datarequest
+
+    @parameterized.expand([
+        (0, 1),
+        (1, 1),
+    ])
+    def test_datarequest_bulk_close(self, chunk_size, expected_commits):
+        # Configure the mocks
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
+        open_datarequest, closed_datarequest = self._generate_bulk_datarequests()
+        closed_row = test_data._generate_basic_datarequest(id='open', closed=True)
+        actions.db.DataRequest.close.return_value = closed_row
+        actions.resolver._query_packages.return_value = [PackageRow('dataset_id', 'dataset', u'Dataset')]
+
+        request_data = {
+            'chunk_size': chunk_size,
+            'datarequests': [
+                {'id': 'open', 'accepted_dataset_id': 'dataset'},
+                {'id': 'closed'},
+                {'id': 'not_found'},
+                {'id': 'open'},
+                {}
+            ]
+        }
+
+        # Call the function
+        result = actions.datarequest_bulk_close(self.context, request_data)
+
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_BULK_CLOSE, self.context, request_data)
+        actions.db.DataRequest.get_by_ids.assert_called_once_with(['open', 'closed', 'not_found', 'open'])
+        actions.validator.validate_datarequest_closing.assert_called_once_with(self.context, request_data['datarequests'][0])
+
+        self.assertEquals({'success': True, 'id': 'open'}, result[0])
+        self.assertEquals({'success': False, 'error': {'Data Request': ['This Data Request is already closed']}}, result[1])
+        self.assertEquals({'success': False, 'error': {'Data Request': ['Data Request not_found not found in the data base']}}, result[2])
+        self.assertEquals({'success': False, 'error': {'Data Request': ['Data Request open is included more than once']}}, result[3])
+        self.assertEquals({'success': False, 'error': {'Data Request': ['Data Request ID has not been included']}}, result[4])
+
+        # Each data request is closed by a single conditional statement
+        actions.db.DataRequest.close.assert_called_once_with(
+            'open', current_time, accepted_dataset_id='dataset_id', accepted_dataset_name='dataset',
+            accepted_dataset_title=u'Dataset')
+        self.assertFalse(open_datarequest.closed)
+        self._check_change(constants.CHANGE_CLOSED, 'open')
+        actions.stats.closed_deltas.assert_called_once_with(closed_row)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.closed_deltas.return_value,
+                                                           {closed_row.organization_id: current_time})
+        self.assertEquals(expected_commits, self.context['session'].commit.call_count)
+        self.assertEquals(1, actions.events.publish.call_count)
+
+    def test_datarequest_bulk_close_closed_concurrently(self):
+        # The data request is closed by other request after being validated
+        self._generate_bulk_datarequests()
+        actions.db.DataRequest.close.return_value = None
+
+        # Call the function
+        result = actions.datarequest_bulk_close(self.context, {'datarequests': [{'id': 'open'}]})
+
+        # Assertions
+        self.assertEquals([{'success': False, 'error': {'Data Request': ['This Data Request is already closed']}}], result)
+        actions.db.DataRequest.close.assert_called_once_with('open', actions.datetime.datetime.now.return_value,
+                                                             accepted_dataset_id=None, accepted_dataset_name=None,
+                                                             accepted_dataset_title=None)
+        self.assertEquals(0, actions.stats.apply_deltas.call_count)
+        self.assertEquals(0, actions.db.Change.call_count)
+        self.assertEquals(0, actions.events.publish.call_count)
+
+    def test_datarequest_bulk_close_invalid_dataset(self):
+        open_datarequest, _ = self._generate_bulk_datarequests()
+        actions.validator.validate_datarequest_closing.side_effect = self._tk.ValidationError({'Accepted Dataset': ['Dataset not found']})
+
+        # Call the function
+        result = actions.datarequest_bulk_close(self.context, {'datarequests': [{'id': 'open', 'accepted_dataset_id': 'dataset'}]})
+
+        # Assertions
+        self.assertEquals([{'success': False, 'error': {'Accepted Dataset': ['Dataset not found']}}], result)
+        self.assertFalse(open_datarequest.closed)
+        self.assertEquals(0, actions.db.DataRequest.close.call_count)
+        self.assertEquals(0, self.context['session'].add.call_count)
+        self.assertEquals(0, self.context['session'].commit.call_count)
+        self.assertEquals(0, actions.events.publish.call_count)
+
+    def test_datarequest_bulk_delete(self):
+        # Configure the mocks
+        open_datarequest, closed_datarequest = self._generate_bulk_datarequests()
+        actions.db.DataRequest.delete_by_id.side_effect = {'open': open_datarequest, 'closed': closed_datarequest}.get
+
+        request_data = {
+            'chunk_size': 1,
+            'datarequests': [{'id': 'open'}, {'id': 'not_found'}, {'id': 'closed'}]
+        }
+
+        # Call the function
+        result = actions.datarequest_bulk_delete(self.context, request_data)
+
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_BULK_DELETE, self.context, request_data)
+        actions.db.DataRequest.get_by_ids.assert_called_once_with(['open', 'not_found', 'closed'])
+
+        self.assertEquals([
+            {'success': True, 'id': 'open'},
+            {'success': False, 'error': {'Data Request': ['Data Request not_found not found in the data base']}},
+            {'success': True, 'id': 'closed'}
+        ], result)
+
+        # Data requests are deleted with a single statement each, as in datarequest_delete
+        self.assertEquals([(('open',), {}), (('closed',), {})], actions.db.DataRequest.delete_by_id.call_args_list)
+        self.assertEquals(0, self.context['session'].delete.call_count)
+        self.assertEquals(2, actions.db.Change.call_count)
+        self.assertEquals(constants.CHANGE_DELETED, actions.db.Change.return_value.change_type)
+        self.assertEquals(2, actions.events.publish.call_count)
+        self.assertEquals([((open_datarequest, -1), {}), ((closed_datarequest, -1), {})],
+                          actions.stats.datarequest_deltas.call_args_list)
+        self.assertEquals(2, self.context['session'].commit.call_count)
+
+        # The comments of each data request are deleted too
+        self.assertEquals([((['open'],), {}), ((['closed'],), {})],
+                          actions.db.Comment.delete_by_datarequest_ids.call_args_list)
+
+    def test_datarequest_bulk_delete_deleted_concurrently(self):
+        # The data request is deleted by other request after being validated
+        self._generate_bulk_datarequests()
+        actions.db.DataRequest.delete_by_id.return_value = None
 
-        org = default_org if organization_id else None
-        pkg = default_pkg if expected_accepted_ds else None
-        self._check_basic_response(datarequest, result, default_user, org, pkg)
+        # Call the function
+        result = actions.datarequest_bulk_delete(self.context, {'datarequests': [{'id': 'open'}]})
+
+        # Assertions
+        self.assertEquals([{'success': False, 'error': {'Data Request': ['Data Request open not found in the data base']}}], result)
+        actions.db.DataRequest.delete_by_id.assert_called_once_with('open')
+        self.assertEquals(0, actions.db.Comment.delete_by_datarequest_ids.call_count)
+        self.assertEquals(0, actions.stats.apply_deltas.call_count)
+        self.assertEquals(0, actions.db.Change.call_count)
+        self.assertEquals(0, actions.events.publish.call_count)
+
+
+    ######################################################################
+    ############################### CHANGES ##############################
+    ######################################################################
+
+    def test_commit_order(self):
+        # Two transactions: the first one adds its change but it is commited
+        # after the second one has tried to add its own change
+        change_log_lock = threading.Lock()
+        ids = itertools.count(1)
+        commited = []
+        local = threading.local()
+        first_added = threading.Event()
+        second_started = threading.Event()
+
+        # The lock is held until the transaction is commited and the ID of
+        # the change is assigned when it is added to the session
+        actions.db.Change.lock.side_effect = change_log_lock.acquire
+
+        def _session(added=None):
+            session = MagicMock()
+
+            def _add(change):
+                local.change_id = next(ids)
+                if added:
+                    added.set()
+                    second_started.wait()
+                    time.sleep(0.05)
+
+            def _commit():
+                commited.append(local.change_id)
+                change_log_lock.release()
+
+            session.add.side_effect = _add
+            session.commit.side_effect = _commit
+            return session
+
+        def _first():
+            change = actions._log_change(MagicMock(), constants.CHANGE_CREATED, 'dr1', 'user')
+            actions._commit(_session(first_added), [change])
+
+        def _second():
+            change = actions._log_change(MagicMock(), constants.CHANGE_CREATED, 'dr2', 'user')
+            first_added.wait()
+            second_started.set()
+            actions._commit(_session(), [change])
+
+        threads = [threading.Thread(target=_first), threading.Thread(target=_second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        # Changes are commited in the same order as their IDs, so a consumer
+        # that has received the change 2 cannot miss the change 1
+        self.assertEquals([1, 2], commited)
+
+    def test_commit_lock(self):
+        session = self.context['session']
+        manager = MagicMock()
+        manager.attach_mock(session.flush, 'flush')
+        manager.attach_mock(actions.db.Change.lock, 'lock')
+        manager.attach_mock(session.add, 'add')
+        manager.attach_mock(session.commit, 'commit')
+        manager.attach_mock(actions.events.publish, 'publish')
+        change = actions._log_change(session, constants.CHANGE_CLOSED, 'dr', 'user')
+
+        actions._commit(session, [None, change])
+
+        # The lock is only taken once the rest of the transaction has been
+        # flushed, just before the change is added
+        self.assertEquals(['flush', 'lock', 'add', 'commit', 'publish'], [c[0] for c in manager.mock_calls])
+        manager.add.assert_called_once_with(change)
+
+    def test_commit_without_changes(self):
+        actions._commit(self.context['session'], [None])
+
+        self.assertEquals(0, actions.db.Change.lock.call_count)
+        self.context['session'].commit.assert_called_once_with()
+        self.assertEquals(0, actions.events.publish.call_count)
+
+    @parameterized.expand([
+        ({'cursor': -1},),
+        ({'cursor': 'invalid'},),
+        ({'limit': 0},),
+        ({'limit': constants.CHANGES_MAX_LIMIT + 1},),
+        ({'limit': 'invalid'},)
+    ])
+    def test_datarequest_changes_since_invalid(self, request_data):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_changes_since(self.context, request_data)
+
+        self.assertEquals(0, actions.tk.check_access.call_count)
+        self.assertEquals(0, actions.db.Change.get_since.call_count)
+
+    def test_datarequest_changes_since_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_changes_since(self.context, {})
+
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CHANGES_SINCE, self.context, {})
+        self.assertEquals(0, actions.db.Change.get_since.call_count)
+
+    def _generate_change(self, id):
+        return MagicMock(id=id, object_type=constants.CHANGE_OBJECT_COMMENT, object_id='comment_%d' % id,
+                         datarequest_id='dr', change_type=constants.CHANGE_UPDATED, user_id='user',
+                         time=datetime.datetime(2016, 1, 1))
+
+    @parameterized.expand([
+        ({},                           0,  constants.CHANGES_DEFAULT_LIMIT, [],           0,  False),
+        ({'cursor': 10},               10, constants.CHANGES_DEFAULT_LIMIT, [],           10, False),
+        ({'cursor': '10', 'limit': 2}, 10, 2,                               [11],         11, False),
+        ({'cursor': 10, 'limit': 2},   10, 2,                               [11, 12],     12, False),
+        ({'cursor': 10, 'limit': 2},   10, 2,                               [11, 12, 14], 12, True)
+    ])
+    def test_datarequest_changes_since(self, request_data, cursor, limit, ids, expected_cursor, expected_has_more):
+        actions.db.Change.get_since.return_value = [self._generate_change(i) for i in ids]
+
+        # Call the function
+        result = actions.datarequest_changes_since(self.context, request_data)
+
+        # Assertions
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_CHANGES_SINCE, self.context, request_data)
+        actions.db.Change.get_since.assert_called_once_with(cursor, limit + 1)
+
+        self.assertEquals(expected_cursor, result['cursor'])
+        self.assertEquals(expected_has_more, result['has_more'])
+        self.assertEquals(ids[:limit], [change['id'] for change in result['changes']])
+
+        if ids:
+            self.assertEquals({
+                'id': ids[0],
+                'object_type': constants.CHANGE_OBJECT_COMMENT,
+                'object_id': 'comment_%d' % ids[0],
+                'datarequest_id': 'dr',
+                'change_type': constants.CHANGE_UPDATED,
+                'user_id': 'user',
+                'time': '2016-01-01 00:00:00'
+            }, result['changes'][0])
+
+
+    ######################################################################
+    ################################ STATS ###############################
+    ######################################################################
+
+    @parameterized.expand([
+        ({'since': '2016-13-01'},),
+        ({'until': 'yesterday'},),
+        ({'period': 'year'},)
+    ])
+    def test_datarequest_stats_invalid(self, request_data):
+        actions.stats.parse_day = self._stats.parse_day
+
+        with self.assertRaises(self._tk.ValidationError):
+            actions.datarequest_stats(self.context, request_data)
+
+        self.assertEquals(0, actions.tk.check_access.call_count)
+        self.assertEquals(0, actions.stats.get_stats.call_count)
+
+    def test_datarequest_stats_not_authorized(self):
+        actions.tk.check_access.side_effect = self._tk.NotAuthorized
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.datarequest_stats(self.context, {})
+
+        self.assertEquals(0, actions.stats.get_stats.call_count)
+
+    @parameterized.expand([
+        ({}, None, None, None, None),
+        ({'organization_id': 'org-name', 'since': '2016-01-01', 'until': '2016-02-29', 'period': 'month'},
+         'org_id', datetime.date(2016, 1, 1), datetime.date(2016, 2, 29), 'month'),
+        ({'since': '', 'period': ''}, None, None, None, None)
+    ])
+    def test_datarequest_stats(self, request_data, organization_id, since, until, period):
+        actions.stats.parse_day = self._stats.parse_day
+        organization_show = actions.tk.get_action.return_value
+        organization_show.return_value = {'id': 'org_id'}
+
+        result = actions.datarequest_stats(self.context, request_data)
+
+        actions.db.init_db.assert_called_once_with(self.context['model'])
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_STATS, self.context, request_data)
+        actions.stats.get_stats.assert_called_once_with(organization_id, since, until, period)
+        self.assertEquals(actions.stats.get_stats.return_value, result)
+
+        # Organizations given by name are resolved
+        if organization_id:
+            organization_show.assert_called_once_with({'ignore_auth': True},
+                                                      dict(actions.resolver.ORGANIZATION_SHOW_PARAMS, id='org-name'))
+        else:
+            self.assertEquals(0, organization_show.call_count)
 
 
     ######################################################################
@@ -609,8 +1653,7 @@ class ActionsTest(unittest.TestCase):
         actions.datetime.datetime.now = MagicMock(return_value=current_time)
 
         # User
-        default_user = {'user': 'value'}
-        test_data._initialize_basic_actions(actions, default_user, None, None)
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
         result = actions.datarequest_comment(self.context, test_data.comment_request_data)
@@ -623,17 +1666,25 @@ class ActionsTest(unittest.TestCase):
         actions.validator.validate_comment.assert_called_once_with(self.context, test_data.comment_request_data)
         actions.db.Comment.assert_called_once()
 
-        self.context['session'].add.assert_called_once_with(comment)
+        self.context['session'].add.assert_any_call(comment)
         self.context['session'].commit.assert_called_once()
+        self._check_change(constants.CHANGE_CREATED, comment.datarequest_id, actions.db.uuid4.return_value)
+        actions.db.DataRequest.update_activity.assert_called_once_with(comment.datarequest_id, comment.time, 1)
+        organization_id = actions.db.DataRequest.update_activity.return_value
+        actions.stats.comment_deltas.assert_called_once_with(organization_id, comment.time)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.comment_deltas.return_value,
+                                                           {organization_id: comment.time})
 
         # Check the object stored in the database
+        self.assertEquals(actions.db.uuid4.return_value, comment.id)
         self.assertEquals(self.context['auth_user_obj'].id, comment.user_id)
         self.assertEquals(test_data.comment_request_data['comment'], comment.comment)
+        self.assertEquals(u'<p>%s</p>' % test_data.comment_request_data['comment'], comment.comment_html)
         self.assertEquals(test_data.comment_request_data['datarequest_id'], comment.datarequest_id)
         self.assertEquals(current_time, comment.time)
 
         # Check that the response is OK
-        self._check_comment(comment, result, default_user)
+        self._check_comment(comment, result, test_data._user_dict(comment.user_id))
 
 
     ######################################################################
@@ -655,14 +1706,13 @@ class ActionsTest(unittest.TestCase):
         actions.db.Comment.get.return_value = [comment]
 
         # User
-        default_user = {'user': 'value'}
-        test_data._initialize_basic_actions(actions, default_user, None, None)
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
         result = actions.datarequest_comment_show(self.context, test_data.comment_show_request_data)
 
         # Check that the response is OK
-        self._check_comment(comment, result, default_user)
+        self._check_comment(comment, result, test_data._user_dict(comment.user_id))
 
 
     ######################################################################
@@ -690,8 +1740,7 @@ class ActionsTest(unittest.TestCase):
         actions.db.Comment.get_ordered_by_date.return_value = comments
 
         # User
-        default_user = {'user': 'value'}
-        test_data._initialize_basic_actions(actions, default_user, None, None)
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
         params = test_data.comment_show_request_data.copy()
@@ -706,9 +1755,12 @@ class ActionsTest(unittest.TestCase):
         actions.db.Comment.get_ordered_by_date.assert_called_once_with(datarequest_id=test_data.comment_show_request_data['datarequest_id'],
                                                                        desc=desc)
 
+        # The commenters are read in a single query
+        actions.resolver._query_users.assert_called_once_with([comments[0].user_id])
+
         # Check that the response is OK
         for i in range(0, len(results)):
-            self._check_comment(comments[i], results[i], default_user)
+            self._check_comment(comments[i], results[i], test_data._user_dict(comments[i].user_id))
 
 
     ######################################################################
@@ -724,7 +1776,7 @@ class ActionsTest(unittest.TestCase):
 
     def test_comment_update_not_found(self):
         self._test_comment_not_found(actions.datarequest_comment_update, constants.DATAREQUEST_COMMENT_UPDATE,
-                                     test_data.comment_update_request_data)
+                                     test_data.comment_update_request_data, actions.db.Comment.update_by_id)
 
     def test_comment_update_invalid(self):
         # The same function as the one used to check invalid content when
@@ -732,37 +1784,48 @@ class ActionsTest(unittest.TestCase):
         self.test_comment_invalid(actions.datarequest_comment_update, constants.DATAREQUEST_COMMENT_UPDATE,
                                   test_data.comment_update_request_data)
 
-    def test_comment_update(self):
-        # Configure the mock
-        comment = test_data._generate_basic_comment(id=test_data.comment_update_request_data['id'])
-        actions.db.Comment.get.return_value = [comment]
+    @parameterized.expand([
+        (None,),
+        (True,),
+        (False,)
+    ])
+    def test_comment_update(self, include_related):
+        # Configure the mock (the updated row is returned by the data base)
+        request_data = test_data.comment_update_request_data.copy()
+        comment = test_data._generate_basic_comment(id=request_data['id'], comment=request_data['comment'],
+                                                    datarequest_id=request_data['datarequest_id'])
+        actions.db.Comment.update_by_id.return_value = comment
+        current_time = self._datetime.datetime.now()
+        actions.datetime.datetime.now = MagicMock(return_value=current_time)
 
-        # Mock actions
-        default_user = {'user': 'value'}
-        test_data._initialize_basic_actions(actions, default_user, None, None)
+        if include_related is not None:
+            request_data['include_related'] = include_related
 
-        # Store previous user (needed to check that it has not been modified)
-        previous_user_id = comment.user_id
+        # Mock actions
+        test_data._initialize_basic_actions(actions)
 
         # Call the action
-        result = actions.datarequest_comment_update(self.context, test_data.comment_update_request_data)
+        result = actions.datarequest_comment_update(self.context, request_data)
 
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
-        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_COMMENT_UPDATE, self.context, test_data.comment_update_request_data)
-        actions.db.Comment.get.assert_called_once_with(id=test_data.comment_update_request_data['id'])
-        actions.validator.validate_comment.assert_called_once_with(self.context, test_data.comment_update_request_data)
+        actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_COMMENT_UPDATE, self.context, request_data)
+        actions.validator.validate_comment.assert_called_once_with(self.context, request_data)
 
-        self.context['session'].add.assert_called_once_with(comment)
+        # The comment is updated with a single statement (it is not loaded before)
+        self.assertEquals(0, actions.db.Comment.get.call_count)
+        actions.db.Comment.update_by_id.assert_called_once_with(
+            request_data['id'], comment=request_data['comment'], datarequest_id=request_data['datarequest_id'],
+            comment_html=actions.helpers.render_markdown(request_data['comment']))
         self.context['session'].commit.assert_called_once()
+        self._check_change(constants.CHANGE_UPDATED, comment.datarequest_id, comment.id)
+        actions.db.DataRequest.update_activity.assert_called_once_with(comment.datarequest_id, current_time)
+        actions.stats.apply_deltas.assert_called_once_with(
+            {}, {actions.db.DataRequest.update_activity.return_value: current_time})
 
-        # Check the object stored in the database
-        self.assertEquals(previous_user_id, comment.user_id)
-        self.assertEquals(test_data.comment_update_request_data['datarequest_id'], comment.datarequest_id)
-        self.assertEquals(test_data.comment_update_request_data['comment'], comment.comment)
-
-        # Check the result
-        self._check_comment(comment, result, default_user)
+        # Check the result (the user is included by default)
+        user = None if include_related is False else test_data._user_dict(comment.user_id)
+        self._check_comment(comment, result, user)
 
 
     ######################################################################
@@ -776,24 +1839,42 @@ class ActionsTest(unittest.TestCase):
         self._test_no_id(actions.datarequest_comment_delete)
 
     def test_comment_delete_not_found(self):
-        self._test_comment_not_found(actions.datarequest_comment_delete, constants.DATAREQUEST_COMMENT_DELETE, test_data.comment_delete_request_data)
+        self._test_comment_not_found(actions.datarequest_comment_delete, constants.DATAREQUEST_COMMENT_DELETE,
+                                     test_data.comment_delete_request_data, actions.db.Comment.delete_by_id)
 
-    def test_comment_delete(self):
-        # Configure the mock
+    @parameterized.expand([
+        (None,),
+        (True,),
+        (False,)
+    ])
+    def test_comment_delete(self, include_related):
+        # Configure the mock (the deleted row is returned by the data base)
         comment = test_data._generate_basic_comment(id=test_data.comment_update_request_data['id'])
-        actions.db.Comment.get.return_value = [comment]
+        actions.db.Comment.delete_by_id.return_value = comment
+        request_data = test_data.comment_delete_request_data.copy()
 
-        default_user = {'user': 'value'}
-        test_data._initialize_basic_actions(actions, default_user, None, None)
+        if include_related is not None:
+            request_data['include_related'] = include_related
+
+        test_data._initialize_basic_actions(actions)
 
         # Call the function
-        expected_data_dict = test_data.comment_delete_request_data.copy()
-        result = actions.datarequest_comment_delete(self.context, test_data.comment_delete_request_data)
+        expected_data_dict = request_data.copy()
+        result = actions.datarequest_comment_delete(self.context, request_data)
 
         # Assertions
         actions.db.init_db.assert_called_once_with(self.context['model'])
         actions.tk.check_access.assert_called_once_with(constants.DATAREQUEST_COMMENT_DELETE, self.context, expected_data_dict)
-        self.context['session'].delete.assert_called_once_with(comment)
+        actions.db.Comment.delete_by_id.assert_called_once_with(request_data['id'])
+        self.assertEquals(0, actions.db.Comment.get.call_count)
+        self.assertEquals(0, self.context['session'].delete.call_count)
         self.context['session'].commit.assert_called_once_with()
-
-        self._check_comment(comment, result, default_user)
+        self._check_change(constants.CHANGE_DELETED, comment.datarequest_id, comment.id)
+        actions.db.DataRequest.update_activity.assert_called_once_with(comment.datarequest_id, comments_delta=-1)
+        actions.stats.comment_deltas.assert_called_once_with(actions.db.DataRequest.update_activity.return_value,
+                                                             comment.time, -1)
+        actions.stats.apply_deltas.assert_called_once_with(actions.stats.comment_deltas.return_value)
+
+        # The user is not retrieved by default
+        user = test_data._user_dict(comment.user_id) if include_related else None
+        self._check_comment(comment, result, user)
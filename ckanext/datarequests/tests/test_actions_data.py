@@ -19,13 +19,20 @@
 
 import copy
 import datetime
+import hashlib
 
+from collections import namedtuple
 from mock import MagicMock
 
 COMMENT_ID = 'comment_uuid4'
 DATAREQUEST_ID = 'example_uuidv4'
 FREE_TEXT = 'free-text'
 
+UserRow = namedtuple('UserRow', ['id', 'name', 'fullname', 'email'])
+OrganizationRow = namedtuple('OrganizationRow', ['id', 'name', 'title', 'state'])
+PackageRow = namedtuple('PackageRow', ['id', 'name', 'title', 'state', 'private'])
+PackageRow.__new__.__defaults__ = ('active', False)
+
 ######################################################################
 ############################## FUNCTIONS #############################
 ######################################################################
@@ -36,11 +43,15 @@ def dictice_ddbb_response(datarequest):
         'user_id': datarequest.user_id,
         'title': datarequest.title,
         'description': datarequest.description,
+        'description_html': datarequest.description_html,
+        'excerpt': datarequest.excerpt,
         'organization_id': datarequest.organization_id,
         'open_time': str(datarequest.open_time),
         'accepted_dataset_id': datarequest.accepted_dataset_id,
         'close_time': str(datarequest.close_time) if datarequest.close_time else datarequest.close_time,
-        'closed': datarequest.closed
+        'closed': datarequest.closed,
+        'last_activity_time': str(datarequest.last_activity_time) if datarequest.last_activity_time else None,
+        'comments_count': datarequest.comments_count
     }
 
 
@@ -89,12 +100,21 @@ def _generate_basic_datarequest(id=DATAREQUEST_ID, user_id='example_uuidv4_user'
     datarequest.user_id = user_id
     datarequest.title = title
     datarequest.description = description
+    datarequest.description_html = '<p>%s</p>' % description
+    datarequest.excerpt = description
     datarequest.organization_id = organization_id
     datarequest.open_time = datetime.datetime.now()
     datarequest.closed = closed
     datarequest.close_time = None
     datarequest.accepted_dataset_id = None
     datarequest.accepted_dataset = {'test': 'test1', 'test2': 'test3'}
+    # Names are not stored by default (the related objects are retrieved)
+    datarequest.organization_name = None
+    datarequest.organization_title = None
+    datarequest.accepted_dataset_name = None
+    datarequest.accepted_dataset_title = None
+    datarequest.last_activity_time = datarequest.open_time
+    datarequest.comments_count = 3
 
     return datarequest
 
@@ -105,16 +125,44 @@ def _generate_basic_comment(id=COMMENT_ID, user_id='example_uuidv4_user',
     comment.id = id
     comment.user_id = user_id
     comment.comment = comment
+    comment.comment_html = '<p>%s</p>' % comment
     comment.datarequest_id = datarequest_id
     comment.time = datetime.datetime.now()
 
     return comment
 
 
-def _initialize_basic_actions(actions, default_user, default_org, default_pkg):
-    _package_show = MagicMock(return_value=default_pkg)
-    _organization_show = MagicMock(return_value=default_org)
-    _user_show = MagicMock(return_value=default_user)
+def _user_dict(user_id):
+    return {
+        'id': user_id,
+        'name': '%s_name' % user_id,
+        'display_name': 'Example User',
+        'email_hash': hashlib.md5('user@example.com').hexdigest()
+    }
+
+
+def _organization_dict(organization_id):
+    return {
+        'id': organization_id,
+        'name': '%s_name' % organization_id,
+        'title': u'Example Organization',
+        'display_name': u'Example Organization'
+    }
+
+
+def _package_dict(package_id):
+    return {
+        'id': package_id,
+        'name': '%s_name' % package_id,
+        'title': u'Example Dataset',
+        'display_name': u'Example Dataset'
+    }
+
+
+def _initialize_basic_actions(actions):
+    _package_show = MagicMock()
+    _organization_show = MagicMock()
+    _user_show = MagicMock(return_value=_user_dict(user_default_id))
 
     def _get_action(action):
         if action == 'package_show':
@@ -127,6 +175,17 @@ def _initialize_basic_actions(actions, default_user, default_org, default_pkg):
     # Mock actions
     actions.tk.get_action.side_effect = _get_action
 
+    # Mock the users table
+    actions.resolver._query_users.side_effect = lambda user_ids: [
+        UserRow(user_id, '%s_name' % user_id, 'Example User', ' User@Example.com') for user_id in user_ids]
+
+    # Mock the organizations and packages tables
+    actions.resolver._query_organizations.side_effect = lambda organization_ids: [
+        OrganizationRow(organization_id, '%s_name' % organization_id, u'Example Organization', 'active')
+        for organization_id in organization_ids]
+    actions.resolver._query_packages.side_effect = lambda package_ids: [
+        PackageRow(package_id, '%s_name' % package_id, u'Example Dataset') for package_id in package_ids]
+
 
 ######################################################################
 ######################### DATA FOR BASIC TESTS #######################
@@ -293,31 +352,31 @@ expected_result_3['result'] = expected_result_3['result'][default_offset:default
 datarequest_index_test_case_1 = {
     'organization_show_func': _organization_show,
     'content': {},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
 
 datarequest_index_test_case_2 = {
     'organization_show_func': _organization_show,
-    'content': {'organization_id': 'fiware'},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False},
+    'content': {'q': FREE_TEXT, 'organization_id': 'fiware'},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
 
 datarequest_index_test_case_3 = {
     'organization_show_func': _organization_show,
-    'content': {'closed': True},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False},
+    'content': {'q': FREE_TEXT, 'closed': True},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
 
 datarequest_index_test_case_4 = {
     'organization_show_func': _organization_show,
-    'content': {'organization_id': 'fiware', 'closed': True},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': None, 'closed': True, 'desc': False},
+    'content': {'q': FREE_TEXT, 'organization_id': 'fiware', 'closed': True},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': None, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
@@ -325,31 +384,31 @@ datarequest_index_test_case_4 = {
 datarequest_index_test_case_5 = {
     'organization_show_func': _organization_show,
     'content': {},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_2
 }
 
 datarequest_index_test_case_6 = {
     'organization_show_func': _organization_show,
-    'content': {'organization_id': 'fiware'},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False},
+    'content': {'q': FREE_TEXT, 'organization_id': 'fiware'},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_2
 }
 
 datarequest_index_test_case_7 = {
     'organization_show_func': _organization_show,
-    'content': {'closed': True},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False},
+    'content': {'q': FREE_TEXT, 'closed': True},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_2
 }
 
 datarequest_index_test_case_8 = {
     'organization_show_func': _organization_show,
-    'content': {'organization_id': 'fiware', 'closed': True},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': None, 'closed': True, 'desc': False},
+    'content': {'q': FREE_TEXT, 'organization_id': 'fiware', 'closed': True},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': None, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_2
 }
@@ -357,23 +416,23 @@ datarequest_index_test_case_8 = {
 datarequest_index_test_case_9 = {
     'organization_show_func': _organization_show,
     'content': {'offset': default_offset, 'limit': default_limit},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_3
 }
 
 datarequest_index_test_case_10 = {
     'organization_show_func': _organization_show,
-    'content': {'organization_id': 'fiware', 'offset': default_offset, 'limit': default_limit},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False},
+    'content': {'q': FREE_TEXT, 'organization_id': 'fiware', 'offset': default_offset, 'limit': default_limit},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_3
 }
 
 datarequest_index_test_case_11 = {
     'organization_show_func': _organization_show,
-    'content': {'closed': True, 'offset': default_offset, 'limit': default_limit},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False},
+    'content': {'q': FREE_TEXT, 'closed': True, 'offset': default_offset, 'limit': default_limit},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_3
 }
@@ -381,7 +440,7 @@ datarequest_index_test_case_11 = {
 datarequest_index_test_case_12 = {
     'organization_show_func': _organization_show,
     'content': {'organization_id': 'fiware', 'user_id': 'ckan', 'closed': True, 'offset': default_offset, 'limit': default_limit},
-    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': user_default_id, 'closed': True, 'desc': False},
+    'expected_ddbb_params': {'q': None, 'organization_id': organization_default_id, 'user_id': user_default_id, 'closed': True, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_3
 }
@@ -389,7 +448,7 @@ datarequest_index_test_case_12 = {
 datarequest_index_test_case_13 = {
     'organization_show_func': _organization_show,
     'content': {'q': FREE_TEXT},
-    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
@@ -397,7 +456,7 @@ datarequest_index_test_case_13 = {
 datarequest_index_test_case_14 = {
     'organization_show_func': _organization_show,
     'content': {'sort': 'desc'},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': True},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': True, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
@@ -405,7 +464,7 @@ datarequest_index_test_case_14 = {
 datarequest_index_test_case_15 = {
     'organization_show_func': _organization_show,
     'content': {'sort': 'asc'},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
@@ -413,8 +472,8 @@ datarequest_index_test_case_15 = {
 
 datarequest_index_test_case_16 = {
     'organization_show_func': _organization_show,
-    'content': {'closed': False},
-    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': False, 'desc': False},
+    'content': {'q': FREE_TEXT, 'closed': False},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': None, 'user_id': None, 'closed': False, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_1,
     'expected_response': expected_result_1
 }
@@ -422,7 +481,39 @@ datarequest_index_test_case_16 = {
 datarequest_index_test_case_17 = {
     'organization_show_func': _organization_show,
     'content': {'q': FREE_TEXT, 'organization_id': 'fiware', 'user_id': 'ckan', 'closed': False, 'offset': default_offset, 'limit': default_limit},
-    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': user_default_id, 'closed': False, 'desc': False},
+    'expected_ddbb_params': {'q': FREE_TEXT, 'organization_id': organization_default_id, 'user_id': user_default_id, 'closed': False, 'desc': False, 'order_by': 'open_time'},
     'ddbb_response': ddbb_response_2,
     'expected_response': expected_result_3
 }
+
+datarequest_index_test_case_18 = {
+    'organization_show_func': _organization_show,
+    'content': {'sort': 'most_commented'},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': True, 'order_by': 'comments_count'},
+    'ddbb_response': ddbb_response_1,
+    'expected_response': expected_result_1
+}
+
+datarequest_index_test_case_19 = {
+    'organization_show_func': _organization_show,
+    'content': {'sort': 'recently_active'},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': True, 'order_by': 'last_activity_time'},
+    'ddbb_response': ddbb_response_1,
+    'expected_response': expected_result_1
+}
+
+datarequest_index_test_case_20 = {
+    'organization_show_func': _organization_show,
+    'content': {'sort': 'recently_closed'},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': True, 'order_by': 'close_time'},
+    'ddbb_response': ddbb_response_1,
+    'expected_response': expected_result_1
+}
+
+datarequest_index_test_case_21 = {
+    'organization_show_func': _organization_show,
+    'content': {'sort': 'invalid'},
+    'expected_ddbb_params': {'q': None, 'organization_id': None, 'user_id': None, 'closed': None, 'desc': False, 'order_by': 'open_time'},
+    'ddbb_response': ddbb_response_1,
+    'expected_response': expected_result_1
+}
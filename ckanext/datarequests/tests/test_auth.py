@@ -52,8 +52,12 @@ class AuthTest(unittest.TestCase):
         self._tk = auth.tk
         auth.tk = MagicMock()
 
+        self._db = auth.db
+        auth.db = MagicMock()
+
     def tearDown(self):
         auth.tk = self._tk
+        auth.db = self._db
 
     @parameterized.expand([
         # Data Requests
@@ -65,10 +69,22 @@ class AuthTest(unittest.TestCase):
         (auth.datarequest_show,   context, None),
         (auth.datarequest_show,   None,    request_data_dr),
         (auth.datarequest_show,   context, request_data_dr),
+        (auth.datarequest_show_many, None,    None),
+        (auth.datarequest_show_many, context, {'ids': ['id1', 'id2']}),
+        (auth.datarequest_list_for_dataset, None,    None),
+        (auth.datarequest_list_for_dataset, context, {'package_id': 'pkg_id'}),
         (auth.datarequest_index,  None,    None),
         (auth.datarequest_index,  context, None),
         (auth.datarequest_index,  None,    request_data_dr),
         (auth.datarequest_index,  context, request_data_dr),
+        (auth.datarequest_bulk_create, None,    None),
+        (auth.datarequest_bulk_create, context, {'datarequests': [request_data_dr]}),
+        # Changes
+        (auth.datarequest_changes_since,  None,    None),
+        (auth.datarequest_changes_since,  context, None),
+        # Statistics
+        (auth.datarequest_stats,          None,    None),
+        (auth.datarequest_stats,          context, None),
         # Comments
         (auth.datarequest_comment,        None,    None),
         (auth.datarequest_comment,        context, None),
@@ -85,20 +101,6 @@ class AuthTest(unittest.TestCase):
         self.assertTrue(function(context, request_data).get('success', False))
 
     @parameterized.expand([
-        # Data Requests
-        (auth.datarequest_update, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, True, True),
-        (auth.datarequest_update, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, False, True),
-        (auth.datarequest_update, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, True, False),
-        (auth.datarequest_update, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, False, False),
-        (auth.datarequest_delete, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, True, True),
-        (auth.datarequest_delete, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, False, True),
-        (auth.datarequest_delete, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, True, False),
-        (auth.datarequest_delete, constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, False, False),
-        (auth.datarequest_close,  constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, True, True),
-        (auth.datarequest_close,  constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'user_id'}, False, True),
-        (auth.datarequest_close,  constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, True, False),
-        (auth.datarequest_close,  constants.DATAREQUEST_SHOW,                 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, False, False),
-        # Comments
         (auth.datarequest_comment_update, constants.DATAREQUEST_COMMENT_SHOW, 'user_id', {'id': 'id', 'user_id': 'user_id'}, True, True),
         (auth.datarequest_comment_update, constants.DATAREQUEST_COMMENT_SHOW, 'user_id', {'id': 'id', 'user_id': 'user_id'}, False, True),
         (auth.datarequest_comment_update, constants.DATAREQUEST_COMMENT_SHOW, 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, True, False),
@@ -109,7 +111,7 @@ class AuthTest(unittest.TestCase):
         (auth.datarequest_comment_delete, constants.DATAREQUEST_COMMENT_SHOW, 'user_id', {'id': 'id', 'user_id': 'other_user_id'}, False, False),
 
     ])
-    def test_datarequest_update_delete(self, function, show_function, user_id, request_data, action_called, expected_result):
+    def test_comment_update_delete(self, function, show_function, user_id, request_data, action_called, expected_result):
 
         user_obj = MagicMock()
         user_obj.id = user_id
@@ -132,3 +134,86 @@ class AuthTest(unittest.TestCase):
             xyz_show.assert_called_once_with({'ignore_auth': True}, {'id': request_data['id']})
         else:
             self.assertEquals(0, auth.tk.get_action.call_count)
+
+    @parameterized.expand([
+        (auth.datarequest_update, {'id': 'id', 'user_id': 'user_id'},       {},                      True),
+        (auth.datarequest_update, {'id': 'id', 'user_id': 'other_user_id'}, {},                      False),
+        (auth.datarequest_update, {'id': 'id'},                             {'id': 'user_id'},       True),
+        (auth.datarequest_update, {'id': 'id'},                             {'id': 'other_user_id'}, False),
+        (auth.datarequest_delete, {'id': 'id', 'user_id': 'user_id'},       {},                      True),
+        (auth.datarequest_delete, {'id': 'id', 'user_id': 'other_user_id'}, {},                      False),
+        (auth.datarequest_delete, {'id': 'id'},                             {'id': 'user_id'},       True),
+        (auth.datarequest_delete, {'id': 'id'},                             {'id': 'other_user_id'}, False),
+        (auth.datarequest_close, {'id': 'id', 'user_id': 'user_id'},       {},                      True),
+        (auth.datarequest_close, {'id': 'id', 'user_id': 'other_user_id'}, {},                      False),
+        (auth.datarequest_close, {'id': 'id'},                             {'id': 'user_id'},       True),
+        (auth.datarequest_close, {'id': 'id'},                             {'id': 'other_user_id'}, False),
+    ])
+    def test_datarequest_update_delete_close(self, function, request_data, owners, expected_result):
+
+        user_obj = MagicMock()
+        user_obj.id = 'user_id'
+
+        context = {'auth_user_obj': user_obj, 'model': MagicMock()}
+        auth.db.DataRequest.get_owners.return_value = owners
+
+        result = function(context, request_data).get('success')
+        self.assertEquals(expected_result, result)
+
+        # Only the creator is read, the data request is not shown
+        if 'user_id' in request_data:
+            self.assertEquals(0, auth.db.DataRequest.get_owners.call_count)
+        else:
+            auth.db.init_db.assert_called_once_with(context['model'])
+            auth.db.DataRequest.get_owners.assert_called_once_with(['id'])
+        self.assertEquals(0, auth.tk.get_action.call_count)
+
+    @parameterized.expand([
+        (auth.datarequest_update, ),
+        (auth.datarequest_delete, ),
+        (auth.datarequest_close, ),
+    ])
+    def test_datarequest_update_delete_close_not_found(self, function):
+        auth.tk.ObjectNotFound = self._tk.ObjectNotFound
+        auth.db.DataRequest.get_owners.return_value = {}
+        context = {'auth_user_obj': MagicMock(), 'model': MagicMock()}
+
+        with self.assertRaises(self._tk.ObjectNotFound):
+            function(context, {'id': 'id'})
+
+        auth.db.DataRequest.get_owners.assert_called_once_with(['id'])
+
+    @parameterized.expand([
+        (auth.datarequest_bulk_close,  {'id1': 'user_id', 'id2': 'user_id'},       True),
+        (auth.datarequest_bulk_close,  {'id1': 'user_id', 'id2': 'other_user_id'}, False),
+        (auth.datarequest_bulk_close,  {},                                         False),
+        (auth.datarequest_bulk_delete, {'id1': 'user_id', 'id2': 'user_id'},       True),
+        (auth.datarequest_bulk_delete, {'id1': 'user_id', 'id2': 'other_user_id'}, False),
+        (auth.datarequest_bulk_delete, {},                                         False),
+    ])
+    def test_datarequest_bulk_close_delete(self, function, owners, expected_result):
+
+        user_obj = MagicMock()
+        user_obj.id = 'user_id'
+
+        context = {'auth_user_obj': user_obj, 'model': MagicMock()}
+        auth.db.DataRequest.get_owners.return_value = owners
+
+        request_data = {'datarequests': [{'id': 'id1'}, {'id': 'id2'}, 'invalid']}
+        result = function(context, request_data).get('success')
+        self.assertEquals(expected_result, result)
+
+        # Creators are retrieved at once
+        auth.db.init_db.assert_called_once_with(context['model'])
+        auth.db.DataRequest.get_owners.assert_called_once_with(['id1', 'id2'])
+        self.assertEquals(0, auth.tk.get_action.call_count)
+
+    def test_datarequest_export(self):
+        # Only sysadmins can export the data requests
+        context = {'auth_user_obj': MagicMock(), 'model': MagicMock()}
+        self.assertFalse(auth.datarequest_export(context, {}).get('success'))
+
+    def test_datarequest_metrics(self):
+        # Only sysadmins can read the metrics
+        context = {'auth_user_obj': MagicMock(), 'model': MagicMock()}
+        self.assertFalse(auth.datarequest_metrics(context, {}).get('success'))
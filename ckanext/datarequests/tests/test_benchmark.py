@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.benchmark as benchmark
+import ckanext.datarequests.constants as constants
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = benchmark.model
+        benchmark.model = MagicMock()
+        benchmark.model.User.get.return_value = None
+        benchmark.model.Group.get.return_value = None
+
+        self._db = benchmark.db
+        benchmark.db = MagicMock()
+
+        self._stats = benchmark.stats
+        benchmark.stats = MagicMock()
+
+        self._tk = benchmark.tk
+        benchmark.tk = MagicMock()
+        benchmark.tk.ObjectNotFound = self._tk.ObjectNotFound
+
+        self._helpers = benchmark.helpers
+        benchmark.helpers = MagicMock()
+
+    def tearDown(self):
+        benchmark.model = self._model
+        benchmark.db = self._db
+        benchmark.stats = self._stats
+        benchmark.tk = self._tk
+        benchmark.helpers = self._helpers
+
+    @parameterized.expand([
+        ([1.0], 50, 1.0),
+        ([1.0, 2.0, 3.0, 4.0], 50, 2.0),
+        (range(1, 101), 95, 95)
+    ])
+    def test_percentile(self, values, percentile, expected_value):
+        self.assertEquals(expected_value, benchmark._percentile(values, percentile))
+
+    def test_seed(self):
+        datarequests, comments = benchmark.seed(25, users=3, organizations=2, max_comments=50,
+                                                batch_size=10, seed_value=1)
+
+        rows = [row for call in benchmark.db.DataRequest.insert_many.call_args_list for row in call[0][0]]
+        comment_rows = [row for call in benchmark.db.Comment.insert_many.call_args_list for row in call[0][0]]
+
+        # Data requests are stored in batches with a commit per batch
+        self.assertEquals(25, datarequests)
+        self.assertEquals(3, benchmark.db.DataRequest.insert_many.call_count)
+        self.assertEquals(25, len(rows))
+        self.assertEquals(len(comment_rows), comments)
+        self.assertEquals(comments, sum(row['comments_count'] for row in rows))
+        self.assertTrue(all(row['comments_count'] <= 50 for row in rows))
+        self.assertEquals(25, len(set(row['title'] for row in rows)))
+        self.assertTrue(all(row['title'].startswith(benchmark.PREFIX) for row in rows))
+
+        # Users and organizations are created once
+        self.assertEquals(3, benchmark.model.User.call_count)
+        self.assertEquals(2, benchmark.model.Group.call_count)
+
+        # The names of the organizations are stored with the data requests
+        for row in rows:
+            organization = benchmark.model.Group.return_value if row['organization_id'] else None
+            self.assertEquals(organization.name if organization else None, row['organization_name'])
+            self.assertEquals(organization.title if organization else None, row['organization_title'])
+
+        # Activity includes the comments and the closing of the data requests
+        for row in rows:
+            self.assertEquals(row['closed'], row['close_time'] is not None)
+            times = [row['open_time'], row['close_time']] + [c['time'] for c in comment_rows
+                                                              if c['datarequest_id'] == row['id']]
+            self.assertEquals(max(t for t in times if t), row['last_activity_time'])
+
+        benchmark.stats.rebuild.assert_called_once_with()
+
+    def test_seed_repeatable(self):
+        benchmark.seed(5, users=2, organizations=1, seed_value=7)
+        first = [(r['description'], r['comments_count']) for r in benchmark.db.DataRequest.insert_many.call_args[0][0]]
+        benchmark.seed(5, users=2, organizations=1, seed_value=7)
+        second = [(r['description'], r['comments_count']) for r in benchmark.db.DataRequest.insert_many.call_args[0][0]]
+
+        self.assertEquals(first, second)
+
+    def test_clean(self):
+        query = benchmark.model.Session.query.return_value.filter.return_value
+        query.delete.return_value = 4
+
+        self.assertEquals(4, benchmark.clean())
+        benchmark.model.Session.commit.assert_called_once_with()
+        benchmark.stats.rebuild.assert_called_once_with()
+
+    def test_run_without_data(self):
+        benchmark.model.Session.query.return_value.autoflush.return_value.filter.return_value.count.return_value = 0
+
+        with self.assertRaises(benchmark.tk.ObjectNotFound):
+            benchmark.run()
+
+    def test_run(self):
+        query = benchmark.model.Session.query.return_value.autoflush.return_value.filter.return_value
+        query.count.return_value = 100
+        datarequest = query.order_by.return_value.first.return_value
+        datarequest.comments_count = 8
+        benchmark.model.User.get.return_value = MagicMock()
+        benchmark.model.Group.get.return_value = MagicMock()
+
+        result = benchmark.run(repeat=3, warmup=1)
+
+        expected_cases = ['badge', 'comment_list', 'duplicate_check', 'index', 'index_closed', 'index_deep_page',
+                          'index_most_commented', 'index_organization', 'index_q', 'index_user', 'show']
+        self.assertEquals(expected_cases, sorted(result['results'].keys()))
+        self.assertEquals(100, result['datarequests'])
+        self.assertEquals(3, result['repeat'])
+        for times in result['results'].values():
+            self.assertEquals(['max', 'mean', 'median', 'min', 'p95'], sorted(times.keys()))
+            self.assertTrue(times['min'] <= times['median'] <= times['max'])
+
+        # Each case is called once to warm up and then measured
+        self.assertEquals(4, benchmark.helpers.get_open_datarequests_number.call_count)
+        self.assertEquals(4, benchmark.db.DataRequest.datarequest_exists.call_count)
+        benchmark.tk.get_action.assert_any_call(constants.DATAREQUEST_COMMENT_LIST)
+        action = benchmark.tk.get_action.return_value
+        self.assertEquals(4 * 9, action.call_count)
+        action.assert_any_call({'model': benchmark.model, 'session': benchmark.model.Session,
+                                'user': benchmark.model.User.get.return_value.name, 'ignore_auth': True},
+                               {'offset': 90, 'limit': constants.DATAREQUESTS_PER_PAGE})
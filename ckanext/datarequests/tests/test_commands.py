@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.commands as commands
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+from nose_parameterized import parameterized
+
+
+class CommandsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = commands.model
+        commands.model = MagicMock()
+
+        self._db = commands.db
+        commands.db = MagicMock()
+
+        self._helpers = commands.helpers
+        commands.helpers = MagicMock()
+
+        self._exporter = commands.exporter
+        commands.exporter = MagicMock()
+
+        self._sys = commands.sys
+        commands.sys = MagicMock()
+
+        self._importer = commands.importer
+        commands.importer = MagicMock()
+
+        self._events = commands.events
+        commands.events = MagicMock()
+
+        self._notifications = commands.notifications
+        commands.notifications = MagicMock()
+
+        self._stats = commands.stats
+        commands.stats = MagicMock()
+
+        self._benchmark = commands.benchmark
+        commands.benchmark = MagicMock()
+
+        self._resolver = commands.resolver
+        commands.resolver = MagicMock()
+        commands.helpers.render_markdown.side_effect = lambda text: u'<p>%s</p>' % text
+        commands.helpers.render_excerpt.side_effect = lambda text: unicode(text)
+
+        self.command = commands.DataRequestsCommand('datarequests')
+        self.command.options = MagicMock()
+
+    def tearDown(self):
+        commands.model = self._model
+        commands.db = self._db
+        commands.helpers = self._helpers
+        commands.exporter = self._exporter
+        commands.sys = self._sys
+        commands.importer = self._importer
+        commands.events = self._events
+        commands.notifications = self._notifications
+        commands.stats = self._stats
+        commands.benchmark = self._benchmark
+        commands.resolver = self._resolver
+
+    def test_load_config_routes_mapper(self):
+        _routes = commands.routes
+        _config = commands.config
+        commands.routes = MagicMock()
+        commands.config = {'routes.map': MagicMock()}
+
+        try:
+            with patch.object(commands.tk.CkanCommand, '_load_config') as load_config:
+                self.command._load_config()
+
+            # The mapper is given to routes, so internal links can be rendered by url_for
+            load_config.assert_called_once_with()
+            self.assertEquals(commands.config['routes.map'], commands.routes.request_config.return_value.mapper)
+        finally:
+            commands.routes = _routes
+            commands.config = _config
+
+    def test_upgrade(self):
+        # Call the function
+        self.command.upgrade()
+
+        commands.db.upgrade_db.assert_called_once_with(commands.model)
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_backfill(self, process_all):
+        rendered_datarequest = MagicMock(description='rendered', description_html=u'<p>old</p>', excerpt=u'old')
+        pending_datarequest = MagicMock(description='pending', description_html=None, excerpt=None)
+        pending_excerpt = MagicMock(description='excerpt', description_html=u'<p>excerpt</p>', excerpt=None)
+        pending_comment = MagicMock(comment='comment', comment_html=None)
+
+        commands.db.DataRequest.iterate_by_id.return_value = [[rendered_datarequest], [pending_datarequest,
+                                                                                         pending_excerpt]]
+        commands.db.Comment.iterate_by_id.return_value = [[pending_comment]]
+        self.command.options.all = process_all
+        self.command._backfill_activity = MagicMock(return_value=0)
+        self.command._backfill_related_names = MagicMock(return_value=0)
+
+        # Call the function
+        self.command.backfill()
+
+        # Rendered rows are only processed again when --all is given
+        expected_html = u'<p>rendered</p>' if process_all else u'<p>old</p>'
+        self.assertEquals(expected_html, rendered_datarequest.description_html)
+        self.assertEquals(u'<p>pending</p>', pending_datarequest.description_html)
+        self.assertEquals(u'pending', pending_datarequest.excerpt)
+        self.assertEquals(u'excerpt', pending_excerpt.excerpt)
+        self.assertEquals(u'<p>excerpt</p>', pending_excerpt.description_html)
+        self.assertEquals(u'<p>comment</p>', pending_comment.comment_html)
+
+        commands.db.DataRequest.iterate_by_id.assert_called_once_with(commands.BATCH_SIZE)
+        commands.db.Comment.iterate_by_id.assert_called_once_with(commands.BATCH_SIZE)
+        self.assertEquals(4 if process_all else 3, commands.model.Session.add.call_count)
+        # One commit per batch
+        self.assertEquals(3, commands.model.Session.commit.call_count)
+        self.command._backfill_activity.assert_called_once_with()
+        self.command._backfill_related_names.assert_called_once_with()
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_backfill_activity(self, process_all):
+        open_time = datetime.datetime(2016, 1, 1)
+        comment_time = datetime.datetime(2016, 1, 5)
+        close_time = datetime.datetime(2016, 1, 10)
+
+        updated = MagicMock(id='updated', open_time=open_time, close_time=None,
+                            comments_count=7, last_activity_time=open_time)
+        commented = MagicMock(id='commented', open_time=open_time, close_time=None,
+                              comments_count=None, last_activity_time=None)
+        closed = MagicMock(id='closed', open_time=open_time, close_time=close_time,
+                           comments_count=None, last_activity_time=None)
+
+        commands.db.DataRequest.iterate_by_id.return_value = [[updated, commented], [closed]]
+        commands.db.Comment.get_activity.return_value = {'updated': (1, comment_time),
+                                                         'commented': (2, comment_time),
+                                                         'closed': (1, comment_time)}
+        self.command.options.all = process_all
+
+        # Call the function
+        result = self.command._backfill_activity()
+
+        # The activity of each batch is retrieved with one query
+        self.assertEquals(3 if process_all else 2, result)
+        self.assertEquals([(['updated', 'commented'] if process_all else ['commented'],), (['closed'],)],
+                          [call[0] for call in commands.db.Comment.get_activity.call_args_list])
+
+        self.assertEquals((1, comment_time) if process_all else (7, open_time),
+                          (updated.comments_count, updated.last_activity_time))
+        self.assertEquals((2, comment_time), (commented.comments_count, commented.last_activity_time))
+        self.assertEquals((1, close_time), (closed.comments_count, closed.last_activity_time))
+        self.assertEquals(2, commands.model.Session.commit.call_count)
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    def test_backfill_related_names(self, process_all):
+        stored = MagicMock(organization_id='org_id', organization_name=u'old', organization_title=u'Old',
+                           accepted_dataset_id=None, accepted_dataset_name=None, accepted_dataset_title=None)
+        pending = MagicMock(organization_id='org_id', organization_name=None, organization_title=None,
+                            accepted_dataset_id='pkg_id', accepted_dataset_name=None, accepted_dataset_title=None)
+        missing = MagicMock(organization_id='missing_id', organization_name=None, organization_title=None,
+                            accepted_dataset_id=None, accepted_dataset_name=None, accepted_dataset_title=None)
+
+        commands.db.DataRequest.iterate_by_id.return_value = [[stored, pending], [missing]]
+        commands.resolver.get_organizations.return_value = {
+            'org_id': {'id': 'org_id', 'name': u'org', 'display_name': u'Org'}}
+        commands.resolver.get_packages.return_value = {
+            'pkg_id': {'id': 'pkg_id', 'name': u'pkg', 'display_name': u'Pkg'}}
+        self.command.options.all = process_all
+
+        # Call the function
+        result = self.command._backfill_related_names()
+
+        # The organizations and datasets of each batch are retrieved at once
+        self.assertEquals(3 if process_all else 2, result)
+        self.assertEquals(set(['org_id']), commands.resolver.get_organizations.call_args_list[0][0][0])
+        self.assertEquals(set(['pkg_id']), commands.resolver.get_packages.call_args_list[0][0][0])
+        self.assertEquals(2, commands.resolver.get_organizations.call_count)
+
+        expected_stored = (u'org', u'Org') if process_all else (u'old', u'Old')
+        self.assertEquals(expected_stored, (stored.organization_name, stored.organization_title))
+        self.assertEquals((u'org', u'Org', u'pkg', u'Pkg'), (pending.organization_name, pending.organization_title,
+                                                              pending.accepted_dataset_name,
+                                                              pending.accepted_dataset_title))
+        # Organizations that do not exist are left empty (they are retrieved when shown)
+        self.assertEquals((None, None), (missing.organization_name, missing.organization_title))
+        self.assertEquals(2, commands.model.Session.commit.call_count)
+
+    @parameterized.expand([
+        ('jsonl', False, False),
+        ('csv',   True,  True)
+    ])
+    def test_export_stdout(self, file_format, include_comments, include_names):
+        commands.exporter.export_datarequests.return_value = iter(['chunk1', 'chunk2'])
+        self.command.options.output = None
+        self.command.options.format = file_format
+        self.command.options.comments = include_comments
+        self.command.options.names = include_names
+
+        # Call the function
+        self.command.export()
+
+        commands.exporter.export_datarequests.assert_called_once_with(file_format, include_comments, include_names)
+        self.assertEquals(2, commands.sys.stdout.write.call_count)
+        commands.sys.stdout.write.assert_any_call('chunk1')
+        commands.sys.stdout.write.assert_any_call('chunk2')
+        self.assertEquals(0, commands.sys.stdout.close.call_count)
+
+    def test_export_file(self):
+        commands.exporter.export_datarequests.return_value = iter(['chunk1'])
+        output_path = os.path.join(self._create_temp_dir(), 'export.jsonl')
+        self.command.options.output = output_path
+
+        # Call the function
+        self.command.export()
+
+        with open(output_path) as f:
+            self.assertEquals('chunk1', f.read())
+
+    def _create_temp_dir(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        return temp_dir
+
+    @parameterized.expand([
+        (None,),
+        ('',),
+        ('5',)
+    ])
+    def test_import(self, checkpoint_content):
+        temp_dir = self._create_temp_dir()
+        input_path = os.path.join(temp_dir, 'import.jsonl')
+        with open(input_path, 'w') as f:
+            f.write('line1\nline2\n')
+
+        checkpoint_path = os.path.join(temp_dir, 'checkpoint')
+        if checkpoint_content is not None:
+            with open(checkpoint_path, 'w') as f:
+                f.write(checkpoint_content)
+
+        datarequests_importer = commands.importer.DataRequestsImporter.return_value
+        datarequests_importer.import_lines.side_effect = lambda lines, start_line, checkpoint: checkpoint(7)
+        self.command.options.checkpoint = checkpoint_path
+
+        # Call the function
+        self.command.import_file(input_path)
+
+        # Assertions
+        expected_start_line = int(checkpoint_content) if checkpoint_content else 0
+        args = datarequests_importer.import_lines.call_args[0]
+        self.assertEquals(expected_start_line, args[1])
+        self.assertEquals(self.command._write_checkpoint, args[2])
+
+        with open(checkpoint_path) as f:
+            self.assertEquals('7', f.read())
+
+    def test_import_without_checkpoint(self):
+        input_path = os.path.join(self._create_temp_dir(), 'import.jsonl')
+        with open(input_path, 'w') as f:
+            f.write('line1\n')
+
+        self.command.options.checkpoint = None
+
+        # Call the function
+        self.command.import_file(input_path)
+
+        datarequests_importer = commands.importer.DataRequestsImporter.return_value
+        args = datarequests_importer.import_lines.call_args[0]
+        self.assertEquals(0, args[1])
+        self.assertIsNone(args[2])
+
+    def test_replay_dead_letters(self):
+        commands.events.replay_dead_letters.return_value = (3, 1)
+
+        # Call the function
+        self.command.replay_dead_letters()
+
+        commands.events.replay_dead_letters.assert_called_once_with()
+
+    def test_send_notifications(self):
+        commands.notifications.send_digests.return_value = 2
+
+        # Call the function
+        self.command.send_notifications()
+
+        commands.notifications.send_digests.assert_called_once_with()
+
+    def test_rebuild_stats(self):
+        commands.stats.rebuild.return_value = 10
+
+        # Call the function
+        self.command.rebuild_stats()
+
+        commands.stats.rebuild.assert_called_once_with()
+
+    @parameterized.expand([
+        ([0],                                         0),
+        ([commands.BATCH_SIZE, 3],                    commands.BATCH_SIZE + 3),
+        ([commands.BATCH_SIZE, commands.BATCH_SIZE, 0], 2 * commands.BATCH_SIZE)
+    ])
+    def test_vacuum_comments(self, batches, expected_removed):
+        commands.db.Comment.delete_orphans.side_effect = batches
+
+        # Call the function
+        self.command.vacuum_comments()
+
+        # Orphans are removed in batches until a batch is not full (each one in its own transaction)
+        self.assertEquals([((commands.BATCH_SIZE,), {})] * len(batches),
+                          commands.db.Comment.delete_orphans.call_args_list)
+        self.assertEquals(len(batches), commands.model.Session.commit.call_count)
+
+    def test_benchmark_seed(self):
+        commands.benchmark.seed.return_value = (10, 25)
+        self.command.options.datarequests = 10
+        self.command.options.seed = 3
+
+        # Call the function
+        self.command.benchmark_seed()
+
+        commands.benchmark.seed.assert_called_once_with(10, seed_value=3)
+
+    def test_benchmark(self):
+        commands.benchmark.run.return_value = {'results': {'show': {'median': 1.5}}}
+        output_path = os.path.join(self._create_temp_dir(), 'benchmark.json')
+        self.command.options.output = output_path
+        self.command.options.repeat = 5
+
+        # Call the function
+        self.command.benchmark()
+
+        commands.benchmark.run.assert_called_once_with(5)
+        with open(output_path) as f:
+            self.assertEquals({'results': {'show': {'median': 1.5}}}, json.load(f))
+
+    def test_benchmark_clean(self):
+        commands.benchmark.clean.return_value = 10
+
+        # Call the function
+        self.command.benchmark_clean()
+
+        commands.benchmark.clean.assert_called_once_with()
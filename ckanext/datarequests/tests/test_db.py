@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import unittest
 import ckanext.datarequests.db as db
 
@@ -33,6 +34,11 @@ class DBTest(unittest.TestCase):
         # Restart databse initial status
         db.DataRequest = None
         db.Comment = None
+        db.Change = None
+        db.DeadLetter = None
+        db.Notification = None
+        db.Stat = None
+        db.OrganizationSummary = None
 
         # Create mocks
         self._sa = db.sa
@@ -44,12 +50,21 @@ class DBTest(unittest.TestCase):
         self._or_ = db.or_
         db.or_ = MagicMock()
 
+        self._and_ = db.and_
+        db.and_ = MagicMock()
+
     def tearDown(self):
         db.Comment = None
         db.DataRequest = None
+        db.Change = None
+        db.DeadLetter = None
+        db.Notification = None
+        db.Stat = None
+        db.OrganizationSummary = None
         db.sa = self._sa
         db.func = self._func
         db.or_ = self._or_
+        db.and_ = self._and_
 
     def _test_get(self, table):
         '''
@@ -84,7 +99,7 @@ class DBTest(unittest.TestCase):
         self.assertEquals(db_response, result)
         final_query.filter_by.assert_called_once_with(**params)
 
-    def _test_get_ordered_by_date(self, table, time_column, params):
+    def _test_get_ordered_by_date(self, table, time_column, params, nullslast=False):
 
         db_response = [MagicMock(), MagicMock(), MagicMock()]
 
@@ -128,12 +143,18 @@ class DBTest(unittest.TestCase):
         if 'desc' in expected_filter_by_params:
             expected_filter_by_params.pop('desc')
 
+        if 'order_by' in expected_filter_by_params:
+            expected_filter_by_params.pop('order_by')
+
         query = '%{0}%'.format(params['q']) if 'q' in params else None
         desc = True if 'desc' in params and params['desc'] is True else False
 
         # Assertions
         self.assertEquals(db_response, result)
-        order = time_column_value.desc() if desc else time_column_value.asc()
+        if desc:
+            order = time_column_value.desc.return_value.nullslast() if nullslast else time_column_value.desc()
+        else:
+            order = time_column_value.asc()
         no_ordered.order_by.assert_called_once_with(order)
         final_query.filter_by.assert_called_once_with(**expected_filter_by_params)
 
@@ -150,21 +171,37 @@ class DBTest(unittest.TestCase):
 
         table_data_request = MagicMock()
         table_comment = MagicMock()
+        table_change = MagicMock()
+        table_dead_letter = MagicMock()
+        table_notification = MagicMock()
+        table_stat = MagicMock()
+        table_summary = MagicMock()
 
-        db.sa.Table = MagicMock(side_effect=[table_data_request, table_comment])
+        db.sa.Table = MagicMock(side_effect=[table_data_request, table_comment, table_change,
+                                             table_dead_letter, table_notification, table_stat, table_summary])
 
         # Call the function
         model = MagicMock()
         db.init_db(model)
 
         # Assert that table method has been called
-        self.assertEquals(2, db.sa.Table.call_count)
+        self.assertEquals(7, db.sa.Table.call_count)
         model.meta.mapper.assert_any_call(db.DataRequest, table_data_request)
         model.meta.mapper.assert_any_call(db.Comment, table_comment)
+        model.meta.mapper.assert_any_call(db.Change, table_change)
+        model.meta.mapper.assert_any_call(db.DeadLetter, table_dead_letter)
+        model.meta.mapper.assert_any_call(db.Notification, table_notification)
+        model.meta.mapper.assert_any_call(db.Stat, table_stat)
+        model.meta.mapper.assert_any_call(db.OrganizationSummary, table_summary)
 
     def test_initdb_initialized(self):
         db.DataRequest = MagicMock()
         db.Comment = MagicMock()
+        db.Change = MagicMock()
+        db.DeadLetter = MagicMock()
+        db.Notification = MagicMock()
+        db.Stat = MagicMock()
+        db.OrganizationSummary = MagicMock()
 
         # Call the function
         model = MagicMock()
@@ -174,9 +211,441 @@ class DBTest(unittest.TestCase):
         self.assertEquals(0, db.sa.Table.call_count)
         self.assertEquals(0, model.meta.mapper.call_count)
 
+    def _init_upgrade(self):
+        existing_column = MagicMock()
+        existing_column.name = 'id'
+        new_column = MagicMock()
+        new_column.name = 'new_column'
+        new_column.type.compile.return_value = 'TEXT'
+
+        existing_index = MagicMock()
+        existing_index.name = 'existing_idx'
+        new_index = MagicMock()
+        new_index.name = 'new_idx'
+
+        table = MagicMock()
+        table.name = 'datarequests'
+        table.columns = [existing_column, new_column]
+        table.indexes = set([existing_index, new_index])
+
+        db.sa.inspect.return_value.get_columns.return_value = [{'name': 'id'}]
+        db.sa.inspect.return_value.get_indexes.return_value = [{'name': 'existing_idx'}]
+
+        return table, new_column, existing_index, new_index
+
+    def test_upgrade_table(self):
+        table, new_column, existing_index, new_index = self._init_upgrade()
+
+        # Call the function
+        engine = MagicMock()
+        db._upgrade_table(engine, table)
+
+        # Only the missing column is added
+        db.sa.inspect.assert_called_once_with(engine)
+        db.sa.inspect.return_value.get_columns.assert_called_once_with('datarequests')
+        new_column.type.compile.assert_called_once_with(dialect=engine.dialect)
+        engine.execute.assert_called_once_with('ALTER TABLE "datarequests" ADD COLUMN "new_column" TEXT')
+
+        # Only the missing index is created
+        db.sa.inspect.return_value.get_indexes.assert_called_once_with('datarequests')
+        self.assertEquals(0, existing_index.create.call_count)
+        new_index.create.assert_called_once_with(engine)
+
+    def test_upgrade_table_concurrent(self):
+        table, new_column, existing_index, new_index = self._init_upgrade()
+
+        # The column and the index have been added by other process since the table was inspected
+        engine = MagicMock()
+        engine.execute.side_effect = db.ProgrammingError('ALTER TABLE', {}, MagicMock(pgcode='42701'))
+        new_index.create.side_effect = db.ProgrammingError('CREATE INDEX', {}, MagicMock(pgcode='42P07'))
+
+        # Call the function. Errors are ignored
+        db._upgrade_table(engine, table)
+
+        self.assertEquals(1, engine.execute.call_count)
+        new_index.create.assert_called_once_with(engine)
+
+    def test_upgrade_table_error(self):
+        table, new_column, existing_index, new_index = self._init_upgrade()
+
+        # Other errors are not ignored
+        engine = MagicMock()
+        engine.execute.side_effect = db.ProgrammingError('ALTER TABLE', {}, MagicMock(pgcode='42501'))
+
+        with self.assertRaises(db.ProgrammingError):
+            db._upgrade_table(engine, table)
+
+        self.assertEquals(0, new_index.create.call_count)
+
+    def test_upgrade_db(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        model.meta.metadata.tables = dict(zip(db.TABLES, tables))
+        connection = model.meta.engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.scalar.return_value = 0
+        upgrade_table = db._upgrade_table
+        db._upgrade_table = mock_upgrade_table = MagicMock()
+
+        try:
+            db.upgrade_db(model)
+        finally:
+            db._upgrade_table = upgrade_table
+
+        # Tables are only upgraded by the upgrade command, not when they are mapped
+        self.assertEquals(7, model.meta.mapper.call_count)
+        self.assertEquals([(model.meta.engine, table) for table in tables],
+                          [call[0] for call in mock_upgrade_table.call_args_list])
+
+        # Empty summaries are filled in their own transaction, not in the session
+        insert = tables[6].insert.return_value.from_select.return_value
+        connection.execute.assert_any_call(tables[6].delete.return_value)
+        connection.execute.assert_called_with(insert)
+        self.assertEquals(0, model.Session.execute.call_count)
+        self.assertEquals(0, model.Session.commit.call_count)
+
+    def test_upgrade_db_summaries_filled(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        model.meta.metadata.tables = dict(zip(db.TABLES, tables))
+        connection = model.meta.engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.scalar.return_value = 3
+        db.sa.inspect.return_value.get_columns.return_value = []
+        db.sa.inspect.return_value.get_indexes.return_value = []
+
+        db.upgrade_db(model)
+
+        # Existing summaries are not computed again
+        self.assertEquals(0, tables[6].insert.return_value.from_select.call_count)
+        self.assertEquals(1, connection.execute.call_count)
+
+    def test_initdb_mapper_error(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        model.meta.mapper.side_effect = Exception('Mapper error')
+
+        with self.assertRaises(Exception):
+            db.init_db(model)
+
+        # The class is not set until it has been mapped, so the next call sets the table up again
+        self.assertIsNone(db.DataRequest)
+        model.meta.metadata.remove.assert_called_once_with(tables[0])
+
+    def _test_iterate_by_id(self, table, initial_id=u''):
+        first_batch = [MagicMock(id='a'), MagicMock(id='b')]
+        second_batch = [MagicMock(id='c')]
+
+        limited_query = MagicMock()
+        limited_query.all.side_effect = [first_batch, second_batch, []]
+
+        final_query = MagicMock()
+        final_query.filter.return_value.order_by.return_value.limit.return_value = limited_query
+
+        query = MagicMock()
+        query.autoflush = MagicMock(return_value=final_query)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        # Init the database
+        db.init_db(model)
+        table = getattr(db, table)
+        table.id = MagicMock()
+
+        # Call the method
+        result = list(table.iterate_by_id(2))
+
+        # Assertions
+        self.assertEquals([first_batch, second_batch], result)
+        table.id.__gt__.assert_any_call(initial_id)
+        table.id.__gt__.assert_any_call('b')
+        table.id.__gt__.assert_any_call('c')
+        final_query.filter.return_value.order_by.return_value.limit.assert_called_with(2)
+
+    def test_datarequest_iterate_by_id(self):
+        self._test_iterate_by_id('DataRequest')
+
+    def test_comment_iterate_by_id(self):
+        self._test_iterate_by_id('Comment')
+
+    def test_dead_letter_iterate_by_id(self):
+        self._test_iterate_by_id('DeadLetter', 0)
+
     def test_datarequest_get(self):
         self._test_get('DataRequest')
 
+    def _init_db_in_query(self, db_response):
+        query_result = MagicMock()
+        query_result.all.return_value = db_response
+
+        final_query = MagicMock()
+        final_query.filter.return_value = query_result
+
+        query = MagicMock()
+        query.autoflush = MagicMock(return_value=final_query)
+
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query = MagicMock(return_value=query)
+
+        # Init the database
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.user_id = MagicMock()
+
+        return model, final_query
+
+    def test_datarequest_get_by_ids(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query(db_response)
+
+        # Call the method
+        ids = ['id1', 'id2']
+        result = db.DataRequest.get_by_ids(ids)
+
+        # Assertions
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.DataRequest)
+        db.DataRequest.id.in_.assert_called_once_with(ids)
+        final_query.filter.assert_called_once_with(db.DataRequest.id.in_.return_value)
+
+    def test_datarequest_get_by_ids_columns(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query(db_response)
+
+        # Call the method
+        result = db.DataRequest.get_by_ids(['id1', 'id2'], columns=['id', 'user_id'])
+
+        # Only the given columns are loaded
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.user_id)
+
+    def test_datarequest_get_by_accepted_dataset(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query([])
+        db.DataRequest.accepted_dataset_id = MagicMock()
+        db.DataRequest.close_time = MagicMock()
+        final_query.filter.return_value.order_by.return_value.all.return_value = db_response
+
+        # Call the method
+        ids = ['pkg_id', 'pkg_name']
+        result = db.DataRequest.get_by_accepted_dataset(ids, columns=['id', 'close_time'])
+
+        # The most recently closed data requests are returned first
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.close_time)
+        db.DataRequest.accepted_dataset_id.in_.assert_called_once_with(ids)
+        final_query.filter.assert_called_once_with(db.DataRequest.accepted_dataset_id.in_.return_value)
+        final_query.filter.return_value.order_by.assert_called_once_with(
+            db.DataRequest.close_time.desc.return_value.nullslast.return_value)
+
+    @parameterized.expand([
+        ('DataRequest',),
+        ('Comment',)
+    ])
+    def test_get_existing_ids(self, table):
+        model, final_query = self._init_db_in_query([('id1',)])
+        getattr(db, table).id = MagicMock()
+
+        # Call the method
+        result = getattr(db, table).get_existing_ids(set(['id1', 'id2']))
+
+        # Assertions
+        self.assertEquals(set(['id1']), result)
+        getattr(db, table).id.in_.assert_called_once_with(set(['id1', 'id2']))
+        self.assertEquals(set(), getattr(db, table).get_existing_ids(set()))
+        self.assertEquals(1, model.Session.query.call_count)
+
+    def test_change_lock(self):
+        model, _ = self._init_db_in_query([])
+
+        db.Change.lock()
+
+        # The advisory lock is released when the transaction ends
+        db.func.pg_advisory_xact_lock.assert_called_once_with(db.constants.CHANGES_LOCK_KEY)
+        db.sa.select.assert_called_once_with([db.func.pg_advisory_xact_lock.return_value])
+        model.Session.execute.assert_called_once_with(db.sa.select.return_value)
+
+    def test_datarequest_get_owners(self):
+        model, final_query = self._init_db_in_query([('id1', 'user1'), ('id2', 'user2')])
+
+        # Call the method
+        ids = ['id1', 'id2']
+        result = db.DataRequest.get_owners(ids)
+
+        # Assertions
+        self.assertEquals({'id1': 'user1', 'id2': 'user2'}, result)
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.user_id)
+        db.DataRequest.id.in_.assert_called_once_with(ids)
+
+    def test_datarequest_stream(self):
+        model, final_query = self._init_db_in_query([])
+        db.DataRequest.open_time = MagicMock()
+
+        # Call the method
+        result = db.DataRequest.stream(100)
+
+        # Assertions
+        ordered_query = final_query.order_by.return_value
+        final_query.order_by.assert_called_once_with(db.DataRequest.open_time.asc.return_value,
+                                                     db.DataRequest.id.asc.return_value)
+        ordered_query.execution_options.assert_called_once_with(stream_results=True)
+        ordered_query.execution_options.return_value.yield_per.assert_called_once_with(100)
+        self.assertEquals(ordered_query.execution_options.return_value.yield_per.return_value, result)
+
+    def test_comment_get_by_datarequest_ids(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query([])
+        db.Comment.datarequest_id = MagicMock()
+        db.Comment.time = MagicMock()
+        final_query.filter.return_value.order_by.return_value.all.return_value = db_response
+
+        # Call the method
+        ids = ['id1', 'id2']
+        result = db.Comment.get_by_datarequest_ids(ids)
+
+        # Assertions
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.Comment)
+        db.Comment.datarequest_id.in_.assert_called_once_with(ids)
+        final_query.filter.return_value.order_by.assert_called_once_with(db.Comment.time.asc.return_value)
+
+    def test_comment_get_by_datarequest_ids_empty(self):
+        model, _ = self._init_db_in_query([])
+
+        self.assertEquals([], db.Comment.get_by_datarequest_ids([]))
+        self.assertEquals(0, model.Session.query.call_count)
+
+    def test_comment_get_commenters(self):
+        model, final_query = self._init_db_in_query([])
+        db.Comment.user_id = MagicMock()
+        distinct_query = final_query.distinct.return_value
+        distinct_query.filter_by.return_value.all.return_value = [('user1',), ('user2',)]
+
+        result = db.Comment.get_commenters('dr_id')
+
+        self.assertEquals(['user1', 'user2'], result)
+        model.Session.query.assert_called_once_with(db.Comment.user_id)
+        distinct_query.filter_by.assert_called_once_with(datarequest_id='dr_id')
+
+    def test_notification_get_due_recipients(self):
+        model, final_query = self._init_db_in_query([])
+        db.Notification.recipient_id = MagicMock()
+        db.Notification.time = MagicMock()
+        grouped_query = final_query.group_by.return_value
+        grouped_query.having.return_value.all.return_value = [('user1',), ('user2',)]
+        db.func.min.return_value.__le__ = MagicMock(return_value='condition')
+
+        result = db.Notification.get_due_recipients('cutoff')
+
+        self.assertEquals(['user1', 'user2'], result)
+        model.Session.query.assert_called_once_with(db.Notification.recipient_id)
+        final_query.group_by.assert_called_once_with(db.Notification.recipient_id)
+        db.func.min.assert_called_once_with(db.Notification.time)
+        grouped_query.having.assert_called_once_with('condition')
+        db.func.min.return_value.__le__.assert_called_once_with('cutoff')
+
+    def test_notification_get_by_recipient(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query([])
+        db.Notification.id = MagicMock()
+        final_query.filter_by.return_value.order_by.return_value.all.return_value = db_response
+
+        result = db.Notification.get_by_recipient('user1')
+
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.Notification)
+        final_query.filter_by.assert_called_once_with(recipient_id='user1')
+        final_query.filter_by.return_value.order_by.assert_called_once_with(db.Notification.id.asc.return_value)
+
+    @parameterized.expand([
+        ([],),
+        ([1, 2],)
+    ])
+    def test_notification_delete_by_ids(self, ids):
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.Notification.id = MagicMock()
+
+        db.Notification.delete_by_ids(ids)
+
+        if ids:
+            db.Notification.id.in_.assert_called_once_with(ids)
+            query = model.Session.query.return_value.filter
+            query.assert_called_once_with(db.Notification.id.in_.return_value)
+            query.return_value.delete.assert_called_once_with(synchronize_session=False)
+        else:
+            self.assertEquals(0, model.Session.query.call_count)
+
+    def test_datarequest_get_lowercase_titles(self):
+        model, final_query = self._init_db_in_query([])
+        final_query.all.return_value = [(u'title 1',), (u'title 2',)]
+        db.DataRequest.title = MagicMock()
+
+        result = db.DataRequest.get_lowercase_titles()
+
+        self.assertEquals(set([u'title 1', u'title 2']), result)
+        db.func.lower.assert_called_once_with(db.DataRequest.title)
+        model.Session.query.assert_called_once_with(db.func.lower.return_value)
+
+    @parameterized.expand([
+        ('DataRequest', 0),
+        ('Comment',     1),
+        ('Change',      2),
+        ('DeadLetter',  3),
+        ('Notification', 4),
+        ('Stat',         5)
+    ])
+    def test_insert_many(self, table, table_index):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        expected_table = tables[table_index]
+
+        rows = [{'id': 'id1'}, {'id': 'id2'}]
+        getattr(db, table).insert_many(rows)
+
+        expected_table.insert.return_value.values.assert_called_once_with(rows)
+        model.Session.execute.assert_called_once_with(expected_table.insert.return_value.values.return_value)
+
+    @parameterized.expand([
+        ('DataRequest',),
+        ('Comment',),
+        ('Change',),
+        ('DeadLetter',),
+        ('Notification',),
+        ('Stat',)
+    ])
+    def test_insert_many_empty(self, table):
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+
+        getattr(db, table).insert_many([])
+
+        self.assertEquals(0, model.Session.execute.call_count)
+
+    @parameterized.expand([
+        ('get_by_ids', []),
+        ('get_owners', {})
+    ])
+    def test_datarequest_get_by_ids_empty(self, method, expected_result):
+        model, _ = self._init_db_in_query([])
+
+        result = getattr(db.DataRequest, method)([])
+
+        self.assertEquals(expected_result, result)
+        self.assertEquals(0, model.Session.query.call_count)
+
     @parameterized.expand([
         (None, False),
         (1,    True)
@@ -226,6 +695,23 @@ class DBTest(unittest.TestCase):
         # equalization of these results must be True
         final_query.filter.assert_called_once_with(expected_result)
 
+    def test_datarequest_exist_excluding_datarequest(self):
+        query = MagicMock()
+        model = MagicMock()
+        model.DomainObject = object
+        model.Session.query.return_value.autoflush.return_value = query
+        db.init_db(model)
+        db.DataRequest.title = 'TITLE'
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.id.__ne__ = MagicMock(return_value='exclude_condition')
+
+        result = db.DataRequest.datarequest_exists('title', 'dr_id')
+
+        # The data request being updated is not taken into account
+        db.DataRequest.id.__ne__.assert_called_once_with('dr_id')
+        query.filter.return_value.filter.assert_called_once_with('exclude_condition')
+        self.assertTrue(result)
+
     @parameterized.expand([
         ({'organization_id': EXAMPLE_UUID},),
         ({'user_id': EXAMPLE_UUID},),
@@ -236,7 +722,466 @@ class DBTest(unittest.TestCase):
         ({'q': 'free-text'},)
     ])
     def test_datarequest_get_ordered_by_date(self, params):
-        self._test_get_ordered_by_date('DataRequest', 'open_time', params)
+        self._test_get_ordered_by_date('DataRequest', 'open_time', params, nullslast=True)
+
+    @parameterized.expand([
+        ('comments_count', True),
+        ('last_activity_time', True),
+        ('close_time', True),
+        ('close_time', False)
+    ])
+    def test_datarequest_get_ordered_by_column(self, column, desc):
+        self._test_get_ordered_by_date('DataRequest', column, {'order_by': column, 'desc': desc}, nullslast=True)
+
+    def test_datarequest_get_ordered_by_date_page(self):
+        model, final_query = self._init_db_in_query([])
+        db.DataRequest.open_time = MagicMock()
+        final_query.filter_by.return_value = final_query
+        final_query.order_by.return_value = final_query
+        final_query.offset.return_value = final_query
+        final_query.limit.return_value = final_query
+
+        result = db.DataRequest.get_ordered_by_date(organization_id='org', offset=20, limit=10)
+
+        # Only the requested page is loaded
+        final_query.offset.assert_called_once_with(20)
+        final_query.limit.assert_called_once_with(10)
+        self.assertEquals(final_query.all.return_value, result)
+
+    def test_datarequest_get_columns(self):
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.title = MagicMock()
+
+        result = db.DataRequest.get_columns(['id', 'title'], id='dr_id')
+
+        # Only the given columns are queried
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.title)
+        query = model.Session.query.return_value.autoflush.return_value
+        query.filter_by.assert_called_once_with(id='dr_id')
+        self.assertEquals(query.filter_by.return_value.all.return_value, result)
+
+    def test_datarequest_get_ordered_by_date_columns(self):
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.closed = MagicMock()
+        db.DataRequest.open_time = MagicMock()
+
+        db.DataRequest.get_ordered_by_date(columns=['id', 'closed'])
+
+        model.Session.query.assert_called_once_with(db.DataRequest.id, db.DataRequest.closed)
+
+    def test_datarequest_update_activity(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.id.__eq__ = MagicMock(return_value='condition')
+        db.DataRequest.comments_count = MagicMock()
+        db.func.coalesce.return_value = 3
+
+        result = db.DataRequest.update_activity('dr_id', 'time', 1)
+
+        update = tables[0].update.return_value
+        db.DataRequest.id.__eq__.assert_called_once_with('dr_id')
+        update.where.assert_called_once_with('condition')
+        db.func.coalesce.assert_called_once_with(db.DataRequest.comments_count, 0)
+        update.where.return_value.values.assert_called_once_with(comments_count=4, last_activity_time='time')
+
+        # The organization of the data request is returned by the same statement
+        statement = update.where.return_value.values.return_value
+        statement.returning.assert_called_once_with(tables[0].c.organization_id)
+        model.Session.execute.assert_called_once_with(statement.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.scalar.return_value, result)
+
+    def test_datarequest_close(self):
+        tables = [MagicMock() for _ in range(7)]
+        tables[0].c.__iter__.return_value = iter(['id', 'closed'])
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.id.__eq__ = MagicMock(return_value='id_condition')
+        db.DataRequest.closed = MagicMock()
+        db.DataRequest.closed.__eq__ = MagicMock(return_value='open_condition')
+
+        result = db.DataRequest.close('dr_id', 'time', 'dataset_id')
+
+        # Only open data requests are updated
+        update = tables[0].update.return_value
+        db.DataRequest.id.__eq__.assert_called_once_with('dr_id')
+        db.DataRequest.closed.__eq__.assert_called_once_with(False)
+        db.and_.assert_called_once_with('id_condition', 'open_condition')
+        update.where.assert_called_once_with(db.and_.return_value)
+        update.where.return_value.values.assert_called_once_with(closed=True, close_time='time',
+                                                                 last_activity_time='time',
+                                                                 accepted_dataset_id='dataset_id')
+
+        # The updated row is returned by the same statement
+        statement = update.where.return_value.values.return_value
+        statement.returning.assert_called_once_with('id', 'closed')
+        model.Session.execute.assert_called_once_with(statement.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.first.return_value, result)
+
+    def test_datarequest_close_values(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.closed = MagicMock()
+
+        db.DataRequest.close('dr_id', 'time', 'dataset_id', accepted_dataset_name='dataset')
+
+        # Other values are stored by the same statement
+        update = tables[0].update.return_value
+        update.where.return_value.values.assert_called_once_with(closed=True, close_time='time',
+                                                                 last_activity_time='time',
+                                                                 accepted_dataset_id='dataset_id',
+                                                                 accepted_dataset_name='dataset')
+
+    @parameterized.expand([
+        ('organization',),
+        ('accepted_dataset',)
+    ])
+    def test_datarequest_update_related_names(self, related):
+        tables = [MagicMock() for _ in range(7)]
+        columns = dict((column, MagicMock()) for column in ('%s_id' % related, '%s_name' % related,
+                                                           '%s_title' % related))
+        columns['%s_id' % related].__eq__ = MagicMock(return_value='id_condition')
+        tables[0].c.__getitem__.side_effect = lambda column: columns.setdefault(column, MagicMock())
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+
+        result = db.DataRequest.update_related_names(related, 'object_id', u'name', u'Title')
+
+        # All the data requests that reference the object and are outdated are updated at once
+        update = tables[0].update.return_value
+        columns['%s_id' % related].__eq__.assert_called_once_with('object_id')
+        db.func.coalesce.assert_any_call(columns['%s_name' % related], u'')
+        db.func.coalesce.assert_any_call(columns['%s_title' % related], u'')
+        db.and_.assert_called_once_with('id_condition', db.or_.return_value)
+        update.where.assert_called_once_with(db.and_.return_value)
+        update.where.return_value.values.assert_called_once_with({columns['%s_name' % related]: u'name',
+                                                                  columns['%s_title' % related]: u'Title'})
+        model.Session.execute.assert_called_once_with(update.where.return_value.values.return_value)
+        self.assertEquals(model.Session.execute.return_value.rowcount, result)
+
+    def test_datarequest_update_by_id(self):
+        tables = [MagicMock() for _ in range(7)]
+        tables[0].c.__iter__.return_value = iter(['id', 'title'])
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.id.__eq__ = MagicMock(return_value='id_condition')
+        previous = tables[0].alias.return_value
+        previous.c.id.__eq__ = MagicMock(return_value='previous_condition')
+
+        result = db.DataRequest.update_by_id('dr_id', title='title', organization_id='org')
+
+        # The previous row is joined to return the previous organization
+        update = tables[0].update.return_value
+        tables[0].alias.assert_called_once_with('previous')
+        db.DataRequest.id.__eq__.assert_called_once_with('dr_id')
+        previous.c.id.__eq__.assert_called_once_with(db.DataRequest.id)
+        db.and_.assert_called_once_with('id_condition', 'previous_condition')
+        update.where.assert_called_once_with(db.and_.return_value)
+        update.where.return_value.values.assert_called_once_with(title='title', organization_id='org')
+
+        # The updated row is returned by the same statement
+        statement = update.where.return_value.values.return_value
+        previous.c.organization_id.label.assert_called_once_with('previous_organization_id')
+        statement.returning.assert_called_once_with('id', 'title', previous.c.organization_id.label.return_value)
+        model.Session.execute.assert_called_once_with(statement.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.first.return_value, result)
+
+    @parameterized.expand([
+        (0, 'DataRequest'),
+        (1, 'Comment')
+    ])
+    def test_delete_by_id(self, table_index, class_name):
+        tables = [MagicMock() for _ in range(7)]
+        tables[table_index].c.__iter__.return_value = iter(['id', 'user_id'])
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        cls = getattr(db, class_name)
+        cls.id = MagicMock()
+        cls.id.__eq__ = MagicMock(return_value='id_condition')
+
+        result = cls.delete_by_id('object_id')
+
+        # The deleted row is returned by the same statement
+        delete = tables[table_index].delete.return_value
+        cls.id.__eq__.assert_called_once_with('object_id')
+        delete.where.assert_called_once_with('id_condition')
+        delete.where.return_value.returning.assert_called_once_with('id', 'user_id')
+        model.Session.execute.assert_called_once_with(delete.where.return_value.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.first.return_value, result)
+
+    @parameterized.expand([
+        ([],),
+        (['dr1', 'dr2'],)
+    ])
+    def test_comment_delete_by_datarequest_ids(self, datarequest_ids):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.Comment.datarequest_id = MagicMock()
+
+        result = db.Comment.delete_by_datarequest_ids(datarequest_ids)
+
+        if not datarequest_ids:
+            self.assertEquals([], result)
+            self.assertEquals(0, model.Session.execute.call_count)
+            return
+
+        # All the comments are deleted by one statement that returns their data requests and times
+        delete = tables[1].delete.return_value
+        db.Comment.datarequest_id.in_.assert_called_once_with(datarequest_ids)
+        delete.where.assert_called_once_with(db.Comment.datarequest_id.in_.return_value)
+        delete.where.return_value.returning.assert_called_once_with(tables[1].c.datarequest_id, tables[1].c.time)
+        model.Session.execute.assert_called_once_with(delete.where.return_value.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.fetchall.return_value, result)
+
+    def test_comment_delete_orphans(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.sa.select = MagicMock()
+        db.sa.exists = MagicMock()
+        datarequests = model.meta.metadata.tables.__getitem__.return_value
+        datarequests.c.id.__eq__ = MagicMock(return_value='exists_condition')
+
+        result = db.Comment.delete_orphans(100)
+
+        # The comments whose data request does not exist are selected (a batch of them)
+        model.meta.metadata.tables.__getitem__.assert_called_once_with('datarequests')
+        datarequests.c.id.__eq__.assert_called_once_with(tables[1].c.datarequest_id)
+        db.sa.exists.return_value.where.assert_called_once_with('exists_condition')
+        db.sa.select.assert_called_once_with([tables[1].c.id])
+        db.sa.select.return_value.where.return_value.limit.assert_called_once_with(100)
+
+        # And deleted by the same statement
+        orphans = db.sa.select.return_value.where.return_value.limit.return_value
+        tables[1].c.id.in_.assert_called_once_with(orphans)
+        delete = tables[1].delete.return_value
+        delete.where.assert_called_once_with(tables[1].c.id.in_.return_value)
+        model.Session.execute.assert_called_once_with(delete.where.return_value)
+        self.assertEquals(model.Session.execute.return_value.rowcount, result)
+
+    def test_comment_update_by_id(self):
+        tables = [MagicMock() for _ in range(7)]
+        tables[1].c.__iter__.return_value = iter(['id', 'comment'])
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.Comment.id = MagicMock()
+        db.Comment.id.__eq__ = MagicMock(return_value='id_condition')
+
+        result = db.Comment.update_by_id('comment_id', comment='comment')
+
+        # The updated row is returned by the same statement
+        update = tables[1].update.return_value
+        db.Comment.id.__eq__.assert_called_once_with('comment_id')
+        update.where.assert_called_once_with('id_condition')
+        update.where.return_value.values.assert_called_once_with(comment='comment')
+        statement = update.where.return_value.values.return_value
+        statement.returning.assert_called_once_with('id', 'comment')
+        model.Session.execute.assert_called_once_with(statement.returning.return_value)
+        self.assertEquals(model.Session.execute.return_value.first.return_value, result)
+
+    def test_datarequest_update_activity_without_time(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        db.DataRequest.id = MagicMock()
+        db.DataRequest.comments_count = MagicMock()
+        db.func.coalesce.return_value = 3
+
+        db.DataRequest.update_activity('dr_id', comments_delta=-1)
+
+        tables[0].update.return_value.where.return_value.values.assert_called_once_with(comments_count=2)
+
+    def _init_stats(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        return model, tables[5]
+
+    def test_initdb_organization_summaries(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+
+        db.init_db(model)
+
+        # Summaries are not filled when the table is created, so the session is not commited
+        self.assertEquals(0, tables[6].insert.return_value.from_select.call_count)
+        self.assertEquals(0, model.Session.commit.call_count)
+
+    def _init_summaries(self):
+        tables = [MagicMock() for _ in range(7)]
+        db.sa.Table = MagicMock(side_effect=tables)
+        model = MagicMock()
+        model.DomainObject = object
+        db.init_db(model)
+        model.reset_mock()
+        return model, tables[6]
+
+    @parameterized.expand([
+        (None, ['open_count', 'closed_count']),
+        ('time', ['open_count', 'closed_count', 'last_activity_time'])
+    ])
+    def test_organization_summary_update(self, activity_time, expected_columns):
+        model, table = self._init_summaries()
+        model.Session.execute.return_value.rowcount = 0
+
+        db.OrganizationSummary.update(u'org', 1, -1, activity_time)
+
+        values = table.update.return_value.where.return_value.values
+        self.assertEquals(sorted(expected_columns), sorted(values.call_args[1].keys()))
+        table.c.open_count.__add__.assert_called_once_with(1)
+        table.c.closed_count.__add__.assert_called_once_with(-1)
+        table.insert.return_value.values.assert_called_once_with(organization_id=u'org', open_count=1,
+                                                                 closed_count=-1, last_activity_time=activity_time)
+        model.Session.execute.assert_called_with(table.insert.return_value.values.return_value)
+
+    def test_organization_summary_get(self):
+        model, _ = self._init_db_in_query([])
+        query = model.Session.query.return_value.autoflush.return_value
+
+        result = db.OrganizationSummary.get(u'org')
+
+        query.filter_by.assert_called_once_with(organization_id=u'org')
+        self.assertEquals(query.filter_by.return_value.first.return_value, result)
+
+    def test_organization_summary_refresh(self):
+        model, table = self._init_summaries()
+
+        db.OrganizationSummary.refresh()
+
+        insert = table.insert.return_value.from_select
+        insert.assert_called_once_with(['organization_id', 'open_count', 'closed_count', 'last_activity_time'],
+                                       db.sa.select.return_value.group_by.return_value)
+        self.assertEquals([((table.delete.return_value,), {}), ((insert.return_value,), {})],
+                          model.Session.execute.call_args_list)
+
+    def test_stat_increment_existing(self):
+        model, table = self._init_stats()
+        model.Session.execute.return_value.rowcount = 1
+
+        db.Stat.increment(u'org', 'day', u'opened', 2)
+
+        update = table.update.return_value.where.return_value.values
+        update.assert_called_once_with(value=table.c.value.__add__.return_value)
+        table.c.value.__add__.assert_called_once_with(2)
+        model.Session.execute.assert_called_once_with(update.return_value)
+        self.assertEquals(0, model.Session.begin_nested.call_count)
+
+    def test_stat_increment_new(self):
+        model, table = self._init_stats()
+        model.Session.execute.return_value.rowcount = 0
+
+        db.Stat.increment(u'org', 'day', u'opened', 1)
+
+        insert = table.insert.return_value.values
+        insert.assert_called_once_with(organization_id=u'org', day='day', metric=u'opened', value=1)
+        model.Session.execute.assert_called_with(insert.return_value)
+        model.Session.begin_nested.return_value.commit.assert_called_once_with()
+
+    def test_stat_increment_concurrent(self):
+        model, table = self._init_stats()
+        update = table.update.return_value.where.return_value.values.return_value
+        insert = table.insert.return_value.values.return_value
+        model.Session.execute.side_effect = [MagicMock(rowcount=0), db.IntegrityError('stmt', {}, None), MagicMock()]
+
+        db.Stat.increment(u'org', 'day', u'opened', 1)
+
+        # The row has been created by another transaction, so it is updated
+        savepoint = model.Session.begin_nested.return_value
+        savepoint.rollback.assert_called_once_with()
+        self.assertEquals(0, savepoint.commit.call_count)
+        self.assertEquals([((update,), {}), ((insert,), {}), ((update,), {})], model.Session.execute.call_args_list)
+
+    @parameterized.expand([
+        ({}, 0, False),
+        ({'organization_id': u'org', 'since': 'since', 'until': 'until'}, 3, False),
+        ({'period': 'month'}, 0, True)
+    ])
+    def test_stat_get_totals(self, params, filters, by_period):
+        model, final_query = self._init_db_in_query([])
+        db.Stat.organization_id = MagicMock()
+        db.Stat.day = MagicMock()
+        db.Stat.metric = MagicMock()
+        db.Stat.value = MagicMock()
+        query = model.Session.query.return_value.autoflush.return_value
+        query.filter.return_value = query
+
+        result = db.Stat.get_totals(**params)
+
+        columns = [db.Stat.organization_id, db.Stat.metric]
+        if by_period:
+            db.func.date_trunc.assert_called_once_with('month', db.Stat.day)
+            columns.insert(1, db.func.date_trunc.return_value)
+
+        model.Session.query.assert_called_once_with(*(columns + [db.func.sum.return_value]))
+        db.func.sum.assert_called_once_with(db.Stat.value)
+        self.assertEquals(filters, query.filter.call_count)
+        query.group_by.assert_called_once_with(*columns)
+        query.group_by.return_value.order_by.assert_called_once_with(*columns)
+        self.assertEquals(query.group_by.return_value.order_by.return_value.all.return_value, result)
+
+    def test_stat_delete_all(self):
+        model, table = self._init_stats()
+
+        db.Stat.delete_all()
+
+        model.Session.execute.assert_called_once_with(table.delete.return_value)
+
+    def test_comment_get_activity(self):
+        time = datetime.datetime.now()
+        model, final_query = self._init_db_in_query([])
+        db.Comment.id = MagicMock()
+        db.Comment.time = MagicMock()
+        db.Comment.datarequest_id = MagicMock()
+        grouped_query = final_query.filter.return_value.group_by.return_value
+        grouped_query.all.return_value = [('dr1', 2, time)]
+
+        result = db.Comment.get_activity(['dr1', 'dr2'])
+
+        self.assertEquals({'dr1': (2, time)}, result)
+        db.Comment.datarequest_id.in_.assert_called_once_with(['dr1', 'dr2'])
+        final_query.filter.return_value.group_by.assert_called_once_with(db.Comment.datarequest_id)
+
+    def test_comment_get_activity_empty(self):
+        model, _ = self._init_db_in_query([])
+
+        self.assertEquals({}, db.Comment.get_activity([]))
+        self.assertEquals(0, model.Session.query.call_count)
 
     def test_get_open_datarequests_number(self):
 
@@ -313,3 +1258,20 @@ class DBTest(unittest.TestCase):
         query.filter_by.assert_called_once_with(**params)
         model.Session.query.assert_called_once_with(count)
         db.func.count.assert_called_once_with(db.Comment.id)
+
+    def test_change_get_since(self):
+        db_response = [MagicMock(), MagicMock()]
+        model, final_query = self._init_db_in_query([])
+        db.Change.id = MagicMock()
+        limited_query = final_query.filter.return_value.order_by.return_value.limit.return_value
+        limited_query.all.return_value = db_response
+
+        # Call the method
+        result = db.Change.get_since(7, 20)
+
+        # Assertions
+        self.assertEquals(db_response, result)
+        model.Session.query.assert_called_once_with(db.Change)
+        db.Change.id.__gt__.assert_called_once_with(7)
+        final_query.filter.return_value.order_by.assert_called_once_with(db.Change.id.asc.return_value)
+        final_query.filter.return_value.order_by.return_value.limit.assert_called_once_with(20)
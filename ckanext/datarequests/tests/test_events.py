@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.events as events
+import json
+import threading
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+EVENT = {
+    'type': 'comment_created',
+    'object_type': constants.CHANGE_OBJECT_COMMENT,
+    'object_id': 'comment_id',
+    'datarequest_id': 'datarequest_id',
+    'change_type': constants.CHANGE_CREATED,
+    'user_id': 'user_id',
+    'time': '2016-01-01 00:00:00'
+}
+
+
+def example_handler(event):
+    pass
+
+
+def _failing_handler(errors):
+    '''Returns a handler that raises the given errors (None means success)'''
+    errors = list(errors)
+    calls = []
+
+    def handler(event):
+        calls.append(event)
+        error = errors.pop(0)
+        if error:
+            raise error
+
+    handler.calls = calls
+    return handler
+
+
+class ExamplePlugin(object):
+
+    def handle_datarequest_event(self, event):
+        pass
+
+
+class EventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = events.model
+        events.model = MagicMock()
+
+        self._db = events.db
+        events.db = MagicMock()
+
+        self._plugins = events.plugins
+        events.plugins = MagicMock()
+        events.plugins.PluginImplementations.return_value = []
+
+        self._config = events.config
+        events.config = {}
+
+        self._time = events.time
+        events.time = MagicMock()
+
+        self._subscribers = events._subscribers
+        events._subscribers = []
+
+        self._dispatcher = events._dispatcher
+        events._dispatcher = None
+
+    def tearDown(self):
+        events.model = self._model
+        events.db = self._db
+        events.plugins = self._plugins
+        events.config = self._config
+        events.time = self._time
+        events._subscribers = self._subscribers
+        events._dispatcher = self._dispatcher
+
+    def test_get_handlers(self):
+        plugin = ExamplePlugin()
+        events.plugins.PluginImplementations.return_value = [plugin]
+
+        events.subscribe(example_handler)
+        events.subscribe(example_handler)
+
+        self.assertEquals([example_handler, plugin.handle_datarequest_event], events.get_handlers())
+        events.plugins.PluginImplementations.assert_called_once_with(events.IDataRequestEvents)
+
+    @parameterized.expand([
+        (example_handler, '%s.example_handler' % __name__),
+        (ExamplePlugin().handle_datarequest_event, '%s.ExamplePlugin.handle_datarequest_event' % __name__)
+    ])
+    def test_get_handler_name(self, handler, expected_name):
+        self.assertEquals(expected_name, events.get_handler_name(handler))
+
+    @parameterized.expand([
+        ({},                                               2, 3, 1.0),
+        ({'ckan.datarequests.events.workers': '0',
+          'ckan.datarequests.events.max_retries': '5',
+          'ckan.datarequests.events.retry_delay': '0.5'}, 0, 5, 0.5)
+    ])
+    def test_get_dispatcher(self, config, workers, max_retries, retry_delay):
+        events.config = config
+
+        dispatcher = events.get_dispatcher()
+
+        self.assertEquals(workers, dispatcher.workers)
+        self.assertEquals(max_retries, dispatcher.max_retries)
+        self.assertEquals(retry_delay, dispatcher.retry_delay)
+        # The same dispatcher is always returned
+        self.assertIs(dispatcher, events.get_dispatcher())
+
+    def test_publish(self):
+        events._dispatcher = MagicMock()
+        event = EVENT.copy()
+        del event['type']
+
+        events.publish(event)
+
+        events._dispatcher.dispatch.assert_called_once_with(EVENT)
+
+    def test_run(self):
+        handler = MagicMock()
+        dispatcher = events.EventDispatcher(0, 3, 1)
+
+        self.assertTrue(dispatcher.run(handler, EVENT))
+
+        handler.assert_called_once_with(EVENT)
+        self.assertEquals(0, events.time.sleep.call_count)
+        self.assertEquals(0, events.db.DeadLetter.insert_many.call_count)
+
+    def test_run_retry(self):
+        handler = MagicMock(side_effect=[Exception(), Exception(), None])
+        dispatcher = events.EventDispatcher(0, 3, 1)
+
+        self.assertTrue(dispatcher.run(handler, EVENT))
+
+        # The delay is doubled in each attempt
+        self.assertEquals(3, handler.call_count)
+        self.assertEquals([((1,), {}), ((2,), {})], events.time.sleep.call_args_list)
+        self.assertEquals(0, events.db.DeadLetter.insert_many.call_count)
+
+    def test_run_dead_letter(self):
+        handler = _failing_handler([ValueError('error')] * 3)
+        dispatcher = events.EventDispatcher(0, 2, 1)
+
+        self.assertFalse(dispatcher.run(handler, EVENT))
+
+        self.assertEquals(3, len(handler.calls))
+        events.db.init_db.assert_called_once_with(events.model)
+        rows = events.db.DeadLetter.insert_many.call_args[0][0]
+        self.assertEquals(1, len(rows))
+        self.assertEquals('comment_created', rows[0]['event_type'])
+        self.assertEquals(EVENT, json.loads(rows[0]['event']))
+        self.assertEquals('%s.handler' % __name__, rows[0]['handler'])
+        self.assertEquals("ValueError('error',)", rows[0]['error'])
+        self.assertEquals(3, rows[0]['attempts'])
+        events.model.Session.commit.assert_called_once_with()
+
+    def test_run_dead_letter_error(self):
+        handler = _failing_handler([Exception()])
+        events.db.DeadLetter.insert_many.side_effect = Exception()
+        dispatcher = events.EventDispatcher(0, 0, 1)
+
+        # Errors storing the dead letter are not propagated
+        self.assertFalse(dispatcher.run(handler, EVENT))
+        self.assertEquals(0, events.model.Session.commit.call_count)
+
+    def test_dispatch_sync(self):
+        handlers = [MagicMock(), MagicMock()]
+        events._subscribers = list(handlers)
+        dispatcher = events.EventDispatcher(0, 3, 1)
+
+        dispatcher.dispatch(EVENT)
+
+        for handler in handlers:
+            handler.assert_called_once_with(EVENT)
+        self.assertEquals([], dispatcher._threads)
+
+    def test_dispatch_threads(self):
+        # Mocks do not count calls from several threads reliably
+        lock = threading.Lock()
+        calls = []
+
+        def record(name):
+            def function(*args):
+                with lock:
+                    calls.append((name,) + args)
+            function.__name__ = name
+            return function
+
+        events._subscribers = [record('handler1'), record('handler2')]
+        events.model.Session.remove = record('remove')
+        dispatcher = events.EventDispatcher(2, 3, 1)
+
+        dispatcher.dispatch(EVENT)
+        dispatcher.dispatch(EVENT)
+        dispatcher._queue.join()
+
+        self.assertEquals(2, calls.count(('handler1', EVENT)))
+        self.assertEquals(2, calls.count(('handler2', EVENT)))
+
+        # Threads are only started once and each job removes its session
+        self.assertEquals(2, len(dispatcher._threads))
+        self.assertEquals(4, calls.count(('remove',)))
+
+    def test_dispatch_no_handlers(self):
+        dispatcher = events.EventDispatcher(2, 3, 1)
+
+        dispatcher.dispatch(EVENT)
+
+        self.assertEquals([], dispatcher._threads)
+
+    def test_replay_dead_letters(self):
+        handler = _failing_handler([None, Exception('error')])
+        events._subscribers = [handler]
+        handler_name = '%s.handler' % __name__
+
+        handled_letter = MagicMock(handler=handler_name, event=json.dumps(EVENT), attempts=3)
+        failed_letter = MagicMock(handler=handler_name, event=json.dumps(EVENT), attempts=3)
+        unknown_letter = MagicMock(handler='module.unknown', event=json.dumps(EVENT), attempts=1)
+        events.db.DeadLetter.iterate_by_id.return_value = [[handled_letter, failed_letter], [unknown_letter]]
+
+        # Call the function
+        handled, failed = events.replay_dead_letters()
+
+        # Assertions
+        self.assertEquals((1, 2), (handled, failed))
+        self.assertEquals([EVENT, EVENT], handler.calls)
+        events.db.DeadLetter.iterate_by_id.assert_called_once_with(constants.EVENTS_REPLAY_BATCH_SIZE)
+        events.model.Session.delete.assert_called_once_with(handled_letter)
+        self.assertEquals(4, failed_letter.attempts)
+        self.assertEquals("Exception('error',)", failed_letter.error)
+        self.assertEquals(2, unknown_letter.attempts)
+        self.assertEquals(3, events.model.Session.commit.call_count)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import ckanext.datarequests.exporter as exporter
+import datetime
+import json
+import unittest
+
+from cStringIO import StringIO
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+def _generate_datarequest(id, user_id, organization_id):
+    return MagicMock(id=id, user_id=user_id, title=u'Título %s' % id, description=u'Description',
+                     organization_id=organization_id, open_time=datetime.datetime(2016, 1, 1),
+                     accepted_dataset_id=None, close_time=None, closed=False)
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = exporter.model
+        exporter.model = MagicMock()
+
+        self._db = exporter.db
+        exporter.db = MagicMock()
+
+        self.datarequests = [
+            _generate_datarequest('dr1', 'user1', 'org1'),
+            _generate_datarequest('dr2', 'user2', None),
+            _generate_datarequest('dr3', 'user1', 'org1')
+        ]
+        self.comments = [
+            MagicMock(id='c1', datarequest_id='dr1', user_id='user3', comment=u'Comment 1',
+                      time=datetime.datetime(2016, 1, 2)),
+            MagicMock(id='c2', datarequest_id='dr1', user_id='user1', comment=u'Comment 2',
+                      time=datetime.datetime(2016, 1, 3))
+        ]
+
+        exporter.db.DataRequest.stream.return_value = iter(self.datarequests)
+        exporter.db.Comment.get_by_datarequest_ids.side_effect = \
+            lambda ids: [c for c in self.comments if c.datarequest_id in ids]
+
+        names = {'user1': 'user-1', 'user2': 'user-2', 'user3': 'user-3', 'org1': 'org-1'}
+        query = exporter.model.Session.query.return_value.filter.return_value
+        query.all.side_effect = lambda: names.items()
+
+    def tearDown(self):
+        exporter.model = self._model
+        exporter.db = self._db
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            exporter.export_datarequests('xml')
+
+        self.assertEquals(0, exporter.db.DataRequest.stream.call_count)
+
+    @parameterized.expand([
+        (False, False),
+        (True,  False),
+        (False, True),
+        (True,  True)
+    ])
+    def test_export_jsonl(self, include_comments, include_names):
+        chunks = list(exporter.export_datarequests('jsonl', include_comments, include_names, batch_size=2))
+
+        # One chunk per batch
+        self.assertEquals(2, len(chunks))
+        exporter.db.init_db.assert_called_once_with(exporter.model)
+        exporter.db.DataRequest.stream.assert_called_once_with(2)
+
+        lines = ''.join(chunks).splitlines()
+        self.assertEquals(3, len(lines))
+        result = [json.loads(line) for line in lines]
+
+        self.assertEquals(['dr1', 'dr2', 'dr3'], [d['id'] for d in result])
+        self.assertEquals(u'Título dr1', result[0]['title'])
+        self.assertEquals('2016-01-01T00:00:00', result[0]['open_time'])
+        self.assertIsNone(result[0]['close_time'])
+
+        if include_comments:
+            self.assertEquals(['c1', 'c2'], [c['id'] for c in result[0]['comments']])
+            self.assertEquals('2016-01-02T00:00:00', result[0]['comments'][0]['time'])
+            self.assertEquals([], result[1]['comments'])
+            # Comments are retrieved once per batch
+            exporter.db.Comment.get_by_datarequest_ids.assert_any_call(['dr1', 'dr2'])
+            exporter.db.Comment.get_by_datarequest_ids.assert_any_call(['dr3'])
+        else:
+            self.assertNotIn('comments', result[0])
+            self.assertEquals(0, exporter.db.Comment.get_by_datarequest_ids.call_count)
+
+        if include_names:
+            self.assertEquals('user-1', result[0]['user_name'])
+            self.assertEquals('org-1', result[0]['organization_name'])
+            self.assertIsNone(result[1]['organization_name'])
+            # Users and organizations are retrieved once per batch (the second
+            # batch has no organizations to look up besides org1)
+            self.assertEquals(4, exporter.model.Session.query.call_count)
+            if include_comments:
+                self.assertEquals('user-3', result[0]['comments'][0]['user_name'])
+        else:
+            self.assertNotIn('user_name', result[0])
+            self.assertEquals(0, exporter.model.Session.query.call_count)
+
+    @parameterized.expand([
+        (False, False),
+        (True,  True)
+    ])
+    def test_export_csv(self, include_comments, include_names):
+        chunks = list(exporter.export_datarequests('csv', include_comments, include_names, batch_size=2))
+
+        self.assertEquals(2, len(chunks))
+        rows = list(csv.DictReader(StringIO(''.join(chunks))))
+
+        self.assertEquals(3, len(rows))
+        self.assertEquals('dr1', rows[0]['id'])
+        self.assertEquals(u'Título dr1', rows[0]['title'].decode('utf-8'))
+        self.assertEquals('', rows[0]['close_time'])
+        self.assertEquals('False', rows[0]['closed'])
+
+        if include_comments:
+            self.assertEquals(['c1', 'c2'], [c['id'] for c in json.loads(rows[0]['comments'])])
+            self.assertEquals('user-2', rows[1]['user_name'])
+        else:
+            self.assertNotIn('comments', rows[0])
+            self.assertNotIn('user_name', rows[0])
+
+    def test_export_csv_empty(self):
+        exporter.db.DataRequest.stream.return_value = iter([])
+
+        chunks = list(exporter.export_datarequests('csv'))
+
+        self.assertEquals([','.join(exporter.DATAREQUEST_FIELDS) + '\r\n'], chunks)
@@ -21,6 +21,7 @@ import ckanext.datarequests.helpers as helpers
 import unittest
 
 from mock import MagicMock
+from nose_parameterized import parameterized
 
 
 class HelpersTest(unittest.TestCase):
@@ -35,10 +36,110 @@ class HelpersTest(unittest.TestCase):
         self._db = helpers.db
         helpers.db = MagicMock()
 
+        self._h = helpers.h
+        helpers.h = MagicMock()
+
+        self._config = helpers.config
+        helpers.config = {}
+        helpers._dataset_datarequests = None
+
     def tearDown(self):
         helpers.tk = self._tk
         helpers.model = self._model
         helpers.db = self._db
+        helpers.h = self._h
+        helpers.config = self._config
+        helpers._dataset_datarequests = None
+
+    def test_render_markdown(self):
+        helpers.h.render_markdown.return_value = '<p>rendered</p>'
+
+        result = helpers.render_markdown('rendered')
+
+        helpers.h.render_markdown.assert_called_once_with('rendered')
+        self.assertEquals(u'<p>rendered</p>', result)
+        self.assertIsInstance(result, unicode)
+
+    def test_render_markdown_empty(self):
+        self.assertEquals(u'', helpers.render_markdown(''))
+        self.assertEquals(u'', helpers.render_markdown(None))
+        self.assertEquals(0, helpers.h.render_markdown.call_count)
+
+    def test_render_excerpt(self):
+        helpers.h.markdown_extract.return_value = 'Fish &amp; chips...'
+
+        result = helpers.render_excerpt('**Fish** & chips')
+
+        # The extract is stored as plain text (the templates escape it)
+        helpers.h.markdown_extract.assert_called_once_with('**Fish** & chips',
+                                                           extract_length=helpers.constants.EXCERPT_MAX_LENGTH)
+        self.assertEquals(u'Fish & chips...', result)
+        self.assertIsInstance(result, unicode)
+
+    def test_render_excerpt_empty(self):
+        self.assertEquals(u'', helpers.render_excerpt(None))
+        self.assertEquals(0, helpers.h.markdown_extract.call_count)
+
+    def test_get_dataset_datarequests(self):
+        datarequests = [{'id': 'dr1', 'title': 'Data Request', 'close_time': '2016-01-01T00:00:00'}]
+        action = helpers.tk.get_action.return_value
+        action.return_value = datarequests
+
+        # The data requests are only retrieved once
+        self.assertEquals(datarequests, helpers.get_dataset_datarequests('pkg_id'))
+        self.assertEquals(datarequests, helpers.get_dataset_datarequests('pkg_id'))
+
+        helpers.tk.get_action.assert_called_once_with(helpers.constants.DATAREQUEST_LIST_FOR_DATASET)
+        action.assert_called_once_with({'ignore_auth': True}, {
+            'package_id': 'pkg_id',
+            'fields': helpers.constants.DATASET_DATAREQUESTS_FIELDS
+        })
+
+    def test_get_dataset_datarequests_not_found(self):
+        helpers.tk.ObjectNotFound = self._tk.ObjectNotFound
+        helpers.tk.get_action.return_value.side_effect = self._tk.ObjectNotFound
+
+        self.assertEquals([], helpers.get_dataset_datarequests('pkg_id'))
+        self.assertEquals([], helpers.get_dataset_datarequests('pkg_id'))
+        self.assertEquals(1, helpers.tk.get_action.return_value.call_count)
+
+    @parameterized.expand([
+        (MagicMock(spec=['id', 'name', 'title', 'is_organization'], is_organization=True), 'organization'),
+        (MagicMock(spec=['id', 'name', 'title', 'state', 'private'], state='active', private=False), 'accepted_dataset')
+    ])
+    def test_update_related_names(self, entity, related):
+        entity.id = 'entity_id'
+        entity.name = 'entity'
+        entity.title = ''
+
+        helpers.update_related_names(entity)
+
+        # The name is used as the title when the entity has no title
+        helpers.db.init_db.assert_called_once_with(helpers.model)
+        helpers.db.DataRequest.update_related_names.assert_called_once_with(related, 'entity_id', 'entity', 'entity')
+
+    @parameterized.expand([
+        ('active', True),
+        ('deleted', False)
+    ])
+    def test_update_related_names_not_public_dataset(self, state, private):
+        package = MagicMock(spec=['id', 'name', 'title', 'state', 'private'], state=state, private=private)
+        package.id = 'pkg_id'
+        package.name = 'pkg'
+        package.title = 'Dataset'
+
+        helpers.update_related_names(package)
+
+        # The names of private and deleted datasets are cleared
+        helpers.db.DataRequest.update_related_names.assert_called_once_with('accepted_dataset', 'pkg_id', None, None)
+
+    def test_update_related_names_group(self):
+        group = MagicMock(spec=['id', 'name', 'title', 'is_organization'], is_organization=False)
+
+        helpers.update_related_names(group)
+
+        # Data requests can only belong to organizations
+        self.assertEquals(0, helpers.db.DataRequest.update_related_names.call_count)
 
     def test_get_comments_number(self):
         # Mocking
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.constants as constants
+import ckanext.datarequests.importer as importer
+import datetime
+import json
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+def _line(**kwargs):
+    record = {'title': 'Title', 'description': 'Description'}
+    record.update(kwargs)
+    return json.dumps(record)
+
+
+class ImporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = importer.model
+        importer.model = MagicMock()
+
+        self._db = importer.db
+        importer.db = MagicMock()
+        importer.db.uuid4.return_value = 'generated_id'
+        importer.db.DataRequest.get_lowercase_titles.return_value = set([u'existing title'])
+        importer.db.DataRequest.get_existing_ids.side_effect = lambda ids: set(ids) & set(['existing_dr'])
+        importer.db.Comment.get_existing_ids.side_effect = lambda ids: set(ids) & set(['existing_comment'])
+
+        self._helpers = importer.helpers
+        importer.helpers = MagicMock()
+        importer.helpers.render_markdown.side_effect = lambda text: u'<p>%s</p>' % text
+        importer.helpers.render_excerpt.side_effect = lambda text: unicode(text)
+
+        # Deltas are computed by the real functions but they are not applied
+        self._stats = importer.stats
+        importer.stats = MagicMock(wraps=self._stats)
+        importer.stats.apply_deltas = MagicMock()
+
+        query = importer.model.Session.query.return_value.filter.return_value
+        query.all.return_value = [('org_id', 'org-name', u'Organization')]
+
+        self._resolver = importer.resolver
+        importer.resolver = MagicMock()
+        packages = {'dataset': {'id': 'dataset_id', 'name': 'dataset', 'display_name': u'Dataset'}}
+        importer.resolver.get_packages.side_effect = lambda ids: dict(
+            (package_id, packages[package_id]) for package_id in ids if package_id in packages)
+
+    def tearDown(self):
+        importer.model = self._model
+        importer.db = self._db
+        importer.resolver = self._resolver
+        importer.helpers = self._helpers
+        importer.stats = self._stats
+
+    def _inserted_datarequests(self):
+        return [row for call in importer.db.DataRequest.insert_many.call_args_list for row in call[0][0]]
+
+    def _inserted_comments(self):
+        return [row for call in importer.db.Comment.insert_many.call_args_list for row in call[0][0]]
+
+    def test_preload(self):
+        datarequests_importer = importer.DataRequestsImporter()
+
+        importer.db.init_db.assert_called_once_with(importer.model)
+        self.assertEquals(set([u'existing title']), datarequests_importer.titles)
+        organization = {'id': 'org_id', 'name': 'org-name', 'title': u'Organization'}
+        self.assertEquals({'org_id': organization, 'org-name': organization}, datarequests_importer.organizations)
+
+    def test_import(self):
+        lines = [
+            _line(id='dr1', title='Title 1', organization_id='org-name', user_id='user1',
+                  open_time='2016-01-01T10:00:00', close_time='2016-01-02T10:00:00.500000',
+                  closed=True, accepted_dataset_id='dataset',
+                  comments=[{'id': 'c1', 'comment': 'Comment', 'user_id': 'user2', 'time': '2016-01-01T11:00:00'}]),
+            _line(title='Title 2'),
+            '',
+            _line(title='Existing Title'),
+            _line(title='title 1'),
+            _line(title='Title 3', organization_id='unknown'),
+            _line(title='Title 4', open_time='yesterday'),
+            _line(title='Title 5', comments=[{'comment': ''}]),
+            _line(title='Title 6', comments='invalid'),
+            _line(title='Title 7', description='a' * (constants.DESCRIPTION_MAX_LENGTH + 1)),
+            _line(title=''),
+            'invalid json',
+            json.dumps(['invalid'])
+        ]
+
+        datarequests_importer = importer.DataRequestsImporter(batch_size=3)
+        datarequests_importer.import_lines(lines)
+
+        datarequests = self._inserted_datarequests()
+        comments = self._inserted_comments()
+
+        self.assertEquals(2, datarequests_importer.imported_datarequests)
+        self.assertEquals(1, datarequests_importer.imported_comments)
+        self.assertEquals(10, datarequests_importer.rejected)
+
+        self.assertEquals({
+            'id': 'dr1',
+            'user_id': 'user1',
+            'title': 'Title 1',
+            'description': 'Description',
+            'description_html': u'<p>Description</p>',
+            'excerpt': u'Description',
+            'organization_id': 'org_id',
+            'organization_name': 'org-name',
+            'organization_title': u'Organization',
+            'open_time': datetime.datetime(2016, 1, 1, 10),
+            'accepted_dataset_id': 'dataset_id',
+            'accepted_dataset_name': 'dataset',
+            'accepted_dataset_title': u'Dataset',
+            'close_time': datetime.datetime(2016, 1, 2, 10, 0, 0, 500000),
+            'closed': True,
+            'last_activity_time': datetime.datetime(2016, 1, 2, 10, 0, 0, 500000),
+            'comments_count': 1
+        }, datarequests[0])
+
+        self.assertEquals('generated_id', datarequests[1]['id'])
+        self.assertEquals('Title 2', datarequests[1]['title'])
+        self.assertIsNone(datarequests[1]['organization_id'])
+        self.assertIsNone(datarequests[1]['organization_name'])
+        self.assertIsNone(datarequests[1]['accepted_dataset_id'])
+        self.assertIsNone(datarequests[1]['accepted_dataset_name'])
+        self.assertIsNone(datarequests[1]['close_time'])
+        self.assertFalse(datarequests[1]['closed'])
+        self.assertEquals(datarequests[1]['open_time'], datarequests[1]['last_activity_time'])
+        self.assertEquals(0, datarequests[1]['comments_count'])
+
+        self.assertEquals([{
+            'id': 'c1',
+            'user_id': 'user2',
+            'datarequest_id': 'dr1',
+            'time': datetime.datetime(2016, 1, 1, 11),
+            'comment': 'Comment',
+            'comment_html': u'<p>Comment</p>'
+        }], comments)
+
+        # Imported data requests and comments are included in the change log
+        changes = [row for call in importer.db.Change.insert_many.call_args_list for row in call[0][0]]
+        self.assertEquals([
+            (constants.CHANGE_OBJECT_COMMENT, 'c1', 'dr1', 'user2'),
+            (constants.CHANGE_OBJECT_DATAREQUEST, 'dr1', 'dr1', 'user1'),
+            (constants.CHANGE_OBJECT_DATAREQUEST, 'generated_id', 'generated_id', '')
+        ], sorted((c['object_type'], c['object_id'], c['datarequest_id'], c['user_id']) for c in changes))
+        self.assertTrue(all(c['change_type'] == constants.CHANGE_CREATED for c in changes))
+
+        # Statistics are updated in the same transaction as each batch
+        self.assertEquals(4, importer.stats.apply_deltas.call_count)
+        deltas = importer.stats.apply_deltas.call_args_list[0][0][0]
+        self.assertEquals(1, deltas[('org_id', datetime.date(2016, 1, 1), self._stats.OPENED)])
+        self.assertEquals(1, deltas[('org_id', datetime.date(2016, 1, 1), self._stats.COMMENTS)])
+        self.assertEquals(1, deltas[('org_id', datetime.date(2016, 1, 2), self._stats.CLOSED)])
+        self.assertEquals(86400, deltas[('org_id', datetime.date(2016, 1, 2), self._stats.TIME_TO_CLOSE)])
+        self.assertEquals(1, deltas[(u'', datarequests[1]['open_time'].date(), self._stats.OPENED)])
+        self.assertEquals({'org_id': datetime.datetime(2016, 1, 2, 10, 0, 0, 500000),
+                           None: datarequests[1]['last_activity_time']},
+                          importer.stats.apply_deltas.call_args_list[0][0][1])
+
+        # The change log is locked before adding the changes of each batch
+        self.assertEquals(4, importer.db.Change.lock.call_count)
+
+        # One commit per batch of 3 lines (the empty line is ignored)
+        self.assertEquals(4, importer.model.Session.commit.call_count)
+        self.assertEquals(4, importer.db.DataRequest.insert_many.call_count)
+
+        # The accepted datasets are read with a single query per batch
+        self.assertEquals([set(['dataset']), set(), set(), set()],
+                          [call[0][0] for call in importer.resolver.get_packages.call_args_list])
+
+    def test_import_unknown_dataset(self):
+        datarequests_importer = importer.DataRequestsImporter()
+        datarequests_importer.import_lines([_line(accepted_dataset_id='unknown')])
+
+        # Datasets that are not found are stored as they are given, without names
+        datarequest = self._inserted_datarequests()[0]
+        self.assertEquals('unknown', datarequest['accepted_dataset_id'])
+        self.assertIsNone(datarequest['accepted_dataset_name'])
+        self.assertIsNone(datarequest['accepted_dataset_title'])
+
+    def test_import_duplicated_ids(self):
+        lines = [
+            _line(id='existing_dr', title='Title 1'),
+            _line(id='dr2', title='Title 2', comments=[{'id': 'existing_comment', 'comment': 'Comment'}]),
+            _line(id='dr3', title='Title 3', comments=[{'id': 'c1', 'comment': 'Comment'},
+                                                       {'id': 'c1', 'comment': 'Comment'}]),
+            _line(id='dr4', title='Title 4', comments=[{'id': 'c2', 'comment': 'Comment'}]),
+            _line(id='dr4', title='Title 5'),
+            _line(id='dr6', title='Title 6', comments=[{'id': 'c2', 'comment': 'Comment'}])
+        ]
+
+        datarequests_importer = importer.DataRequestsImporter(batch_size=10)
+        datarequests_importer.import_lines(lines)
+
+        # Records whose IDs are already in use (in the data base or in the same batch) are rejected
+        self.assertEquals(['dr4'], [d['id'] for d in self._inserted_datarequests()])
+        self.assertEquals(['c2'], [c['id'] for c in self._inserted_comments()])
+        self.assertEquals(5, datarequests_importer.rejected)
+
+        # The IDs of each batch are checked with a single query per table
+        importer.db.DataRequest.get_existing_ids.assert_called_once_with(set(['existing_dr', 'dr2', 'dr3', 'dr4', 'dr6']))
+        importer.db.Comment.get_existing_ids.assert_called_once_with(set(['existing_comment', 'c1', 'c2']))
+
+    @parameterized.expand([
+        ({'closed': 'false'},),
+        ({'closed': 1},),
+        ({'closed': False, 'close_time': '2016-01-02T10:00:00'},),
+        ({'close_time': '2016-01-02T10:00:00'},)
+    ])
+    def test_import_invalid_state(self, fields):
+        datarequests_importer = importer.DataRequestsImporter()
+        datarequests_importer.import_lines([_line(**fields)])
+
+        # The state must be a boolean that agrees with the close date
+        self.assertEquals([], self._inserted_datarequests())
+        self.assertEquals(1, datarequests_importer.rejected)
+
+    def test_import_closed_without_close_time(self):
+        datarequests_importer = importer.DataRequestsImporter()
+        datarequests_importer.import_lines([_line(closed=True)])
+
+        # Data requests are closed when they are imported, so they are counted as closed
+        datarequest = self._inserted_datarequests()[0]
+        self.assertTrue(datarequest['closed'])
+        self.assertEquals(datarequest['open_time'], datarequest['close_time'])
+        deltas = importer.stats.apply_deltas.call_args[0][0]
+        self.assertEquals(1, deltas[(u'', datarequest['close_time'].date(), self._stats.CLOSED)])
+
+    def test_import_exported_comments(self):
+        datarequests_importer = importer.DataRequestsImporter()
+        datarequests_importer.import_lines([_line(comments=[{'comment': '&lt;b&gt;Comment&lt;/b&gt; &amp; more'}])])
+
+        # Exported comments are already escaped, so they are not escaped again
+        comment = self._inserted_comments()[0]
+        self.assertEquals(u'&lt;b&gt;Comment&lt;/b&gt; &amp; more', comment['comment'])
+        self.assertEquals(u'<p>&lt;b&gt;Comment&lt;/b&gt; &amp; more</p>', comment['comment_html'])
+
+    def test_import_comment_max_length(self):
+        comment = '&amp;' * (constants.COMMENT_MAX_LENGTH // 5)
+        lines = [_line(title='Title 1', comments=[{'comment': comment}]),
+                 _line(title='Title 2', comments=[{'comment': comment + 'a'}])]
+
+        datarequests_importer = importer.DataRequestsImporter()
+        datarequests_importer.import_lines(lines)
+
+        # The length is checked on the stored value
+        self.assertEquals([comment], [c['comment'] for c in self._inserted_comments()])
+        self.assertEquals(1, datarequests_importer.rejected)
+
+    @parameterized.expand([
+        (0, [3, 6, 7]),
+        (3, [6, 7]),
+        (7, [])
+    ])
+    def test_import_checkpoint(self, start_line, expected_checkpoints):
+        lines = [_line(title='Title %d' % i) for i in range(7)]
+        checkpoint = MagicMock()
+
+        datarequests_importer = importer.DataRequestsImporter(batch_size=3)
+        datarequests_importer.import_lines(lines, start_line, checkpoint)
+
+        # Lines before the checkpoint are not imported again
+        titles = [d['title'] for d in self._inserted_datarequests()]
+        self.assertEquals(['Title %d' % i for i in range(start_line, 7)], titles)
+        self.assertEquals(expected_checkpoints, [call[0][0] for call in checkpoint.call_args_list])
+
+    def test_import_comments_chunks(self):
+        comments = [{'comment': 'Comment %d' % i} for i in range(5)]
+
+        datarequests_importer = importer.DataRequestsImporter(batch_size=2)
+        datarequests_importer.import_lines([_line(comments=comments)])
+
+        # Comments are inserted in chunks of batch_size rows
+        self.assertEquals(3, importer.db.Comment.insert_many.call_count)
+        self.assertEquals(5, len(self._inserted_comments()))
+        self.assertEquals(1, importer.model.Session.commit.call_count)
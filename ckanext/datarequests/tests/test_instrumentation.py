@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.instrumentation as instrumentation
+import json
+import query_counts
+import sqlalchemy as sa
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tk = instrumentation.tk
+        instrumentation.tk = MagicMock()
+
+        self._log = instrumentation.log
+        instrumentation.log = MagicMock()
+
+        self._timeit = instrumentation.timeit
+        instrumentation.timeit = MagicMock()
+        instrumentation.timeit.default_timer.side_effect = [1.0, 1.25]
+
+        instrumentation.metrics.clear()
+
+    def tearDown(self):
+        instrumentation.tk = self._tk
+        instrumentation.log = self._log
+        instrumentation.timeit = self._timeit
+        instrumentation.metrics.clear()
+        instrumentation.configure(None)
+
+    def test_recorder_queries(self):
+        instrumentation.timeit = self._timeit
+        engine = sa.create_engine('sqlite://')
+
+        with instrumentation.Recorder() as outer:
+            engine.execute('SELECT 1')
+            with instrumentation.Recorder() as inner:
+                engine.execute('SELECT 2')
+
+        engine.execute('SELECT 3')
+
+        # Active recorders record all the statements
+        self.assertEquals(['SELECT 1', 'SELECT 2'], outer.queries)
+        self.assertEquals(['SELECT 2'], inner.queries)
+        self.assertTrue(outer.sql_time >= inner.sql_time > 0)
+
+    def test_recorder_failed_query(self):
+        instrumentation.timeit.default_timer.side_effect = [1.0, 5.0, 5.5]
+        engine = sa.create_engine('sqlite://')
+
+        with instrumentation.Recorder() as recorder:
+            with engine.connect() as conn:
+                self.assertRaises(sa.exc.OperationalError, conn.execute, 'SELECT * FROM missing')
+                self.assertNotIn('datarequests_query_start', conn.info)
+                conn.execute('SELECT 1')
+
+        # The start time of the failed statement is not kept on the connection
+        self.assertEquals(['SELECT * FROM missing', 'SELECT 1'], recorder.queries)
+        self.assertEquals(0.5, recorder.sql_time)
+
+    def test_get_action(self):
+        user_show = instrumentation.tk.get_action.return_value
+
+        with instrumentation.Recorder() as recorder:
+            result = instrumentation.get_action('user_show')({'ignore_auth': True}, {'id': 'user'})
+
+        instrumentation.tk.get_action.assert_called_once_with('user_show')
+        user_show.assert_called_once_with({'ignore_auth': True}, {'id': 'user'})
+        self.assertEquals(user_show.return_value, result)
+        self.assertEquals(['user_show'], recorder.actions)
+
+    def test_instrument_action(self):
+        def datarequest_show(context, data_dict):
+            '''Docstring'''
+            instrumentation.get_action('user_show')(context, data_dict)
+            instrumentation.get_action('package_show')(context, data_dict)
+            return 'result'
+
+        datarequest_show.side_effect_free = True
+        action = instrumentation.instrument_action('datarequest_show', datarequest_show)
+
+        with instrumentation.Recorder() as recorder:
+            self.assertEquals('result', action({}, {'id': 'dr'}))
+
+        # The attributes of the action are kept
+        self.assertEquals('datarequest_show', action.__name__)
+        self.assertEquals('Docstring', action.__doc__)
+        self.assertTrue(action.side_effect_free)
+        self.assertEquals(datarequest_show, action.__wrapped__)
+        self.assertEquals(['datarequest_show', 'user_show', 'package_show'], recorder.actions)
+
+    def test_instrument_auth(self):
+        def datarequest_update(context, data_dict):
+            return {'success': True}
+
+        datarequest_update.auth_allow_anonymous_access = True
+        auth = instrumentation.instrument_auth('datarequest_update', datarequest_update)
+
+        with instrumentation.Recorder() as recorder:
+            self.assertEquals({'success': True}, auth({}, {}))
+            auth({}, {})
+
+        self.assertTrue(auth.auth_allow_anonymous_access)
+        self.assertEquals(['datarequest_update', 'datarequest_update'], recorder.auth_checks)
+        self.assertEquals([], recorder.actions)
+
+    def test_assert_max_calls(self):
+        with query_counts.assert_max_calls(queries=0, actions=2) as recorder:
+            instrumentation.get_action('user_show')({}, {})
+            instrumentation.get_action('user_show')({}, {})
+
+        self.assertEquals(2, len(recorder.actions))
+
+    def test_assert_max_calls_exceeded(self):
+        with self.assertRaises(AssertionError) as cm:
+            with query_counts.assert_max_calls(actions=1):
+                instrumentation.get_action('user_show')({}, {})
+                instrumentation.get_action('organization_show')({}, {})
+
+        self.assertEquals('2 actions performed (at most 1 expected):\nuser_show\norganization_show',
+                          str(cm.exception))
+
+    def test_record_cache(self):
+        with instrumentation.Recorder() as recorder:
+            instrumentation.record_cache('users', True)
+            instrumentation.record_cache('users', False)
+            instrumentation.record_cache('users', True)
+
+        self.assertEquals({'users': 2}, recorder.cache_hits)
+        self.assertEquals({'users': 1}, recorder.cache_misses)
+        self.assertEquals({('users', 'hit'): 2, ('users', 'miss'): 1}, instrumentation.metrics.caches)
+
+    @parameterized.expand([
+        (None, False),
+        ('300', False),
+        ('250', True),
+        ('100', True)
+    ])
+    def test_instrument_action_metrics(self, threshold, slow):
+        instrumentation.configure(threshold)
+        action = instrumentation.instrument_action('datarequest_index', lambda context, data_dict: 'result')
+
+        self.assertEquals('result', action({'user': 'user1'}, {}))
+
+        metrics = instrumentation.metrics.actions['datarequest_index']
+        self.assertEquals(1, metrics['count'])
+        self.assertEquals(0, metrics['errors'])
+        self.assertEquals(0.25, metrics['duration'])
+        self.assertEquals(1, metrics['buckets'][instrumentation.metrics.buckets.index(0.25)])
+
+        if slow:
+            message = instrumentation.log.warning.call_args[0][0]
+            self.assertTrue(message.startswith('Slow action: '))
+            record = json.loads(message[len('Slow action: '):])
+            self.assertEquals('datarequest_index', record['action'])
+            self.assertEquals('user1', record['user'])
+            self.assertEquals(250.0, record['duration_ms'])
+            self.assertEquals(0, record['queries'])
+            self.assertFalse(record['error'])
+        else:
+            self.assertEquals(0, instrumentation.log.warning.call_count)
+
+    def test_instrument_action_error(self):
+        def _action(context, data_dict):
+            raise ValueError()
+
+        action = instrumentation.instrument_action('datarequest_show', _action)
+
+        with self.assertRaises(ValueError):
+            action({}, {})
+
+        metrics = instrumentation.metrics.actions['datarequest_show']
+        self.assertEquals(1, metrics['count'])
+        self.assertEquals(1, metrics['errors'])
+
+    def test_record_request(self):
+        engine = sa.create_engine('sqlite://')
+        instrumentation.timeit.default_timer.side_effect = [1.0, 1.1, 1.2, 1.25]
+        auth = instrumentation.instrument_auth('datarequest_comment_update', lambda context, data_dict: True)
+
+        # Calls made outside of the actions (e.g. by the templates) are recorded too
+        with instrumentation.record_request('ui:comment') as recorder:
+            for i in range(2):
+                auth({}, {'id': 'comment%d' % i})
+            engine.execute('SELECT 1')
+
+        self.assertEquals(['datarequest_comment_update'] * 2, recorder.auth_checks)
+        self.assertEquals(['SELECT 1'], recorder.queries)
+
+        metrics = instrumentation.metrics.actions['ui:comment']
+        self.assertEquals(1, metrics['count'])
+        self.assertEquals(0, metrics['errors'])
+        self.assertEquals(1, metrics['queries'])
+        self.assertEquals(0.25, metrics['duration'])
+
+    def test_render(self):
+        metrics = instrumentation.Metrics(buckets=(0.1, 1))
+        metrics.observe_action('datarequest_show', 0.05, 0.01, 2, False)
+        metrics.observe_action('datarequest_show', 0.5, 0.25, 3, True)
+        metrics.observe_cache('users', True)
+
+        self.assertEquals(u'\n'.join([
+            u'# HELP datarequests_action_duration_seconds Wall time of the calls to the data requests actions',
+            u'# TYPE datarequests_action_duration_seconds histogram',
+            u'datarequests_action_duration_seconds_bucket{action="datarequest_show",le="0.1"} 1',
+            u'datarequests_action_duration_seconds_bucket{action="datarequest_show",le="1.0"} 2',
+            u'datarequests_action_duration_seconds_bucket{action="datarequest_show",le="+Inf"} 2',
+            u'datarequests_action_duration_seconds_sum{action="datarequest_show"} 0.55',
+            u'datarequests_action_duration_seconds_count{action="datarequest_show"} 2',
+            u'# HELP datarequests_action_errors_total Calls to the data requests actions that raised an exception',
+            u'# TYPE datarequests_action_errors_total counter',
+            u'datarequests_action_errors_total{action="datarequest_show"} 1',
+            u'# HELP datarequests_action_sql_seconds_total Time spent executing SQL statements in the data requests actions',
+            u'# TYPE datarequests_action_sql_seconds_total counter',
+            u'datarequests_action_sql_seconds_total{action="datarequest_show"} 0.26',
+            u'# HELP datarequests_action_queries_total SQL statements executed by the data requests actions',
+            u'# TYPE datarequests_action_queries_total counter',
+            u'datarequests_action_queries_total{action="datarequest_show"} 5',
+            u'# HELP datarequests_cache_requests_total Lookups in the caches of the data requests extension',
+            u'# TYPE datarequests_cache_requests_total counter',
+            u'datarequests_cache_requests_total{cache="users",result="hit"} 1',
+            u''
+        ]), metrics.render())
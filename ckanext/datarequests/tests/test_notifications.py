@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.notifications as notifications
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+def _event(event_type, user_id='actor'):
+    return {
+        'type': event_type,
+        'object_id': 'object_id',
+        'datarequest_id': 'dr1',
+        'user_id': user_id
+    }
+
+
+class ExampleTransport(object):
+
+    def send(self, user, subject, body):
+        pass
+
+
+def _notification(notification_id, datarequest_id, event_type):
+    return MagicMock(id=notification_id, datarequest_id=datarequest_id, event_type=event_type)
+
+
+class NotificationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = notifications.model
+        notifications.model = MagicMock()
+
+        self._db = notifications.db
+        notifications.db = MagicMock()
+
+        self._config = notifications.config
+        notifications.config = {'ckan.site_url': 'http://example.com/'}
+
+        self._mailer = notifications.mailer
+        notifications.mailer = MagicMock()
+
+    def tearDown(self):
+        notifications.model = self._model
+        notifications.db = self._db
+        notifications.config = self._config
+        notifications.mailer = self._mailer
+
+    @parameterized.expand([
+        ('comment_created',),
+        ('datarequest_closed',)
+    ])
+    def test_record_event(self, event_type):
+        notifications.db.DataRequest.get.return_value = [MagicMock(user_id='creator')]
+        notifications.db.Comment.get_commenters.return_value = ['actor', 'commenter', 'creator', u'']
+
+        notifications.record_event(_event(event_type))
+
+        notifications.db.DataRequest.get.assert_called_once_with(id='dr1')
+        notifications.db.Comment.get_commenters.assert_called_once_with('dr1')
+
+        # The user that performed the change is not notified
+        rows = notifications.db.Notification.insert_many.call_args[0][0]
+        self.assertEquals(['commenter', 'creator'], [row['recipient_id'] for row in rows])
+        for row in rows:
+            self.assertEquals('dr1', row['datarequest_id'])
+            self.assertEquals(event_type, row['event_type'])
+            self.assertEquals('object_id', row['object_id'])
+            self.assertEquals('actor', row['user_id'])
+        notifications.model.Session.commit.assert_called_once_with()
+
+    @parameterized.expand([
+        ('comment_updated', [MagicMock()]),
+        ('datarequest_created', [MagicMock()]),
+        ('comment_created', [])
+    ])
+    def test_record_event_ignored(self, event_type, datarequests):
+        notifications.db.DataRequest.get.return_value = datarequests
+
+        notifications.record_event(_event(event_type))
+
+        self.assertEquals(0, notifications.db.Notification.insert_many.call_count)
+        self.assertEquals(0, notifications.model.Session.commit.call_count)
+
+    @parameterized.expand([
+        ({}, notifications.SMTPTransport),
+        ({'ckan.datarequests.notifications.transport': 'smtp'}, notifications.SMTPTransport),
+        ({'ckan.datarequests.notifications.transport': 'file'}, notifications.FileTransport),
+        ({'ckan.datarequests.notifications.transport': '%s:ExampleTransport' % __name__}, ExampleTransport),
+    ])
+    def test_get_transport(self, config, expected_class):
+        notifications.config = config
+        self.assertIsInstance(notifications.get_transport(), expected_class)
+
+    def test_smtp_transport(self):
+        user = MagicMock()
+
+        notifications.SMTPTransport().send(user, 'subject', 'body')
+
+        notifications.mailer.mail_user.assert_called_once_with(user, 'subject', 'body')
+
+    def test_file_transport(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'notifications.txt')
+        user = MagicMock(display_name=u'User', email=u'user@example.com')
+
+        transport = notifications.FileTransport(path)
+        transport.send(user, u'Subject', u'Body 1')
+        transport.send(user, u'Subject', u'Body 2')
+
+        with open(path) as f:
+            content = f.read()
+
+        self.assertEquals('To: User <user@example.com>\nSubject: Subject\n\nBody 1\n\n'
+                          'To: User <user@example.com>\nSubject: Subject\n\nBody 2\n\n', content)
+
+    def test_compose_digest(self):
+        notification_list = [
+            _notification(1, 'dr1', 'comment_created'),
+            _notification(2, 'dr2', 'datarequest_closed'),
+            _notification(3, 'dr1', 'comment_created'),
+            _notification(4, 'dr1', 'datarequest_closed'),
+            _notification(5, 'deleted', 'comment_created')
+        ]
+        datarequests = {'dr1': MagicMock(title=u'Title 1'), 'dr2': MagicMock(title=u'Title 2')}
+
+        body = notifications._compose_digest(notification_list, datarequests)
+
+        self.assertEquals(u'* Title 1: 2 new comment(s), closed\n  http://example.com/datarequest/dr1\n'
+                          u'* Title 2: closed\n  http://example.com/datarequest/dr2', body)
+
+    def _prepare_digests(self, users):
+        notifications.db.Notification.get_due_recipients.return_value = sorted(users.keys())
+        notifications.db.Notification.get_by_recipient.side_effect = lambda recipient_id: [
+            _notification(recipient_id + '_1', 'dr1', 'comment_created'),
+            _notification(recipient_id + '_2', 'dr1', 'comment_created')
+        ]
+        notifications.db.DataRequest.get_by_ids.return_value = [MagicMock(id='dr1', title=u'Title')]
+        notifications.model.User.get.side_effect = lambda user_id: users[user_id]
+
+    def test_send_digests(self):
+        user1 = MagicMock(email='user1@example.com')
+        user2 = MagicMock(email='user2@example.com')
+        self._prepare_digests({'user1': user1, 'user2': user2, 'no_email': MagicMock(email=''), 'deleted': None})
+        transport = MagicMock()
+        notifications.config['ckan.datarequests.notifications.window'] = '30'
+
+        start = datetime.datetime.now()
+        sent = notifications.send_digests(transport)
+
+        self.assertEquals(2, sent)
+        cutoff = notifications.db.Notification.get_due_recipients.call_args[0][0]
+        self.assertTrue(start - datetime.timedelta(minutes=31) < cutoff < start - datetime.timedelta(minutes=29))
+
+        # A single digest is sent to each user for all their notifications
+        body = u'* Title: 2 new comment(s)\n  http://example.com/datarequest/dr1'
+        self.assertEquals([((user1, notifications.DIGEST_SUBJECT, body), {}),
+                           ((user2, notifications.DIGEST_SUBJECT, body), {})],
+                          transport.send.call_args_list)
+
+        # Notifications of users that cannot be notified are discarded too
+        deleted_ids = [call[0][0] for call in notifications.db.Notification.delete_by_ids.call_args_list]
+        self.assertEquals([['deleted_1', 'deleted_2'], ['no_email_1', 'no_email_2'],
+                           ['user1_1', 'user1_2'], ['user2_1', 'user2_2']], deleted_ids)
+        self.assertEquals(4, notifications.model.Session.commit.call_count)
+
+    def test_send_digests_error(self):
+        user1 = MagicMock(email='user1@example.com')
+        user2 = MagicMock(email='user2@example.com')
+        self._prepare_digests({'user1': user1, 'user2': user2})
+        transport = MagicMock()
+        transport.send.side_effect = [Exception(), None]
+
+        sent = notifications.send_digests(transport)
+
+        # Notifications that could not be sent are kept for the next execution
+        self.assertEquals(1, sent)
+        notifications.db.Notification.delete_by_ids.assert_called_once_with(['user2_1', 'user2_2'])
+        notifications.model.Session.rollback.assert_called_once_with()
+        notifications.model.Session.commit.assert_called_once_with()
@@ -24,9 +24,11 @@ import unittest
 from mock import MagicMock
 from nose_parameterized import parameterized
 
-TOTAL_ACTIONS = 11
+TOTAL_ACTIONS = 18
 COMMENTS_ACTIONS = 5
 ACTIONS_NO_COMMENTS = TOTAL_ACTIONS - COMMENTS_ACTIONS
+# Auth functions that are not bound to any action (datarequest_export and datarequest_metrics)
+EXTRA_AUTH_FUNCTIONS = 2
 
 
 class DataRequestPluginTest(unittest.TestCase):
@@ -50,12 +52,26 @@ class DataRequestPluginTest(unittest.TestCase):
         self._partial = plugin.partial
         plugin.partial = MagicMock()
 
+        self._events = plugin.events
+        plugin.events = MagicMock()
+
+        self._instrumentation = plugin.instrumentation
+        plugin.instrumentation = MagicMock()
+        plugin.instrumentation.instrument_action.side_effect = lambda name, function: function
+        plugin.instrumentation.instrument_auth.side_effect = lambda name, function: function
+
+        self._querylog = plugin.querylog
+        plugin.querylog = MagicMock()
+
         # plg = plugin
         self.datarequest_create = constants.DATAREQUEST_CREATE
         self.datarequest_show = constants.DATAREQUEST_SHOW
         self.datarequest_update = constants.DATAREQUEST_UPDATE
         self.datarequest_index = constants.DATAREQUEST_INDEX
         self.datarequest_delete = constants.DATAREQUEST_DELETE
+        self.datarequest_bulk_create = constants.DATAREQUEST_BULK_CREATE
+        self.datarequest_bulk_close = constants.DATAREQUEST_BULK_CLOSE
+        self.datarequest_bulk_delete = constants.DATAREQUEST_BULK_DELETE
         self.datarequest_comment = constants.DATAREQUEST_COMMENT
         self.datarequest_comment_list = constants.DATAREQUEST_COMMENT_LIST
         self.datarequest_comment_show = constants.DATAREQUEST_COMMENT_SHOW
@@ -68,6 +84,9 @@ class DataRequestPluginTest(unittest.TestCase):
         plugin.tk = self._tk
         plugin.helpers = self._helpers
         plugin.partial = self._partial
+        plugin.events = self._events
+        plugin.instrumentation = self._instrumentation
+        plugin.querylog = self._querylog
 
     @parameterized.expand([
         ('True',),
@@ -85,11 +104,19 @@ class DataRequestPluginTest(unittest.TestCase):
         actions = self.plg_instance.get_actions()
 
         self.assertEquals(actions_len, len(actions))
+        self.assertEquals(actions_len, plugin.instrumentation.instrument_action.call_count)
         self.assertEquals(plugin.actions.datarequest_create, actions[self.datarequest_create])
         self.assertEquals(plugin.actions.datarequest_show, actions[self.datarequest_show])
         self.assertEquals(plugin.actions.datarequest_update, actions[self.datarequest_update])
         self.assertEquals(plugin.actions.datarequest_index, actions[self.datarequest_index])
         self.assertEquals(plugin.actions.datarequest_delete, actions[self.datarequest_delete])
+        self.assertEquals(plugin.actions.datarequest_bulk_create, actions[self.datarequest_bulk_create])
+        self.assertEquals(plugin.actions.datarequest_bulk_close, actions[self.datarequest_bulk_close])
+        self.assertEquals(plugin.actions.datarequest_bulk_delete, actions[self.datarequest_bulk_delete])
+        self.assertEquals(plugin.actions.datarequest_changes_since, actions[constants.DATAREQUEST_CHANGES_SINCE])
+        self.assertEquals(plugin.actions.datarequest_stats, actions[constants.DATAREQUEST_STATS])
+        self.assertEquals(plugin.actions.datarequest_show_many, actions[constants.DATAREQUEST_SHOW_MANY])
+        self.assertEquals(plugin.actions.datarequest_list_for_dataset, actions[constants.DATAREQUEST_LIST_FOR_DATASET])
 
         if comments_enabled == 'True':
             self.assertEquals(plugin.actions.datarequest_comment, actions[self.datarequest_comment])
@@ -105,6 +132,7 @@ class DataRequestPluginTest(unittest.TestCase):
     def test_get_auth_functions(self, comments_enabled):
 
         auth_functions_len = TOTAL_ACTIONS if comments_enabled == 'True' else ACTIONS_NO_COMMENTS
+        auth_functions_len += EXTRA_AUTH_FUNCTIONS
 
         # Configure config and create instance
         plugin.config.get.return_value = comments_enabled
@@ -114,11 +142,22 @@ class DataRequestPluginTest(unittest.TestCase):
         auth_functions = self.plg_instance.get_auth_functions()
 
         self.assertEquals(auth_functions_len, len(auth_functions))
+        self.assertEquals(auth_functions_len, plugin.instrumentation.instrument_auth.call_count)
         self.assertEquals(plugin.auth.datarequest_create, auth_functions[self.datarequest_create])
         self.assertEquals(plugin.auth.datarequest_show, auth_functions[self.datarequest_show])
         self.assertEquals(plugin.auth.datarequest_update, auth_functions[self.datarequest_update])
         self.assertEquals(plugin.auth.datarequest_index, auth_functions[self.datarequest_index])
         self.assertEquals(plugin.auth.datarequest_delete, auth_functions[self.datarequest_delete])
+        self.assertEquals(plugin.auth.datarequest_bulk_create, auth_functions[self.datarequest_bulk_create])
+        self.assertEquals(plugin.auth.datarequest_bulk_close, auth_functions[self.datarequest_bulk_close])
+        self.assertEquals(plugin.auth.datarequest_bulk_delete, auth_functions[self.datarequest_bulk_delete])
+        self.assertEquals(plugin.auth.datarequest_export, auth_functions[constants.DATAREQUEST_EXPORT])
+        self.assertEquals(plugin.auth.datarequest_metrics, auth_functions[constants.DATAREQUEST_METRICS])
+        self.assertEquals(plugin.auth.datarequest_changes_since, auth_functions[constants.DATAREQUEST_CHANGES_SINCE])
+        self.assertEquals(plugin.auth.datarequest_stats, auth_functions[constants.DATAREQUEST_STATS])
+        self.assertEquals(plugin.auth.datarequest_show_many, auth_functions[constants.DATAREQUEST_SHOW_MANY])
+        self.assertEquals(plugin.auth.datarequest_list_for_dataset,
+                          auth_functions[constants.DATAREQUEST_LIST_FOR_DATASET])
 
         if comments_enabled == 'True':
             self.assertEquals(plugin.auth.datarequest_comment, auth_functions[self.datarequest_comment])
@@ -127,6 +166,32 @@ class DataRequestPluginTest(unittest.TestCase):
             self.assertEquals(plugin.auth.datarequest_comment_update, auth_functions[self.datarequest_comment_update])
             self.assertEquals(plugin.auth.datarequest_comment_delete, auth_functions[self.datarequest_comment_delete])
 
+    @parameterized.expand([
+        ('True',),
+        ('False',)
+    ])
+    def test_notifications_subscription(self, notifications_enabled):
+        plugin.config.get.return_value = notifications_enabled
+
+        self.plg_instance = plugin.DataRequestsPlugin()
+
+        if notifications_enabled == 'True':
+            plugin.events.subscribe.assert_called_once_with(plugin.notifications.record_event)
+        else:
+            self.assertEquals(0, plugin.events.subscribe.call_count)
+
+    def test_instrumentation_configuration(self):
+        plugin.config = {
+            'ckan.datarequests.slow_action_threshold': '500',
+            'ckan.datarequests.slow_query_threshold': '100',
+            'ckan.datarequests.slow_query_explain_rate': '0.1'
+        }
+
+        self.plg_instance = plugin.DataRequestsPlugin()
+
+        plugin.instrumentation.configure.assert_called_once_with('500')
+        plugin.querylog.configure.assert_called_once_with('100', '0.1')
+
     def test_update_config(self):
         # Create instance
         self.plg_instance = plugin.DataRequestsPlugin()
@@ -142,7 +207,7 @@ class DataRequestPluginTest(unittest.TestCase):
     ])
     def test_before_map(self, comments_enabled):
 
-        urls_set = 10
+        urls_set = 12
         mapa_calls = urls_set if comments_enabled == 'True' else urls_set - 2
 
         # Configure config and get instance
@@ -163,6 +228,14 @@ class DataRequestPluginTest(unittest.TestCase):
             controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
             action='new', conditions=dict(method=['GET', 'POST']))
 
+        mapa.connect.assert_any_call('datarequests_export', '/%s/export' % dr_basic_path,
+            controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+            action='export', conditions=dict(method=['GET']))
+
+        mapa.connect.assert_any_call('datarequests_metrics', '/%s/metrics' % dr_basic_path,
+            controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
+            action='metrics', conditions=dict(method=['GET']))
+
         mapa.connect.assert_any_call('datarequest_show', '/%s/{id}' % dr_basic_path,
             controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
             action='show', conditions=dict(method=['GET']), ckan_icon='question-sign')
@@ -200,18 +273,28 @@ class DataRequestPluginTest(unittest.TestCase):
                 controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
                 action='delete_comment', conditions=dict(method=['GET', 'POST']))
 
+    def test_edit(self):
+        self.plg_instance = plugin.DataRequestsPlugin()
+        entity = MagicMock()
+
+        self.plg_instance.edit(entity)
+
+        # Organizations and datasets are handled by the same method
+        plugin.helpers.update_related_names.assert_called_once_with(entity)
+
     @parameterized.expand([
-        ('True',  'True'),
-        ('True',  'False'),
-        ('False', 'True'),
-        ('False', 'False')
+        ('True',  'True',  'True'),
+        ('True',  'False', 'False'),
+        ('False', 'True',  'False'),
+        ('False', 'False', 'True')
     ])
-    def test_helpers(self, comments_enabled, show_datarequests_badge):
+    def test_helpers(self, comments_enabled, show_datarequests_badge, show_dataset_datarequests):
 
         # Configure config and get instance
         plugin.config = {
             'ckan.datarequests.comments': comments_enabled,
-            'ckan.datarequests.show_datarequests_badge': show_datarequests_badge
+            'ckan.datarequests.show_datarequests_badge': show_datarequests_badge,
+            'ckan.datarequests.show_dataset_datarequests': show_dataset_datarequests
         }
         self.plg_instance = plugin.DataRequestsPlugin()
 
@@ -223,6 +306,8 @@ class DataRequestPluginTest(unittest.TestCase):
         self.assertEquals(helpers['get_comments_badge'], plugin.helpers.get_comments_badge)
         self.assertEquals(helpers['get_open_datarequests_number'], plugin.helpers.get_open_datarequests_number)
         self.assertEquals(helpers['get_open_datarequests_badge'], plugin.partial.return_value)
+        self.assertEquals(helpers['show_dataset_datarequests'](), show_dataset_datarequests == 'True')
+        self.assertEquals(helpers['get_dataset_datarequests'], plugin.helpers.get_dataset_datarequests)
 
         # Check that partial has been called
         show_datarequests_expected = True if show_datarequests_badge == 'True' else False
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.querylog as querylog
+import json
+import sqlalchemy as sa
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+class QueryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self._log = querylog.log
+        querylog.log = MagicMock()
+
+        self._random = querylog.random
+        querylog.random = MagicMock()
+
+        self.engine = sa.create_engine('sqlite://')
+        self.engine.execute('CREATE TABLE datarequests_test (id INTEGER)')
+
+    def tearDown(self):
+        querylog.log = self._log
+        querylog.random = self._random
+        querylog.configure(None)
+
+    def _records(self):
+        records = []
+        for call in querylog.log.warning.call_args_list:
+            message = call[0][0]
+            self.assertTrue(message.startswith('Slow query: '))
+            records.append(json.loads(message[len('Slow query: '):]))
+        return records
+
+    def test_disabled(self):
+        querylog.configure(None)
+
+        self.engine.execute('SELECT * FROM datarequests_test')
+
+        self.assertEquals(0, querylog.log.warning.call_count)
+
+    def test_slow_queries(self):
+        querylog.configure(0)
+
+        self.engine.execute('SELECT * FROM datarequests_test WHERE id = ?', 3)
+        self.engine.execute('SELECT 1')
+
+        # Only the statements on the tables of the extension are logged
+        records = self._records()
+        self.assertEquals(1, len(records))
+        self.assertEquals('SELECT * FROM datarequests_test WHERE id = ?', records[0]['statement'])
+        self.assertEquals([3], records[0]['parameters'])
+        self.assertTrue(records[0]['duration_ms'] >= 0)
+        self.assertNotIn('plan', records[0])
+
+    def test_failed_query(self):
+        querylog.configure(0)
+        self._timeit = querylog.timeit
+        querylog.timeit = MagicMock()
+        querylog.timeit.default_timer.side_effect = [1.0, 5.0, 5.5]
+
+        try:
+            with self.engine.connect() as conn:
+                self.assertRaises(sa.exc.OperationalError, conn.execute, 'SELECT * FROM datarequests_missing')
+                self.assertNotIn('datarequests_slow_query_start', conn.info)
+                conn.execute('SELECT * FROM datarequests_test')
+        finally:
+            querylog.timeit = self._timeit
+
+        # The start time of the failed statement is not kept on the connection
+        records = self._records()
+        self.assertEquals(1, len(records))
+        self.assertEquals(500, records[0]['duration_ms'])
+
+    def test_fast_queries(self):
+        querylog.configure(60000)
+
+        self.engine.execute('SELECT * FROM datarequests_test')
+
+        self.assertEquals(0, querylog.log.warning.call_count)
+
+    @parameterized.expand([
+        (0.5, 0.4, True),
+        (0.5, 0.6, False)
+    ])
+    def test_sampled_explain(self, rate, random_value, explained):
+        querylog.random.random.return_value = random_value
+        querylog.configure(0, rate)
+
+        self.engine.execute('SELECT * FROM datarequests_test')
+
+        # Plans are only captured in PostgreSQL
+        records = self._records()
+        self.assertEquals(explained, 'plan' in records[0])
+        if explained:
+            self.assertIsNone(records[0]['plan'])
+
+    def _connection(self, dialect='postgresql'):
+        conn = MagicMock()
+        conn.dialect.name = dialect
+        cursor = conn.connection.cursor.return_value
+        cursor.fetchall.return_value = [('Index Scan using idx on datarequests',), ('Buffers: shared hit=4',)]
+        return conn, cursor
+
+    def test_explain(self):
+        conn, cursor = self._connection()
+
+        plan = querylog._explain(conn, 'SELECT * FROM datarequests WHERE id = %(id)s', {'id': 'dr'})
+
+        # The EXPLAIN is run in a savepoint of the current transaction
+        self.assertEquals([
+            (('SAVEPOINT datarequests_explain',),),
+            (('EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM datarequests WHERE id = %(id)s', {'id': 'dr'}),),
+            (('RELEASE SAVEPOINT datarequests_explain',),)
+        ], [(call[0],) for call in cursor.execute.call_args_list])
+        self.assertEquals(['Index Scan using idx on datarequests', 'Buffers: shared hit=4'], plan)
+        cursor.close.assert_called_once_with()
+
+    @parameterized.expand([
+        ('sqlite', 'SELECT * FROM datarequests'),
+        ('postgresql', 'UPDATE datarequests SET closed = true'),
+        ('postgresql', 'DELETE FROM datarequests_comments')
+    ])
+    def test_explain_not_captured(self, dialect, statement):
+        conn, cursor = self._connection(dialect)
+
+        self.assertIsNone(querylog._explain(conn, statement, {}))
+        self.assertEquals(0, cursor.execute.call_count)
+
+    def test_explain_error(self):
+        conn, cursor = self._connection()
+
+        def _execute(statement, parameters=None):
+            if statement.startswith('EXPLAIN'):
+                raise Exception('canceling statement due to statement timeout')
+
+        cursor.execute.side_effect = _execute
+
+        self.assertIsNone(querylog._explain(conn, 'SELECT * FROM datarequests', {}))
+        cursor.close.assert_called_once_with()
+
+        # Only the savepoint is rolled back, so the transaction of the caller is not aborted
+        self.assertEquals(['SAVEPOINT datarequests_explain', 'EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM datarequests',
+                           'ROLLBACK TO SAVEPOINT datarequests_explain', 'RELEASE SAVEPOINT datarequests_explain'],
+                          [call[0][0] for call in cursor.execute.call_args_list])
+
+    def test_explain_savepoint_error(self):
+        conn, cursor = self._connection()
+        cursor.execute.side_effect = Exception('Error')
+
+        self.assertIsNone(querylog._explain(conn, 'SELECT * FROM datarequests', {}))
+        self.assertEquals(1, cursor.execute.call_count)
+        cursor.close.assert_called_once_with()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.resolver as resolver
+import hashlib
+import unittest
+
+from collections import namedtuple
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+
+Row = namedtuple('Row', ['id', 'name', 'title', 'state'])
+UserRow = namedtuple('UserRow', ['id', 'name', 'fullname', 'email'])
+PackageRow = namedtuple('PackageRow', ['id', 'name', 'title', 'state', 'private'])
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = resolver.time
+        resolver.time = MagicMock()
+        resolver.time.time.return_value = 100
+
+    def tearDown(self):
+        resolver.time = self._time
+
+    def test_get_set(self):
+        cache = resolver.TTLCache(10, 5)
+        cache.set('a', 1)
+
+        self.assertEquals(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+    def test_expiration(self):
+        cache = resolver.TTLCache(10, 5)
+        cache.set('a', 1)
+
+        resolver.time.time.return_value = 110
+        self.assertIsNone(cache.get('a'))
+
+    @parameterized.expand([
+        (112, ['b', 'c']),
+        (107, ['c'])
+    ])
+    def test_max_size(self, now, expected_keys):
+        cache = resolver.TTLCache(10, 2)
+        cache.set('a', 1)
+        resolver.time.time.return_value = 106
+        cache.set('b', 2)
+
+        # Expired entries are removed first. If none has expired, all of them are removed
+        resolver.time.time.return_value = now
+        cache.set('c', 3)
+
+        self.assertEquals(sorted(expected_keys), sorted(cache._entries.keys()))
+
+    def test_get_recorded(self):
+        cache = resolver.TTLCache(10, 5, 'organizations')
+        cache.set('a', 1)
+
+        with resolver.instrumentation.Recorder() as recorder:
+            cache.get('a')
+            cache.get('b')
+
+        self.assertEquals({'organizations': 1}, recorder.cache_hits)
+        self.assertEquals({'organizations': 1}, recorder.cache_misses)
+
+    def test_clear(self):
+        cache = resolver.TTLCache(10, 5)
+        cache.set('a', 1)
+        cache.clear()
+
+        self.assertIsNone(cache.get('a'))
+
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tk = resolver.instrumentation.tk
+        resolver.instrumentation.tk = MagicMock()
+        resolver.clear()
+
+        self._model = resolver.model
+        resolver.model = MagicMock()
+
+        self._or_ = resolver.or_
+        resolver.or_ = MagicMock()
+
+        self.organization_show = MagicMock(side_effect=lambda context, data_dict: {
+            'id': data_dict['id'] + '_id', 'name': data_dict['id'], 'display_name': data_dict['id'].upper(),
+            'users': []
+        })
+        self.user_show = MagicMock(return_value={'id': 'user_id', 'name': 'user'})
+        actions = {'organization_show': self.organization_show, 'user_show': self.user_show}
+        resolver.instrumentation.tk.get_action.side_effect = lambda action: actions[action]
+
+    def tearDown(self):
+        resolver.instrumentation.tk = self._tk
+        resolver.model = self._model
+        resolver.or_ = self._or_
+        resolver.clear()
+
+    def test_get_organization(self):
+        expected = {'id': 'org_id', 'name': 'org', 'display_name': 'ORG', 'state': None}
+
+        self.assertEquals(expected, resolver.get_organization('org'))
+        self.assertEquals(expected, resolver.get_organization('org'))
+        self.assertEquals('org_id', resolver.get_organization_id('org_id'))
+
+        # The organization is retrieved once and then found by name and by ID
+        self.organization_show.assert_called_once_with(
+            {'ignore_auth': True}, dict(resolver.ORGANIZATION_SHOW_PARAMS, id='org'))
+
+    def test_store_organization(self):
+        resolver.store_organization({'id': 'org_id', 'name': 'org', 'display_name': 'Org', 'packages': []})
+
+        self.assertEquals({'id': 'org_id', 'name': 'org', 'display_name': 'Org', 'state': None},
+                          resolver.get_organization('org'))
+        self.assertEquals('org_id', resolver.get_organization_id('org_id'))
+        self.assertEquals(0, self.organization_show.call_count)
+
+    def test_get_organization_not_found(self):
+        self.organization_show.side_effect = self._tk.ObjectNotFound('Not found')
+
+        with self.assertRaises(self._tk.ObjectNotFound):
+            resolver.get_organization('missing')
+
+    def test_get_organizations(self):
+        resolver.store_organization({'id': 'cached_id', 'name': 'cached', 'display_name': 'Cached', 'state': 'active'})
+        query = resolver.model.Session.query.return_value.filter.return_value
+        query.all.return_value = [Row('org1_id', 'org1', u'Org 1', 'active'), Row('org2', 'org2_name', u'', 'deleted')]
+
+        result = resolver.get_organizations(['org1', 'org2', 'cached', 'missing'])
+
+        # Only the organizations that are not cached are retrieved, in a single query
+        self.assertEquals(1, resolver.model.Session.query.call_count)
+        self.assertEquals(1, query.all.call_count)
+        self.assertEquals({
+            'org1': {'id': 'org1_id', 'name': 'org1', 'display_name': u'Org 1', 'state': 'active'},
+            'org2': {'id': 'org2', 'name': 'org2_name', 'display_name': 'org2_name', 'state': 'deleted'},
+            'cached': {'id': 'cached_id', 'name': 'cached', 'display_name': 'Cached', 'state': 'active'}
+        }, result)
+
+        # Retrieved organizations are cached
+        self.assertEquals(result['org1'], resolver.get_organization('org1_id'))
+        self.assertEquals(0, self.organization_show.call_count)
+
+    def test_get_organizations_cached(self):
+        resolver.store_organization({'id': 'org_id', 'name': 'org', 'display_name': 'Org'})
+
+        self.assertEquals(['org'], resolver.get_organizations(['org']).keys())
+        self.assertEquals(0, resolver.model.Session.query.call_count)
+
+    def test_get_user_id(self):
+        self.assertEquals('user_id', resolver.get_user_id('user'))
+        self.assertEquals('user_id', resolver.get_user_id('user'))
+        self.assertEquals('user_id', resolver.get_user_id('user_id'))
+
+        self.user_show.assert_called_once_with({'ignore_auth': True}, {'id': 'user'})
+
+    def test_store_user(self):
+        resolver.store_user({'id': 'user_id', 'name': 'user'})
+
+        self.assertEquals('user_id', resolver.get_user_id('user'))
+        self.assertEquals(0, self.user_show.call_count)
+
+    def _packages_query(self):
+        query = resolver.model.Session.query.return_value.filter.return_value
+        query.all.return_value = [PackageRow('pkg1_id', 'pkg1', u'Dataset 1', 'active', False),
+                                  PackageRow('pkg2_id', 'pkg2', u'', 'active', False),
+                                  PackageRow('private_id', 'private', u'Private', 'active', True),
+                                  PackageRow('deleted_id', 'deleted', u'Deleted', 'deleted', False)]
+
+    def test_get_packages(self):
+        self._packages_query()
+
+        result = resolver.get_packages(['pkg1', 'pkg2_id', 'private', 'deleted_id', 'missing'])
+
+        # Only the required columns are read, in a single query. Private and
+        # deleted datasets are not returned
+        package = resolver.model.Package
+        resolver.model.Session.query.assert_called_once_with(package.id, package.name, package.title,
+                                                             package.state, package.private)
+        self.assertEquals({
+            'pkg1': {'id': 'pkg1_id', 'name': 'pkg1', 'display_name': u'Dataset 1', 'state': 'active', 'private': False},
+            'pkg2_id': {'id': 'pkg2_id', 'name': 'pkg2', 'display_name': 'pkg2', 'state': 'active', 'private': False}
+        }, result)
+
+    def test_get_packages_include_private(self):
+        self._packages_query()
+
+        result = resolver.get_packages(['private', 'deleted_id'], include_private=True)
+
+        self.assertEquals(['deleted_id', 'private'], sorted(result))
+        self.assertFalse(resolver.is_public_package(result['private']))
+        self.assertFalse(resolver.is_public_package(result['deleted_id']))
+
+    def test_get_packages_empty(self):
+        self.assertEquals({}, resolver.get_packages([]))
+        self.assertEquals(0, resolver.model.Session.query.call_count)
+
+    def test_get_users(self):
+        query = resolver.model.Session.query.return_value.filter.return_value
+        query.all.return_value = [UserRow('user1_id', 'user1', u'User 1', ' User1@Example.com '),
+                                  UserRow('user2_id', 'user2', u'', None)]
+
+        result = resolver.get_users(['user1', 'user2_id', 'missing'])
+
+        # Only the required columns are read, in a single query
+        user = resolver.model.User
+        resolver.model.Session.query.assert_called_once_with(user.id, user.name, user.fullname, user.email)
+        self.assertEquals(['user1', 'user2_id'], sorted(result.keys()))
+        self.assertEquals({
+            'id': 'user1_id',
+            'name': 'user1',
+            'display_name': u'User 1',
+            'email_hash': hashlib.md5('user1@example.com').hexdigest()
+        }, result['user1'].as_dict())
+        self.assertEquals({
+            'id': 'user2_id',
+            'name': 'user2',
+            'display_name': 'user2',
+            'email_hash': hashlib.md5('').hexdigest()
+        }, result['user2_id'].as_dict())
+
+        # Users are cached by ID and by name
+        self.assertIs(result['user1'], resolver.get_user('user1_id'))
+        self.assertIs(result['user2_id'], resolver.get_user('user2'))
+        self.assertEquals(1, query.all.call_count)
+
+    def test_get_user_not_found(self):
+        resolver.model.Session.query.return_value.filter.return_value.all.return_value = []
+
+        self.assertIsNone(resolver.get_user('missing'))
+
+    def test_user_summary_slots(self):
+        summary = resolver.UserSummary('user_id', 'user', 'User', 'hash')
+
+        # Summaries do not have a __dict__, so no other attribute can be stored
+        with self.assertRaises(AttributeError):
+            summary.email = 'user@example.com'
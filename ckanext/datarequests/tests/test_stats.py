@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 CoNWeT Lab., Universidad Politécnica de Madrid
+
+# This file is part of CKAN Data Requests Extension.
+
+# CKAN Data Requests Extension is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# CKAN Data Requests Extension is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
+
+import ckanext.datarequests.stats as stats
+import datetime
+import unittest
+
+from mock import MagicMock
+from nose_parameterized import parameterized
+
+DAY_1 = datetime.date(2016, 1, 1)
+DAY_2 = datetime.date(2016, 1, 2)
+
+
+def _datarequest(organization_id='org', closed=False, hours_to_close=None, id='dr'):
+    open_time = datetime.datetime(2016, 1, 1, 10)
+    close_time = open_time + datetime.timedelta(hours=hours_to_close) if hours_to_close is not None else None
+    return MagicMock(id=id, organization_id=organization_id, open_time=open_time,
+                     closed=closed, close_time=close_time)
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = stats.model
+        stats.model = MagicMock()
+
+        self._db = stats.db
+        stats.db = MagicMock()
+
+    def tearDown(self):
+        stats.model = self._model
+        stats.db = self._db
+
+    def test_opened_deltas(self):
+        self.assertEquals({(u'', DAY_1, stats.OPENED): 1}, stats.opened_deltas(_datarequest(organization_id=None)))
+
+    @parameterized.expand([
+        (False, None, {}),
+        (True,  None, {}),
+        (True,  14, {
+            ('org', DAY_2, stats.CLOSED): -1,
+            ('org', DAY_2, stats.TIME_TO_CLOSE): -14 * 3600,
+            ('org', DAY_2, stats.TIME_TO_CLOSE_BUCKET % 24): -1
+        }),
+        (True,  24 * 400, {
+            ('org', datetime.date(2017, 2, 4), stats.CLOSED): -1,
+            ('org', datetime.date(2017, 2, 4), stats.TIME_TO_CLOSE): -24 * 400 * 3600,
+            ('org', datetime.date(2017, 2, 4), stats.TIME_TO_CLOSE_BUCKET % 'inf'): -1
+        })
+    ])
+    def test_closed_deltas(self, closed, hours_to_close, expected_deltas):
+        datarequest = _datarequest(closed=closed, hours_to_close=hours_to_close)
+        self.assertEquals(expected_deltas, stats.closed_deltas(datarequest, -1))
+
+    def test_datarequest_deltas(self):
+        deltas = stats.merge_deltas(stats.datarequest_deltas(_datarequest(closed=True, hours_to_close=1)),
+                                    stats.comment_deltas('org', datetime.datetime(2016, 1, 1, 12)),
+                                    stats.comment_deltas('org', datetime.datetime(2016, 1, 1, 13)))
+
+        self.assertEquals({
+            ('org', DAY_1, stats.OPENED): 1,
+            ('org', DAY_1, stats.CLOSED): 1,
+            ('org', DAY_1, stats.TIME_TO_CLOSE): 3600,
+            ('org', DAY_1, stats.TIME_TO_CLOSE_BUCKET % 1): 1,
+            ('org', DAY_1, stats.COMMENTS): 2
+        }, deltas)
+
+    def test_moved_deltas(self):
+        deltas = stats.moved_deltas(_datarequest(organization_id='new_org', closed=True, hours_to_close=1), 'org')
+
+        self.assertEquals({
+            ('org', DAY_1, stats.OPENED): -1,
+            ('org', DAY_1, stats.CLOSED): -1,
+            ('org', DAY_1, stats.TIME_TO_CLOSE): -3600,
+            ('org', DAY_1, stats.TIME_TO_CLOSE_BUCKET % 1): -1,
+            ('new_org', DAY_1, stats.OPENED): 1,
+            ('new_org', DAY_1, stats.CLOSED): 1,
+            ('new_org', DAY_1, stats.TIME_TO_CLOSE): 3600,
+            ('new_org', DAY_1, stats.TIME_TO_CLOSE_BUCKET % 1): 1
+        }, deltas)
+
+    def test_moved_deltas_same_organization(self):
+        self.assertEquals({}, stats.moved_deltas(_datarequest(), 'org'))
+
+    def test_apply_deltas(self):
+        stats.apply_deltas({
+            ('org2', DAY_1, stats.OPENED): 1,
+            ('org1', DAY_2, stats.OPENED): -1,
+            ('org1', DAY_1, stats.OPENED): 0,
+            ('org1', DAY_1, stats.CLOSED): 1
+        })
+
+        # Rows are always updated in the same order and zero deltas are skipped
+        self.assertEquals([
+            (('org1', DAY_1, stats.CLOSED, 1), {}),
+            (('org1', DAY_2, stats.OPENED, -1), {}),
+            (('org2', DAY_1, stats.OPENED, 1), {})
+        ], stats.db.Stat.increment.call_args_list)
+
+        # Closed data requests are no longer open
+        self.assertEquals([
+            (('org1', -2, 1, None), {}),
+            (('org2', 1, 0, None), {})
+        ], stats.db.OrganizationSummary.update.call_args_list)
+
+    def test_apply_deltas_activity(self):
+        time = datetime.datetime(2016, 1, 1, 12)
+
+        stats.apply_deltas(stats.comment_deltas(None, time), {None: time, 'org': time})
+
+        stats.db.Stat.increment.assert_called_once_with(u'', DAY_1, stats.COMMENTS, 1)
+        self.assertEquals([
+            ((u'', 0, 0, time), {}),
+            (('org', 0, 0, time), {})
+        ], stats.db.OrganizationSummary.update.call_args_list)
+
+    def test_rebuild(self):
+        stats.db.DataRequest.iterate_by_id.return_value = [
+            [_datarequest(id='dr1'), _datarequest(id='dr2', organization_id=None)],
+            [_datarequest(id='dr3', closed=True, hours_to_close=2)]
+        ]
+        stats.db.Comment.iterate_by_id.return_value = [[
+            MagicMock(datarequest_id='dr1', time=datetime.datetime(2016, 1, 2)),
+            MagicMock(datarequest_id='deleted', time=datetime.datetime(2016, 1, 2))
+        ]]
+
+        rows = stats.rebuild(batch_size=2)
+
+        stats.db.init_db.assert_called_once_with(stats.model)
+        stats.db.Stat.delete_all.assert_called_once_with()
+        inserted = [row for call in stats.db.Stat.insert_many.call_args_list for row in call[0][0]]
+        self.assertEquals([
+            {'organization_id': u'', 'day': DAY_1, 'metric': stats.OPENED, 'value': 1},
+            {'organization_id': 'org', 'day': DAY_1, 'metric': stats.CLOSED, 'value': 1},
+            {'organization_id': 'org', 'day': DAY_1, 'metric': stats.OPENED, 'value': 2},
+            {'organization_id': 'org', 'day': DAY_1, 'metric': stats.TIME_TO_CLOSE, 'value': 7200},
+            {'organization_id': 'org', 'day': DAY_1, 'metric': stats.TIME_TO_CLOSE_BUCKET % 6, 'value': 1},
+            {'organization_id': 'org', 'day': DAY_2, 'metric': stats.COMMENTS, 'value': 1}
+        ], inserted)
+        self.assertEquals(6, rows)
+        self.assertEquals(3, stats.db.Stat.insert_many.call_count)
+        stats.db.OrganizationSummary.refresh.assert_called_once_with()
+        stats.model.Session.commit.assert_called_once_with()
+
+    @parameterized.expand([
+        ('', None),
+        (None, None),
+        ('2016-01-02', DAY_2)
+    ])
+    def test_parse_day(self, value, expected_day):
+        self.assertEquals(expected_day, stats.parse_day(value))
+
+    def test_parse_day_invalid(self):
+        with self.assertRaises(ValueError):
+            stats.parse_day('2016-02-30')
+
+    @parameterized.expand([
+        ({}, None),
+        ({stats.TIME_TO_CLOSE_BUCKET % 1: 1}, 0.5),
+        ({stats.TIME_TO_CLOSE_BUCKET % 1: 1, stats.TIME_TO_CLOSE_BUCKET % 24: 3}, 12.0),
+        ({stats.TIME_TO_CLOSE_BUCKET % 'inf': 2}, 8760.0)
+    ])
+    def test_median_time_to_close(self, metrics, expected_median):
+        self.assertEquals(expected_median, stats._median_time_to_close(metrics))
+
+    def test_get_stats(self):
+        stats.db.Stat.get_totals.return_value = [
+            (u'', stats.OPENED, 1),
+            (u'org', stats.CLOSED, 2),
+            (u'org', stats.COMMENTS, 5),
+            (u'org', stats.OPENED, 3),
+            (u'org', stats.TIME_TO_CLOSE, 3 * 3600),
+            (u'org', stats.TIME_TO_CLOSE_BUCKET % 1, 1),
+            (u'org', stats.TIME_TO_CLOSE_BUCKET % 6, 1)
+        ]
+
+        result = stats.get_stats(since=DAY_1)
+
+        stats.db.Stat.get_totals.assert_called_once_with(None, DAY_1, None, None)
+        self.assertEquals({
+            'results': [{
+                'organization_id': None,
+                'opened': 1,
+                'closed': 0,
+                'comments': 0,
+                'mean_time_to_close': None,
+                'median_time_to_close': None
+            }, {
+                'organization_id': u'org',
+                'opened': 3,
+                'closed': 2,
+                'comments': 5,
+                'mean_time_to_close': 1.5,
+                'median_time_to_close': 1.0
+            }],
+            'total': {
+                'opened': 4,
+                'closed': 2,
+                'comments': 5,
+                'mean_time_to_close': 1.5,
+                'median_time_to_close': 1.0
+            }
+        }, result)
+
+    def test_get_stats_period(self):
+        stats.db.Stat.get_totals.return_value = [
+            (u'org', DAY_1, stats.OPENED, 1),
+            (u'org', datetime.date(2016, 2, 1), stats.OPENED, 2)
+        ]
+
+        result = stats.get_stats(u'org', period='month')
+
+        stats.db.Stat.get_totals.assert_called_once_with(u'org', None, None, 'month')
+        self.assertEquals(['2016-01', '2016-02'], [r['period'] for r in result['results']])
+        self.assertEquals([1, 2], [r['opened'] for r in result['results']])
+        self.assertEquals(3, result['total']['opened'])
@@ -19,6 +19,9 @@
 
 import ckanext.datarequests.constants as constants
 import ckanext.datarequests.controllers.ui_controller as controller
+import jinja2
+import os
+import sqlalchemy as sa
 import unittest
 
 from mock import MagicMock
@@ -28,6 +31,7 @@ from nose_parameterized import parameterized
 INDEX_FUNCTION = 'index'
 ORGANIZATION_DATAREQUESTS_FUNCTION = 'organization_datarequests'
 USER_DATAREQUESTS_FUNCTION = 'user_datarequests'
+TEMPLATES_DIR = os.path.join(os.path.dirname(controller.__file__), '..', 'templates')
 
 
 class UIControllerTest(unittest.TestCase):
@@ -61,6 +65,19 @@ class UIControllerTest(unittest.TestCase):
         self._base = controller.base
         controller.base = MagicMock()
 
+        self._response = controller.response
+        controller.response = MagicMock()
+        controller.response.headers = {}
+
+        self._exporter = controller.exporter
+        controller.exporter = MagicMock()
+
+        self._resolver = controller.resolver
+        controller.resolver = MagicMock()
+
+        self._instrumentation = controller.instrumentation
+        controller.instrumentation = MagicMock()
+
         self._datarequests_per_page = controller.constants.DATAREQUESTS_PER_PAGE
 
         self.expected_context = {
@@ -81,6 +98,10 @@ class UIControllerTest(unittest.TestCase):
         controller.request = self._request
         controller.helpers = self._helpers
         controller.base = self._base
+        controller.response = self._response
+        controller.exporter = self._exporter
+        controller.resolver = self._resolver
+        controller.instrumentation = self._instrumentation
         controller.constants.DATAREQUESTS_PER_PAGE = self._datarequests_per_page
 
 
@@ -446,7 +467,8 @@ class UIControllerTest(unittest.TestCase):
         result = self.controller_instance.index()
 
         # Assertions
-        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0, 'sort': 'desc'}
+        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0, 'sort': 'desc',
+                             'fields': constants.DATAREQUEST_LIST_FIELDS}
         controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_INDEX, self.expected_context, expected_data_req)
         controller.tk.abort.assert_called_once_with(403, 'Unauthorized to list Data Requests')
         self.assertEquals(0, controller.tk.get_action.call_count)
@@ -466,6 +488,48 @@ class UIControllerTest(unittest.TestCase):
         self.assertEquals(0, controller.tk.render.call_count)
         self.assertIsNone(result)
 
+    def test_call_records_request(self):
+        base_call = MagicMock()
+        controller.base.BaseController = type('BaseController', (object,), {'__call__': base_call})
+        environ = {'pylons.routes_dict': {'action': 'index'}}
+        start_response = MagicMock()
+
+        # Call the function
+        result = self.controller_instance(environ, start_response)
+
+        # The whole request is recorded
+        controller.instrumentation.record_request.assert_called_once_with('ui:index')
+        base_call.assert_called_once_with(self.controller_instance, environ, start_response)
+        self.assertEquals(base_call.return_value, result)
+
+    def test_index_queries_do_not_grow_with_page_size(self):
+        engine = sa.create_engine('sqlite://')
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES_DIR), extensions=['jinja2.ext.i18n'])
+        env.install_null_translations()
+        item = env.get_template('datarequests/snippets/datarequest_item.html')
+
+        # Helpers that read from the data base run real queries
+        h = MagicMock()
+        h.show_comments_tab.return_value = True
+        h.get_comments_number.side_effect = lambda datarequest_id: engine.execute('SELECT 1').scalar()
+        controller.tk.render.side_effect = lambda template: u''.join(
+            item.render(datarequest=datarequest, h=h) for datarequest in controller.c.datarequests)
+        controller.instrumentation = self._instrumentation
+        controller.request.GET = {}
+
+        def _queries(page_size):
+            datarequests = [{'id': 'dr%d' % i, 'title': u'Title', 'excerpt': u'Excerpt', 'closed': False,
+                             'open_time': '2016-01-01 00:00:00', 'comments_count': i} for i in range(page_size)]
+            controller.tk.get_action.return_value.return_value = {'count': page_size, 'result': datarequests,
+                                                                  'facets': {}}
+            with self._instrumentation.record_request('ui:index') as recorder:
+                self.controller_instance.index()
+            return len(recorder.queries)
+
+        # The rows of the list (including the templates) do not run a query each
+        self.assertEquals(_queries(1), _queries(constants.DATAREQUESTS_PER_PAGE))
+        self.assertEquals(0, h.get_comments_number.call_count)
+
     @parameterized.expand([
         (INDEX_FUNCTION, '1', 'conwet', '', 0,    10),
         (INDEX_FUNCTION, '2', 'conwet', '', 10,   10),
@@ -477,6 +541,9 @@ class UIControllerTest(unittest.TestCase):
         (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'asc'),
         (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'desc'),
         (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'invalid'),
+        (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'most_commented'),
+        (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'recently_active'),
+        (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, 'recently_closed'),
         (INDEX_FUNCTION, '1', None,     '', 0,    10, 10, None,   'free-text'),
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10),
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '2', 'conwet', '',     10,   10),
@@ -487,6 +554,7 @@ class UIControllerTest(unittest.TestCase):
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10, 10, 'asc'),
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10, 10, 'desc'),
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10, 10, 'invalid', ''),
+        (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10, 10, 'recently_active'),
         (ORGANIZATION_DATAREQUESTS_FUNCTION, '1', 'conwet', '',     0,    10, 10, None,      'free-text'),
         (USER_DATAREQUESTS_FUNCTION,         '1', 'conwet', 'ckan', 0,    10),
         (USER_DATAREQUESTS_FUNCTION,         '1', '',       'ckan', 0,    10),
@@ -504,13 +572,15 @@ class UIControllerTest(unittest.TestCase):
         user_show_action = 'user_show'
         organization_show_action = 'organization_show'
         base_url = 'http://someurl.com/somepath/otherpath'
-        expected_sort = sort if sort and sort in ['asc', 'desc'] else 'desc'
+        expected_sort = sort if sort and sort in constants.DATAREQUESTS_SORTS else 'desc'
 
         # Expected data_dict
+        # Only the fields shown in the list are requested
         expected_data_dict = {
             'offset': expected_offset,
             'limit': expected_limit,
-            'sort': expected_sort
+            'sort': expected_sort,
+            'fields': constants.DATAREQUEST_LIST_FIELDS
         }
 
         if query:
@@ -581,6 +651,7 @@ class UIControllerTest(unittest.TestCase):
             controller.tk.get_action.assert_any_call(organization_show_action)
             self.assertEquals(organization_show.return_value, controller.c.group_dict)
             organization_show.assert_called_once_with(self.expected_context, {'id': organization})
+            controller.resolver.store_organization.assert_called_once_with(controller.c.group_dict)
             expected_render_page = 'organization/datarequests.html'
         elif func == USER_DATAREQUESTS_FUNCTION:
             self.assertEquals(2, controller.tk.get_action.call_count)
@@ -588,6 +659,7 @@ class UIControllerTest(unittest.TestCase):
             controller.tk.get_action.assert_any_call(user_show_action)
             self.assertEquals(user_show.return_value, controller.c.user_dict)
             user_show.assert_called_once_with(self.expected_context, {'id': user, 'include_num_followers': True})
+            controller.resolver.store_user.assert_called_once_with(controller.c.user_dict)
             expected_render_page = 'user/datarequests.html'
 
         # Check the values put in c
@@ -980,3 +1052,67 @@ class UIControllerTest(unittest.TestCase):
             controller='ckanext.datarequests.controllers.ui_controller:DataRequestsUI',
             action='comment', id=datarequest_id)
         controller.base.redirect.assert_called_once_with(controller.helpers.url_for.return_value)
+
+    ######################################################################
+    ############################### EXPORT ###############################
+    ######################################################################
+
+    def test_export_not_authorized(self):
+        controller.request.GET = {}
+        controller.tk.check_access.side_effect = controller.tk.NotAuthorized('User not authorized')
+
+        result = self.controller_instance.export()
+
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_EXPORT, self.expected_context, None)
+        controller.tk.abort.assert_called_once_with(403, 'You are not authorized to export the Data Requests')
+        self.assertEquals(0, controller.exporter.export_datarequests.call_count)
+        self.assertIsNone(result)
+
+    def test_export_invalid_format(self):
+        controller.request.GET = {'format': 'xml'}
+
+        result = self.controller_instance.export()
+
+        controller.tk.abort.assert_called_once_with(400, 'Invalid export format: xml')
+        self.assertEquals(0, controller.exporter.export_datarequests.call_count)
+        self.assertIsNone(result)
+
+    def test_metrics_not_authorized(self):
+        controller.tk.check_access.side_effect = controller.tk.NotAuthorized('User not authorized')
+
+        result = self.controller_instance.metrics()
+
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_METRICS, self.expected_context, None)
+        controller.tk.abort.assert_called_once_with(403, 'You are not authorized to read the metrics of the Data Requests')
+        self.assertEquals(0, controller.instrumentation.metrics.render.call_count)
+        self.assertIsNone(result)
+
+    def test_metrics(self):
+        result = self.controller_instance.metrics()
+
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_METRICS, self.expected_context, None)
+        self.assertEquals('text/plain; version=0.0.4; charset=utf-8', controller.response.headers['Content-Type'])
+        self.assertEquals(controller.instrumentation.metrics.render.return_value, result)
+
+    @parameterized.expand([
+        ({},                                                     'jsonl', False, False, 'application/x-ndjson'),
+        ({'format': 'csv'},                                      'csv',   False, False, 'text/csv'),
+        ({'format': 'jsonl', 'comments': 'true', 'names': 'true'}, 'jsonl', True,  True,  'application/x-ndjson'),
+        ({'format': 'csv', 'comments': 'false', 'names': 'true'},  'csv',   False, True,  'text/csv')
+    ])
+    def test_export(self, params, file_format, include_comments, include_names, content_type):
+        controller.request.GET = params
+        controller.exporter.export_datarequests.return_value = iter(['chunk1', 'chunk2'])
+
+        result = self.controller_instance.export()
+
+        controller.tk.check_access.assert_called_once_with(constants.DATAREQUEST_EXPORT, self.expected_context, None)
+        controller.exporter.export_datarequests.assert_called_once_with(file_format, include_comments, include_names)
+        self.assertEquals('%s; charset=utf-8' % content_type, controller.response.headers['Content-Type'])
+        self.assertEquals('attachment; filename="datarequests.%s"' % file_format,
+                          controller.response.headers['Content-Disposition'])
+
+        # The export is streamed and the session is removed at the end
+        self.assertEquals(0, controller.model.Session.remove.call_count)
+        self.assertEquals(['chunk1', 'chunk2'], list(result))
+        controller.model.Session.remove.assert_called_once_with()
@@ -54,11 +54,15 @@ class ValidatorTest(unittest.TestCase):
         validator.tk = self._tk
 
     @parameterized.expand([
-        (True,),
-        (False,)
+        (True,  None),
+        (False, None),
+        (False, 'datarequest_id')
     ])
-    def test_validate_valid_data_request(self, avoid_existing_title_check):
+    def test_validate_valid_data_request(self, avoid_existing_title_check, updated_datarequest_id):
         context = {'avoid_existing_title_check': avoid_existing_title_check}
+        if updated_datarequest_id:
+            context['updated_datarequest_id'] = updated_datarequest_id
+
         self.assertIsNone(validator.validate_datarequest(context, self.request_data))
         validator.tk.get_validator.assert_called_once_with('group_id_exists')
         group_validator = validator.tk.get_validator.return_value
@@ -67,7 +71,8 @@ class ValidatorTest(unittest.TestCase):
         if avoid_existing_title_check:
             self.assertEquals(0, validator.db.DataRequest.datarequest_exists.call_count)
         else:
-            validator.db.DataRequest.datarequest_exists.assert_called_once_with(self.request_data['title'])
+            validator.db.DataRequest.datarequest_exists.assert_called_once_with(self.request_data['title'],
+                                                                          updated_datarequest_id)
 
     @parameterized.expand([
         ('Title', generate_string(validator.constants.NAME_MAX_LENGTH + 1), False,
@@ -37,7 +37,8 @@ def validate_datarequest(context, request_data):
     avoid_existing_title_check = context['avoid_existing_title_check'] if 'avoid_existing_title_check' in context else False
 
     if 'Title' not in errors and not avoid_existing_title_check:
-        if db.DataRequest.datarequest_exists(request_data['title']):
+        # The title of the data request being updated (if any) is not in use
+        if db.DataRequest.datarequest_exists(request_data['title'], context.get('updated_datarequest_id')):
             errors[tk._('Title')] = [tk._('That title is already in use')]
 
     # Check description
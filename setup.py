@@ -55,6 +55,9 @@ setup(
         [ckan.plugins]
         datarequests=ckanext.datarequests.plugin:DataRequestsPlugin
 
+        [paste.paster_command]
+        datarequests=ckanext.datarequests.commands:DataRequestsCommand
+
         [babel.extractors]
         ckan = ckan.lib.extract:extract_ckan
     ''',